@@ -2,5 +2,6 @@ set -o errexit
 
 pip install -r requirements.txt
 
+python manage.py optimizar_imagenes
 python manage.py collectstatic --no-input
 python manage.py migrate
\ No newline at end of file
@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'centro_medico.settings')
 
 application = get_asgi_application()
+
+# Con PRECALENTAR_AL_INICIAR=1 carga URLs y plantillas antes de la primera petición
+from ficha_medica.arranque import precalentar  # noqa: E402
+precalentar()
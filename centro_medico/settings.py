@@ -60,13 +60,16 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Debe ir inmediatamente después de SecurityMiddleware para servir estáticos sin pasar por el resto
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Activa la sede del usuario: filtra los managers por sede y elige la base de sus tablas
+    'ficha_medica.sedes.SedeMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware'
 ]
 
 ROOT_URLCONF = 'centro_medico.urls'
@@ -99,6 +102,146 @@ DATABASES = {
     )
 }
 
+# Sedes con base de datos propia: DATABASE_URL_SEDE_<CODIGO>=<url> agrega el alias sede_<codigo>
+# para la sede con ese código (ver ficha_medica/sedes.py). Cada base se migra con
+# `migrate --database=sede_<codigo>` y recibe una copia de los catálogos con `replicar_catalogos`.
+# Para probar en local basta con archivos SQLite: DATABASE_URL_SEDE_NORTE=sqlite:////tmp/norte.sqlite3
+SEDES = {
+    'BASES': {},
+    'TAMANO_LOTE_REPLICACION': 1000,
+}
+for _variable, _url in sorted(os.environ.items()):
+    if _variable.startswith('DATABASE_URL_SEDE_'):
+        _codigo = _variable[len('DATABASE_URL_SEDE_'):].lower()
+        DATABASES[f'sede_{_codigo}'] = dj_database_url.parse(_url, conn_max_age=600)
+        SEDES['BASES'][_codigo] = f'sede_{_codigo}'
+
+DATABASE_ROUTERS = ['ficha_medica.sedes.RouterSedes']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Redis compartido entre todos los workers; en local y en tests se usa la caché en memoria.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'centro_medico',
+            'TIMEOUT': 300,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'centro_medico',
+        }
+    }
+
+# L1 en memoria de cada proceso delante de la caché compartida (ver ficha_medica/cache.py)
+CACHE_EN_NIVELES = {
+    'ALIAS': 'default',
+    'MAX_ENTRADAS': 1024,
+    'TTL_LOCAL': 5,
+    'TTL_VERSIONES': 1,
+}
+
+
+# Auditoría (core/audit.py): los eventos se encolan y se escriben en lotes desde un hilo
+AUDITORIA = {
+    'INTERVALO': 2,
+    'LOTE': 500,
+    'MAXIMO_EN_COLA': 50000,
+    'EN_SEGUNDO_PLANO': os.environ.get('AUDITORIA_SINCRONA') is None,
+}
+
+# Lista de espera: minutos que se retiene un bloque ofrecido y anticipación mínima para ofrecerlo
+LISTA_ESPERA = {
+    'MINUTOS_RETENCION': 30,
+    'MINUTOS_ANTICIPACION': 15,
+}
+
+# Calendario iCalendar de cada médico: días pasados que incluye, segundos máximos en caché y
+# margen con que retrocede el token de sincronización incremental
+CALENDARIO = {
+    'DIAS_PASADOS': 30,
+    'TIMEOUT': 3600,
+    'SEGUNDOS_MARGEN': 10,
+}
+
+# API de cambios de reservas (/reservas/cambios/): tamaño de página, antigüedad mínima de un cambio
+# para entregarlo y días que se conserva el registro (un cursor más antiguo obliga a releer todo)
+CAMBIOS_RESERVAS = {
+    'TAMANO_PAGINA': 500,
+    'TAMANO_MAXIMO': 2000,
+    'SEGUNDOS_MARGEN': 10,
+    'DIAS_RETENCION': 30,
+}
+
+# Archivo de la agenda (manage.py archivar_agenda): los bloques libres de más de DIAS_BLOQUES_LIBRES
+# días y las reservas de antes de MESES_RESERVAS meses pasan a las tablas de archivo, de a LOTE
+# bloques por transacción. Las reservas deben quedar fuera de CALENDARIO['DIAS_PASADOS'].
+ARCHIVO_AGENDA = {
+    'DIAS_BLOQUES_LIBRES': 7,
+    'MESES_RESERVAS': 12,
+    'LOTE': 2000,
+}
+
+# Límite de peticiones de las APIs de consulta públicas (token bucket por usuario o IP).
+# En Render las peticiones llegan a través de su proxy, que agrega X-Forwarded-For.
+# TASAS permite ajustar la tasa de un endpoint por nombre, por ejemplo {'validar_rut': '20/m'}.
+LIMITES = {
+    'HABILITADO': os.environ.get('LIMITES_DESHABILITADOS') is None,
+    'ALIAS': 'default',
+    'CONFIAR_EN_PROXY': 'RENDER' in os.environ,
+    'TASAS': {},
+}
+
+# Cola de tareas en la base de datos (manage.py run_workers).
+# COLAS: procesos por cola en cada servidor de workers. Con TAREAS_EN_WORKERS las tareas
+# periódicas las encola run_workers y los servidores web no arrancan APScheduler.
+TAREAS = {
+    'COLAS': {'default': 2, 'pdf': 1, 'correo': 2},
+    'INTERVALO': 1.0,
+    'ESPERA_BASE': 10,
+    'ESPERA_MAXIMA': 3600,
+    'TIEMPO_MAXIMO': 300,
+    'DIAS_RETENCION': 7,
+    'PERIODICAS_EN_WORKERS': os.environ.get('TAREAS_EN_WORKERS') is not None,
+}
+
+# Correo saliente. Sin EMAIL_HOST (desarrollo) los mensajes se escriben en la consola; con
+# EMAIL_BACKEND=django.core.mail.backends.filebased.EmailBackend, en archivos en EMAIL_FILE_PATH.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND') or (
+    'django.core.mail.backends.smtp.EmailBackend' if os.environ.get('EMAIL_HOST')
+    else 'django.core.mail.backends.console.EmailBackend'
+)
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '1') == '1'
+EMAIL_TIMEOUT = 30
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', BASE_DIR / 'correos')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'Centro Médico <no-responder@centromedico.cl>')
+
+# Recordatorios de reservas por correo (ficha_medica/recordatorios.py). Se generan a HORA_GENERACION
+# para las reservas de DIAS_ANTICIPACION días después y se envían en lotes de TAMANO_LOTE mensajes
+# por conexión, hasta MAXIMO_POR_CICLO por minuto repartidos entre los procesos de la cola 'correo'.
+RECORDATORIOS = {
+    'BACKEND': None,  # None: EMAIL_BACKEND
+    'HORA_GENERACION': (9, 0),
+    'DIAS_ANTICIPACION': 1,
+    'TAMANO_LOTE': 200,
+    'MAXIMO_POR_CICLO': 5000,
+    'MAX_INTENTOS': 5,
+    'MINUTOS_LOTE_ABANDONADO': 30,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -135,10 +278,20 @@ USE_I18N = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 if not DEBUG:
-    STATIC_ROOT=os.path.join(BASE_DIR,'staticfiles')
-    STATICFILES_STORAGE='whitenoise.storage.CompressedManifestStaticFilesStorage'
+    # collectstatic agrega un hash al nombre de cada archivo y genera variantes .br y .gz;
+    # WhiteNoise sirve la variante comprimida que acepte el navegador y marca los archivos
+    # con hash como inmutables (Cache-Control: max-age de 10 años, immutable).
+    STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+# Archivos sin hash (p. ej. favicon enlazado directamente): una hora de caché
+WHITENOISE_MAX_AGE = 0 if DEBUG else 3600
+
+# Variantes WebP que genera `manage.py optimizar_imagenes` (ver core/imagenes.py)
+IMAGENES_ANCHOS_WEBP = (400, 800)
+IMAGENES_CALIDAD_WEBP = 80
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -147,6 +300,17 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGOUT_REDIRECT_URL = '/'
 
+# Sesiones: por defecto cached_db (lectura desde la caché, respaldo en BD).
+# Con SESSION_EN_COOKIE=1 se usan cookies firmadas y no se consulta nada por petición.
+if os.environ.get('SESSION_EN_COOKIE'):
+    SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+    SESSION_COOKIE_HTTPONLY = True
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# El usuario autenticado (con roles y perfil) se lee de la caché en cada petición
+AUTHENTICATION_BACKENDS = ['ficha_medica.auth.CachedModelBackend']
+
 # Configuración de autenticación personalizada
 AUTH_USER_MODEL = 'auth.User'
 USERNAME_FIELD = 'username'
@@ -25,10 +25,14 @@ urlpatterns = [
     path('pacientes/modificar/<int:paciente_id>/', ficha_medica_views.modificar_paciente, name='modificar_paciente'),
     path('pacientes/eliminar/<int:paciente_id>/', ficha_medica_views.eliminar_paciente, name='eliminar_paciente'),
     path('reservas/modificar/<int:reserva_id>/', ficha_medica_views.modificar_reserva, name='modificar_reserva'),
+    path('reservas/lista-espera/', ficha_medica_views.lista_espera, name='lista_espera'),
+    path('reservas/lista-espera/<int:entrada_id>/responder/', ficha_medica_views.responder_oferta_espera, name='responder_oferta_espera'),
+    path('reservas/operacion-masiva/', ficha_medica_views.operacion_masiva_reservas, name='operacion_masiva_reservas'),
     path('reservas/eliminar/<int:reserva_id>/', ficha_medica_views.eliminar_reserva, name='eliminar_reserva'),
 
     # Médico
     path('medico/', ficha_medica_views.medico_dashboard, name='medico_dashboard'),
+    path('medico/calendario/renovar/', ficha_medica_views.renovar_calendario, name='renovar_calendario'),
     path('medico/fichas/filtrar/<str:paciente_rut>/', ficha_medica_views.filtrar_fichas_por_paciente, name='filtrar_fichas_por_paciente'),
     path('fichas/', ficha_medica_views.listar_fichas, name='listar_fichas_medicas'),
     path('fichas/crear/<int:reserva_id>/', ficha_medica_views.crear_ficha_medica, name='crear_ficha'),
@@ -39,17 +43,26 @@ urlpatterns = [
     path('marcar-notificacion-leida/<int:notificacion_id>/', ficha_medica_views.marcar_notificacion_leida, name='marcar_notificacion_leida'),
     path('notificaciones/ajax/', ficha_medica_views.obtener_notificaciones, name='obtener_notificaciones'),
     path('reservas/activas/', ficha_medica_views.obtener_reservas_activas, name='obtener_reservas_activas'),
+    path('reservas/cambios/', ficha_medica_views.api_cambios_reservas, name='api_cambios_reservas'),
     path('modificar-disponibilidad/', ficha_medica_views.modificar_disponibilidad, name='modificar_disponibilidad'),
     path('ficha/<int:ficha_id>/pdf/', ficha_medica_views.generar_ficha_pdf, name='generar_ficha_pdf'),
+    path('pacientes/<int:paciente_id>/fichas/pdf/', ficha_medica_views.encolar_pdf_fichas, name='encolar_pdf_fichas'),
+    path('calendario/<str:token>.ics', ficha_medica_views.calendario_medico, name='calendario_medico'),
+    path('archivos/<int:archivo_id>/', ficha_medica_views.descargar_archivo_generado, name='descargar_archivo_generado'),
 
     # APIs
     path('api/medicos/', ficha_medica_views.api_medicos, name='api_medicos'),
     path('api/disponibilidades/', ficha_medica_views.api_disponibilidades, name='api_disponibilidades'),
     path('api/validar_rut/', ficha_medica_views.api_validar_rut, name='api_validar_rut'),
+    path('api/pacientes/<int:paciente_id>/linea-tiempo/', ficha_medica_views.api_linea_tiempo_paciente, name='api_linea_tiempo_paciente'),
+    path('api/fichas/<int:ficha_id>/revisiones/', ficha_medica_views.api_revisiones_ficha, name='api_revisiones_ficha'),
+    path('api/tareas/<int:tarea_id>/', ficha_medica_views.api_estado_tarea, name='api_estado_tarea'),
+    path('api/analitica/cohortes/', ficha_medica_views.api_analitica_cohortes, name='api_analitica_cohortes'),
 
     # Panel de administración
     path('admin/', admin.site.urls),
     path('admin-dashboard/', ficha_medica_views.admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/ocupacion/', ficha_medica_views.ocupacion_agenda, name='ocupacion_agenda'),
 
     # Gestión de usuarios
     path('medico/crear/', ficha_medica_views.crear_medico, name='crear_medico'),
@@ -15,4 +15,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'centro_medico.settings')
 
 application = get_wsgi_application()
 
+# Con PRECALENTAR_AL_INICIAR=1 carga URLs y plantillas antes de la primera petición
+from ficha_medica.arranque import precalentar  # noqa: E402
+precalentar()
+
 app= application
\ No newline at end of file
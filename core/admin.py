@@ -1,3 +1,20 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import UserActivity
+
+
+@admin.register(UserActivity)
+class UserActivityAdmin(admin.ModelAdmin):
+    list_display = ('timestamp', 'user', 'accion', 'objeto_tipo', 'objeto_id', 'activity')
+    list_filter = ('accion', 'objeto_tipo')
+    list_select_related = ('user',)
+    search_fields = ('user__username', 'objeto_id')
+    date_hierarchy = 'timestamp'
+    ordering = ('-timestamp',)
+    show_full_result_count = False  # Evita un COUNT(*) adicional sobre una tabla que crece sin parar
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
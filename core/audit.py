@@ -0,0 +1,232 @@
+from collections import deque
+from datetime import datetime, time, timedelta
+import atexit
+import threading
+
+from django.conf import settings
+from django.contrib.admin.models import ADDITION, CHANGE, DELETION, LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.timezone import localtime, make_aware, now
+
+from .models import UserActivity, UserActivityArchivo
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'AUDITORIA', {})
+INTERVALO = _config.get('INTERVALO', 2)              # Segundos entre vaciados del hilo
+LOTE = _config.get('LOTE', 500)                      # Eventos que fuerzan un vaciado inmediato
+MAXIMO_EN_COLA = _config.get('MAXIMO_EN_COLA', 50000)  # Tope de memoria si la BD no responde
+EN_SEGUNDO_PLANO = _config.get('EN_SEGUNDO_PLANO', True)
+
+_cola = deque()
+_lock = threading.Lock()
+_hay_lote = threading.Event()
+_hilo = None
+
+
+def _describir(objeto):
+    if objeto is None:
+        return '', ''
+    return objeto._meta.label_lower, str(objeto.pk)
+
+
+def registrar(user, accion, objeto=None, descripcion=''):
+    """
+    Encola un evento de auditoría. No toca la base de datos: los eventos se escriben
+    en lotes con bulk_create desde un hilo en segundo plano (o al terminar la petición).
+    """
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return
+    objeto_tipo, objeto_id = _describir(objeto)
+    evento = UserActivity(
+        user_id=user.pk,
+        activity=descripcion or f"{accion} {objeto_tipo} {objeto_id}".strip(),
+        timestamp=now(),
+        accion=accion,
+        objeto_tipo=objeto_tipo,
+        objeto_id=objeto_id,
+    )
+    _encolar(evento)
+
+
+def _encolar(evento):
+    with _lock:
+        if len(_cola) >= MAXIMO_EN_COLA:
+            _cola.popleft()
+            logger.warning("Cola de auditoría llena: se descartó el evento más antiguo.")
+        _cola.append(evento)
+        pendientes = len(_cola)
+
+    if EN_SEGUNDO_PLANO:
+        _asegurar_hilo()
+        if pendientes >= LOTE:
+            _hay_lote.set()
+
+
+def vaciar():
+    """
+    Escribe todos los eventos pendientes. Retorna la cantidad escrita.
+    Si la escritura falla, los eventos vuelven a la cola para el próximo intento.
+    """
+    with _lock:
+        if not _cola:
+            return 0
+        eventos = list(_cola)
+        _cola.clear()
+    try:
+        UserActivity.objects.bulk_create(eventos, batch_size=LOTE)
+    except Exception as e:
+        logger.error(f"No se pudieron guardar {len(eventos)} eventos de auditoría: {e}")
+        with _lock:
+            _cola.extendleft(reversed(eventos))
+        return 0
+    return len(eventos)
+
+
+def _trabajar():
+    while True:
+        _hay_lote.wait(INTERVALO)
+        _hay_lote.clear()
+        close_old_connections()
+        vaciar()
+        # El hilo no atiende peticiones: cierra su conexión para no retenerla entre vaciados
+        connection.close()
+
+
+def _asegurar_hilo():
+    global _hilo
+    if _hilo is not None and _hilo.is_alive():
+        return
+    with _lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_trabajar, name='auditoria', daemon=True)
+            _hilo.start()
+
+
+atexit.register(vaciar)
+
+
+@receiver(request_finished)
+def vaciar_al_terminar(sender, **kwargs):
+    # Sin hilo (tests, desarrollo) los eventos se escriben al final de cada petición
+    if not EN_SEGUNDO_PLANO:
+        vaciar()
+
+
+ACCIONES_ADMIN = {ADDITION: 'crear', CHANGE: 'modificar', DELETION: 'eliminar'}
+
+
+@receiver(post_save, sender=LogEntry)
+def auditar_admin(sender, instance, created, **kwargs):
+    """Los cambios hechos desde el admin de Django también quedan en la auditoría."""
+    if not created or instance.action_flag not in ACCIONES_ADMIN:
+        return
+    objeto_tipo = ''
+    if instance.content_type_id:
+        # get_for_id usa la caché de ContentType: no consulta la base en cada acción
+        tipo = ContentType.objects.get_for_id(instance.content_type_id)
+        objeto_tipo = f"{tipo.app_label}.{tipo.model}"
+    _encolar(UserActivity(
+        user_id=instance.user_id,
+        activity=f"Admin: {instance}",
+        timestamp=instance.action_time,
+        accion=ACCIONES_ADMIN[instance.action_flag],
+        objeto_tipo=objeto_tipo,
+        objeto_id=instance.object_id or '',
+    ))
+
+
+# Consultas para reportes de cumplimiento
+
+CAMPOS_REPORTE = ('id', 'timestamp', 'user_id', 'user__username', 'accion', 'objeto_tipo', 'objeto_id', 'activity')
+
+
+def _filtrar(queryset, desde, hasta, usuario=None, objeto=None, objeto_tipo=None):
+    queryset = queryset.filter(timestamp__gte=desde, timestamp__lt=hasta)
+    if usuario is not None:
+        queryset = queryset.filter(user=usuario)
+    if objeto is not None:
+        objeto_tipo, objeto_id = _describir(objeto)
+        queryset = queryset.filter(objeto_id=objeto_id)
+    if objeto_tipo:
+        queryset = queryset.filter(objeto_tipo=objeto_tipo)
+    return queryset
+
+
+def _por_paginas(queryset, tamano):
+    # Paginación por llave (timestamp, id): cada página usa el índice y el costo no crece con el rango
+    ultimo = None
+    while True:
+        pagina = queryset
+        if ultimo is not None:
+            pagina = pagina.filter(timestamp__gte=ultimo[0]).exclude(timestamp=ultimo[0], id__lte=ultimo[1])
+        filas = list(pagina.order_by('timestamp', 'id').values(*CAMPOS_REPORTE)[:tamano])
+        yield from filas
+        if len(filas) < tamano:
+            return
+        ultimo = (filas[-1]['timestamp'], filas[-1]['id'])
+
+
+def consultar_actividades(desde, hasta, usuario=None, objeto=None, objeto_tipo=None, tamano=2000):
+    """
+    Itera cronológicamente las actividades del rango [desde, hasta), incluyendo las archivadas,
+    leyendo páginas de `tamano` filas. Apto para rangos de varios años.
+    """
+    filtros = dict(usuario=usuario, objeto=objeto, objeto_tipo=objeto_tipo)
+    yield from _por_paginas(_filtrar(UserActivityArchivo.objects.all(), desde, hasta, **filtros), tamano)
+    yield from _por_paginas(_filtrar(UserActivity.objects.all(), desde, hasta, **filtros), tamano)
+
+
+def resumen_actividades(desde, hasta, objeto_tipo=None):
+    """
+    Cantidad de eventos por usuario y acción en el rango, agregada en la base de datos.
+    """
+    resumen = {}
+    for modelo in (UserActivityArchivo, UserActivity):
+        filas = (
+            _filtrar(modelo.objects.all(), desde, hasta, objeto_tipo=objeto_tipo)
+            .values('user__username', 'accion')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        for fila in filas:
+            clave = (fila['user__username'], fila['accion'])
+            resumen[clave] = resumen.get(clave, 0) + fila['total']
+    return resumen
+
+
+def inicio_de_mes(fecha):
+    return fecha.replace(day=1)
+
+
+def rotar(meses=12, lote=5000):
+    """
+    Mueve al archivo las actividades anteriores a `meses` meses, en lotes acotados.
+    Retorna la cantidad de filas movidas.
+    """
+    limite = make_aware(datetime.combine(inicio_de_mes(localtime(now() - timedelta(days=30 * meses)).date()), time.min))
+    movidas = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                UserActivity.objects.filter(timestamp__lt=limite).order_by('timestamp', 'id').values_list('id', flat=True)[:lote]
+            )
+            if not ids:
+                return movidas
+            filas = UserActivity.objects.filter(id__in=ids)
+            UserActivityArchivo.objects.bulk_create([
+                UserActivityArchivo(
+                    user_id=fila.user_id, activity=fila.activity, timestamp=fila.timestamp, accion=fila.accion,
+                    objeto_tipo=fila.objeto_tipo, objeto_id=fila.objeto_id, mes=inicio_de_mes(localtime(fila.timestamp).date()),
+                )
+                for fila in filas
+            ])
+            filas.delete()
+            movidas += len(ids)
@@ -0,0 +1,68 @@
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+
+
+# Anchos (px) de las variantes WebP que se generan para cada imagen
+ANCHOS_WEBP = getattr(settings, 'IMAGENES_ANCHOS_WEBP', (400, 800))
+CALIDAD_WEBP = getattr(settings, 'IMAGENES_CALIDAD_WEBP', 80)
+EXTENSIONES_OPTIMIZABLES = ('.png', '.jpg', '.jpeg')
+
+
+def nombre_variante(ruta, ancho):
+    """'assets/img/cabin.png' -> 'assets/img/cabin-400w.webp'"""
+    base, _ = os.path.splitext(ruta)
+    return f"{base}-{ancho}w.webp"
+
+
+def generar_variantes(archivo, anchos=ANCHOS_WEBP, forzar=False):
+    """
+    Genera las variantes WebP redimensionadas junto al archivo original.
+    No amplía imágenes: los anchos mayores al original se omiten.
+    Retorna la lista de archivos escritos.
+    """
+    from PIL import Image
+
+    escritos = []
+    with Image.open(archivo) as imagen:
+        if imagen.mode not in ('RGB', 'RGBA'):
+            imagen = imagen.convert('RGBA' if 'transparency' in imagen.info else 'RGB')
+        for ancho in anchos:
+            if ancho > imagen.width:
+                continue
+            destino = nombre_variante(archivo, ancho)
+            if not forzar and os.path.exists(destino) and os.path.getmtime(destino) >= os.path.getmtime(archivo):
+                continue
+            alto = round(imagen.height * ancho / imagen.width)
+            imagen.resize((ancho, alto), Image.LANCZOS).save(destino, 'WEBP', quality=CALIDAD_WEBP, method=6)
+            escritos.append(destino)
+    return escritos
+
+
+@lru_cache(maxsize=256)
+def variantes_disponibles(ruta):
+    """
+    Variantes WebP ya generadas para una ruta estática, como lista de (ruta, ancho).
+    Se calcula una vez por proceso.
+    """
+    return [
+        (nombre_variante(ruta, ancho), ancho)
+        for ancho in ANCHOS_WEBP
+        if finders.find(nombre_variante(ruta, ancho))
+    ]
+
+
+@lru_cache(maxsize=256)
+def dimensiones(ruta):
+    """Ancho y alto de la imagen original, o None si no se puede leer."""
+    archivo = finders.find(ruta)
+    if not archivo:
+        return None
+    try:
+        from PIL import Image
+        with Image.open(archivo) as imagen:
+            return imagen.size
+    except OSError:
+        return None
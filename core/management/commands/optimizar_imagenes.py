@@ -0,0 +1,40 @@
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management.base import BaseCommand
+
+from core.imagenes import EXTENSIONES_OPTIMIZABLES, generar_variantes
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera variantes WebP redimensionadas de las imágenes estáticas de las apps. "
+        "Se ejecuta antes de collectstatic, que luego les agrega hash y las comprime."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forzar', action='store_true', help="Regenera aunque la variante esté al día.")
+
+    def handle(self, *args, **options):
+        generados = 0
+        bytes_originales = bytes_variantes = 0
+        for finder in get_finders():
+            for ruta, storage in finder.list(ignore_patterns=[]):
+                if not ruta.lower().endswith(EXTENSIONES_OPTIMIZABLES):
+                    continue
+                archivo = storage.path(ruta)
+                # Solo las imágenes del proyecto, nunca las de paquetes instalados (p. ej. el admin)
+                if not os.path.abspath(archivo).startswith(str(settings.BASE_DIR)):
+                    continue
+                escritos = generar_variantes(archivo, forzar=options['forzar'])
+                if escritos:
+                    bytes_originales += os.path.getsize(archivo)
+                    bytes_variantes += sum(os.path.getsize(escrito) for escrito in escritos)
+                    generados += len(escritos)
+                    self.stdout.write(f"{ruta}: {len(escritos)} variantes")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{generados} variantes WebP generadas "
+            f"({bytes_originales / 1024:.0f} KB en originales, {bytes_variantes / 1024:.0f} KB en variantes)."
+        ))
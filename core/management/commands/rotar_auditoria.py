@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.audit import rotar
+
+
+class Command(BaseCommand):
+    help = "Mueve al archivo mensual las actividades de auditoría más antiguas que el período indicado."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses', type=int, default=12, help="Meses que se mantienen en la tabla principal.")
+        parser.add_argument('--lote', type=int, default=5000, help="Filas movidas por transacción.")
+
+    def handle(self, *args, **options):
+        movidas = rotar(meses=options['meses'], lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"{movidas} actividades movidas al archivo."))
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.16 on 2026-10-19 12:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivityArchivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity', models.TextField(verbose_name='Descripción de la actividad')),
+                ('timestamp', models.DateTimeField(verbose_name='Fecha y hora')),
+                ('accion', models.CharField(blank=True, choices=[('ver', 'Ver'), ('crear', 'Crear'), ('modificar', 'Modificar'), ('eliminar', 'Eliminar')], max_length=10, verbose_name='Acción')),
+                ('objeto_tipo', models.CharField(blank=True, max_length=100, verbose_name='Tipo de objeto')),
+                ('objeto_id', models.CharField(blank=True, max_length=64, verbose_name='ID del objeto')),
+                ('mes', models.DateField(verbose_name='Mes')),
+            ],
+            options={
+                'verbose_name': 'Actividad archivada',
+                'verbose_name_plural': 'Actividades archivadas',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='useractivity',
+            options={'verbose_name': 'Actividad de usuario', 'verbose_name_plural': 'Actividades de usuarios'},
+        ),
+        migrations.AddField(
+            model_name='useractivity',
+            name='accion',
+            field=models.CharField(blank=True, choices=[('ver', 'Ver'), ('crear', 'Crear'), ('modificar', 'Modificar'), ('eliminar', 'Eliminar')], max_length=10, verbose_name='Acción'),
+        ),
+        migrations.AddField(
+            model_name='useractivity',
+            name='objeto_id',
+            field=models.CharField(blank=True, max_length=64, verbose_name='ID del objeto'),
+        ),
+        migrations.AddField(
+            model_name='useractivity',
+            name='objeto_tipo',
+            field=models.CharField(blank=True, max_length=100, verbose_name='Tipo de objeto'),
+        ),
+        migrations.AlterField(
+            model_name='useractivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Fecha y hora'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user', 'timestamp'], name='actividad_usuario_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['timestamp'], name='actividad_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['objeto_tipo', 'objeto_id', 'timestamp'], name='actividad_objeto_fecha'),
+        ),
+        migrations.AddField(
+            model_name='useractivityarchivo',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activities_archivadas', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='useractivityarchivo',
+            index=models.Index(fields=['user', 'timestamp'], name='archivo_usuario_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivityarchivo',
+            index=models.Index(fields=['mes', 'timestamp'], name='archivo_mes_fecha'),
+        ),
+    ]
@@ -1,16 +1,61 @@
 from django.db import models
 from django.contrib.auth.models import User  # Importar el modelo de usuario predeterminado de Django
+from django.utils.timezone import now
+
 
 class UserActivity(models.Model):
     """
     Modelo para registrar las actividades realizadas por los usuarios.
+    Se escribe en lotes desde core.audit; no se crean filas una por una.
     """
+    ACCIONES = [
+        ('ver', 'Ver'),
+        ('crear', 'Crear'),
+        ('modificar', 'Modificar'),
+        ('eliminar', 'Eliminar'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="activities")
     activity = models.TextField(verbose_name="Descripción de la actividad")
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Fecha y hora")
+    # La hora del evento la fija quien lo registra, no el momento en que se escribe el lote
+    timestamp = models.DateTimeField(default=now, verbose_name="Fecha y hora")
+    accion = models.CharField(max_length=10, choices=ACCIONES, blank=True, verbose_name="Acción")
+    objeto_tipo = models.CharField(max_length=100, blank=True, verbose_name="Tipo de objeto")  # Ej: ficha_medica.fichamedica
+    objeto_id = models.CharField(max_length=64, blank=True, verbose_name="ID del objeto")
+
+    class Meta:
+        verbose_name = "Actividad de usuario"
+        verbose_name_plural = "Actividades de usuarios"
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='actividad_usuario_fecha'),
+            models.Index(fields=['timestamp'], name='actividad_fecha'),
+            models.Index(fields=['objeto_tipo', 'objeto_id', 'timestamp'], name='actividad_objeto_fecha'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} realizó: {self.activity} en {self.timestamp}"
 
-# Create your models here.
 
+class UserActivityArchivo(models.Model):
+    """
+    Actividades antiguas movidas por `manage.py rotar_auditoria`. Mantiene la tabla
+    principal acotada a los meses recientes; los reportes leen ambas.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="activities_archivadas")
+    activity = models.TextField(verbose_name="Descripción de la actividad")
+    timestamp = models.DateTimeField(verbose_name="Fecha y hora")
+    accion = models.CharField(max_length=10, choices=UserActivity.ACCIONES, blank=True, verbose_name="Acción")
+    objeto_tipo = models.CharField(max_length=100, blank=True, verbose_name="Tipo de objeto")
+    objeto_id = models.CharField(max_length=64, blank=True, verbose_name="ID del objeto")
+    mes = models.DateField(verbose_name="Mes")  # Primer día del mes del evento
+
+    class Meta:
+        verbose_name = "Actividad archivada"
+        verbose_name_plural = "Actividades archivadas"
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='archivo_usuario_fecha'),
+            models.Index(fields=['mes', 'timestamp'], name='archivo_mes_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} realizó: {self.activity} en {self.timestamp}"
@@ -0,0 +1,33 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from core.imagenes import dimensiones, variantes_disponibles
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(ruta, alt='', css_class='', sizes='(max-width: 800px) 100vw, 800px', lazy=True):
+    """
+    Genera un <picture> con las variantes WebP de la imagen y el original como respaldo.
+    Uso: {% picture 'assets/img/portfolio/cabin.png' alt='Cabaña' css_class='img-fluid' %}
+    """
+    variantes = variantes_disponibles(ruta)
+    fuente = ''
+    if variantes:
+        srcset = ', '.join(f"{static(variante)} {ancho}w" for variante, ancho in variantes)
+        fuente = format_html('<source type="image/webp" srcset="{}" sizes="{}">', srcset, sizes)
+
+    atributos = {'src': static(ruta), 'alt': alt, 'decoding': 'async'}
+    if css_class:
+        atributos['class'] = css_class
+    if lazy:
+        atributos['loading'] = 'lazy'
+    tamano = dimensiones(ruta)
+    if tamano:
+        # Reserva el espacio de la imagen y evita saltos de diseño
+        atributos['width'], atributos['height'] = tamano
+
+    imagen = format_html('<img {}>', format_html_join(' ', '{}="{}"', atributos.items()))
+    return format_html('<picture>{}{}</picture>', fuente, imagen)
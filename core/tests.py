@@ -1,3 +1,113 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+import os
+import tempfile
 
-# Create your tests here.
+from django.contrib.admin.models import ADDITION, LogEntry
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.template import Context, Template
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+from PIL import Image
+
+from core import audit, imagenes
+from core.models import UserActivity, UserActivityArchivo
+
+
+class AuditoriaTest(TestCase):
+    """Los eventos se encolan sin consultas y se escriben en lotes; los antiguos pasan al archivo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('auditor')
+
+    def setUp(self):
+        # Sin hilo: cada prueba decide cuándo se vacía la cola
+        audit._cola.clear()
+        patcher = mock.patch.object(audit, 'EN_SEGUNDO_PLANO', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(audit._cola.clear)
+
+    def test_registrar_y_vaciar(self):
+        with self.assertNumQueries(0):
+            audit.registrar(self.user, 'ver', self.user)
+            audit.registrar(None, 'ver', self.user)
+        self.assertEqual(audit.vaciar(), 1)
+        evento = UserActivity.objects.get()
+        self.assertEqual((evento.accion, evento.objeto_tipo, evento.objeto_id), ('ver', 'auth.user', str(self.user.pk)))
+        self.assertEqual(audit.vaciar(), 0)
+
+    def test_fallo_al_escribir_conserva_los_eventos(self):
+        audit.registrar(self.user, 'crear')
+        with mock.patch.object(UserActivity.objects, 'bulk_create', side_effect=RuntimeError('sin conexión')):
+            self.assertEqual(audit.vaciar(), 0)
+        self.assertEqual(audit.vaciar(), 1)
+
+    def test_tope_de_la_cola(self):
+        tipo = ContentType.objects.get_for_model(User)
+        with mock.patch.object(audit, 'MAXIMO_EN_COLA', 2):
+            for descripcion in ('primero', 'segundo'):
+                audit.registrar(self.user, 'ver', descripcion=descripcion)
+            # Las acciones del admin pasan por el mismo tope
+            LogEntry.objects.log_action(self.user.pk, tipo.id, self.user.pk, 'auditor', ADDITION)
+        audit.vaciar()
+        self.assertEqual(sorted(UserActivity.objects.values_list('accion', flat=True)), ['crear', 'ver'])
+        self.assertEqual(UserActivity.objects.get(accion='ver').activity, 'segundo')
+
+    def test_acciones_del_admin(self):
+        tipo = ContentType.objects.get_for_model(User)
+        # Solo el INSERT del LogEntry: el tipo de objeto sale de la caché de ContentType
+        with self.assertNumQueries(1):
+            LogEntry.objects.log_action(self.user.pk, tipo.id, self.user.pk, 'auditor', ADDITION)
+        audit.vaciar()
+        evento = UserActivity.objects.get()
+        self.assertEqual((evento.accion, evento.objeto_tipo, evento.objeto_id), ('crear', 'auth.user', str(self.user.pk)))
+
+    def test_rotar_y_consultar(self):
+        antigua = now() - timedelta(days=450)
+        UserActivity.objects.bulk_create([
+            UserActivity(user=self.user, activity='antigua', timestamp=antigua, accion='ver'),
+            UserActivity(user=self.user, activity='reciente', timestamp=now(), accion='ver'),
+        ])
+        self.assertEqual(audit.rotar(meses=12, lote=1), 1)
+        self.assertEqual(list(UserActivityArchivo.objects.values_list('activity', flat=True)), ['antigua'])
+        actividades = audit.consultar_actividades(antigua - timedelta(days=1), now() + timedelta(days=1), usuario=self.user, tamano=1)
+        self.assertEqual([fila['activity'] for fila in actividades], ['antigua', 'reciente'])
+        self.assertEqual(audit.resumen_actividades(antigua - timedelta(days=1), now() + timedelta(days=1)), {('auditor', 'ver'): 2})
+
+
+class ImagenesTest(SimpleTestCase):
+    """Variantes WebP redimensionadas y la etiqueta {% picture %} que las ofrece."""
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = directorio.name
+        os.makedirs(os.path.join(self.directorio, 'img'))
+        self.original = os.path.join(self.directorio, 'img', 'foto.png')
+        Image.new('RGB', (1000, 500), 'white').save(self.original)
+        imagenes.variantes_disponibles.cache_clear()
+        imagenes.dimensiones.cache_clear()
+        self.addCleanup(imagenes.variantes_disponibles.cache_clear)
+        self.addCleanup(imagenes.dimensiones.cache_clear)
+
+    def test_generar_variantes(self):
+        escritas = imagenes.generar_variantes(self.original, anchos=(400, 800, 1200))
+        self.assertEqual([os.path.basename(ruta) for ruta in escritas], ['foto-400w.webp', 'foto-800w.webp'])
+        with Image.open(escritas[0]) as variante:
+            self.assertEqual(variante.size, (400, 200))
+        # Ya están al día: solo se regeneran si se fuerza
+        self.assertEqual(imagenes.generar_variantes(self.original, anchos=(400, 800)), [])
+        self.assertEqual(len(imagenes.generar_variantes(self.original, anchos=(400, 800), forzar=True)), 2)
+
+    def test_etiqueta_picture(self):
+        imagenes.generar_variantes(self.original, anchos=(400, 800))
+        with override_settings(
+            STATICFILES_DIRS=[self.directorio], STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+        ):
+            html = Template("{% load imagenes %}{% picture 'img/foto.png' alt='Foto' %}").render(Context())
+        self.assertIn('srcset="/static/img/foto-400w.webp 400w, /static/img/foto-800w.webp 800w"', html)
+        self.assertIn('width="1000" height="500"', html)
+        self.assertIn('loading="lazy"', html)
@@ -1,5 +1,158 @@
-from django.contrib import admin
-from .models import Paciente, Medico, FichaMedica, Recepcionista, Reserva, Especialidad, Disponibilidad
+from datetime import date, timedelta
+
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.utils.functional import cached_property
+from django.utils.timezone import localdate, now
+from .calendario import renovar_suscripcion
+from .models import Paciente, Medico, FichaMedica, Recepcionista, Reserva, Especialidad, Disponibilidad, ListaEspera, Sede
+from .reprogramacion import cancelar_reservas
+from .rut import cuerpos_de_busqueda
+from .utils import limites_del_dia
+
+
+class PaginadorEstimado(Paginator):
+    """
+    Paginador de los listados grandes del admin. Sin filtros, en PostgreSQL usa la estimación de
+    filas de las estadísticas de la tabla; en otro caso cuenta con un tope, así el COUNT(*) nunca
+    recorre más de TOPE filas. Más allá del tope las páginas dejan de estar disponibles:
+    se espera que el usuario filtre.
+    """
+    TOPE = 10000
+
+    @cached_property
+    def count(self):
+        consulta = self.object_list
+        if not consulta.query.where and connections[consulta.db].vendor == 'postgresql':
+            with connections[consulta.db].cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [consulta.model._meta.db_table],
+                )
+                fila = cursor.fetchone()
+            if fila and fila[0] > self.TOPE:
+                return fila[0]
+        total = consulta.order_by()[:self.TOPE + 1].count()
+        self.truncado = total > self.TOPE
+        return min(total, self.TOPE)
+
+
+class ListadoEscalable(ChangeList):
+    """
+    Django desempata siempre por -pk; aquí el desempate sigue el sentido de la primera columna
+    del orden, así un índice (columna, id) sirve al listado en ambos sentidos.
+    """
+
+    def get_ordering(self, request, queryset):
+        ordering = super().get_ordering(request, queryset)
+        if len(ordering) > 1 and isinstance(ordering[0], str) and isinstance(ordering[-1], str) and ordering[-1] in ('pk', '-pk'):
+            ordering[-1] = '-pk' if ordering[0].startswith('-') else 'pk'
+        return ordering
+
+
+class AdminEscalable(admin.ModelAdmin):
+    """
+    Listado sin COUNT(*) completos: conteo estimado y sin el total sin filtrar; si el conteo llega
+    al tope se avisa que las últimas páginas no son alcanzables.
+    Si `campo_rut` está definido, una búsqueda que es un RUT se resuelve por igualdad con su índice
+    en vez de un icontains sobre cada campo de búsqueda (también la usa el autocompletado).
+    """
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+    campo_rut = None
+
+    def get_changelist(self, request, **kwargs):
+        return ListadoEscalable
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        listado = getattr(response, 'context_data', {}).get('cl')
+        if listado is not None and listado.paginator.truncado:
+            self.message_user(
+                request,
+                f"Hay más de {listado.paginator.TOPE} resultados y solo se listan los primeros. "
+                "Filtre, o invierta el orden de una columna para llegar a los últimos.",
+                messages.WARNING,
+            )
+        return response
+
+    def get_search_results(self, request, queryset, search_term):
+        cuerpos = cuerpos_de_busqueda(search_term) if self.campo_rut else []
+        if cuerpos:
+            return queryset.filter(**{f"{self.campo_rut}__in": cuerpos}), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class RangoFechasFilter(admin.FieldListFilter):
+    """
+    Filtro por rango de fechas locales [desde, hasta] como límites de un rango sobre la columna,
+    de modo que use su índice (a diferencia de `__date`). Ofrece rangos frecuentes y uno libre.
+    Reemplaza a date_hierarchy, que calcula los años y meses con un DISTINCT sobre toda la tabla.
+    """
+    template = 'admin/filtro_rango_fechas.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.parametro_desde = f"{field_path}__desde"
+        self.parametro_hasta = f"{field_path}__hasta"
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.desde = self.used_parameters.get(self.parametro_desde, '')
+        self.hasta = self.used_parameters.get(self.parametro_hasta, '')
+
+    def expected_parameters(self):
+        return [self.parametro_desde, self.parametro_hasta]
+
+    def queryset(self, request, queryset):
+        try:
+            desde = date.fromisoformat(self.desde) if self.desde else None
+            hasta = date.fromisoformat(self.hasta) if self.hasta else None
+        except ValueError as e:
+            raise IncorrectLookupParameters(e)
+        con_hora = isinstance(self.field, models.DateTimeField)
+        if desde:
+            queryset = queryset.filter(**{f"{self.field_path}__gte": limites_del_dia(desde)[0] if con_hora else desde})
+        if hasta:
+            queryset = queryset.filter(**{f"{self.field_path}__lt": limites_del_dia(hasta)[1] if con_hora else hasta + timedelta(days=1)})
+        return queryset
+
+    def rangos(self):
+        hoy = localdate()
+        return [
+            ("Hoy", hoy, hoy),
+            ("Últimos 7 días", hoy - timedelta(days=6), hoy),
+            ("Próximos 7 días", hoy, hoy + timedelta(days=6)),
+            ("Este mes", hoy.replace(day=1), hoy),
+        ]
+
+    def choices(self, changelist):
+        # Los demás parámetros se conservan como campos ocultos del formulario de rango libre
+        self.otros_parametros = [
+            (clave, valor) for clave, valor in changelist.get_filters_params().items()
+            if clave not in (self.parametro_desde, self.parametro_hasta)
+        ]
+        yield {
+            'selected': not self.desde and not self.hasta,
+            'query_string': changelist.get_query_string(remove=self.expected_parameters()),
+            'display': "Todas",
+        }
+        for nombre, desde, hasta in self.rangos():
+            desde, hasta = desde.isoformat(), hasta.isoformat()
+            yield {
+                'selected': (self.desde, self.hasta) == (desde, hasta),
+                'query_string': changelist.get_query_string({self.parametro_desde: desde, self.parametro_hasta: hasta}),
+                'display': nombre,
+            }
+
+
+class MedicoFilter(admin.RelatedFieldListFilter):
+    """Filtro por médico que carga los nombres en una consulta (el __str__ usa user y especialidad)."""
+
+    def field_choices(self, field, request, model_admin):
+        medicos = Medico.objects.select_related('user', 'especialidad').order_by('user__last_name', 'user__first_name')
+        return [(medico.pk, str(medico)) for medico in medicos]
+
 
 # Configuración para Especialidad
 @admin.register(Especialidad)
@@ -8,21 +161,29 @@ class EspecialidadAdmin(admin.ModelAdmin):
     search_fields = ('nombre',)  # Campo para la barra de búsqueda
     ordering = ('nombre',)  # Orden alfabético por nombre
 
+@admin.register(Sede)
+class SedeAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'codigo', 'direccion')
+    search_fields = ('nombre', 'codigo')
+    ordering = ('nombre',)
+
 # Configuración para Paciente
 @admin.register(Paciente)
-class PacienteAdmin(admin.ModelAdmin):
+class PacienteAdmin(AdminEscalable):
     list_display = ('rut', 'nombre', 'telefono', 'email')  # Campos visibles en la lista
-    search_fields = ('rut', 'nombre', 'telefono', 'email')  # Campos para la barra de búsqueda
-    list_filter = ('direccion',)  # Filtro por dirección
-    ordering = ('nombre',)  # Orden por nombre
+    search_fields = ('nombre', 'email')  # Campos para la barra de búsqueda; el RUT se busca por igualdad
+    campo_rut = 'rut_cuerpo'
+    ordering = ('nombre',)  # Orden por nombre, con el índice paciente_nombre
 
 # Configuración para Médico
 @admin.register(Medico)
 class MedicoAdmin(admin.ModelAdmin):
-    list_display = ('get_full_name', 'especialidad', 'telefono', 'get_rut')  # Mostrar nombre completo y RUT
+    list_display = ('get_full_name', 'especialidad', 'sede', 'telefono', 'get_rut')  # Mostrar nombre completo y RUT
+    list_select_related = ('user', 'especialidad', 'sede')
     search_fields = ('user__username', 'user__first_name', 'user__last_name', 'especialidad__nombre')  # Campos para búsqueda
     list_filter = ('especialidad',)  # Filtro por especialidad
     ordering = ('user__last_name',)  # Orden por apellido
+    actions = ['cancelar_reservas_de_hoy', 'renovar_calendarios']
 
     def get_full_name(self, obj):
         return f"{obj.user.first_name} {obj.user.last_name}"
@@ -32,19 +193,36 @@ class MedicoAdmin(admin.ModelAdmin):
         return obj.user.username
     get_rut.short_description = "RUT"
 
+    @admin.action(description="Cancelar las reservas que quedan hoy")
+    def cancelar_reservas_de_hoy(self, request, queryset):
+        _, fin = limites_del_dia(localdate())
+        total = 0
+        for medico in queryset.select_related('user'):
+            total += len(cancelar_reservas(medico, now(), fin, usuario=request.user, motivo="Cancelada desde el admin")['canceladas'])
+        self.message_user(request, f"Se cancelaron {total} reservas.", messages.SUCCESS)
+
+    @admin.action(description="Revocar la URL de suscripción al calendario")
+    def renovar_calendarios(self, request, queryset):
+        for medico in queryset:
+            renovar_suscripcion(medico)
+        self.message_user(request, f"Se renovó la URL del calendario de {len(queryset)} médicos.", messages.SUCCESS)
+
 # Configuración para Ficha Médica
 @admin.register(FichaMedica)
-class FichaMedicaAdmin(admin.ModelAdmin):
+class FichaMedicaAdmin(AdminEscalable):
     list_display = ('paciente', 'medico', 'fecha_creacion', 'diagnostico')  # Campos visibles
-    search_fields = ('paciente__rut', 'paciente__nombre', 'medico__user__username', 'diagnostico')  # Campos de búsqueda
-    list_filter = ('fecha_creacion', 'medico')  # Filtros por fecha de creación y médico
-    date_hierarchy = 'fecha_creacion'  # Barra de navegación por fecha
+    search_fields = ('paciente__nombre', 'medico__user__username', 'diagnostico')  # Campos de búsqueda
+    campo_rut = 'paciente__rut_cuerpo'
+    list_filter = (('fecha_creacion', RangoFechasFilter), ('medico', MedicoFilter))  # Filtros por fecha de creación y médico
+    list_select_related = ('paciente', 'medico__user', 'medico__especialidad')
+    autocomplete_fields = ('paciente', 'medico')
     ordering = ('-fecha_creacion',)  # Orden descendente por fecha de creación
 
 # Configuración para Recepcionista
 @admin.register(Recepcionista)
 class RecepcionistaAdmin(admin.ModelAdmin):
-    list_display = ('get_full_name', 'telefono', 'direccion', 'fecha_contratacion', 'get_rut')  # Mostrar nombre completo y RUT
+    list_display = ('get_full_name', 'sede', 'telefono', 'direccion', 'fecha_contratacion', 'get_rut')  # Mostrar nombre completo y RUT
+    list_select_related = ('user', 'sede')
     search_fields = ('user__username', 'user__first_name', 'user__last_name', 'telefono')  # Campos de búsqueda
     list_filter = ('fecha_contratacion',)  # Filtro por fecha de contratación
     ordering = ('user__last_name',)  # Orden por apellido
@@ -59,10 +237,14 @@ class RecepcionistaAdmin(admin.ModelAdmin):
 
 # Configuración para Reserva
 @admin.register(Reserva)
-class ReservaAdmin(admin.ModelAdmin):
-    list_display = ('paciente', 'medico', 'fecha_reserva', 'motivo')  # Campos visibles
-    search_fields = ('paciente__nombre', 'paciente__rut', 'medico__user__username', 'motivo')  # Campos de búsqueda
-    list_filter = ('fecha_reserva__fecha_disponible', 'medico')  # Filtros por fecha y médico
+class ReservaAdmin(AdminEscalable):
+    list_display = ('paciente', 'medico', 'get_fecha_reserva', 'motivo')  # Campos visibles
+    search_fields = ('paciente__nombre', 'medico__user__username', 'motivo')  # Campos de búsqueda
+    campo_rut = 'paciente__rut_cuerpo'
+    list_filter = (('fecha_reserva__fecha_disponible', RangoFechasFilter), ('medico', MedicoFilter))  # Filtros por fecha y médico
+    list_select_related = ('paciente', 'medico__user', 'medico__especialidad', 'fecha_reserva')
+    autocomplete_fields = ('paciente', 'medico')
+    raw_id_fields = ('fecha_reserva', 'recepcionista')
     ordering = ('-fecha_reserva__fecha_disponible',)  # Orden descendente por fecha de disponibilidad
 
     def get_fecha_reserva(self, obj):
@@ -71,7 +253,20 @@ class ReservaAdmin(admin.ModelAdmin):
     get_fecha_reserva.short_description = 'Fecha de Reserva'
 
 @admin.register(Disponibilidad)
-class DisponibilidadAdmin(admin.ModelAdmin):
+class DisponibilidadAdmin(AdminEscalable):
     list_display = ('medico', 'fecha_disponible')  # Mostrar campos relevantes en la tabla
-    list_filter = ('medico', 'fecha_disponible')  # Agregar filtros
+    list_filter = (('medico', MedicoFilter), ('fecha_disponible', RangoFechasFilter))  # Agregar filtros
+    list_select_related = ('medico__user', 'medico__especialidad')
     search_fields = ('medico__user__first_name', 'medico__user__last_name')
+    autocomplete_fields = ('medico',)
+    ordering = ('-fecha_disponible',)
+
+@admin.register(ListaEspera)
+class ListaEsperaAdmin(AdminEscalable):
+    list_display = ('paciente', 'especialidad', 'medico', 'prioridad', 'estado', 'oferta_expira', 'fecha_creacion')
+    list_filter = ('estado', 'prioridad', 'especialidad')
+    search_fields = ('paciente__nombre',)
+    campo_rut = 'paciente__rut_cuerpo'
+    list_select_related = ('paciente', 'especialidad', 'medico__user', 'medico__especialidad')
+    raw_id_fields = ('paciente', 'bloque_ofrecido')
+    ordering = ('-prioridad', 'fecha_creacion')
@@ -0,0 +1,183 @@
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.timezone import localdate, localtime
+
+from .consultas import consulta_critica
+from .models import Disponibilidad, Medico, Paciente, Reserva
+from .utils import en_lote, limites_del_dia, segundos_hasta_medianoche
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Campos que necesita el panel del médico; se leen con values() en una sola consulta.
+CAMPOS_AGENDA = {
+    'id': 'id',
+    'inicio': 'fecha_reserva__fecha_disponible',
+    'duracion': 'fecha_reserva__duracion',
+    'paciente': 'paciente__nombre',
+    'paciente_rut': 'paciente__rut',
+    'motivo': 'motivo',
+}
+
+
+def clave_agenda(usuario_id, fecha):
+    """Clave de caché de la agenda de un médico (identificado por su usuario) para un día."""
+    return f"agenda:{usuario_id}:{fecha.isoformat()}"
+
+
+@consulta_critica('agenda_del_dia', ejemplo=lambda: {'fecha': localdate(), 'fecha_reserva__medico__user_id': 1})
+def _reservas_del_dia(fecha, **filtros):
+    inicio, fin = limites_del_dia(fecha)
+    return (
+        Reserva.objects
+        .filter(fecha_reserva__fecha_disponible__gte=inicio, fecha_reserva__fecha_disponible__lt=fin, **filtros)
+        .order_by('fecha_reserva__fecha_disponible')
+        .values('medico__user_id', *CAMPOS_AGENDA.values())
+    )
+
+
+def _entrada(fila):
+    return {nombre: fila[campo] for nombre, campo in CAMPOS_AGENDA.items()}
+
+
+def construir_agenda(usuario_id, fecha):
+    """
+    Lee de la base de datos las reservas del día de un médico, ordenadas por hora.
+    """
+    # La reserva y su bloque son siempre del mismo médico; filtrar por el médico del bloque
+    # recorre el índice (medico, fecha_disponible) ya ordenado por hora
+    return [_entrada(fila) for fila in _reservas_del_dia(fecha, fecha_reserva__medico__user_id=usuario_id)]
+
+
+def obtener_agenda(usuario_id, fecha=None):
+    """
+    Agenda del día de un médico. Se lee de la caché y solo se reconstruye si falta.
+    """
+    fecha = fecha or localdate()
+    clave = clave_agenda(usuario_id, fecha)
+    agenda = cache.get(clave)
+    if agenda is None:
+        agenda = construir_agenda(usuario_id, fecha)
+        cache.set(clave, agenda, segundos_hasta_medianoche())
+    return agenda
+
+
+def calentar_agendas(fecha=None):
+    """
+    Precalcula la agenda del día de todos los médicos con una sola consulta y la deja en caché.
+    Pensado para correr antes de la apertura.
+    """
+    fecha = fecha or localdate()
+    agendas = {usuario_id: [] for usuario_id in Medico.objects.values_list('user_id', flat=True)}
+    for fila in _reservas_del_dia(fecha):
+        agendas.setdefault(fila['medico__user_id'], []).append(_entrada(fila))
+
+    cache.set_many(
+        {clave_agenda(usuario_id, fecha): agenda for usuario_id, agenda in agendas.items()},
+        segundos_hasta_medianoche(),
+    )
+    logger.info(f"Agendas precalculadas para {len(agendas)} médicos ({fecha}).")
+    return len(agendas)
+
+
+def actualizar_agendas(pares):
+    """
+    Reconstruye solo las agendas afectadas, dadas como pares (usuario_id, fecha),
+    y únicamente si ya estaban en caché.
+    """
+    por_fecha = defaultdict(set)
+    for usuario_id, fecha in pares:
+        if usuario_id and fecha:
+            por_fecha[fecha].add(usuario_id)
+
+    for fecha, usuarios in por_fecha.items():
+        claves = {clave_agenda(usuario_id, fecha): usuario_id for usuario_id in usuarios}
+        en_cache = cache.get_many(list(claves))
+        if not en_cache:
+            continue
+        agendas = {claves[clave]: [] for clave in en_cache}
+        for fila in _reservas_del_dia(fecha, fecha_reserva__medico__user_id__in=list(agendas)):
+            agendas[fila['medico__user_id']].append(_entrada(fila))
+        cache.set_many(
+            {clave_agenda(usuario_id, fecha): agenda for usuario_id, agenda in agendas.items()},
+            segundos_hasta_medianoche(),
+        )
+
+
+def _programar_actualizacion(pares):
+    # Se actualiza al confirmar la transacción para no leer datos a medio escribir
+    pares = set(pares)
+    transaction.on_commit(lambda: actualizar_agendas(pares), using=router.db_for_write(Reserva))
+
+
+def _par_agenda(usuario_id, fecha_disponible):
+    return (usuario_id, localtime(fecha_disponible).date()) if fecha_disponible else None
+
+
+@receiver(pre_save, sender=Reserva)
+def recordar_agenda_anterior(sender, instance, **kwargs):
+    """Guarda el médico y el día que tenía la reserva antes de modificarse."""
+    instance._agenda_anterior = None
+    if instance.pk and not en_lote():
+        anterior = (
+            Reserva.objects.filter(pk=instance.pk)
+            .values_list('medico__user_id', 'fecha_reserva__fecha_disponible')
+            .first()
+        )
+        if anterior:
+            instance._agenda_anterior = _par_agenda(*anterior)
+
+
+@receiver(post_save, sender=Reserva)
+def actualizar_agenda_reserva(sender, instance, **kwargs):
+    if en_lote():
+        return
+    pares = [_par_agenda(instance.medico.user_id, instance.fecha_reserva.fecha_disponible)]
+    if getattr(instance, '_agenda_anterior', None):
+        pares.append(instance._agenda_anterior)
+    _programar_actualizacion(par for par in pares if par)
+
+
+@receiver(post_delete, sender=Reserva)
+def quitar_reserva_de_agenda(sender, instance, **kwargs):
+    if en_lote():
+        return
+    _programar_actualizacion([_par_agenda(instance.medico.user_id, instance.fecha_reserva.fecha_disponible)])
+
+
+@receiver(pre_save, sender=Disponibilidad)
+def recordar_horario_anterior(sender, instance, **kwargs):
+    instance._fecha_anterior = None
+    if instance.pk and not en_lote():
+        instance._fecha_anterior = (
+            Disponibilidad.objects.filter(pk=instance.pk).values_list('fecha_disponible', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Disponibilidad)
+def actualizar_agenda_horario(sender, instance, created, **kwargs):
+    """Si se mueve un bloque ya reservado, su reserva cambia de hora o de día."""
+    anterior = getattr(instance, '_fecha_anterior', None)
+    if en_lote() or created or not instance.ocupada or anterior in (None, instance.fecha_disponible):
+        return
+    usuario_id = instance.medico.user_id
+    _programar_actualizacion([_par_agenda(usuario_id, anterior), _par_agenda(usuario_id, instance.fecha_disponible)])
+
+
+@receiver(post_save, sender=Paciente)
+def actualizar_agenda_paciente(sender, instance, created, **kwargs):
+    """El nombre del paciente aparece en la agenda; se refrescan los días de hoy en adelante."""
+    if created:
+        return
+    inicio, _ = limites_del_dia(localdate())
+    reservas = (
+        Reserva.objects
+        .filter(paciente=instance, fecha_reserva__fecha_disponible__gte=inicio)
+        .values_list('medico__user_id', 'fecha_reserva__fecha_disponible')
+    )
+    _programar_actualizacion(_par_agenda(*reserva) for reserva in reservas)
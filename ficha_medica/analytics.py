@@ -0,0 +1,348 @@
+# Analítica de cohortes calculada en la base de datos; NumPy solo arma las matrices para gráficos.
+# La ocupación de la agenda (al final) se calcula en NumPy sobre los bloques leídos como arreglos.
+from datetime import date, datetime
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import BigIntegerField, Case, CharField, Count, F, Func, IntegerField, Value, When
+from django.db.models.functions import Cast
+from django.utils.timezone import get_current_timezone, localdate, now
+
+from .archivo import mes_de
+from .consultas import consulta_critica
+from .models import Disponibilidad, DisponibilidadArchivo, Especialidad, Medico, Paciente, Reserva, ReservaArchivo
+from .utils import limites_del_dia, sede_activa, segundos_hasta_medianoche
+
+
+# Límite inferior (en años) de cada grupo etario, en orden ascendente.
+GRUPOS_ETARIOS = [
+    (0, '0-17'),
+    (18, '18-29'),
+    (30, '30-44'),
+    (45, '45-59'),
+    (60, '60-74'),
+    (75, '75+'),
+]
+SIN_REGISTRO = 'Sin registro'
+ETIQUETAS_GRUPOS = [etiqueta for _, etiqueta in GRUPOS_ETARIOS] + [SIN_REGISTRO]
+
+
+def restar_anios(fecha, anios):
+    """Resta años a una fecha; el 29 de febrero pasa al 28 en años no bisiestos."""
+    try:
+        return fecha.replace(year=fecha.year - anios)
+    except ValueError:
+        return fecha.replace(year=fecha.year - anios, day=28)
+
+
+def expresion_grupo_etario(campo='fecha_nacimiento', hoy=None):
+    """
+    Expresión SQL (CASE) que asigna el grupo etario según la fecha de nacimiento.
+
+    Tener al menos N años equivale a haber nacido en o antes de `hoy - N años`, así que
+    cada grupo es una comparación sobre la columna y puede aprovechar su índice.
+    """
+    hoy = hoy or localdate()
+    condiciones = [
+        When(**{f'{campo}__lte': restar_anios(hoy, limite)}, then=Value(etiqueta))
+        for limite, etiqueta in reversed(GRUPOS_ETARIOS)
+    ]
+    return Case(*condiciones, default=Value(SIN_REGISTRO), output_field=CharField())
+
+
+def _en_cache_diaria(nombre, calcular):
+    clave = f"analitica:{nombre}:{sede_activa() or 'todas'}:{localdate().isoformat()}"
+    resultado = cache.get(clave)
+    if resultado is None:
+        resultado = calcular()
+        cache.set(clave, resultado, segundos_hasta_medianoche())
+    return resultado
+
+
+def pacientes_por_grupo_etario(hoy=None):
+    """
+    Cantidad de pacientes por grupo etario en una sola consulta agregada.
+    """
+    filas = (
+        Paciente.objects
+        .annotate(grupo=expresion_grupo_etario(hoy=hoy))
+        .values('grupo')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    conteos = {fila['grupo']: fila['total'] for fila in filas}
+    return {etiqueta: conteos.get(etiqueta, 0) for etiqueta in ETIQUETAS_GRUPOS}
+
+
+def reservas_por_especialidad_y_grupo(desde=None, hasta=None, hoy=None):
+    """
+    Matriz densa de reservas (especialidad x grupo etario del paciente), vigentes y archivadas.
+
+    Retorna un diccionario con las etiquetas de filas y columnas y la matriz como ndarray.
+    """
+    reservas = Reserva.objects.all()
+    archivadas = ReservaArchivo.objects.all()
+    if desde:
+        reservas = reservas.filter(fecha_reserva__fecha_disponible__gte=desde)
+        archivadas = archivadas.filter(fecha__gte=desde, mes__gte=mes_de(desde))
+    if hasta:
+        reservas = reservas.filter(fecha_reserva__fecha_disponible__lt=hasta)
+        archivadas = archivadas.filter(fecha__lt=hasta, mes__lte=mes_de(hasta))
+
+    filas = [
+        fila
+        for consulta in (reservas, archivadas)
+        for fila in (
+            consulta
+            .annotate(grupo=expresion_grupo_etario('paciente__fecha_nacimiento', hoy=hoy))
+            .values_list('especialidad_id', 'grupo')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+    ]
+
+    especialidades = list(Especialidad.objects.order_by('nombre').values_list('id', 'nombre'))
+    indice_fila = {pk: i for i, (pk, _) in enumerate(especialidades)}
+    indice_columna = {etiqueta: j for j, etiqueta in enumerate(ETIQUETAS_GRUPOS)}
+
+    matriz = np.zeros((len(especialidades), len(ETIQUETAS_GRUPOS)), dtype=np.int64)
+    if especialidades:
+        datos = np.array(
+            [(indice_fila[esp], indice_columna[grupo], total) for esp, grupo, total in filas],
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        np.add.at(matriz, (datos[:, 0], datos[:, 1]), datos[:, 2])
+
+    return {
+        'especialidades': [nombre for _, nombre in especialidades],
+        'grupos': ETIQUETAS_GRUPOS,
+        'matriz': matriz,
+    }
+
+
+def _visitas_por_paciente_id():
+    """
+    Ids de pacientes con reservas y su total, sumando las vigentes y las archivadas. Cada tabla
+    se agrega en la base de datos; NumPy suma los totales de los pacientes que aparecen en ambas.
+    """
+    ids, totales = [], []
+    for modelo in (Reserva, ReservaArchivo):
+        filas = np.array(
+            list(modelo.objects.values('paciente_id').annotate(total=Count('id')).order_by().values_list('paciente_id', 'total')),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        ids.append(filas[:, 0])
+        totales.append(filas[:, 1])
+    pacientes, posiciones = np.unique(np.concatenate(ids), return_inverse=True)
+    return pacientes, np.bincount(posiciones, weights=np.concatenate(totales), minlength=len(pacientes)).astype(np.int64)
+
+
+def visitas_por_paciente(maximo=20):
+    """
+    Distribución de visitas: cuántos pacientes tienen 0, 1, 2, ... reservas.
+
+    El conteo por paciente se agrega en la base de datos; NumPy solo arma el histograma.
+    El último casillero acumula a los pacientes con `maximo` visitas o más.
+    """
+    _, visitas = _visitas_por_paciente_id()
+    histograma = np.bincount(np.minimum(visitas, maximo), minlength=maximo + 1)
+    histograma[0] = Paciente.objects.count() - len(visitas)
+    return {
+        'visitas': list(range(maximo + 1)),
+        'pacientes': histograma,
+        'promedio': float(visitas.sum() / max(histograma.sum(), 1)),
+    }
+
+
+def pacientes_frecuentes(limite=10):
+    """
+    Pacientes con más reservas, vigentes y archivadas. Se leen solo los que empatan o superan
+    al `limite`-ésimo total y se ordenan por visitas y nombre.
+    """
+    pacientes, visitas = _visitas_por_paciente_id()
+    if not len(pacientes):
+        return []
+    corte = np.sort(visitas)[::-1][min(limite, len(visitas)) - 1]
+    totales = dict(zip(pacientes[visitas >= corte].tolist(), visitas[visitas >= corte].tolist()))
+    frecuentes = [
+        {**fila, 'visitas': totales[fila['id']]}
+        for fila in Paciente.objects.filter(id__in=totales).values('id', 'rut', 'nombre')
+    ]
+    frecuentes.sort(key=lambda fila: (-fila['visitas'], fila['nombre']))
+    return frecuentes[:limite]
+
+
+def reporte_cohortes():
+    """
+    Reporte completo de cohortes, cacheado hasta el fin del día.
+    Las matrices se convierten a listas para que el resultado sea serializable.
+    """
+    def calcular():
+        cruce = reservas_por_especialidad_y_grupo()
+        visitas = visitas_por_paciente()
+        return {
+            'fecha': localdate().isoformat(),
+            'pacientes_por_grupo': pacientes_por_grupo_etario(),
+            'reservas_por_especialidad': {
+                'especialidades': cruce['especialidades'],
+                'grupos': cruce['grupos'],
+                'matriz': cruce['matriz'].tolist(),
+            },
+            'visitas_por_paciente': {
+                'visitas': visitas['visitas'],
+                'pacientes': visitas['pacientes'].tolist(),
+                'promedio': visitas['promedio'],
+            },
+            'pacientes_frecuentes': pacientes_frecuentes(),
+        }
+    return _en_cache_diaria('cohortes', calcular)
+
+
+# Ocupación de la agenda: minutos ofrecidos en bloques frente a minutos reservados. Agrupar por
+# hora de la semana en hora local (con cambios de horario) no se expresa igual en todas las bases
+# ni aprovecha índices, así que los bloques del período se leen como enteros y se agregan en NumPy.
+
+DIAS_SEMANA = ('Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom')
+HORAS_SEMANA = 7 * 24
+BLOQUE = np.dtype([('medico', np.int64), ('duracion', np.int64), ('ocupada', np.bool_), ('segundos', np.int64)])
+
+
+class SegundosEpoca(Func):
+    """Segundos Unix de una fecha y hora: la base entrega un entero en vez de un datetime por fila."""
+    template = 'CAST(EXTRACT(EPOCH FROM %(expressions)s) AS BIGINT)'
+    output_field = BigIntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite guarda el texto en UTC; julianday es de punto flotante, por eso se redondea
+        return self.as_sql(
+            compiler, connection, template='CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400) AS INTEGER)', **extra_context,
+        )
+
+
+# Cada bloque viaja como un solo entero: minutos desde el inicio del período (bits 33+), médico
+# (24 bits), duración (8 bits) y ocupada (1 bit). Un período de un año cabe de sobra en 63 bits.
+BITS_MEDICO = 24
+BITS_DURACION = 8
+
+
+def _leer_bloques(queryset, campo_fecha, inicio):
+    """Lee los bloques del queryset en un arreglo BLOQUE, empaquetados en la base como un entero por fila."""
+    base = int(inicio.timestamp())
+    empaquetado = (
+        ((SegundosEpoca(campo_fecha) - base) / 60 * 2 ** BITS_MEDICO + F('medico_id')) * 2 ** BITS_DURACION + F('duracion')
+    ) * 2 + Cast('ocupada', IntegerField())
+    sql, params = queryset.values_list(empaquetado).query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        valores = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1)
+    bloques = np.empty(len(valores), dtype=BLOQUE)
+    bloques['ocupada'] = valores & 1
+    valores >>= 1
+    bloques['duracion'] = valores & (2 ** BITS_DURACION - 1)
+    valores >>= BITS_DURACION
+    bloques['medico'] = valores & (2 ** BITS_MEDICO - 1)
+    bloques['segundos'] = base + (valores >> BITS_MEDICO) * 60
+    return bloques
+
+
+@consulta_critica('ocupacion_bloques', ejemplo=lambda: {'inicio': now(), 'fin': now()})
+def bloques_vigentes(inicio, fin):
+    """Bloques de la agenda que empiezan en [inicio, fin)."""
+    return Disponibilidad.objects.filter(fecha_disponible__gte=inicio, fecha_disponible__lt=fin)
+
+
+@consulta_critica('ocupacion_bloques_archivados', ejemplo=lambda: {'inicio': now(), 'fin': now()})
+def bloques_archivados(inicio, fin):
+    """Bloques del archivo que empiezan en [inicio, fin); el filtro por mes poda particiones."""
+    return DisponibilidadArchivo.objects.filter(fecha__gte=inicio, fecha__lt=fin, mes__gte=mes_de(inicio), mes__lte=mes_de(fin))
+
+
+def bloques_del_periodo(inicio, fin):
+    """Bloques que empiezan en [inicio, fin), de la agenda y del archivo, como un arreglo estructurado BLOQUE."""
+    return np.concatenate([
+        _leer_bloques(bloques_vigentes(inicio, fin), 'fecha_disponible', inicio),
+        _leer_bloques(bloques_archivados(inicio, fin), 'fecha', inicio),
+    ])
+
+
+def _segundos_locales(segundos, inicio, fin):
+    """Pasa segundos UTC a hora local con el desfase de cada hora del período."""
+    primera = int(inicio.timestamp()) // 3600
+    zona = get_current_timezone()
+    desfases = np.array([
+        datetime.fromtimestamp(hora * 3600, zona).utcoffset().total_seconds()
+        for hora in range(primera, int(fin.timestamp()) // 3600 + 1)
+    ], dtype=np.int64)
+    return segundos + desfases[segundos // 3600 - primera]
+
+
+def _posiciones(valores, ids):
+    """Posición de cada valor en `ids`, o -1 si no está."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return np.full(len(valores), -1, dtype=np.int64)
+    orden = np.argsort(ids)
+    posiciones = orden[np.minimum(np.searchsorted(ids, valores, sorter=orden), len(ids) - 1)]
+    return np.where(ids[posiciones] == valores, posiciones, -1)
+
+
+def _oferta_y_ocupacion(fila, columna, forma, bloques):
+    validos = (fila >= 0) & (columna >= 0) & (columna < forma[1])
+    celdas = fila[validos] * forma[1] + columna[validos]
+    minutos = bloques['duracion'][validos]
+    oferta = np.bincount(celdas, weights=minutos, minlength=forma[0] * forma[1]).reshape(forma).astype(np.int64)
+    ocupado = np.bincount(celdas, weights=minutos * bloques['ocupada'][validos], minlength=forma[0] * forma[1]).reshape(forma).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        utilizacion = np.where(oferta > 0, ocupado / oferta, np.nan)
+    return {'oferta': oferta, 'ocupado': ocupado, 'utilizacion': utilizacion}
+
+
+def ocupacion_por_medico_y_hora(desde, hasta):
+    """
+    Matrices (médico x hora de la semana, lunes 00:00 primero) de minutos ofrecidos y reservados en
+    los días [desde, hasta], y la utilización: reservados / ofrecidos, NaN donde no hubo oferta.
+    """
+    inicio, fin = limites_del_dia(desde)[0], limites_del_dia(hasta)[1]
+    bloques = bloques_del_periodo(inicio, fin)
+    medicos = list(Medico.objects.order_by('user__last_name', 'user__first_name', 'id').values_list('id', 'user__first_name', 'user__last_name'))
+    local = _segundos_locales(bloques['segundos'], inicio, fin)
+    # El 1 de enero de 1970 fue jueves: con el lunes como 0, el día de la semana es (día + 3) % 7
+    columna = (local // 86400 + 3) % 7 * 24 + local % 86400 // 3600
+    fila = _posiciones(bloques['medico'], [medico[0] for medico in medicos])
+    return {
+        'filas': [f"{nombre} {apellido}".strip() for _, nombre, apellido in medicos],
+        'columnas': [f"{dia} {hora:02d}:00" for dia in DIAS_SEMANA for hora in range(24)],
+        **_oferta_y_ocupacion(fila, columna, (len(medicos), HORAS_SEMANA), bloques),
+    }
+
+
+def ocupacion_por_especialidad_y_dia(desde, hasta):
+    """Como ocupacion_por_medico_y_hora, por especialidad y fecha de los días [desde, hasta]."""
+    inicio, fin = limites_del_dia(desde)[0], limites_del_dia(hasta)[1]
+    bloques = bloques_del_periodo(inicio, fin)
+    especialidades = list(Especialidad.objects.order_by('nombre').values_list('id', 'nombre'))
+    medicos = np.array(list(Medico.objects.values_list('id', 'especialidad_id')), dtype=np.int64).reshape(-1, 2)
+    # El -1 final es la especialidad de los bloques cuyo médico no está en la lista
+    especialidad_de_medico = np.append(_posiciones(medicos[:, 1], [especialidad[0] for especialidad in especialidades]), -1)
+    fila = especialidad_de_medico[_posiciones(bloques['medico'], medicos[:, 0])]
+    columna = _segundos_locales(bloques['segundos'], inicio, fin) // 86400 - (desde - date(1970, 1, 1)).days
+    dias = (hasta - desde).days + 1
+    return {
+        'filas': [nombre for _, nombre in especialidades],
+        'columnas': [date.fromordinal(desde.toordinal() + dia).isoformat() for dia in range(dias)],
+        **_oferta_y_ocupacion(fila, columna, (len(especialidades), dias), bloques),
+    }
+
+
+VISTAS_OCUPACION = {
+    'medicos': ocupacion_por_medico_y_hora,
+    'especialidades': ocupacion_por_especialidad_y_dia,
+}
+
+
+def reporte_ocupacion(vista, desde, hasta):
+    """Matrices de ocupación de la vista ('medicos' o 'especialidades'), cacheadas hasta el fin del día."""
+    return _en_cache_diaria(
+        f"ocupacion:{vista}:{desde.isoformat()}:{hasta.isoformat()}", lambda: VISTAS_OCUPACION[vista](desde, hasta),
+    )
@@ -5,5 +5,20 @@ class FichaMedicaConfig(AppConfig):
     name = 'ficha_medica'
 
     def ready(self):
-        from .scheduler import iniciar_scheduler
-        iniciar_scheduler()
+        from django.conf import settings
+        from . import agenda  # noqa: F401  (registra las señales que mantienen la agenda diaria)
+        from . import cache  # noqa: F401  (registra las señales que versionan la caché)
+        from . import auth  # noqa: F401  (registra las señales que invalidan el usuario en caché)
+        from . import linea_tiempo  # noqa: F401  (registra las señales que invalidan la línea de tiempo)
+        from . import revisiones  # noqa: F401  (registra las señales que versionan las fichas)
+        from . import calendario  # noqa: F401  (registra las señales que invalidan los calendarios)
+        from . import cambios  # noqa: F401  (registra las señales que llevan el registro de cambios de reservas)
+        from . import sedes  # noqa: F401  (registra las señales que copian los catálogos a las bases de sede)
+        from . import trabajos  # noqa: F401  (registra las tareas de la cola para poder encolarlas)
+        from .arranque import es_proceso_servidor
+
+        # migrate, collectstatic, test, etc. no necesitan el scheduler. Con TAREAS_EN_WORKERS
+        # las tareas periódicas las encola run_workers en vez de cada proceso web.
+        if es_proceso_servidor() and not settings.TAREAS.get('PERIODICAS_EN_WORKERS'):
+            from .scheduler import iniciar_scheduler
+            iniciar_scheduler()
@@ -0,0 +1,255 @@
+from datetime import datetime, time, timedelta
+from heapq import merge
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils.timezone import localtime, make_aware, now
+
+from .consultas import consulta_critica
+from .models import Disponibilidad, DisponibilidadArchivo, Reserva, ReservaArchivo
+from .sedes import en_cada_sede
+from .tareas import tarea
+from .utils import senales_en_lote
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'ARCHIVO_AGENDA', {})
+DIAS_BLOQUES_LIBRES = _config.get('DIAS_BLOQUES_LIBRES', 7)
+MESES_RESERVAS = _config.get('MESES_RESERVAS', 12)
+LOTE = _config.get('LOTE', 2000)
+
+CAMPOS_BLOQUE = ('id', 'medico_id', 'fecha_disponible', 'duracion', 'ocupada', 'sede_id', 'creado_en')
+CAMPOS_RESERVA = (
+    'id', 'paciente_id', 'especialidad_id', 'medico_id', 'fecha_reserva_id', 'motivo', 'recepcionista_id', 'sede_id', 'creado_en',
+)
+
+_particiones = set()  # (alias, tabla, mes) ya creadas por este proceso
+
+
+def inicio_de_mes(fecha):
+    return fecha.replace(day=1)
+
+
+def mes_de(momento):
+    """Primer día del mes, en hora local, de `momento`: la clave de partición del archivo."""
+    return inicio_de_mes(localtime(momento).date())
+
+
+def _mes_siguiente(mes):
+    return inicio_de_mes(mes + timedelta(days=32))
+
+
+def _asegurar_particiones(modelo, meses, using):
+    """En PostgreSQL crea las particiones mensuales del archivo que falten; en otras bases no hace nada."""
+    conexion = connections[using]
+    if conexion.vendor != 'postgresql':
+        return
+    tabla = modelo._meta.db_table
+    nuevas = sorted(mes for mes in meses if (using, tabla, mes) not in _particiones)
+    with conexion.cursor() as cursor:
+        for mes in nuevas:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {conexion.ops.quote_name(f'{tabla}_{mes:%Y_%m}')} "
+                f"PARTITION OF {conexion.ops.quote_name(tabla)} FOR VALUES FROM (%s) TO (%s)",
+                [mes, _mes_siguiente(mes)],
+            )
+    if nuevas:
+        transaction.on_commit(lambda: _particiones.update((using, tabla, mes) for mes in nuevas), using=using)
+
+
+@consulta_critica('archivo_bloques_antiguos', ejemplo=lambda: {'limite': now(), 'desde': now()})
+def bloques_antiguos(limite, desde=None):
+    """Bloques que empiezan antes de `limite` (desde `desde`), del más antiguo al más nuevo."""
+    bloques = Disponibilidad.objects.filter(fecha_disponible__lt=limite)
+    if desde is not None:
+        bloques = bloques.filter(fecha_disponible__gte=desde)
+    return bloques.order_by('fecha_disponible')
+
+
+@consulta_critica('archivo_bloques_libres', ejemplo=lambda: {'limite': now(), 'desde': now()})
+def bloques_libres_pasados(limite, desde=None):
+    """Como bloques_antiguos, solo los libres."""
+    return bloques_antiguos(limite, desde).filter(ocupada=False)
+
+
+def _guardar_en_archivo(modelo, filas, alias):
+    """
+    Inserta las filas en el archivo. Las que ya estaban archivadas (p. ej. restauradas a mano a la
+    agenda) se sobrescriben con la versión vigente, que es la que se elimina a continuación.
+    """
+    archivo = modelo._base_manager.db_manager(alias)
+    existentes = set(archivo.filter(id__in=[fila.id for fila in filas]).values_list('id', flat=True))
+    archivo.bulk_create([fila for fila in filas if fila.id not in existentes], batch_size=LOTE)
+    if existentes:
+        campos = [campo.name for campo in modelo._meta.concrete_fields if not campo.primary_key]
+        archivo.bulk_update([fila for fila in filas if fila.id in existentes], campos, batch_size=LOTE)
+        logger.warning(f"{len(existentes)} filas de {modelo._meta.db_table} ya estaban archivadas: se actualizaron.")
+
+
+def _mover(bloques, alias):
+    """Copia al archivo los bloques (filas de values()) y sus reservas y los elimina de la agenda."""
+    ids = [bloque['id'] for bloque in bloques]
+    por_id = {bloque['id']: bloque for bloque in bloques}
+    reservas = list(Reserva.objects.filter(fecha_reserva_id__in=ids).values(*CAMPOS_RESERVA))
+    archivado_en = now()
+
+    archivados = [
+        DisponibilidadArchivo(
+            id=bloque['id'], medico_id=bloque['medico_id'], fecha=bloque['fecha_disponible'], duracion=bloque['duracion'],
+            ocupada=bloque['ocupada'], sede_id=bloque['sede_id'], creado_en=bloque['creado_en'],
+            archivado_en=archivado_en, mes=mes_de(bloque['fecha_disponible']),
+        )
+        for bloque in bloques
+    ]
+    reservas_archivadas = [
+        ReservaArchivo(
+            id=reserva['id'], paciente_id=reserva['paciente_id'], especialidad_id=reserva['especialidad_id'],
+            medico_id=reserva['medico_id'], bloque_id=reserva['fecha_reserva_id'],
+            fecha=por_id[reserva['fecha_reserva_id']]['fecha_disponible'], duracion=por_id[reserva['fecha_reserva_id']]['duracion'],
+            motivo=reserva['motivo'], recepcionista_id=reserva['recepcionista_id'], sede_id=reserva['sede_id'],
+            creado_en=reserva['creado_en'], archivado_en=archivado_en, mes=mes_de(por_id[reserva['fecha_reserva_id']]['fecha_disponible']),
+        )
+        for reserva in reservas
+    ]
+    _asegurar_particiones(DisponibilidadArchivo, {fila.mes for fila in archivados}, alias)
+    _asegurar_particiones(ReservaArchivo, {fila.mes for fila in reservas_archivadas}, alias)
+    _guardar_en_archivo(DisponibilidadArchivo, archivados, alias)
+    _guardar_en_archivo(ReservaArchivo, reservas_archivadas, alias)
+    Reserva.objects.filter(id__in=[reserva['id'] for reserva in reservas]).delete()
+    Disponibilidad.objects.filter(id__in=ids).delete()
+    return len(reservas)
+
+
+def _archivar(consulta, limite, lote):
+    """
+    Mueve los bloques de `consulta` anteriores a `limite`, de a `lote` por transacción. Cada lote
+    sigue desde la fecha del anterior: los bloques que el filtro salta no se vuelven a recorrer.
+    Las señales por fila se omiten: lo archivado ya quedó fuera de la agenda, el calendario y las
+    cachés derivadas, y la línea de tiempo lo sigue mostrando desde el archivo.
+    """
+    alias = router.db_for_write(Disponibilidad)
+    movidos = {'bloques': 0, 'reservas': 0}
+    desde = None
+    while True:
+        with transaction.atomic(using=alias), senales_en_lote():
+            bloques = list(consulta(limite, desde).values(*CAMPOS_BLOQUE)[:lote])
+            if not bloques:
+                return movidos
+            movidos['reservas'] += _mover(bloques, alias)
+            movidos['bloques'] += len(bloques)
+        desde = bloques[-1]['fecha_disponible']
+
+
+def limite_reservas(meses=MESES_RESERVAS):
+    """Inicio del mes de hace `meses` meses: las reservas se archivan por meses completos."""
+    return make_aware(datetime.combine(mes_de(now() - timedelta(days=30 * meses)), time.min))
+
+
+@tarea('archivar_agenda', max_intentos=1, tiempo_maximo=3600)
+@en_cada_sede
+def archivar_agenda(dias_libres=DIAS_BLOQUES_LIBRES, meses_reservas=MESES_RESERVAS, lote=LOTE):
+    """
+    Mueve al archivo las reservas anteriores a `meses_reservas` meses con sus bloques, y los bloques
+    libres de hace más de `dias_libres` días. Retorna la cantidad de bloques y reservas movidos.
+    """
+    antiguos = _archivar(bloques_antiguos, limite_reservas(meses_reservas), lote)
+    libres = _archivar(bloques_libres_pasados, now() - timedelta(days=dias_libres), lote)
+    movidos = {'bloques': antiguos['bloques'] + libres['bloques'], 'reservas': antiguos['reservas'] + libres['reservas']}
+    logger.info(f"Agenda archivada: {movidos['bloques']} bloques y {movidos['reservas']} reservas.")
+    return movidos
+
+
+# Lectura histórica: la agenda vigente y el archivo como una sola secuencia
+
+CAMPOS_HISTORICOS_RESERVA = ('id', 'paciente_id', 'especialidad_id', 'medico_id', 'motivo', 'sede_id')
+CAMPOS_HISTORICOS_BLOQUE = ('id', 'medico_id', 'ocupada', 'sede_id')
+
+
+def _en_rango(queryset, desde, hasta, archivo):
+    queryset = queryset.filter(fecha__gte=desde, fecha__lt=hasta)
+    if archivo:
+        # En PostgreSQL el filtro por mes limita la consulta a las particiones del rango
+        queryset = queryset.filter(mes__gte=mes_de(desde), mes__lte=mes_de(hasta))
+    return queryset
+
+
+def _por_paginas(queryset, tamano, archivada):
+    # Paginación por llave (fecha, id), como en core.audit: el costo de cada página no crece con el rango
+    ultimo = None
+    while True:
+        pagina = queryset
+        if ultimo is not None:
+            pagina = pagina.filter(Q(fecha__gt=ultimo[0]) | Q(fecha=ultimo[0], id__gt=ultimo[1]))
+        filas = list(pagina.order_by('fecha', 'id')[:tamano])
+        for fila in filas:
+            fila['archivada'] = archivada
+            yield fila
+        if len(filas) < tamano:
+            return
+        ultimo = (filas[-1]['fecha'], filas[-1]['id'])
+
+
+def _filtros(**valores):
+    return {campo: valor for campo, valor in valores.items() if valor is not None}
+
+
+def consultar_reservas(desde, hasta, medico_id=None, paciente_id=None, tamano=2000):
+    """
+    Itera en orden cronológico las reservas con bloque en [desde, hasta), vigentes y archivadas,
+    leyendo páginas de `tamano` filas de cada tabla. Cada fila trae su fecha y duración.
+    """
+    filtros = _filtros(medico_id=medico_id, paciente_id=paciente_id)
+    archivadas = _en_rango(
+        ReservaArchivo.objects.filter(**filtros).values(*CAMPOS_HISTORICOS_RESERVA, 'fecha', 'duracion'), desde, hasta, archivo=True,
+    )
+    vigentes = _en_rango(
+        Reserva.objects.filter(**filtros).values(
+            *CAMPOS_HISTORICOS_RESERVA, fecha=F('fecha_reserva__fecha_disponible'), duracion=F('fecha_reserva__duracion'),
+        ), desde, hasta, archivo=False,
+    )
+    yield from merge(
+        _por_paginas(archivadas, tamano, True), _por_paginas(vigentes, tamano, False),
+        key=lambda fila: (fila['fecha'], fila['id']),
+    )
+
+
+def consultar_bloques(desde, hasta, medico_id=None, tamano=2000):
+    """Itera en orden cronológico los bloques libres y ocupados que empiezan en [desde, hasta)."""
+    filtros = _filtros(medico_id=medico_id)
+    archivados = _en_rango(
+        DisponibilidadArchivo.objects.filter(**filtros).values(*CAMPOS_HISTORICOS_BLOQUE, 'fecha', 'duracion'), desde, hasta, archivo=True,
+    )
+    vigentes = _en_rango(
+        Disponibilidad.objects.filter(**filtros).values(*CAMPOS_HISTORICOS_BLOQUE, 'duracion', fecha=F('fecha_disponible')),
+        desde, hasta, archivo=False,
+    )
+    yield from merge(
+        _por_paginas(archivados, tamano, True), _por_paginas(vigentes, tamano, False),
+        key=lambda fila: (fila['fecha'], fila['id']),
+    )
+
+
+def resumen_ocupacion(desde, hasta):
+    """
+    Por médico: bloques y minutos ofrecidos y ocupados que empiezan en [desde, hasta), sumando
+    la agenda y el archivo. Se agrega en la base de datos.
+    """
+    ocupada = Q(ocupada=True)
+    resumen = {}
+    consultas = (
+        _en_rango(DisponibilidadArchivo.objects.all(), desde, hasta, archivo=True),
+        _en_rango(Disponibilidad.objects.annotate(fecha=F('fecha_disponible')), desde, hasta, archivo=False),
+    )
+    for bloques in consultas:
+        filas = bloques.values('medico_id').annotate(
+            bloques=Count('id'), ocupados=Count('id', filter=ocupada),
+            minutos=Sum('duracion'), minutos_ocupados=Sum('duracion', filter=ocupada),
+        ).order_by()
+        for fila in filas:
+            total = resumen.setdefault(fila.pop('medico_id'), dict.fromkeys(('bloques', 'ocupados', 'minutos', 'minutos_ocupados'), 0))
+            for campo, valor in fila.items():
+                total[campo] += valor or 0
+    return resumen
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ejecutables que atienden peticiones y por lo tanto necesitan los servicios en segundo plano
+SERVIDORES = ('gunicorn', 'daphne', 'uvicorn', 'uwsgi')
+
+
+def _activado(variable):
+    valor = os.environ.get(variable)
+    if valor is None:
+        return None
+    return valor.strip().lower() in ('1', 'true', 'si', 'sí', 'yes')
+
+
+def es_proceso_servidor(argv=None):
+    """
+    Indica si el proceso actual atiende peticiones. Los comandos como `migrate`,
+    `collectstatic`, `test` o `shell` no lo hacen y no deben arrancar servicios.
+    La variable INICIAR_SERVICIOS (1/0) permite forzar la decisión.
+    """
+    forzado = _activado('INICIAR_SERVICIOS')
+    if forzado is not None:
+        return forzado
+
+    argv = sys.argv if argv is None else argv
+    ejecutable = os.path.basename(argv[0]) if argv else ''
+    if any(servidor in ejecutable for servidor in SERVIDORES):
+        return True
+    if 'runserver' in argv:
+        # Con el autorecargador solo el proceso hijo (RUN_MAIN) atiende peticiones
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
+    return False
+
+
+def precalentar_urls():
+    from django.urls import get_resolver
+    resolver = get_resolver()
+    resolver.url_patterns  # Importa las vistas de todas las apps
+    resolver.reverse_dict  # Construye los índices de reverse()
+
+
+def precalentar_plantillas():
+    """
+    Compila todas las plantillas de las apps para que queden en el cached loader
+    antes de la primera petición. Retorna la cantidad de plantillas cargadas.
+    """
+    from django.template import engines
+    from django.template.exceptions import TemplateSyntaxError
+
+    total = 0
+    for engine in engines.all():
+        directorios = engine.template_dirs
+        for directorio in directorios:
+            for raiz, _, archivos in os.walk(directorio):
+                for archivo in archivos:
+                    if not archivo.endswith('.html'):
+                        continue
+                    nombre = os.path.relpath(os.path.join(raiz, archivo), directorio).replace(os.sep, '/')
+                    try:
+                        engine.get_template(nombre)
+                        total += 1
+                    except TemplateSyntaxError as e:
+                        logger.warning(f"No se pudo precompilar la plantilla {nombre}: {e}")
+    return total
+
+
+def precalentar():
+    """
+    Carga el resolvedor de URLs y las plantillas al arrancar, si PRECALENTAR_AL_INICIAR está activo.
+    """
+    if not _activado('PRECALENTAR_AL_INICIAR'):
+        return
+    inicio = time.perf_counter()
+    precalentar_urls()
+    plantillas = precalentar_plantillas()
+    logger.info(f"Precalentamiento: URLs y {plantillas} plantillas en {time.perf_counter() - inicio:.2f}s.")
@@ -0,0 +1,103 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import cache_en_niveles
+from .models import Medico, Recepcionista
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Duración del principal en la caché compartida; se invalida explícitamente ante cualquier cambio.
+# No pasa por la L1 de cada proceso: una invalidación solo borraría la copia del proceso que
+# la hace y los demás seguirían aceptando a un usuario desactivado o con otra contraseña.
+TIMEOUT_PRINCIPAL = 15 * 60
+
+
+def clave_principal(user_id):
+    return f"principal:{user_id}"
+
+
+def cargar_principal(user_id):
+    """
+    Carga el usuario con sus roles y su perfil (Medico o Recepcionista) en dos consultas,
+    dejando las relaciones ya resueltas para que las vistas no vuelvan a consultar.
+    """
+    user = (
+        User.objects
+        .select_related('medico__especialidad', 'recepcionista')
+        .filter(pk=user_id)
+        .first()
+    )
+    if user is None:
+        return None
+    user.roles = frozenset(user.groups.values_list('name', flat=True))
+    # Fija la ausencia del perfil para que `user.medico` no consulte de nuevo
+    for relacion in (User.medico.related, User.recepcionista.related):
+        if not relacion.is_cached(user):
+            relacion.set_cached_value(user, None)
+    return user
+
+
+def invalidar_principal(user_id):
+    try:
+        cache_en_niveles.compartida.delete(clave_principal(user_id))
+    except Exception as e:
+        logger.error(f"No se pudo invalidar el principal del usuario {user_id}: {e}")
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Igual que ModelBackend, pero el usuario de cada petición (con roles y perfil)
+    se lee de la caché compartida en lugar de la base de datos.
+    """
+
+    def get_user(self, user_id):
+        user = cache_en_niveles.compartida.get(clave_principal(user_id))
+        if user is None:
+            user = cargar_principal(user_id)
+            if user is None:
+                return None
+            cache_en_niveles.compartida.set(clave_principal(user_id), user, TIMEOUT_PRINCIPAL)
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidar_por_usuario(sender, instance, **kwargs):
+    # Cubre cambios de contraseña (set_password + save), de datos y desactivaciones
+    invalidar_principal(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidar_por_grupos(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidar_principal(instance.pk)
+    elif action == 'pre_clear':
+        # Se vacía un grupo: hay que leer sus miembros antes de que se borren
+        for user_id in User.objects.filter(groups=instance).values_list('pk', flat=True):
+            invalidar_principal(user_id)
+    else:
+        for user_id in pk_set:
+            invalidar_principal(user_id)
+
+
+@receiver(post_save, sender=Medico)
+@receiver(post_delete, sender=Medico)
+@receiver(post_save, sender=Recepcionista)
+@receiver(post_delete, sender=Recepcionista)
+def invalidar_por_perfil(sender, instance, **kwargs):
+    invalidar_principal(instance.user_id)
+
+
+@receiver(user_logged_out)
+def invalidar_al_cerrar_sesion(sender, request, user, **kwargs):
+    if user is not None:
+        invalidar_principal(user.pk)
@@ -0,0 +1,208 @@
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import pickle
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+
+from .models import Disponibilidad, Especialidad, Medico, Paciente, Reserva
+from .utils import en_lote, sede_activa
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Modelos cuyas versiones forman parte de las claves; al cambiar un registro se invalida todo lo que dependa del modelo.
+MODELOS_VERSIONADOS = [Medico, Disponibilidad, Reserva, Paciente, Especialidad]
+
+
+class CacheLocal:
+    """
+    Caché LRU en memoria del proceso, con expiración por entrada. Segura entre hilos.
+    """
+
+    def __init__(self, max_entradas=1024, ttl=5):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave, default=None):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return default
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return default
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def delete(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class CacheEnNiveles:
+    """
+    Caché de dos niveles: L1 en memoria del proceso (corta duración) delante de la caché
+    compartida de Django (L2, Redis en producción).
+
+    Las claves se prefijan con la versión de los modelos de los que dependen. Cada cambio
+    en uno de esos modelos incrementa su versión en L2, por lo que las entradas viejas dejan
+    de leerse en todos los procesos sin borrarlas una por una. Otros procesos ven la nueva
+    versión como máximo `ttl_versiones` segundos después.
+    """
+
+    def __init__(self, alias='default', max_entradas=1024, ttl_local=5, ttl_versiones=1):
+        self.alias = alias
+        self.local = CacheLocal(max_entradas=max_entradas, ttl=ttl_local)
+        self.ttl_local = ttl_local
+        self.ttl_versiones = ttl_versiones
+
+    @property
+    def compartida(self):
+        return caches[self.alias]
+
+    # En L1 se guardan los valores serializados: cada lectura entrega una copia propia y
+    # una vista que modifique el objeto (por ejemplo request.user) no altera la caché.
+
+    def get(self, clave, default=None):
+        serializado = self.local.get(clave)
+        if serializado is not None:
+            return pickle.loads(serializado)
+        valor = self.compartida.get(clave)
+        if valor is None:
+            return default
+        self.local.set(clave, pickle.dumps(valor, pickle.HIGHEST_PROTOCOL))
+        return valor
+
+    def set(self, clave, valor, timeout=300):
+        self.compartida.set(clave, valor, timeout)
+        self.local.set(
+            clave, pickle.dumps(valor, pickle.HIGHEST_PROTOCOL),
+            min(self.ttl_local, timeout) if timeout else self.ttl_local,
+        )
+
+    def delete(self, clave):
+        self.compartida.delete(clave)
+        self.local.delete(clave)
+
+    def get_or_set(self, clave, calcular, timeout=300):
+        valor = self.get(clave)
+        if valor is None:
+            valor = calcular()
+            self.set(clave, valor, timeout)
+        return valor
+
+    # Versiones por modelo
+
+    @staticmethod
+    def _clave_version(modelo):
+        return f"version:{modelo._meta.label_lower}"
+
+    def versiones(self, modelos):
+        """Versiones actuales de los modelos, leídas de L1 o en una sola ida a L2."""
+        claves = [self._clave_version(modelo) for modelo in modelos]
+        resultado = {clave: self.local.get(clave) for clave in claves}
+        faltantes = [clave for clave, valor in resultado.items() if valor is None]
+        if faltantes:
+            leidas = self.compartida.get_many(faltantes)
+            for clave in faltantes:
+                resultado[clave] = leidas.get(clave, 1)
+                self.local.set(clave, resultado[clave], self.ttl_versiones)
+        return tuple(resultado[clave] for clave in claves)
+
+    def incrementar_version(self, modelo):
+        clave = self._clave_version(modelo)
+        compartida = self.compartida
+        try:
+            version = compartida.incr(clave)
+        except ValueError:
+            # La clave no existía (o expiró): se parte de 2 para no colisionar con la versión por defecto
+            compartida.add(clave, 1, None)
+            version = compartida.incr(clave)
+        self.local.set(clave, version, self.ttl_versiones)
+        return version
+
+    def clave(self, prefijo, *partes, modelos=()):
+        """
+        Construye una clave que incluye las versiones de `modelos`. Las partes largas se
+        resumen con un hash para respetar el largo máximo de clave de los backends.
+        """
+        version = '.'.join(str(v) for v in self.versiones(modelos)) if modelos else '0'
+        cuerpo = ':'.join(str(parte) for parte in partes)
+        if len(cuerpo) > 150:
+            cuerpo = hashlib.sha1(cuerpo.encode()).hexdigest()
+        return f"{prefijo}:{version}:{cuerpo}"
+
+
+_config = getattr(settings, 'CACHE_EN_NIVELES', {})
+cache_en_niveles = CacheEnNiveles(
+    alias=_config.get('ALIAS', 'default'),
+    max_entradas=_config.get('MAX_ENTRADAS', 1024),
+    ttl_local=_config.get('TTL_LOCAL', 5),
+    ttl_versiones=_config.get('TTL_VERSIONES', 1),
+)
+
+
+def cachear_vista(modelos, timeout=60, por_usuario=False):
+    """
+    Decorador para vistas GET cuyo resultado depende solo de la URL (y opcionalmente del usuario),
+    de la sede activa y de los modelos indicados. Solo se guardan respuestas 200.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view_func(request, *args, **kwargs)
+            # Con una sede activa los managers filtran por ella: cada sede tiene su propia entrada
+            partes = [view_func.__name__, request.get_full_path(), sede_activa()]
+            if por_usuario:
+                partes.append(request.user.pk)
+            clave = cache_en_niveles.clave('vista', *partes, modelos=modelos)
+
+            guardada = cache_en_niveles.get(clave)
+            if guardada is not None:
+                contenido, content_type = guardada
+                return HttpResponse(contenido, content_type=content_type)
+
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache_en_niveles.set(clave, (response.content, response['Content-Type']), timeout)
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def invalidar_modelo(sender, **kwargs):
+    if en_lote():
+        return
+    try:
+        cache_en_niveles.incrementar_version(sender)
+    except Exception as e:
+        # Un fallo de la caché no debe impedir guardar datos clínicos
+        logger.error(f"No se pudo invalidar la caché de {sender._meta.label}: {e}")
+
+
+for _modelo in MODELOS_VERSIONADOS:
+    post_save.connect(invalidar_modelo, sender=_modelo, dispatch_uid=f"cache_version_save_{_modelo._meta.label_lower}")
+    post_delete.connect(invalidar_modelo, sender=_modelo, dispatch_uid=f"cache_version_delete_{_modelo._meta.label_lower}")
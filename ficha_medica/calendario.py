@@ -0,0 +1,256 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.db import router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.timezone import localdate, now
+
+from .cache import cache_en_niveles
+from .consultas import consulta_critica
+from .models import CambioReserva, Disponibilidad, Paciente, Reserva, nueva_clave_calendario
+from .utils import en_lote, limites_del_dia, segundos_hasta_medianoche
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'CALENDARIO', {})
+DIAS_PASADOS = _config.get('DIAS_PASADOS', 30)
+TIMEOUT = _config.get('TIMEOUT', 3600)
+# Una transacción que confirma tarde puede guardar una marca anterior al token ya entregado:
+# el token retrocede este margen y el cliente puede recibir de nuevo algún evento (es idempotente por UID)
+MARGEN_SINCRONIZACION = timedelta(seconds=_config.get('SEGUNDOS_MARGEN', 10))
+
+PRODID = '-//Centro Medico//Agenda de reservas//ES'
+_SAL_SUSCRIPCION = 'ficha_medica.calendario'
+
+
+class TokenInvalido(Exception):
+    """El token de sincronización no es válido o es anterior a la ventana del calendario."""
+
+
+# Suscripción: la URL lleva el id del médico y su clave de calendario, firmados, porque las
+# aplicaciones de calendario no inician sesión. Renovar la clave revoca las URL entregadas.
+
+def token_suscripcion(medico):
+    return signing.Signer(salt=_SAL_SUSCRIPCION).sign(f"{medico.id}.{medico.clave_calendario}")
+
+
+def medico_de_suscripcion(token):
+    """Retorna (medico_id, clave) o None si la firma no es válida."""
+    try:
+        medico_id, clave = signing.Signer(salt=_SAL_SUSCRIPCION).unsign(token).split('.', 1)
+        return int(medico_id), clave
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def renovar_suscripcion(medico):
+    """Nueva clave de calendario: la URL anterior deja de funcionar."""
+    medico.clave_calendario = nueva_clave_calendario()
+    medico.save(update_fields=['clave_calendario'])
+    return token_suscripcion(medico)
+
+
+# Token de sincronización: marca de tiempo en microsegundos, en hexadecimal
+
+def codificar_token(marca):
+    return format(int(marca.timestamp() * 1_000_000), 'x')
+
+
+def decodificar_token(token):
+    try:
+        marca = datetime.fromtimestamp(int(token, 16) / 1_000_000, tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        raise TokenInvalido("Token de sincronización inválido.")
+    if marca < inicio_ventana() or marca > now():
+        raise TokenInvalido("El token de sincronización expiró; descargue el calendario completo.")
+    return marca
+
+
+def inicio_ventana():
+    """El calendario incluye las reservas desde DIAS_PASADOS días atrás en adelante."""
+    inicio, _ = limites_del_dia(localdate() - timedelta(days=DIAS_PASADOS))
+    return inicio
+
+
+# Formato iCalendar (RFC 5545)
+
+def _texto(valor):
+    return (
+        str(valor).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def _fecha(valor):
+    return valor.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _plegar(linea):
+    """Las líneas de más de 75 octetos se continúan en la siguiente con un espacio inicial."""
+    codificada = linea.encode('utf-8')
+    if len(codificada) <= 75:
+        return linea
+    partes, inicio, limite = [], 0, 75
+    while inicio < len(codificada):
+        fin = min(inicio + limite, len(codificada))
+        # No cortar un carácter multibyte
+        while fin < len(codificada) and (codificada[fin] & 0xC0) == 0x80:
+            fin -= 1
+        partes.append(codificada[inicio:fin].decode('utf-8'))
+        inicio, limite = fin, 74
+    return '\r\n '.join(partes)
+
+
+def _evento(fila):
+    marcas = (fila['actualizado_en'], fila['reserva__actualizado_en'], fila.get('cambiado_en'))
+    modificado = max(marca for marca in marcas if marca)
+    inicio = fila['fecha_disponible']
+    lineas = [
+        'BEGIN:VEVENT',
+        f"UID:disponibilidad-{fila['id']}@centro-medico",
+        f"DTSTAMP:{_fecha(modificado)}",
+        # Debe crecer con cada cambio para que el cliente reemplace su copia
+        f"SEQUENCE:{int(modificado.timestamp())}",
+        f"DTSTART:{_fecha(inicio)}",
+        f"DTEND:{_fecha(inicio + timedelta(minutes=fila['duracion']))}",
+    ]
+    if fila['reserva__id'] is None:
+        # El bloque ya no tiene reserva (se canceló o se movió): el cliente elimina el evento
+        lineas += ['SUMMARY:Reserva cancelada', 'STATUS:CANCELLED']
+    else:
+        lineas += [
+            f"SUMMARY:{_texto(fila['reserva__paciente__nombre'])}",
+            f"DESCRIPTION:{_texto(fila['reserva__especialidad__nombre'])}",
+            'STATUS:CONFIRMED',
+        ]
+    return lineas + ['END:VEVENT']
+
+
+def _evento_eliminado(bloque_id, cambiado_en):
+    """El bloque ya no existe: se cancela su evento solo por UID, sin conocer su hora."""
+    return [
+        'BEGIN:VEVENT',
+        f"UID:disponibilidad-{bloque_id}@centro-medico",
+        f"DTSTAMP:{_fecha(cambiado_en)}",
+        f"SEQUENCE:{int(cambiado_en.timestamp())}",
+        'SUMMARY:Reserva cancelada',
+        'STATUS:CANCELLED',
+        'END:VEVENT',
+    ]
+
+
+def _calendario(filas, nombre, eliminados=()):
+    lineas = ['BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN', f'X-WR-CALNAME:{_texto(nombre)}']
+    for fila in filas:
+        lineas += _evento(fila)
+    for bloque_id, cambiado_en in eliminados:
+        lineas += _evento_eliminado(bloque_id, cambiado_en)
+    lineas.append('END:VCALENDAR')
+    return ('\r\n'.join(_plegar(linea) for linea in lineas) + '\r\n').encode('utf-8')
+
+
+CAMPOS_EVENTO = (
+    'id', 'fecha_disponible', 'duracion', 'actualizado_en',
+    'reserva__id', 'reserva__actualizado_en', 'reserva__paciente__nombre', 'reserva__especialidad__nombre',
+)
+
+
+@consulta_critica('calendario_medico', ejemplo=lambda: {'medico_id': 1, 'desde': now()})
+def bloques_reservados(medico_id, desde):
+    """Bloques con reserva de un médico desde una fecha, por hora; recorre el índice (medico, fecha_disponible)."""
+    return (
+        Disponibilidad.objects.filter(medico_id=medico_id, fecha_disponible__gte=desde, reserva__isnull=False)
+        .order_by('fecha_disponible', 'id')
+    )
+
+
+def clave_calendario(medico_id):
+    return f"calendario:{medico_id}"
+
+
+def calendario_completo(medico_id, nombre):
+    """
+    ICS completo del médico, su ETag y el token de sincronización que le corresponde. Se guarda en
+    caché hasta que cambia una reserva o un bloque del médico (o el día, que mueve la ventana).
+    """
+    def construir():
+        token = codificar_token(now() - MARGEN_SINCRONIZACION)
+        contenido = _calendario(bloques_reservados(medico_id, inicio_ventana()).values(*CAMPOS_EVENTO), nombre)
+        return contenido, f'"{hashlib.sha1(contenido).hexdigest()}"', token
+
+    return cache_en_niveles.get_or_set(
+        clave_calendario(medico_id), construir, min(TIMEOUT, segundos_hasta_medianoche()),
+    )
+
+
+def cambios_desde(medico_id, token, nombre):
+    """
+    ICS con solo los eventos del médico que cambiaron desde el token: reservas nuevas o
+    modificadas y, como STATUS:CANCELLED, los bloques que dejaron de estar reservados.
+    Las reservas eliminadas por cualquier vía (admin, cascada, cancelación masiva) se
+    encuentran en el registro de cambios, que conserva su bloque aunque este ya no exista.
+    Retorna el contenido y el token para la siguiente sincronización.
+    """
+    marca = decodificar_token(token)
+    siguiente = codificar_token(now() - MARGEN_SINCRONIZACION)
+    bloque_ids = set(
+        Disponibilidad.objects.filter(medico_id=medico_id, actualizado_en__gt=marca).values_list('id', flat=True)
+    )
+    bloque_ids.update(
+        Reserva.objects.filter(medico_id=medico_id, actualizado_en__gt=marca).values_list('fecha_reserva_id', flat=True)
+    )
+    registrados = {}
+    for bloque_id, registrado_en in (
+        CambioReserva.objects.filter(medico_id=medico_id, registrado_en__gt=marca, bloque_id__isnull=False)
+        .values_list('bloque_id', 'registrado_en')
+    ):
+        registrados[bloque_id] = max(registrado_en, registrados.get(bloque_id, registrado_en))
+    bloque_ids.update(registrados)
+
+    filas = list(
+        Disponibilidad.objects.filter(id__in=bloque_ids, medico_id=medico_id)
+        .order_by('fecha_disponible', 'id').values('creado_en', *CAMPOS_EVENTO)
+    )
+    eliminados = sorted((bloque_id, registrados[bloque_id]) for bloque_id in registrados.keys() - {fila['id'] for fila in filas})
+    inicio = inicio_ventana()
+    # Un bloque libre creado después del token nunca estuvo en el calendario del cliente
+    filas = [
+        {**fila, 'cambiado_en': registrados.get(fila['id'])} for fila in filas
+        if fila['fecha_disponible'] >= inicio and (fila['reserva__id'] is not None or fila['creado_en'] <= marca)
+    ]
+    return _calendario(filas, nombre, eliminados), siguiente
+
+
+def invalidar_calendarios(medico_ids):
+    def _invalidar():
+        for medico_id in medico_ids:
+            try:
+                cache_en_niveles.delete(clave_calendario(medico_id))
+            except Exception as e:
+                logger.error(f"No se pudo invalidar el calendario del médico {medico_id}: {e}")
+    transaction.on_commit(_invalidar, using=router.db_for_write(Reserva))
+
+
+@receiver(post_save, sender=Reserva)
+@receiver(post_delete, sender=Reserva)
+@receiver(post_save, sender=Disponibilidad)
+@receiver(post_delete, sender=Disponibilidad)
+def invalidar_por_cambio(sender, instance, **kwargs):
+    if not en_lote():
+        invalidar_calendarios([instance.medico_id])
+
+
+@receiver(post_save, sender=Paciente)
+def invalidar_por_paciente(sender, instance, created, **kwargs):
+    """El nombre del paciente es el título del evento."""
+    if created or en_lote():
+        return
+    invalidar_calendarios(set(
+        Reserva.objects.filter(paciente=instance, fecha_reserva__fecha_disponible__gte=inicio_ventana())
+        .values_list('medico_id', flat=True)
+    ))
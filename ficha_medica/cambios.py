@@ -0,0 +1,161 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from .consultas import consulta_critica
+from .models import CambioReserva, Disponibilidad, Reserva
+from .serializacion import RESERVA
+from .tareas import tarea
+from .utils import en_lote
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'CAMBIOS_RESERVAS', {})
+TAMANO_PAGINA = _config.get('TAMANO_PAGINA', 500)
+TAMANO_MAXIMO = _config.get('TAMANO_MAXIMO', 2000)
+# Un cambio se entrega cuando tiene al menos esta antigüedad. `seq` se asigna al insertar, no al
+# confirmar: una transacción aún abierta puede tener un seq menor que otro ya visible, y el cursor
+# no debe pasar por encima de ella. Las transacciones que escriben reservas duran mucho menos.
+MARGEN_VISIBILIDAD = timedelta(seconds=_config.get('SEGUNDOS_MARGEN', 10))
+DIAS_RETENCION = _config.get('DIAS_RETENCION', 30)
+
+
+class CursorInvalido(Exception):
+    """El cursor apunta a cambios que ya se eliminaron del registro."""
+
+
+def registrar_cambios(cambios):
+    """Agrega al registro los cambios dados como (reserva_id, medico_id, operacion, bloque_id)."""
+    CambioReserva.objects.bulk_create([
+        CambioReserva(reserva_id=reserva_id, medico_id=medico_id, operacion=operacion, bloque_id=bloque_id)
+        for reserva_id, medico_id, operacion, bloque_id in cambios
+    ])
+
+
+def _horizonte():
+    return now() - MARGEN_VISIBILIDAD
+
+
+def cursor_actual():
+    """Cursor desde el que se sigue después de leer una instantánea: el último cambio asentado."""
+    ultimo = (
+        CambioReserva.objects.filter(registrado_en__lte=_horizonte())
+        .order_by('-registrado_en').values_list('seq', flat=True).first()
+    )
+    return ultimo or 0
+
+
+def _validar_cursor(texto):
+    """ValueError si el cursor no es un entero no negativo; CursorInvalido si ya no se puede seguir."""
+    cursor = int(texto)
+    if cursor < 0:
+        raise ValueError("Cursor negativo.")
+    primero = CambioReserva.objects.order_by('seq').values_list('seq', flat=True).first()
+    if primero is not None and cursor < primero - 1:
+        raise CursorInvalido("El cursor es anterior a los cambios conservados; vuelva a leer la instantánea.")
+    return cursor
+
+
+@consulta_critica('cambios_reservas', ejemplo=lambda: {'cursor': 0, 'medico_id': 1})
+def entradas_desde(cursor, medico_id=None):
+    """Entradas del registro posteriores al cursor, en orden; recorre el índice (medico_id, seq) o la clave."""
+    entradas = CambioReserva.objects.filter(seq__gt=cursor)
+    if medico_id is not None:
+        entradas = entradas.filter(medico_id=medico_id)
+    return entradas.order_by('seq')
+
+
+def cambios_desde(texto_cursor, medico_id=None, limite=TAMANO_PAGINA):
+    """
+    Cambios posteriores al cursor, en orden, opcionalmente solo los de un médico. Si una reserva
+    cambia varias veces en la página se entrega una vez, con su estado actual; las eliminadas
+    como lápida. Retorna los cambios, el cursor siguiente y si quedan más.
+    """
+    cursor = _validar_cursor(texto_cursor)
+    limite = max(1, min(limite, TAMANO_MAXIMO))
+    entradas = list(entradas_desde(cursor, medico_id).values_list('seq', 'reserva_id', 'operacion', 'registrado_en')[:limite + 1])
+    hay_mas = len(entradas) > limite
+
+    horizonte = _horizonte()
+    asentadas = []
+    for entrada in entradas[:limite]:
+        if entrada[3] > horizonte:
+            hay_mas = False  # Lo que sigue todavía no se entrega: el cliente vuelve a consultar más tarde
+            break
+        asentadas.append(entrada)
+    if not asentadas:
+        return [], cursor, hay_mas
+
+    ultimas = {}
+    for seq, reserva_id, operacion, _ in asentadas:
+        ultimas.pop(reserva_id, None)  # Reinsertar conserva el orden de la última aparición
+        ultimas[reserva_id] = (seq, operacion)
+    vigentes = {
+        fila['id']: fila
+        for fila in RESERVA.filas(Reserva.objects.filter(id__in=[
+            reserva_id for reserva_id, (_, operacion) in ultimas.items() if operacion != CambioReserva.ELIMINAR
+        ]))
+    }
+    cambios = []
+    for reserva_id, (seq, operacion) in ultimas.items():
+        reserva = vigentes.get(reserva_id)
+        if operacion != CambioReserva.ELIMINAR and reserva is None:
+            continue  # Se eliminó después: su lápida llega en una página siguiente
+        cambios.append({'seq': seq, 'operacion': operacion, 'reserva_id': reserva_id, 'reserva': reserva})
+    return cambios, asentadas[-1][0], hay_mas
+
+
+@tarea('limpiar_cambios_reservas', max_intentos=1)
+def limpiar_cambios(dias=DIAS_RETENCION):
+    """Elimina las entradas más antiguas que `dias`; se conserva la última para validar cursores."""
+    ultimo = CambioReserva.objects.order_by('-seq').values_list('seq', flat=True).first()
+    if ultimo is None:
+        return {'eliminados': 0}
+    eliminados, _ = CambioReserva.objects.filter(registrado_en__lt=now() - timedelta(days=dias), seq__lt=ultimo).delete()
+    return {'eliminados': eliminados}
+
+
+# Los cambios se registran en la misma transacción que los produce. Las operaciones masivas
+# (ficha_medica/reprogramacion.py) los registran ellas mismas con registrar_cambios().
+
+@receiver(pre_save, sender=Reserva)
+def recordar_medico_anterior(sender, instance, **kwargs):
+    instance._anterior = None
+    if instance.pk and not en_lote():
+        instance._anterior = Reserva.objects.filter(pk=instance.pk).values_list('medico_id', 'fecha_reserva_id').first()
+
+
+@receiver(post_save, sender=Reserva)
+def registrar_guardado(sender, instance, created, **kwargs):
+    if en_lote():
+        return
+    cambios = [(instance.id, instance.medico_id, CambioReserva.CREAR if created else CambioReserva.MODIFICAR, instance.fecha_reserva_id)]
+    medico_anterior, bloque_anterior = getattr(instance, '_anterior', None) or (None, None)
+    if medico_anterior and medico_anterior != instance.medico_id:
+        # Para el médico anterior la reserva desaparece
+        cambios.insert(0, (instance.id, medico_anterior, CambioReserva.ELIMINAR, bloque_anterior))
+    elif bloque_anterior and bloque_anterior != instance.fecha_reserva_id:
+        # El calendario debe cancelar el evento del bloque anterior
+        cambios.insert(0, (instance.id, instance.medico_id, CambioReserva.MODIFICAR, bloque_anterior))
+    registrar_cambios(cambios)
+
+
+@receiver(post_delete, sender=Reserva)
+def registrar_eliminacion(sender, instance, **kwargs):
+    if not en_lote():
+        registrar_cambios([(instance.id, instance.medico_id, CambioReserva.ELIMINAR, instance.fecha_reserva_id)])
+
+
+@receiver(post_save, sender=Disponibilidad)
+def registrar_cambio_de_horario(sender, instance, created, **kwargs):
+    # Cambiar la hora o duración de un bloque ocupado modifica su reserva
+    if not created and instance.ocupada and not en_lote():
+        registrar_cambios(
+            (reserva_id, medico_id, CambioReserva.MODIFICAR, instance.id)
+            for reserva_id, medico_id in Reserva.objects.filter(fecha_reserva=instance).values_list('id', 'medico_id')
+        )
@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+from django.utils.timezone import now
+
+from .models import Disponibilidad, Notificacion, Reserva
+
+
+# Registro de consultas críticas: nombre -> ConsultaCritica.
+# ficha_medica/tests.py revisa el plan de cada una y falla si aparece un recorrido completo o un
+# ordenamiento en tabla temporal sobre una tabla grande.
+CONSULTAS_CRITICAS = {}
+ConsultaCritica = namedtuple('ConsultaCritica', 'construir ejemplo permitir_ordenamiento')
+
+
+def consulta_critica(nombre, ejemplo=dict, permitir_ordenamiento=False):
+    """
+    Declara una función que construye un queryset de una ruta crítica.
+    `ejemplo` retorna los argumentos con que se construye para revisar su plan.
+    `permitir_ordenamiento` acepta un ordenamiento en tabla temporal cuando el conjunto
+    ordenado está acotado por otro filtro (por ejemplo, las reservas de un paciente).
+    """
+    def decorator(funcion):
+        if nombre in CONSULTAS_CRITICAS:
+            raise ValueError(f"La consulta crítica '{nombre}' ya está registrada.")
+        CONSULTAS_CRITICAS[nombre] = ConsultaCritica(funcion, ejemplo, permitir_ordenamiento)
+        return funcion
+    return decorator
+
+
+@consulta_critica('reservas_en_rango', ejemplo=lambda: {'desde': now(), 'hasta': now()})
+def reservas_en_rango(desde, hasta=None, descendente=False):
+    """
+    Reservas cuyo bloque empieza en [desde, hasta) (sin fin si `hasta` es None), ordenadas por hora.
+    Usada por el scheduler, las reservas activas y el listado de recepción.
+    """
+    reservas = Reserva.objects.filter(fecha_reserva__fecha_disponible__gte=desde)
+    if hasta is not None:
+        reservas = reservas.filter(fecha_reserva__fecha_disponible__lt=hasta)
+    orden = '-fecha_reserva__fecha_disponible' if descendente else 'fecha_reserva__fecha_disponible'
+    return reservas.order_by(orden)
+
+
+@consulta_critica('disponibilidades_libres', ejemplo=lambda: {'medico_id': 1, 'desde': now()})
+def disponibilidades_libres(medico_id, desde=None):
+    """Bloques libres de un médico, en orden cronológico."""
+    disponibilidades = Disponibilidad.objects.filter(medico_id=medico_id, ocupada=False)
+    if desde is not None:
+        disponibilidades = disponibilidades.filter(fecha_disponible__gte=desde)
+    return disponibilidades.order_by('fecha_disponible')
+
+
+@consulta_critica('notificaciones_no_leidas', ejemplo=lambda: {'usuario_id': 1})
+def notificaciones_no_leidas(usuario_id):
+    return Notificacion.objects.filter(usuario_id=usuario_id, leido=False).order_by('-fecha_creacion')
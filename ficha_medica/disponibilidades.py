@@ -0,0 +1,105 @@
+from collections import namedtuple
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.timezone import localtime
+
+from .models import Disponibilidad, DURACION_MAXIMA_DISPONIBILIDAD
+from .sedes import alias_de_sede
+
+
+# Bloque de tiempo [inicio, fin). `ref` identifica el bloque (id en BD o posición en el lote).
+Intervalo = namedtuple('Intervalo', ['inicio', 'fin', 'ref'])
+
+
+def detectar_solapamientos(nuevos, existentes):
+    """
+    Detecta los intervalos nuevos que se solapan con otro intervalo (existente o del mismo lote).
+
+    Ordena ambos conjuntos y los recorre una sola vez (barrido de intervalos), por lo que el
+    costo es O((n + m) log n) en lugar de una consulta por bloque. Los solapamientos entre
+    intervalos existentes no se informan. Retorna una lista de pares (ref_nuevo, ref_conflicto).
+    """
+    eventos = sorted(
+        [(i.inicio, 1, i) for i in nuevos] + [(i.inicio, 0, i) for i in existentes],
+        key=lambda evento: (evento[0], evento[1]),
+    )
+
+    conflictos = []
+    ultimo_nuevo = None       # Intervalo nuevo que termina más tarde entre los ya vistos
+    ultimo_existente = None   # Intervalo existente que termina más tarde entre los ya vistos
+    for inicio, es_nuevo, intervalo in eventos:
+        if es_nuevo:
+            previo = max(
+                (i for i in (ultimo_nuevo, ultimo_existente) if i is not None and i.fin > inicio),
+                key=lambda i: i.fin,
+                default=None,
+            )
+            if previo is not None:
+                conflictos.append((intervalo.ref, previo.ref))
+            if ultimo_nuevo is None or intervalo.fin > ultimo_nuevo.fin:
+                ultimo_nuevo = intervalo
+        else:
+            # Un existente que empieza dentro de un nuevo ya visto también es un conflicto
+            if ultimo_nuevo is not None and ultimo_nuevo.fin > inicio:
+                conflictos.append((ultimo_nuevo.ref, intervalo.ref))
+            if ultimo_existente is None or intervalo.fin > ultimo_existente.fin:
+                ultimo_existente = intervalo
+    return conflictos
+
+
+def intervalos_existentes(medico, desde, hasta, excluir_ids=()):
+    """
+    Obtiene en una sola consulta los bloques del médico que podrían solaparse con [desde, hasta).
+    """
+    filas = (
+        Disponibilidad.objects
+        .filter(
+            medico=medico,
+            fecha_disponible__gt=desde - timedelta(minutes=DURACION_MAXIMA_DISPONIBILIDAD),
+            fecha_disponible__lt=hasta,
+        )
+        .exclude(id__in=excluir_ids)
+        .values_list('id', 'fecha_disponible', 'duracion')
+    )
+    return [Intervalo(inicio, inicio + timedelta(minutes=duracion), pk) for pk, inicio, duracion in filas]
+
+
+def validar_disponibilidades(medico, horarios, excluir_ids=()):
+    """
+    Valida un lote de horarios (inicio, duración en minutos) contra la agenda del médico.
+    Lanza ValidationError con los bloques en conflicto.
+    """
+    nuevos = [
+        Intervalo(inicio, inicio + timedelta(minutes=duracion), posicion)
+        for posicion, (inicio, duracion) in enumerate(horarios)
+    ]
+    if not nuevos:
+        return
+    desde = min(i.inicio for i in nuevos)
+    hasta = max(i.fin for i in nuevos)
+    existentes = intervalos_existentes(medico, desde, hasta, excluir_ids)
+
+    conflictos = detectar_solapamientos(nuevos, existentes)
+    if conflictos:
+        horas = sorted({localtime(nuevos[ref].inicio).strftime('%d/%m/%Y %H:%M') for ref, _ in conflictos})
+        raise ValidationError(
+            "Los siguientes horarios se solapan con otros bloques de tu agenda: %(horas)s.",
+            code='solapamiento',
+            params={'horas': ', '.join(horas)},
+        )
+
+
+def crear_disponibilidades(medico, horarios):
+    """
+    Crea un lote de disponibilidades validando antes que no se solapen.
+    """
+    validar_disponibilidades(medico, horarios)
+    # bulk_create no pasa por save(): la sede (y con ella la base) se asigna aquí
+    alias = alias_de_sede(medico.sede_id)
+    with transaction.atomic(using=alias):
+        return Disponibilidad.objects.using(alias).bulk_create([
+            Disponibilidad(medico=medico, sede_id=medico.sede_id, fecha_disponible=inicio, duracion=duracion)
+            for inicio, duracion in horarios
+        ])
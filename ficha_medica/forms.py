@@ -1,20 +1,15 @@
 from django import forms
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from .models import Medico, Recepcionista, FichaMedica, Reserva, Disponibilidad, Especialidad, Paciente
+from django.db import IntegrityError
+from django.utils.timezone import make_aware
+from .models import Medico, Recepcionista, FichaMedica, Reserva, Disponibilidad, Especialidad, Paciente, ListaEspera
+from .disponibilidades import validar_disponibilidades
+from .rut import formatear as formatear_rut, normalizar as normalizar_rut, parsear as parsear_rut, validar_rut
 import re
 
 
-# Función para validar el RUT
-def validar_rut(rut):
-    """
-    Valida que el RUT esté en el formato correcto (12345678-9).
-    """
-    if not re.match(r'^\d{7,8}-\d{1}$', rut):
-        raise ValidationError("El RUT debe estar en el formato 12345678-9.")
-    return rut
-
 def clean_rut(self):
     rut = self.cleaned_data.get('rut')
     if Paciente.objects.filter(rut=rut).exists():
@@ -30,11 +25,13 @@ class MedicoForm(forms.ModelForm):
 
     class Meta:
         model = Medico
-        fields = ['especialidad', 'telefono']
+        fields = ['especialidad', 'sede', 'telefono']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if self.instance.pk:  # Solo si el médico ya existe
+            # Sus bloques, reservas y fichas quedan en su sede (y en su base): no se cambia desde aquí
+            self.fields['sede'].disabled = True
             user = getattr(self.instance, 'user', None)
             if user:
                 self.fields['first_name'].initial = user.first_name
@@ -42,7 +39,7 @@ class MedicoForm(forms.ModelForm):
                 self.fields['username'].initial = user.username
 
     def clean_username(self):
-        username = self.cleaned_data['username']
+        username = normalizar_rut(self.cleaned_data['username'])
         user_id = getattr(self.instance.user, 'id', None) if hasattr(self.instance, 'user') else None
         if User.objects.filter(username=username).exclude(id=user_id).exists():
             raise ValidationError("El RUT ingresado ya está registrado.")
@@ -84,10 +81,10 @@ class RecepcionistaForm(forms.ModelForm):
 
     class Meta:
         model = Recepcionista
-        fields = ['telefono', 'direccion', 'fecha_contratacion']
+        fields = ['sede', 'telefono', 'direccion', 'fecha_contratacion']
 
     def clean_username(self):
-        username = self.cleaned_data['username']
+        username = normalizar_rut(self.cleaned_data['username'])
         if User.objects.filter(username=username).exists():
             raise ValidationError("El RUT ingresado ya está registrado.")
         return username
@@ -135,17 +132,39 @@ class FichaMedicaForm(forms.ModelForm):
 class DisponibilidadForm(forms.ModelForm):
     fecha = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}), label="Fecha")
     hora = forms.TimeField(widget=forms.TimeInput(attrs={'type': 'time'}), label="Hora")
+    cantidad = forms.IntegerField(
+        label="Bloques consecutivos", min_value=1, max_value=48, initial=1, required=False,
+        help_text="Crea varios bloques seguidos de la misma duración."
+    )
 
     class Meta:
         model = Disponibilidad
-        fields = []
+        fields = ['duracion']
+
+    def __init__(self, *args, medico=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.medico = medico
+
+    def horarios(self):
+        """
+        Lista de (inicio, duración) que representa el formulario, en hora local.
+        """
+        inicio = make_aware(datetime.combine(self.cleaned_data['fecha'], self.cleaned_data['hora']))
+        duracion = self.cleaned_data['duracion']
+        cantidad = self.cleaned_data.get('cantidad') or 1
+        return [(inicio + timedelta(minutes=duracion * i), duracion) for i in range(cantidad)]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.medico and not self.errors:
+            excluir = [self.instance.pk] if self.instance.pk else []
+            validar_disponibilidades(self.medico, self.horarios(), excluir_ids=excluir)
+        return cleaned_data
 
     def save(self, commit=True):
         try:
             disponibilidad = super().save(commit=False)
-            fecha = self.cleaned_data['fecha']
-            hora = self.cleaned_data['hora']
-            disponibilidad.fecha_disponible = datetime.combine(fecha, hora)
+            disponibilidad.fecha_disponible, disponibilidad.duracion = self.horarios()[0]
             if commit:
                 disponibilidad.save()
             return disponibilidad
@@ -174,9 +193,9 @@ class ReservaForm(forms.ModelForm):
                 pass
 
     def clean_rut_paciente(self):
-        rut = self.cleaned_data['rut_paciente']
+        cuerpo, _ = parsear_rut(self.cleaned_data['rut_paciente'])
         try:
-            return Paciente.objects.get(rut=rut)
+            return Paciente.objects.get(rut_cuerpo=cuerpo)
         except Paciente.DoesNotExist:
             raise ValidationError("No se encontró un paciente con este RUT.")
 
@@ -212,10 +231,10 @@ class PacienteForm(forms.ModelForm):
         fields = ['rut', 'nombre', 'fecha_nacimiento', 'direccion', 'telefono', 'email']
 
     def clean_rut(self):
-        rut = self.cleaned_data['rut']
-        if Paciente.objects.filter(rut=rut).exists():
+        cuerpo, dv = parsear_rut(self.cleaned_data['rut'])
+        if Paciente.objects.filter(rut_cuerpo=cuerpo).exclude(pk=self.instance.pk).exists():
             raise ValidationError("El RUT ya está registrado.")
-        return rut
+        return formatear_rut(cuerpo, dv)
 
     def clean_telefono(self):
         telefono = self.cleaned_data['telefono']
@@ -229,3 +248,76 @@ class PacienteForm(forms.ModelForm):
         except IntegrityError:
             raise ValidationError("Error al guardar el paciente. Verifique los datos.")
 
+
+
+class OperacionMasivaReservasForm(forms.Form):
+    ACCIONES = [('cancelar', 'Cancelar reservas'), ('reprogramar', 'Reprogramar reservas')]
+
+    medico = forms.ModelChoiceField(queryset=Medico.objects.select_related('user', 'especialidad'), label="Médico")
+    desde = forms.DateTimeField(widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}), label="Desde")
+    hasta = forms.DateTimeField(widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}), label="Hasta")
+    accion = forms.ChoiceField(choices=ACCIONES, label="Acción")
+    motivo = forms.CharField(label="Motivo", required=False, max_length=200)
+    dias = forms.IntegerField(
+        label="Mover (días)", required=False, initial=0, min_value=-60, max_value=60,
+        help_text="Las reservas se mueven a la misma hora del día indicado."
+    )
+    medico_destino = forms.ModelChoiceField(
+        queryset=Medico.objects.select_related('user', 'especialidad'), label="Médico de destino", required=False
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        desde, hasta = cleaned_data.get('desde'), cleaned_data.get('hasta')
+        if desde and hasta and desde >= hasta:
+            raise ValidationError("El inicio del rango debe ser anterior al fin.")
+        if cleaned_data.get('accion') == 'reprogramar':
+            medico_destino = cleaned_data.get('medico_destino')
+            if not cleaned_data.get('dias') and (not medico_destino or medico_destino == cleaned_data.get('medico')):
+                raise ValidationError("Para reprogramar indique días a mover o un médico de destino distinto.")
+        return cleaned_data
+
+
+class ListaEsperaForm(forms.ModelForm):
+    DIAS = [(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')]
+
+    rut_paciente = forms.CharField(label="RUT del Paciente", validators=[validar_rut])
+    dias = forms.TypedMultipleChoiceField(
+        choices=DIAS, coerce=int, required=False, label="Días aceptados",
+        widget=forms.CheckboxSelectMultiple, help_text="Sin marcar: cualquier día."
+    )
+
+    class Meta:
+        model = ListaEspera
+        fields = ['especialidad', 'medico', 'motivo', 'prioridad', 'hora_desde', 'hora_hasta', 'fecha_limite']
+        widgets = {
+            'hora_desde': forms.TimeInput(attrs={'type': 'time'}),
+            'hora_hasta': forms.TimeInput(attrs={'type': 'time'}),
+            'fecha_limite': forms.DateInput(attrs={'type': 'date'}),
+        }
+
+    def clean_rut_paciente(self):
+        cuerpo, _ = parsear_rut(self.cleaned_data['rut_paciente'])
+        try:
+            return Paciente.objects.get(rut_cuerpo=cuerpo)
+        except Paciente.DoesNotExist:
+            raise ValidationError("No se encontró un paciente con este RUT.")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        medico, especialidad = cleaned_data.get('medico'), cleaned_data.get('especialidad')
+        if medico and especialidad and medico.especialidad_id != especialidad.id:
+            raise ValidationError("El médico seleccionado no pertenece a la especialidad.")
+        desde, hasta = cleaned_data.get('hora_desde'), cleaned_data.get('hora_hasta')
+        if desde and hasta and desde >= hasta:
+            raise ValidationError("La hora de inicio debe ser anterior a la hora de término.")
+        return cleaned_data
+
+    def save(self, commit=True):
+        entrada = super().save(commit=False)
+        entrada.paciente = self.cleaned_data['rut_paciente']
+        dias = self.cleaned_data.get('dias')
+        entrada.dias_semana = sum(1 << dia for dia in dias) if dias else ListaEspera.TODOS_LOS_DIAS
+        if commit:
+            entrada.save()
+        return entrada
@@ -0,0 +1,183 @@
+from functools import wraps
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'LIMITES', {})
+HABILITADO = _config.get('HABILITADO', True)
+ALIAS = _config.get('ALIAS', 'default')
+CONFIAR_EN_PROXY = _config.get('CONFIAR_EN_PROXY', False)
+TASAS = _config.get('TASAS', {})
+
+UNIDADES = {'s': 1, 'm': 60, 'h': 3600}
+
+# Token bucket atómico en Redis: recarga según el tiempo transcurrido y consume un token
+_SCRIPT_REDIS = """
+local capacidad = tonumber(ARGV[1])
+local tasa = tonumber(ARGV[2])
+local ahora = tonumber(ARGV[3])
+local datos = redis.call('HMGET', KEYS[1], 'fichas', 'instante')
+local fichas = tonumber(datos[1]) or capacidad
+local instante = tonumber(datos[2]) or ahora
+fichas = math.min(capacidad, fichas + math.max(0, ahora - instante) * tasa)
+local permitido = 0
+if fichas >= 1 then
+    fichas = fichas - 1
+    permitido = 1
+end
+redis.call('HSET', KEYS[1], 'fichas', tostring(fichas), 'instante', tostring(ahora))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return {permitido, tostring(fichas)}
+"""
+
+
+def interpretar_tasa(tasa):
+    """'30/m' -> (30, 60): cantidad de peticiones por período en segundos."""
+    cantidad, unidad = tasa.split('/')
+    return int(cantidad), UNIDADES[unidad]
+
+
+def _recargar(fichas, instante, capacidad, por_segundo, ahora):
+    return min(capacidad, fichas + max(0.0, ahora - instante) * por_segundo)
+
+
+class BaldesLocales:
+    """Token buckets en memoria del proceso. Respaldo cuando la caché compartida no responde."""
+
+    def __init__(self, max_baldes=10000):
+        self.max_baldes = max_baldes
+        self._baldes = {}
+        self._lock = threading.Lock()
+
+    def consumir(self, clave, capacidad, por_segundo):
+        ahora = time.monotonic()
+        with self._lock:
+            fichas, instante = self._baldes.get(clave, (capacidad, ahora))
+            fichas = _recargar(fichas, instante, capacidad, por_segundo, ahora)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            if len(self._baldes) >= self.max_baldes and clave not in self._baldes:
+                # Sin memoria ilimitada por IPs distintas: se descartan los baldes llenos (inactivos)
+                self._baldes = {
+                    k: v for k, v in self._baldes.items()
+                    if _recargar(v[0], v[1], capacidad, por_segundo, ahora) < capacidad
+                }
+            self._baldes[clave] = (fichas, ahora)
+            return permitido, fichas
+
+
+class BaldesCompartidos:
+    """
+    Token buckets en la caché compartida, para que el límite valga entre procesos y servidores.
+    Con Redis la operación es atómica (script Lua); con otros backends es una lectura y escritura
+    protegida solo dentro del proceso, suficiente para locmem (que es por proceso de todos modos).
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._script = None
+
+    def _cliente_redis(self, cache, clave):
+        cliente = getattr(cache, '_cache', None)
+        if cliente is None or not hasattr(cliente, 'get_client'):
+            return None
+        return cliente.get_client(clave, write=True)
+
+    def consumir(self, clave, capacidad, por_segundo):
+        cache = caches[self.alias]
+        ahora = time.time()
+        expira = math.ceil(capacidad / por_segundo) + 1
+        clave = cache.make_key(f"limite:{clave}")
+        redis = self._cliente_redis(cache, clave)
+        if redis is not None:
+            if self._script is None:
+                self._script = redis.register_script(_SCRIPT_REDIS)
+            permitido, fichas = self._script(keys=[clave], args=[capacidad, por_segundo, ahora, expira], client=redis)
+            return bool(permitido), float(fichas)
+
+        with self._lock:
+            fichas, instante = cache.get(clave, version=None) or (capacidad, ahora)
+            fichas = _recargar(fichas, instante, capacidad, por_segundo, ahora)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            cache.set(clave, (fichas, ahora), expira)
+            return permitido, fichas
+
+
+baldes_compartidos = BaldesCompartidos(ALIAS)
+baldes_locales = BaldesLocales()
+
+
+def consumir(clave, capacidad, por_segundo):
+    try:
+        return baldes_compartidos.consumir(clave, capacidad, por_segundo)
+    except Exception as e:
+        logger.warning(f"Caché compartida no disponible para el límite de peticiones, se usa el local: {e}")
+        return baldes_locales.consumir(clave, capacidad, por_segundo)
+
+
+def identificar_cliente(request):
+    """Usuario autenticado o, si no hay sesión, la IP del cliente."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"u{user.pk}"
+    ip = request.META.get('REMOTE_ADDR', '')
+    if CONFIAR_EN_PROXY:
+        # Detrás de un proxy de confianza la IP real es la primera de X-Forwarded-For
+        reenviada = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        ip = reenviada.split(',')[0].strip() or ip
+    return f"ip{ip}"
+
+
+def _rechazo(status, mensaje, segundos):
+    response = JsonResponse({'error': mensaje}, status=status)
+    response['Retry-After'] = str(max(1, math.ceil(segundos)))
+    return response
+
+
+def limitar(nombre, tasa, rafaga=None, concurrencia=None):
+    """
+    Limita una vista con un token bucket por cliente y endpoint: `tasa` como '30/m' y
+    `rafaga` peticiones seguidas permitidas (por defecto, la cantidad de la tasa);
+    settings.LIMITES['TASAS'] puede reemplazar la tasa de un endpoint por su nombre.
+    Responde 429 con Retry-After al agotarse. `concurrencia` limita las peticiones
+    simultáneas del endpoint en este proceso y responde 503 al excederse, antes de
+    ocupar una conexión a la base de datos.
+    """
+    cantidad, periodo = interpretar_tasa(TASAS.get(nombre, tasa))
+    por_segundo = cantidad / periodo
+    capacidad = rafaga or cantidad
+    semaforo = threading.BoundedSemaphore(concurrencia) if concurrencia else None
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not HABILITADO:
+                return view_func(request, *args, **kwargs)
+
+            permitido, fichas = consumir(f"{nombre}:{identificar_cliente(request)}", capacidad, por_segundo)
+            if not permitido:
+                return _rechazo(429, "Demasiadas solicitudes. Intente nuevamente en unos segundos.", (1 - fichas) / por_segundo)
+
+            if semaforo is None:
+                return view_func(request, *args, **kwargs)
+            if not semaforo.acquire(blocking=False):
+                logger.warning(f"Concurrencia máxima alcanzada en {nombre}; se rechaza la petición.")
+                return _rechazo(503, "El servicio está ocupado. Intente nuevamente.", 1)
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                semaforo.release()
+        return _wrapped_view
+    return decorator
@@ -0,0 +1,203 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from heapq import merge
+from itertools import islice
+
+from django.db import router, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from .cache import cache_en_niveles
+from .consultas import consulta_critica
+from .models import Disponibilidad, FichaMedica, Notificacion, Reserva, ReservaArchivo
+from .sedes import codigos_de_sedes
+from .utils import en_lote, sede_activa
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+TAMANO_PAGINA = 20
+TAMANO_MAXIMO = 100
+TIMEOUT_PRIMERA_PAGINA = 300
+
+
+# Cada fuente se lee con una consulta indexada por paciente, ordenada por fecha descendente y
+# proyectada con values() (los joins de select_related se resuelven en la misma consulta).
+FUENTES = {
+    'ficha': {
+        'queryset': lambda paciente_id: FichaMedica.objects.filter(paciente_id=paciente_id),
+        'fecha': 'fecha_creacion',
+        'campos': {
+            'diagnostico': 'diagnostico',
+            'tratamiento': 'tratamiento',
+            'medico': 'medico__user__first_name',
+            'medico_apellido': 'medico__user__last_name',
+        },
+    },
+    'notificacion': {
+        'queryset': lambda paciente_id: Notificacion.objects.filter(paciente_id=paciente_id),
+        'fecha': 'fecha_creacion',
+        'campos': {
+            'mensaje': 'mensaje',
+            'leido': 'leido',
+        },
+    },
+    'reserva': {
+        'queryset': lambda paciente_id: Reserva.objects.filter(paciente_id=paciente_id),
+        'fecha': 'fecha_reserva__fecha_disponible',
+        'campos': {
+            'motivo': 'motivo',
+            'duracion': 'fecha_reserva__duracion',
+            'especialidad': 'especialidad__nombre',
+            'medico': 'medico__user__first_name',
+            'medico_apellido': 'medico__user__last_name',
+        },
+    },
+    # Las reservas antiguas (ficha_medica/archivo.py) salen como eventos 'reserva': conservan su id,
+    # así que el cursor las ordena junto con las vigentes
+    'reserva_archivada': {
+        'tipo': 'reserva',
+        'queryset': lambda paciente_id: ReservaArchivo.objects.filter(paciente_id=paciente_id),
+        'fecha': 'fecha',
+        'campos': {
+            'motivo': 'motivo',
+            'duracion': 'duracion',
+            'especialidad': 'especialidad__nombre',
+            'medico': 'medico__user__first_name',
+            'medico_apellido': 'medico__user__last_name',
+        },
+    },
+}
+TIPOS = {fuente.get('tipo', nombre) for nombre, fuente in FUENTES.items()}
+
+
+def codificar_cursor(evento):
+    texto = f"{evento['fecha'].isoformat()}|{evento['tipo']}|{evento['id']}"
+    return urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Retorna (fecha, tipo, id). Lanza ValueError si el cursor no es válido."""
+    try:
+        texto = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        fecha, tipo, id_ = texto.split('|')
+        fecha = datetime.fromisoformat(fecha)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Cursor inválido.") from e
+    if tipo not in TIPOS or fecha.tzinfo is None:
+        raise ValueError("Cursor inválido.")
+    return fecha, tipo, int(id_)
+
+
+def _despues_del_cursor(tipo, campo_fecha, cursor):
+    """
+    Filtro de los eventos que van después del cursor en el orden (fecha, tipo, id) descendente.
+    """
+    fecha, tipo_cursor, id_cursor = cursor
+    if tipo < tipo_cursor:
+        return Q(**{f'{campo_fecha}__lte': fecha})
+    if tipo > tipo_cursor:
+        return Q(**{f'{campo_fecha}__lt': fecha})
+    return Q(**{f'{campo_fecha}__lt': fecha}) | Q(**{campo_fecha: fecha, 'id__lt': id_cursor})
+
+
+def _consulta_fuente(paciente_id, tipo, cursor, limite):
+    fuente = FUENTES[tipo]
+    queryset = fuente['queryset'](paciente_id)
+    if cursor is not None:
+        queryset = queryset.filter(_despues_del_cursor(fuente.get('tipo', tipo), fuente['fecha'], cursor))
+    return (
+        queryset
+        .order_by(f"-{fuente['fecha']}", '-id')
+        .values('id', fuente['fecha'], *fuente['campos'].values())[:limite]
+    )
+
+
+for _tipo in FUENTES:
+    consulta_critica(
+        f'linea_tiempo_{_tipo}',
+        ejemplo=lambda tipo=_tipo: {'paciente_id': 1, 'tipo': tipo, 'cursor': (now(), 'notificacion', 1), 'limite': TAMANO_PAGINA + 1},
+        # La hora de la reserva está en el bloque: se ordenan solo las reservas del paciente
+        permitir_ordenamiento=(_tipo == 'reserva'),
+    )(_consulta_fuente)
+
+
+def _eventos(paciente_id, tipo, cursor, limite):
+    fuente = FUENTES[tipo]
+    for fila in _consulta_fuente(paciente_id, tipo, cursor, limite):
+        evento = {'tipo': fuente.get('tipo', tipo), 'id': fila['id'], 'fecha': fila[fuente['fecha']]}
+        evento.update({nombre: fila[campo] for nombre, campo in fuente['campos'].items()})
+        yield evento
+
+
+def construir_pagina(paciente_id, cursor=None, tamano=TAMANO_PAGINA):
+    """
+    Une las reservas, fichas y notificaciones del paciente en orden cronológico descendente.
+    Cada fuente aporta a lo sumo `tamano + 1` filas y se mezclan con heapq.merge, así que
+    el costo no depende de la antigüedad del paciente.
+    """
+    limite = tamano + 1
+    flujos = [_eventos(paciente_id, tipo, cursor, limite) for tipo in sorted(FUENTES)]
+    eventos = list(islice(
+        merge(*flujos, key=lambda evento: (evento['fecha'], evento['tipo'], evento['id']), reverse=True),
+        limite,
+    ))
+    siguiente = codificar_cursor(eventos[tamano - 1]) if len(eventos) > tamano else None
+    return {'eventos': eventos[:tamano], 'siguiente': siguiente}
+
+
+def clave_primera_pagina(paciente_id, tamano, sede_id=None):
+    # Con una sede activa la página solo tiene las reservas y fichas de esa sede
+    return f"linea_tiempo:{paciente_id}:{tamano}:{sede_id or 'todas'}"
+
+
+def obtener_linea_tiempo(paciente_id, cursor=None, tamano=TAMANO_PAGINA):
+    """
+    Página de la línea de tiempo de un paciente. La primera página (la más consultada al abrir
+    la ficha) se sirve desde la caché en niveles y se invalida cuando cambian los datos del paciente.
+    """
+    tamano = max(1, min(tamano, TAMANO_MAXIMO))
+    if cursor:
+        return construir_pagina(paciente_id, decodificar_cursor(cursor), tamano)
+    if tamano != TAMANO_PAGINA:
+        return construir_pagina(paciente_id, None, tamano)
+    return cache_en_niveles.get_or_set(
+        clave_primera_pagina(paciente_id, tamano, sede_activa()),
+        lambda: construir_pagina(paciente_id, None, tamano),
+        TIMEOUT_PRIMERA_PAGINA,
+    )
+
+
+def invalidar_linea_tiempo(paciente_ids):
+    def _invalidar():
+        sedes = [None, *codigos_de_sedes()]
+        for paciente_id in paciente_ids:
+            try:
+                for sede_id in sedes:
+                    cache_en_niveles.delete(clave_primera_pagina(paciente_id, TAMANO_PAGINA, sede_id))
+            except Exception as e:
+                logger.error(f"No se pudo invalidar la línea de tiempo del paciente {paciente_id}: {e}")
+    transaction.on_commit(_invalidar, using=router.db_for_write(Reserva))
+
+
+@receiver(post_save, sender=Reserva)
+@receiver(post_delete, sender=Reserva)
+@receiver(post_save, sender=FichaMedica)
+@receiver(post_delete, sender=FichaMedica)
+@receiver(post_save, sender=Notificacion)
+@receiver(post_delete, sender=Notificacion)
+def invalidar_por_evento(sender, instance, **kwargs):
+    if instance.paciente_id and not en_lote():
+        invalidar_linea_tiempo([instance.paciente_id])
+
+
+@receiver(post_save, sender=Disponibilidad)
+def invalidar_por_disponibilidad(sender, instance, created, **kwargs):
+    # Cambiar la hora de una disponibilidad ocupada mueve la reserva en la línea de tiempo
+    if not created and instance.ocupada and not en_lote():
+        invalidar_linea_tiempo(list(
+            Reserva.objects.filter(fecha_reserva=instance).values_list('paciente_id', flat=True)
+        ))
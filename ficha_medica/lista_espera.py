@@ -0,0 +1,174 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils.timezone import localtime, now
+
+from .consultas import consulta_critica
+from .models import Disponibilidad, ListaEspera, Medico, Notificacion, Reserva
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'LISTA_ESPERA', {})
+RETENCION = timedelta(minutes=_config.get('MINUTOS_RETENCION', 30))
+ANTICIPACION = timedelta(minutes=_config.get('MINUTOS_ANTICIPACION', 15))
+
+
+@consulta_critica('lista_espera_candidatos', ejemplo=lambda: {
+    'bloque': Disponibilidad(medico=Medico(id=1, especialidad_id=1), sede_id=1, fecha_disponible=now()),
+})
+def candidatos(bloque, excluir_ids=()):
+    """
+    Entradas en espera de la sede del bloque compatibles con él, en orden de prioridad y luego de
+    llegada. La consulta recorre el índice parcial espera_cola; el día de la semana se revisa en Python.
+    """
+    inicio = localtime(bloque.fecha_disponible)
+    hora = inicio.time()
+    return (
+        ListaEspera.objects
+        .filter(estado=ListaEspera.ESPERANDO, sede_id=bloque.sede_id, especialidad_id=bloque.medico.especialidad_id)
+        .filter(Q(medico__isnull=True) | Q(medico_id=bloque.medico_id))
+        .filter(Q(hora_desde__isnull=True) | Q(hora_desde__lte=hora))
+        .filter(Q(hora_hasta__isnull=True) | Q(hora_hasta__gt=hora))
+        .filter(Q(fecha_limite__isnull=True) | Q(fecha_limite__gte=inicio.date()))
+        .exclude(id__in=excluir_ids)
+        .order_by('-prioridad', 'fecha_creacion')
+    )
+
+
+def ofrecer_bloque(disponibilidad_id, excluir_ids=()):
+    """
+    Si el bloque sigue libre y falta suficiente para su inicio, lo retiene para el mejor
+    candidato de la lista de espera. Retorna la entrada a la que se ofreció, o None.
+    """
+    with transaction.atomic(using=router.db_for_write(Disponibilidad)):
+        bloque = (
+            Disponibilidad.objects.select_for_update().select_related('medico__user')
+            .filter(id=disponibilidad_id, ocupada=False, fecha_disponible__gt=now() + ANTICIPACION)
+            .first()
+        )
+        if bloque is None:
+            return None
+        inicio = localtime(bloque.fecha_disponible)
+        # Las entradas bloqueadas por otra oferta simultánea se saltan en vez de esperar
+        consulta = candidatos(bloque, excluir_ids).select_for_update(skip_locked=True)
+        entrada = next((e for e in consulta.iterator(chunk_size=50) if e.acepta_dia(inicio.weekday())), None)
+        if entrada is None:
+            return None
+
+        # Retener el bloque lo saca de las horas disponibles hasta que se confirme o expire
+        bloque.ocupada = True
+        bloque.save(update_fields=['ocupada'])
+        entrada.estado = ListaEspera.OFRECIDA
+        entrada.bloque_ofrecido = bloque
+        entrada.oferta_expira = min(now() + RETENCION, bloque.fecha_disponible - ANTICIPACION)
+        entrada.save(update_fields=['estado', 'bloque_ofrecido', 'oferta_expira'])
+
+        if entrada.registrada_por_id:
+            Notificacion.objects.create(
+                usuario_id=entrada.registrada_por_id,
+                paciente_id=entrada.paciente_id,
+                mensaje=(
+                    f"Se liberó una hora para el paciente en lista de espera el {inicio.strftime('%d/%m/%Y %H:%M')} "
+                    f"con el Dr(a). {bloque.medico.user.get_full_name()}. Confirme antes de las "
+                    f"{localtime(entrada.oferta_expira).strftime('%H:%M')}."
+                ),
+            )
+        logger.info(f"Bloque {bloque.id} ofrecido a la entrada de lista de espera {entrada.id}.")
+        return entrada
+
+
+def programar_ofertas(disponibilidad_ids, excluir_ids=()):
+    """Ofrece los bloques liberados una vez confirmada la transacción que los liberó."""
+    ids = list(disponibilidad_ids)
+
+    def _ofrecer():
+        for disponibilidad_id in ids:
+            try:
+                ofrecer_bloque(disponibilidad_id, excluir_ids)
+            except Exception as e:
+                # La lista de espera nunca debe impedir cancelar o mover una reserva
+                logger.error(f"No se pudo ofrecer el bloque {disponibilidad_id} a la lista de espera: {e}")
+
+    if ids:
+        transaction.on_commit(_ofrecer, using=router.db_for_write(Disponibilidad))
+
+
+def _liberar_oferta(entrada, estado):
+    bloque_id = entrada.bloque_ofrecido_id
+    entrada.estado = estado
+    entrada.bloque_ofrecido = None
+    entrada.oferta_expira = None
+    entrada.save(update_fields=['estado', 'bloque_ofrecido', 'oferta_expira'])
+    bloque = Disponibilidad.objects.filter(id=bloque_id).first()
+    if bloque is not None:
+        bloque.ocupada = False
+        bloque.save(update_fields=['ocupada'])
+        # El bloque pasa al siguiente candidato; esta entrada no vuelve a recibirlo
+        programar_ofertas([bloque.id], excluir_ids=[entrada.id])
+
+
+def _oferta_vigente(entrada_id):
+    entrada = (
+        ListaEspera.objects.select_for_update()
+        .select_related('bloque_ofrecido__medico__user', 'paciente')
+        .filter(id=entrada_id).first()
+    )
+    if entrada is None or entrada.estado != ListaEspera.OFRECIDA:
+        raise ValidationError("La entrada no tiene una oferta vigente.")
+    return entrada
+
+
+def confirmar_oferta(entrada_id, usuario):
+    """Convierte la retención en una reserva. Retorna la reserva creada."""
+    with transaction.atomic(using=router.db_for_write(ListaEspera)):
+        entrada = _oferta_vigente(entrada_id)
+        if entrada.oferta_expira <= now():
+            raise ValidationError("La oferta expiró.")
+        bloque = entrada.bloque_ofrecido
+        reserva = Reserva.objects.create(
+            paciente=entrada.paciente,
+            especialidad_id=bloque.medico.especialidad_id,
+            medico=bloque.medico,
+            fecha_reserva=bloque,
+            motivo=entrada.motivo,
+            recepcionista=usuario,
+        )
+        entrada.estado = ListaEspera.ASIGNADA
+        entrada.oferta_expira = None
+        entrada.save(update_fields=['estado', 'oferta_expira'])
+        Notificacion.objects.create(
+            usuario=bloque.medico.user,
+            paciente=entrada.paciente,
+            mensaje=(
+                f"Se ha registrado una nueva reserva desde la lista de espera para el paciente {entrada.paciente.nombre} "
+                f"para la fecha del {localtime(bloque.fecha_disponible).strftime('%d/%m/%Y %H:%M')}."
+            ),
+        )
+    return reserva
+
+
+def rechazar_oferta(entrada_id):
+    """El paciente no puede asistir: vuelve a la espera y el bloque pasa al siguiente candidato."""
+    with transaction.atomic(using=router.db_for_write(ListaEspera)):
+        _liberar_oferta(_oferta_vigente(entrada_id), ListaEspera.ESPERANDO)
+
+
+def expirar_ofertas():
+    """Libera las retenciones vencidas. Retorna la cantidad de ofertas expiradas."""
+    expiradas = 0
+    with transaction.atomic(using=router.db_for_write(ListaEspera)):
+        vencidas = (
+            ListaEspera.objects.select_for_update(skip_locked=True)
+            .filter(estado=ListaEspera.OFRECIDA, oferta_expira__lte=now())
+        )
+        for entrada in vencidas:
+            _liberar_oferta(entrada, ListaEspera.EXPIRADA)
+            expiradas += 1
+    if expiradas:
+        logger.info(f"{expiradas} ofertas de lista de espera expiradas.")
+    return expiradas
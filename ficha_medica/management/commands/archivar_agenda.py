@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from ficha_medica.archivo import DIAS_BLOQUES_LIBRES, LOTE, MESES_RESERVAS, archivar_agenda
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve a las tablas de archivo los bloques libres pasados y las reservas antiguas con sus bloques, "
+        "en lotes acotados y sede por sede. Los reportes históricos leen la agenda y el archivo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias-libres', type=int, default=DIAS_BLOQUES_LIBRES, help="Días que se mantienen los bloques libres pasados.")
+        parser.add_argument('--meses-reservas', type=int, default=MESES_RESERVAS, help="Meses de reservas que se mantienen en la agenda.")
+        parser.add_argument('--lote', type=int, default=LOTE, help="Bloques movidos por transacción.")
+
+    def handle(self, *args, **options):
+        por_sede = archivar_agenda(dias_libres=options['dias_libres'], meses_reservas=options['meses_reservas'], lote=options['lote'])
+        for codigo, movidos in por_sede.items():
+            self.stdout.write(f"{codigo}: {movidos['bloques']} bloques, {movidos['reservas']} reservas")
+        self.stdout.write(self.style.SUCCESS("Agenda archivada."))
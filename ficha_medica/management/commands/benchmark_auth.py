@@ -0,0 +1,71 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from ficha_medica.cache import cache_en_niveles
+from ficha_medica.models import Especialidad, Medico
+
+
+CONFIGURACIONES = {
+    'original (sesión en BD + ModelBackend)': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+    },
+    'cached_db + principal en caché': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+        'AUTHENTICATION_BACKENDS': ['ficha_medica.auth.CachedModelBackend'],
+    },
+    'cookie firmada + principal en caché': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies',
+        'AUTHENTICATION_BACKENDS': ['ficha_medica.auth.CachedModelBackend'],
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Mide las consultas y el tiempo por petición autenticada con cada configuración de sesión."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peticiones', type=int, default=200)
+        parser.add_argument('--url', default='/medico/', help="Vista protegida a solicitar.")
+
+    def handle(self, *args, **options):
+        # Todo ocurre dentro de una transacción que se revierte al final
+        with transaction.atomic():
+            user = self._crear_medico()
+            for nombre, config in CONFIGURACIONES.items():
+                consultas, milisegundos = self._medir(user, config, options['url'], options['peticiones'])
+                self.stdout.write(f"{nombre:<40} {consultas:6.2f} consultas/petición {milisegundos:8.3f} ms/petición")
+            transaction.set_rollback(True)
+
+    def _crear_medico(self):
+        especialidad, _ = Especialidad.objects.get_or_create(nombre='Benchmark')
+        user = User.objects.create_user(username='00000000-0', password='benchmark', first_name='Bench')
+        # Sin el rol la vista responde 403 y se mediría la respuesta de acceso denegado
+        user.groups.add(Group.objects.get_or_create(name='Medico')[0])
+        Medico.objects.create(user=user, especialidad=especialidad)
+        return user
+
+    def _medir(self, user, config, url, peticiones):
+        hosts = settings.ALLOWED_HOSTS + ['testserver']
+        with override_settings(ALLOWED_HOSTS=hosts, **config):
+            cache_en_niveles.local.clear()
+            client = Client()
+            client.force_login(user, backend=config['AUTHENTICATION_BACKENDS'][0])
+            client.get(url)  # Primera petición: llena las cachés
+
+            total_consultas = 0
+            inicio = time.perf_counter()
+            for _ in range(peticiones):
+                with CaptureQueriesContext(connection) as consultas:
+                    response = client.get(url)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{url} respondió {response.status_code}")
+                total_consultas += len(consultas.captured_queries)
+            duracion = time.perf_counter() - inicio
+        return total_consultas / peticiones, duracion * 1000 / peticiones
@@ -0,0 +1,129 @@
+from datetime import timedelta
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.http import JsonResponse
+from django.utils.timezone import localtime, now
+
+from ficha_medica.consultas import disponibilidades_libres, reservas_en_rango
+from ficha_medica.models import Disponibilidad, Especialidad, Medico, Paciente, Reserva
+from ficha_medica.serializacion import DISPONIBILIDAD, MEDICO, RESERVA_ACTIVA, codificar, orjson, responder_json
+
+
+# Serialización previa: instancias completas, localtime().strftime() por fila y DjangoJSONEncoder
+def medicos_original(especialidad_id):
+    medicos = Medico.objects.filter(especialidad_id=especialidad_id)
+    data = [{'id': medico.id, 'nombre': f"{medico.user.first_name} {medico.user.last_name}"} for medico in medicos]
+    return JsonResponse(data, safe=False)
+
+
+def disponibilidades_original(medico_id, desde):
+    data = [
+        {'id': disp.id, 'fecha_hora': localtime(disp.fecha_disponible).strftime('%d/%m/%Y %H:%M')}
+        for disp in disponibilidades_libres(medico_id, desde)
+    ]
+    return JsonResponse(data, safe=False)
+
+
+def reservas_original(desde):
+    reservas = reservas_en_rango(desde).select_related('paciente', 'fecha_reserva')
+    data = [
+        {"id": r.id, "paciente": r.paciente.nombre, "hora": localtime(r.fecha_reserva.fecha_disponible).strftime('%H:%M')}
+        for r in reservas
+    ]
+    return JsonResponse(data, safe=False)
+
+
+class Command(BaseCommand):
+    help = "Mide el costo por fila de las respuestas JSON con la serialización original y con proyecciones values()."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=10000)
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        filas = options['filas']
+        # Todo ocurre dentro de una transacción que se revierte al final
+        with transaction.atomic():
+            especialidad_id, medico_id, desde = self._datos(filas)
+            casos = {
+                'api_medicos': (
+                    lambda: medicos_original(especialidad_id),
+                    lambda: responder_json(MEDICO.filas(Medico.objects.filter(especialidad_id=especialidad_id))),
+                ),
+                'api_disponibilidades': (
+                    lambda: disponibilidades_original(medico_id, desde),
+                    lambda: responder_json(DISPONIBILIDAD.filas(disponibilidades_libres(medico_id, desde))),
+                ),
+                'obtener_reservas_activas': (
+                    lambda: reservas_original(desde),
+                    lambda: responder_json(RESERVA_ACTIVA.filas(reservas_en_rango(desde))),
+                ),
+            }
+            self.stdout.write(f"{filas} filas por respuesta, codificador: {'orjson' if orjson else 'json'}")
+            self.stdout.write(f"{'Endpoint':<26} {'Versión':<10} {'consultas':>9} {'µs/fila':>9} {'ms total':>9}")
+            for nombre, (original, proyectada) in casos.items():
+                contenidos = []
+                for version, vista in (('original', original), ('values()', proyectada)):
+                    consultas, segundos, contenido = self._medir(vista, options['repeticiones'])
+                    contenidos.append(json.loads(contenido))
+                    self.stdout.write(
+                        f"{nombre:<26} {version:<10} {consultas:>9} {segundos * 1e6 / filas:>9.2f} {segundos * 1000:>9.1f}"
+                    )
+                if contenidos[0] != contenidos[1]:
+                    self.stderr.write(f"  {nombre}: las respuestas difieren entre versiones.")
+
+            data = DISPONIBILIDAD.filas(disponibilidades_libres(medico_id, desde))
+            for nombre, codificador in (
+                ('DjangoJSONEncoder', lambda: json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')),
+                ('codificar()', lambda: codificar(data)),
+            ):
+                inicio = time.perf_counter()
+                for _ in range(options['repeticiones']):
+                    codificador()
+                segundos = (time.perf_counter() - inicio) / options['repeticiones']
+                self.stdout.write(f"Solo codificación {nombre:<20} {segundos * 1e6 / filas:>9.2f} µs/fila")
+            transaction.set_rollback(True)
+
+    def _datos(self, filas):
+        especialidad = Especialidad.objects.create(nombre='Benchmark serialización')
+        usuarios = User.objects.bulk_create([
+            User(username=f"bench-serializacion-{i}", first_name='Nombre', last_name=f"Apellido {i}") for i in range(filas)
+        ])
+        medicos = Medico.objects.bulk_create([Medico(user=usuario, especialidad=especialidad) for usuario in usuarios])
+        medico = medicos[0]
+
+        # Bloques futuros de 30 minutos: la primera mitad libres, la segunda con reserva
+        desde = now() + timedelta(days=1)
+        bloques = Disponibilidad.objects.bulk_create([
+            Disponibilidad(medico=medico, fecha_disponible=desde + timedelta(minutes=30 * i), ocupada=i >= filas)
+            for i in range(2 * filas)
+        ])
+        pacientes = Paciente.objects.bulk_create([
+            Paciente(rut=f"B{i}", nombre=f"Paciente {i}") for i in range(filas)
+        ])
+        Reserva.objects.bulk_create([
+            Reserva(paciente=paciente, especialidad=especialidad, medico=medico, fecha_reserva=bloque, motivo='Benchmark')
+            for paciente, bloque in zip(pacientes, bloques[filas:])
+        ])
+        return especialidad.id, medico.id, desde
+
+    def _medir(self, vista, repeticiones):
+        # Las consultas se cuentan en una ejecución aparte, que además sirve de calentamiento
+        consultas = []
+
+        def contar(execute, sql, params, many, context):
+            consultas.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            vista()
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            response = vista()
+        segundos = (time.perf_counter() - inicio) / repeticiones
+        return len(consultas), segundos, response.content
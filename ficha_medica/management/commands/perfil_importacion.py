@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Simula el arranque de un worker: aplicación WSGI y URLconf completa
+CODIGO_ARRANQUE = (
+    "import centro_medico.wsgi; "
+    "from django.urls import get_resolver; "
+    "get_resolver().url_patterns"
+)
+
+
+def resumir_importtime(salida):
+    """
+    Resume la salida de `python -X importtime` (stderr). Retorna el tiempo total y el
+    tiempo propio sumado por paquete raíz, en microsegundos.
+    """
+    por_paquete = defaultdict(int)
+    total = 0
+    for linea in salida.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        _, propio, acumulado, modulo = linea.replace('import time:', '|', 1).split('|')
+        # La columna del módulo empieza con un espacio; el resto de la sangría indica el anidamiento
+        modulo = modulo[1:].rstrip()
+        nombre = modulo.lstrip()
+        por_paquete[nombre.split('.')[0]] += int(propio)
+        if nombre == modulo:
+            # Solo los módulos de primer nivel: su acumulado ya incluye a sus hijos
+            total += int(acumulado)
+    return total, dict(por_paquete)
+
+
+class Command(BaseCommand):
+    help = "Mide el tiempo de importación del arranque (python -X importtime) y lo resume por paquete."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15, help="Cantidad de paquetes a mostrar.")
+        parser.add_argument('--json', dest='archivo_json', help="Guarda el resumen en este archivo para comparar entre versiones.")
+
+    def handle(self, *args, **options):
+        entorno = dict(os.environ, INICIAR_SERVICIOS='0', PRECALENTAR_AL_INICIAR='0')
+        resultado = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CODIGO_ARRANQUE],
+            cwd=settings.BASE_DIR, env=entorno, capture_output=True, text=True,
+        )
+        if resultado.returncode != 0:
+            raise CommandError(f"El arranque falló:\n{resultado.stderr[-2000:]}")
+
+        total, por_paquete = resumir_importtime(resultado.stderr)
+        ranking = sorted(por_paquete.items(), key=lambda item: item[1], reverse=True)[:options['top']]
+
+        self.stdout.write(f"Tiempo total de importación: {total / 1000:.1f} ms")
+        self.stdout.write(f"{'Paquete':<30} {'ms':>10} {'%':>6}")
+        for paquete, microsegundos in ranking:
+            self.stdout.write(f"{paquete:<30} {microsegundos / 1000:>10.1f} {100 * microsegundos / max(total, 1):>6.1f}")
+
+        if options['archivo_json']:
+            with open(options['archivo_json'], 'w') as archivo:
+                json.dump({
+                    'total_ms': round(total / 1000, 1),
+                    'paquetes_ms': {paquete: round(us / 1000, 1) for paquete, us in ranking},
+                }, archivo, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resumen guardado en {options['archivo_json']}"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ficha_medica.sedes import CATALOGOS, bases_de_sedes, replicar
+
+
+class Command(BaseCommand):
+    help = (
+        "Copia los catálogos compartidos (usuarios, sedes, especialidades, pacientes y médicos) a las bases "
+        "de las sedes. Necesario al agregar una base de sede y después de cambios masivos que no emiten señales."
+    )
+
+    def handle(self, *args, **options):
+        if not bases_de_sedes():
+            raise CommandError("No hay sedes con base propia (variables DATABASE_URL_SEDE_<CODIGO>).")
+        for modelo in CATALOGOS:
+            copiadas = replicar(modelo)
+            detalle = ', '.join(f"{alias}: {cantidad}" for alias, cantidad in copiadas.items())
+            self.stdout.write(f"{modelo._meta.label}: {detalle}")
+        self.stdout.write(self.style.SUCCESS("Catálogos replicados."))
@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from ficha_medica import tareas
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántos segundos el proceso principal devuelve a la cola las tareas de trabajadores caídos
+INTERVALO_RECUPERACION = 30
+
+
+def interpretar_colas(texto):
+    """'default=2,pdf=1' -> {'default': 2, 'pdf': 1}"""
+    colas = {}
+    for parte in filter(None, (p.strip() for p in texto.split(','))):
+        nombre, _, cantidad = parte.partition('=')
+        colas[nombre] = int(cantidad or 1)
+    return colas
+
+
+def al_recibir_senal(senales):
+    """
+    Retorna una lista que pasa a contener las señales recibidas. El manejador solo anota la señal:
+    llamar a Event.set() desde él bloquea el proceso si la señal llega durante Event.wait().
+    """
+    recibidas = []
+    for senal in senales:
+        signal.signal(senal, lambda numero, _: recibidas.append(numero))
+    return recibidas
+
+
+def bucle_trabajador(cola, detener, intervalo):
+    """Proceso hijo: toma y ejecuta tareas de una cola hasta que se pida detener."""
+    import django
+    django.setup()  # Sin efecto con fork; con spawn carga la app y registra las tareas
+
+    # Al recibir la señal se termina la tarea en curso antes de salir
+    recibidas = al_recibir_senal([signal.SIGTERM, signal.SIGINT])
+    trabajador = f"{socket.gethostname()}:{os.getpid()}"
+    while not recibidas and not detener.is_set():
+        try:
+            tomada = tareas.tomar(cola, trabajador)
+            if tomada is not None:
+                tareas.ejecutar(tomada)
+        except Exception as e:
+            # Por ejemplo, la base de datos no está disponible: se reintenta en el siguiente ciclo
+            logger.error(f"Error en el trabajador de la cola {cola}: {e}")
+            tomada = None
+        finally:
+            close_old_connections()
+        if tomada is None:
+            time.sleep(intervalo)
+
+
+class Command(BaseCommand):
+    help = "Ejecuta las tareas de la cola en la base de datos con un grupo de procesos por cola."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--colas', help="Procesos por cola, por ejemplo 'default=2,pdf=1'. Por defecto, settings.TAREAS['COLAS'].")
+        parser.add_argument('--intervalo', type=float, default=tareas.INTERVALO, help="Segundos de espera cuando una cola está vacía.")
+        parser.add_argument('--una-vez', action='store_true', help="Ejecuta en este proceso lo pendiente y termina (útil desde un cron).")
+        parser.add_argument('--periodicas', action='store_true', default=tareas.PERIODICAS_EN_WORKERS,
+                            help="Encola también las tareas periódicas de APScheduler (reemplaza al de los procesos web).")
+
+    def handle(self, *args, **options):
+        from ficha_medica.trabajos import PERIODICAS, PERIODICAS_COLA
+
+        colas = interpretar_colas(options['colas']) if options['colas'] else dict(tareas.COLAS)
+        desconocidas = [cola for cola in colas if cola not in {d.cola for d in tareas.TAREAS.values()}]
+        if desconocidas:
+            raise CommandError(f"No hay tareas registradas en las colas: {', '.join(desconocidas)}")
+
+        periodicas = PERIODICAS if options['periodicas'] else PERIODICAS_COLA
+        if options['una_vez']:
+            tareas.recuperar_vencidas()
+            tareas.programar_periodicas(periodicas)
+            ejecutadas = tareas.procesar_pendientes(colas)
+            self.stdout.write(f"{ejecutadas} tareas ejecutadas.")
+            return
+
+        detener = multiprocessing.Event()
+        recibidas = al_recibir_senal([signal.SIGTERM, signal.SIGINT])
+
+        procesos = {(cola, i): None for cola, cantidad in colas.items() for i in range(cantidad)}
+        self.stdout.write(f"Trabajadores: {', '.join(f'{cola}={cantidad}' for cola, cantidad in colas.items())}"
+                          f"{' (con tareas periódicas)' if options['periodicas'] else ''}.")
+        ultima_recuperacion = 0
+        while not recibidas:
+            for (cola, i), proceso in procesos.items():
+                if proceso is None or not proceso.is_alive():
+                    if proceso is not None:
+                        logger.warning(f"El trabajador {i} de la cola {cola} terminó con código {proceso.exitcode}; se reinicia.")
+                    # Los hijos no deben heredar las conexiones abiertas del proceso principal
+                    connections.close_all()
+                    procesos[(cola, i)] = proceso = multiprocessing.Process(
+                        target=bucle_trabajador, args=(cola, detener, options['intervalo']), daemon=False,
+                        name=f"trabajador-{cola}-{i}",
+                    )
+                    proceso.start()
+            try:
+                tareas.programar_periodicas(periodicas)
+                if time.monotonic() - ultima_recuperacion > INTERVALO_RECUPERACION:
+                    tareas.recuperar_vencidas()
+                    ultima_recuperacion = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error al programar o recuperar tareas: {e}")
+            finally:
+                close_old_connections()
+            time.sleep(options['intervalo'])
+
+        self.stdout.write("Deteniendo: se espera a que terminen las tareas en curso.")
+        detener.set()
+        for proceso in procesos.values():
+            proceso.join(tareas.TIEMPO_MAXIMO)
+            if proceso.is_alive():
+                proceso.terminate()
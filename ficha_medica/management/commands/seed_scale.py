@@ -0,0 +1,313 @@
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+import random
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+from django.utils.timezone import localdate, make_aware, now
+
+from ficha_medica.models import (
+    Disponibilidad, Especialidad, FichaMedica, Medico, Notificacion, Paciente, Recepcionista, Reserva, Sede,
+    nueva_clave_calendario,
+)
+from ficha_medica.rut import digito_verificador, formatear as formatear_rut
+
+import time as reloj
+
+
+NOMBRES = [
+    'María', 'José', 'Francisca', 'Juan', 'Catalina', 'Diego', 'Valentina', 'Matías', 'Constanza', 'Felipe',
+    'Camila', 'Sebastián', 'Javiera', 'Benjamín', 'Fernanda', 'Tomás', 'Isidora', 'Vicente', 'Antonia', 'Cristóbal',
+]
+APELLIDOS = [
+    'González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda',
+    'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández', 'Torres', 'Araya', 'Flores', 'Espinoza', 'Valenzuela',
+]
+ESPECIALIDADES = [
+    'Medicina General', 'Pediatría', 'Cardiología', 'Dermatología', 'Ginecología', 'Traumatología',
+    'Oftalmología', 'Otorrinolaringología', 'Neurología', 'Psiquiatría', 'Endocrinología', 'Urología',
+]
+COMUNAS = ['Santiago', 'Providencia', 'Ñuñoa', 'Maipú', 'La Florida', 'Puente Alto', 'Las Condes', 'Valparaíso']
+MOTIVOS = ['Control', 'Dolor abdominal', 'Chequeo anual', 'Resultados de exámenes', 'Cefalea', 'Tos persistente']
+DIAGNOSTICOS = ['Sin hallazgos', 'Hipertensión arterial', 'Resfrío común', 'Lumbago', 'Gastritis', 'Migraña']
+
+
+@contextmanager
+def sin_auto_now_add(*modelos):
+    # Las fechas sintéticas deben respetarse: auto_now_add las reemplazaría por la hora actual al insertar
+    campos = [campo for modelo in modelos for campo in modelo._meta.concrete_fields if getattr(campo, 'auto_now_add', False)]
+    for campo in campos:
+        campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo in campos:
+            campo.auto_now_add = True
+
+
+def _valor_copy(valor):
+    if valor is None:
+        return r'\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class Escritor:
+    """
+    Acumula filas por modelo y las inserta en lotes: COPY en PostgreSQL, bulk_create en el resto.
+    Los ids se asignan aquí, así las claves foráneas se conocen sin leer de vuelta lo insertado.
+    Al vaciar un modelo se vacían antes los modelos de los que depende (el orden de `modelos`).
+    """
+
+    def __init__(self, modelos, lote, usar_copy):
+        self.modelos = modelos
+        self.lote = lote
+        self.usar_copy = usar_copy
+        self.filas = {modelo: [] for modelo in modelos}
+        self.totales = {modelo: 0 for modelo in modelos}
+        self.siguiente_id = {
+            modelo: (modelo.objects.aggregate(maximo=Max('id'))['maximo'] or 0) + 1 for modelo in modelos
+        }
+
+    def nuevo_id(self, modelo):
+        id_ = self.siguiente_id[modelo]
+        self.siguiente_id[modelo] += 1
+        return id_
+
+    def agregar(self, modelo, **valores):
+        valores.setdefault('id', self.nuevo_id(modelo))
+        self.filas[modelo].append(valores)
+        if len(self.filas[modelo]) >= self.lote:
+            self.vaciar(modelo)
+        return valores['id']
+
+    def vaciar(self, hasta=None):
+        for modelo in self.modelos:
+            if self.filas[modelo]:
+                self._insertar(modelo, self.filas[modelo])
+                self.totales[modelo] += len(self.filas[modelo])
+                self.filas[modelo] = []
+            if modelo is hasta:
+                return
+
+    def _insertar(self, modelo, filas):
+        if self.usar_copy:
+            columnas = list(filas[0])
+            buffer = StringIO()
+            for fila in filas:
+                buffer.write('\t'.join(_valor_copy(fila[columna]) for columna in columnas))
+                buffer.write('\n')
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {connection.ops.quote_name(modelo._meta.db_table)} "
+                    f"({', '.join(connection.ops.quote_name(columna) for columna in columnas)}) FROM STDIN",
+                    buffer,
+                )
+        else:
+            modelo.objects.bulk_create([modelo(**fila) for fila in filas], batch_size=self.lote)
+
+    def reiniciar_secuencias(self):
+        # Los ids se dieron explícitamente: las secuencias de PostgreSQL deben continuar después del máximo
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), self.modelos):
+                cursor.execute(sql)
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un conjunto de datos sintético y reproducible a escala (especialidades, personal, pacientes con "
+        "RUT válido, sedes, disponibilidades, reservas, fichas y notificaciones) para pruebas de rendimiento."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--semilla', type=int, default=42, help="Misma semilla, mismos datos.")
+        parser.add_argument('--especialidades', type=int, default=12)
+        parser.add_argument('--sedes', type=int, default=1, help="Los médicos y recepcionistas se reparten entre ellas.")
+        parser.add_argument('--medicos', type=int, default=200)
+        parser.add_argument('--recepcionistas', type=int, default=20)
+        parser.add_argument('--pacientes', type=int, default=100000)
+        parser.add_argument('--meses', type=int, default=3, help="Meses de agenda hacia atrás desde hoy.")
+        parser.add_argument('--meses-futuros', type=int, default=1, help="Meses de agenda hacia adelante.")
+        parser.add_argument('--bloques-por-dia', type=int, default=16, help="Bloques de 30 minutos desde las 09:00.")
+        parser.add_argument('--ocupacion', type=float, default=0.7, help="Fracción de bloques con reserva.")
+        parser.add_argument('--fichas-por-reserva', type=float, default=0.6, help="Fracción de reservas pasadas con ficha.")
+        parser.add_argument('--notificaciones-por-reserva', type=float, default=1.0)
+        parser.add_argument('--lote', type=int, default=10000)
+        parser.add_argument('--sin-copy', action='store_true', help="Usa bulk_create también en PostgreSQL.")
+        parser.add_argument('--permitir-sin-debug', action='store_true', help="Permite ejecutarlo con DEBUG=False.")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['permitir_sin_debug']:
+            raise CommandError("Con DEBUG=False use --permitir-sin-debug para confirmar que no es producción.")
+        for opcion in ('ocupacion', 'fichas_por_reserva', 'notificaciones_por_reserva'):
+            if not 0 <= options[opcion] <= 1:
+                raise CommandError(f"--{opcion.replace('_', '-')} debe estar entre 0 y 1.")
+
+        self.rng = random.Random(options['semilla'])
+        usar_copy = connection.vendor == 'postgresql' and not options['sin_copy']
+        modelos = [Especialidad, Sede, User, User.groups.through, Medico, Recepcionista, Paciente,
+                   Disponibilidad, Reserva, FichaMedica, Notificacion]
+        self.escritor = Escritor(modelos, options['lote'], usar_copy)
+        inicio = reloj.perf_counter()
+
+        with sin_auto_now_add(FichaMedica):
+            especialidades = self._especialidades(options['especialidades'])
+            sedes = self._sedes(options['sedes'])
+            medicos, recepcionistas = self._personal(options['medicos'], options['recepcionistas'], especialidades, sedes)
+            pacientes = self._pacientes(options['pacientes'])
+            self.escritor.vaciar()
+            self.stdout.write(f"Personal y pacientes listos ({reloj.perf_counter() - inicio:.1f} s).")
+            self._agenda(medicos, recepcionistas, pacientes, options)
+            self.escritor.vaciar()
+        self.escritor.reiniciar_secuencias()
+
+        duracion = reloj.perf_counter() - inicio
+        total = sum(self.escritor.totales.values())
+        for modelo, cantidad in self.escritor.totales.items():
+            self.stdout.write(f"  {modelo._meta.label}: {cantidad}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} filas en {duracion:.1f} s ({total / duracion:.0f} filas/s, {'COPY' if usar_copy else 'bulk_create'})."
+        ))
+
+    def _nombre(self):
+        return f"{self.rng.choice(NOMBRES)} {self.rng.choice(APELLIDOS)} {self.rng.choice(APELLIDOS)}"
+
+    def _telefono(self):
+        return f"9{self.rng.randrange(10**7, 10**8)}"
+
+    def _especialidades(self, cantidad):
+        existentes = set(Especialidad.objects.values_list('nombre', flat=True))
+        ids = []
+        for i in range(cantidad):
+            nombre = ESPECIALIDADES[i % len(ESPECIALIDADES)]
+            if i >= len(ESPECIALIDADES):
+                nombre = f"{nombre} {i // len(ESPECIALIDADES) + 1}"
+            if nombre in existentes:
+                nombre = f"{nombre} (semilla {self.rng.randrange(10**6)})"
+            ids.append(self.escritor.agregar(Especialidad, nombre=nombre, descripcion=f"Especialidad sintética: {nombre}"))
+        return ids
+
+    def _sedes(self, cantidad):
+        existentes = set(Sede.objects.values_list('codigo', flat=True))
+        ids = []
+        for i in range(1, cantidad + 1):
+            codigo = f"sede_{i}"
+            if codigo in existentes:
+                codigo = f"{codigo}_{self.rng.randrange(10**6)}"
+            ids.append(self.escritor.agregar(Sede, codigo=codigo, nombre=f"Sede sintética {codigo}", direccion=self.rng.choice(COMUNAS)))
+        return ids
+
+    def _ruts_unicos(self, cantidad, desde, hasta, excluir):
+        """`cantidad` cuerpos de RUT distintos en [desde, hasta), sin los ya usados."""
+        cuerpos = []
+        for cuerpo in self.rng.sample(range(desde, hasta), cantidad + len(excluir)):
+            if len(cuerpos) == cantidad:
+                break
+            rut = formatear_rut(cuerpo)
+            if rut not in excluir:
+                cuerpos.append(rut)
+        return cuerpos
+
+    def _personal(self, cantidad_medicos, cantidad_recepcionistas, especialidades, sedes):
+        contrasena = make_password('benchmark')  # Se calcula una vez: el hash es deliberadamente lento
+        grupos = {nombre: Group.objects.get_or_create(name=nombre)[0].id for nombre in ('Medico', 'Recepcionista')}
+        existentes = set(User.objects.values_list('username', flat=True))
+        ruts = self._ruts_unicos(cantidad_medicos + cantidad_recepcionistas, 5_000_000, 6_000_000, existentes)
+        fecha_alta = now()
+
+        def crear_usuario(rut, grupo):
+            nombre, apellido = self.rng.choice(NOMBRES), self.rng.choice(APELLIDOS)
+            usuario_id = self.escritor.agregar(
+                User, username=rut, password=contrasena, first_name=nombre, last_name=apellido,
+                email=f"{rut.replace('-', '')}@ejemplo.cl", is_active=True, is_staff=False, is_superuser=False,
+                date_joined=fecha_alta,
+            )
+            self.escritor.agregar(User.groups.through, user_id=usuario_id, group_id=grupos[grupo])
+            return usuario_id
+
+        medicos = []
+        for rut in ruts[:cantidad_medicos]:
+            usuario_id = crear_usuario(rut, 'Medico')
+            especialidad_id = self.rng.choice(especialidades)
+            sede_id = self.rng.choice(sedes)
+            medico_id = self.escritor.agregar(
+                Medico, user_id=usuario_id, especialidad_id=especialidad_id, sede_id=sede_id, telefono=self._telefono(),
+                clave_calendario=nueva_clave_calendario(),
+            )
+            medicos.append((medico_id, usuario_id, especialidad_id, sede_id))
+
+        recepcionistas = []
+        for rut in ruts[cantidad_medicos:]:
+            usuario_id = crear_usuario(rut, 'Recepcionista')
+            self.escritor.agregar(
+                Recepcionista, user_id=usuario_id, sede_id=self.rng.choice(sedes), telefono=self._telefono(),
+                direccion=self.rng.choice(COMUNAS), fecha_contratacion=localdate() - timedelta(days=self.rng.randrange(3650)),
+            )
+            recepcionistas.append(usuario_id)
+        return medicos, recepcionistas
+
+    def _pacientes(self, cantidad):
+        existentes = set(Paciente.objects.values_list('rut', flat=True))
+        ids = []
+        hoy = localdate()
+        for rut in self._ruts_unicos(cantidad, 6_000_000, 26_000_000, existentes):
+            cuerpo = int(rut.split('-')[0])
+            ids.append(self.escritor.agregar(
+                Paciente, rut=rut, rut_cuerpo=cuerpo, rut_dv=digito_verificador(cuerpo), nombre=self._nombre(),
+                fecha_nacimiento=hoy - timedelta(days=self.rng.randrange(365 * 90)),
+                direccion=f"Calle {self.rng.randrange(1, 9999)}, {self.rng.choice(COMUNAS)}",
+                telefono=self._telefono(), email=f"paciente{cuerpo}@ejemplo.cl",
+            ))
+        return ids
+
+    def _agenda(self, medicos, recepcionistas, pacientes, options):
+        rng, escritor = self.rng, self.escritor
+        hoy = localdate()
+        primer_dia = hoy - timedelta(days=30 * options['meses'])
+        dias = [
+            primer_dia + timedelta(days=i)
+            for i in range(30 * (options['meses'] + options['meses_futuros']))
+            if (primer_dia + timedelta(days=i)).weekday() < 5
+        ]
+        momento_actual = now()
+        for numero, (medico_id, usuario_id, especialidad_id, sede_id) in enumerate(medicos, 1):
+            for dia in dias:
+                apertura = make_aware(datetime.combine(dia, time(9)))
+                for bloque in range(options['bloques_por_dia']):
+                    inicio = apertura + timedelta(minutes=30 * bloque)
+                    ocupada = rng.random() < options['ocupacion']
+                    disponibilidad_id = escritor.agregar(
+                        Disponibilidad, medico_id=medico_id, sede_id=sede_id, fecha_disponible=inicio, duracion=30, ocupada=ocupada,
+                    )
+                    if not ocupada or not pacientes:
+                        continue
+                    paciente_id = rng.choice(pacientes)
+                    escritor.agregar(
+                        Reserva, paciente_id=paciente_id, especialidad_id=especialidad_id, medico_id=medico_id, sede_id=sede_id,
+                        fecha_reserva_id=disponibilidad_id, motivo=rng.choice(MOTIVOS),
+                        recepcionista_id=rng.choice(recepcionistas) if recepcionistas else None,
+                    )
+                    if inicio < momento_actual and rng.random() < options['fichas_por_reserva']:
+                        escritor.agregar(
+                            FichaMedica, paciente_id=paciente_id, medico_id=medico_id, sede_id=sede_id,
+                            fecha_creacion=inicio + timedelta(minutes=25), diagnostico=rng.choice(DIAGNOSTICOS),
+                            tratamiento='Reposo e hidratación', observaciones=None,
+                        )
+                    if rng.random() < options['notificaciones_por_reserva']:
+                        escritor.agregar(
+                            Notificacion, usuario_id=usuario_id, paciente_id=paciente_id,
+                            mensaje=f"Nueva reserva para el {inicio:%d/%m/%Y %H:%M}.",
+                            fecha_creacion=inicio - timedelta(days=rng.randrange(1, 14)), leido=inicio < momento_actual,
+                        )
+            if numero % 20 == 0 or numero == len(medicos):
+                self.stdout.write(f"Agenda generada para {numero}/{len(medicos)} médicos.")
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.16 on 2026-10-19 12:46
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def fusionar_disponibilidades_duplicadas(apps, schema_editor):
+    """
+    Deja una sola disponibilidad por (medico, fecha_disponible) antes de crear la restricción.
+    Las reservas de los duplicados se reasignan al bloque conservado.
+    """
+    Disponibilidad = apps.get_model('ficha_medica', 'Disponibilidad')
+    Reserva = apps.get_model('ficha_medica', 'Reserva')
+    duplicados = (
+        Disponibilidad.objects.values('medico_id', 'fecha_disponible')
+        .annotate(total=models.Count('id'), conservar=models.Min('id'))
+        .filter(total__gt=1)
+    )
+    for grupo in duplicados:
+        sobrantes = Disponibilidad.objects.filter(
+            medico_id=grupo['medico_id'], fecha_disponible=grupo['fecha_disponible']
+        ).exclude(id=grupo['conservar'])
+        ocupada = sobrantes.filter(ocupada=True).exists()
+        Reserva.objects.filter(fecha_reserva__in=sobrantes).update(fecha_reserva_id=grupo['conservar'])
+        if ocupada:
+            Disponibilidad.objects.filter(id=grupo['conservar']).update(ocupada=True)
+        sobrantes.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ficha_medica', '0003_alter_disponibilidad_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mensaje', models.TextField()),
+                ('fecha_creacion', models.DateTimeField(default=django.utils.timezone.now)),
+                ('leido', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='disponibilidad',
+            name='duracion',
+            field=models.PositiveSmallIntegerField(default=30, validators=[django.core.validators.MinValueValidator(5), django.core.validators.MaxValueValidator(240)], verbose_name='Duración (minutos)'),
+        ),
+        migrations.AlterField(
+            model_name='medico',
+            name='telefono',
+            field=models.CharField(blank=True, max_length=15, null=True, validators=[django.core.validators.RegexValidator(code='invalid_telefono', message='El teléfono solo debe contener números.', regex='^\\d+$')]),
+        ),
+        migrations.AlterField(
+            model_name='paciente',
+            name='telefono',
+            field=models.CharField(blank=True, max_length=15, null=True, validators=[django.core.validators.RegexValidator(code='invalid_telefono', message='El teléfono solo debe contener números.', regex='^\\d+$')]),
+        ),
+        migrations.AlterField(
+            model_name='recepcionista',
+            name='telefono',
+            field=models.CharField(blank=True, max_length=15, null=True, validators=[django.core.validators.RegexValidator(code='invalid_telefono', message='El teléfono solo debe contener números.', regex='^\\d+$')]),
+        ),
+        migrations.RunPython(fusionar_disponibilidades_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='disponibilidad',
+            constraint=models.UniqueConstraint(fields=('medico', 'fecha_disponible'), name='disponibilidad_unica_por_medico'),
+        ),
+        migrations.AddField(
+            model_name='notificacion',
+            name='usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notificaciones', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
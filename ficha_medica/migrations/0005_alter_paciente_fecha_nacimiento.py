@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0004_notificacion_disponibilidad_duracion_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paciente',
+            name='fecha_nacimiento',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+    ]
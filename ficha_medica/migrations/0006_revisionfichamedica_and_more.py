@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-19 12:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ficha_medica', '0005_alter_paciente_fecha_nacimiento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevisionFichaMedica',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero', models.PositiveIntegerField()),
+                ('completa', models.BooleanField(default=False)),
+                ('datos', models.BinaryField()),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('autor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('ficha', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisiones', to='ficha_medica.fichamedica')),
+            ],
+            options={
+                'verbose_name': 'Revisión de ficha',
+                'verbose_name_plural': 'Revisiones de fichas',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='revisionfichamedica',
+            constraint=models.UniqueConstraint(fields=('ficha', 'numero'), name='revision_unica_por_ficha'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-19 12:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0006_revisionfichamedica_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificacion',
+            name='paciente',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notificaciones', to='ficha_medica.paciente'),
+        ),
+        migrations.AddIndex(
+            model_name='fichamedica',
+            index=models.Index(fields=['paciente', '-fecha_creacion'], name='ficha_paciente_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['paciente', '-fecha_creacion'], name='notificacion_paciente_fecha'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ficha_medica', '0007_linea_tiempo_paciente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListaEspera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('motivo', models.TextField()),
+                ('prioridad', models.PositiveSmallIntegerField(choices=[(0, 'Normal'), (1, 'Alta'), (2, 'Urgente')], default=0)),
+                ('hora_desde', models.TimeField(blank=True, null=True)),
+                ('hora_hasta', models.TimeField(blank=True, null=True)),
+                ('dias_semana', models.PositiveSmallIntegerField(default=127)),
+                ('fecha_limite', models.DateField(blank=True, null=True)),
+                ('estado', models.CharField(choices=[('esperando', 'Esperando'), ('ofrecida', 'Bloque ofrecido'), ('asignada', 'Reserva asignada'), ('expirada', 'Oferta expirada'), ('cancelada', 'Cancelada')], default='esperando', max_length=10)),
+                ('oferta_expira', models.DateTimeField(blank=True, null=True)),
+                ('fecha_creacion', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bloque_ofrecido', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ofertas', to='ficha_medica.disponibilidad')),
+                ('especialidad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ficha_medica.especialidad')),
+                ('medico', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='ficha_medica.medico')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='esperas', to='ficha_medica.paciente')),
+                ('registrada_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Lista de espera',
+                'verbose_name_plural': 'Listas de espera',
+                'indexes': [models.Index(condition=models.Q(('estado', 'esperando')), fields=['especialidad', '-prioridad', 'fecha_creacion'], name='espera_cola'), models.Index(condition=models.Q(('estado', 'ofrecida')), fields=['oferta_expira'], name='espera_oferta_expira')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='listaespera',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'ofrecida')), fields=('bloque_ofrecido',), name='una_oferta_por_bloque'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0008_lista_espera'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='fichamedica',
+            name='ficha_paciente_fecha',
+        ),
+        migrations.RemoveIndex(
+            model_name='notificacion',
+            name='notificacion_paciente_fecha',
+        ),
+        migrations.AddIndex(
+            model_name='disponibilidad',
+            index=models.Index(fields=['fecha_disponible'], name='disponibilidad_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='fichamedica',
+            index=models.Index(fields=['paciente', 'fecha_creacion', 'id'], name='ficha_paciente_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['paciente', 'fecha_creacion', 'id'], name='notificacion_paciente_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(condition=models.Q(('leido', False)), fields=['usuario', '-fecha_creacion'], name='notificacion_no_leida'),
+        ),
+    ]
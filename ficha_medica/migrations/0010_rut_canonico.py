@@ -0,0 +1,70 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:07
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import migrations, models
+import ficha_medica.rut
+
+
+def canonicalizar_ruts(apps, schema_editor):
+    """
+    Completa rut_cuerpo/rut_dv y reescribe el RUT y el nombre de usuario del personal en forma canónica.
+    Los RUT ilegibles o que colisionan con otro ya normalizado se dejan como estaban para revisarlos a mano.
+    """
+    Paciente = apps.get_model('ficha_medica', 'Paciente')
+    Medico = apps.get_model('ficha_medica', 'Medico')
+    Recepcionista = apps.get_model('ficha_medica', 'Recepcionista')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    # Por cuerpo se conserva la fila que ya está en forma canónica o, si no hay, la más antigua
+    elegidos = {}
+    for paciente_id, rut in Paciente.objects.order_by('id').values_list('id', 'rut').iterator(chunk_size=2000):
+        try:
+            cuerpo, dv = ficha_medica.rut.parsear(rut, verificar=False)
+        except ValidationError:
+            continue
+        canonico = rut == ficha_medica.rut.formatear(cuerpo, dv)
+        actual = elegidos.get(cuerpo)
+        if actual is None or (canonico and not actual[2]):
+            elegidos[cuerpo] = (paciente_id, dv, canonico)
+
+    pacientes = [
+        Paciente(id=paciente_id, rut=ficha_medica.rut.formatear(cuerpo, dv), rut_cuerpo=cuerpo, rut_dv=dv)
+        for cuerpo, (paciente_id, dv, _) in elegidos.items()
+    ]
+    Paciente.objects.bulk_update(pacientes, ['rut', 'rut_cuerpo', 'rut_dv'], batch_size=2000)
+
+    personal = set(Medico.objects.values_list('user_id', flat=True)) | set(Recepcionista.objects.values_list('user_id', flat=True))
+    usados = set(User.objects.values_list('username', flat=True))
+    for usuario in User.objects.filter(id__in=personal).only('id', 'username'):
+        canonico = ficha_medica.rut.normalizar_usuario(usuario.username)
+        if canonico != usuario.username and canonico not in usados:
+            usados.add(canonico)
+            User.objects.filter(id=usuario.id).update(username=canonico)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ficha_medica', '0009_indices_consultas_criticas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paciente',
+            name='rut_cuerpo',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='paciente',
+            name='rut_dv',
+            field=models.CharField(blank=True, editable=False, max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='paciente',
+            name='rut',
+            field=models.CharField(max_length=12, unique=True, validators=[ficha_medica.rut.validar_rut]),
+        ),
+        migrations.RunPython(canonicalizar_ruts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0010_rut_canonico'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fichamedica',
+            index=models.Index(fields=['fecha_creacion'], name='ficha_fecha'),
+        ),
+    ]
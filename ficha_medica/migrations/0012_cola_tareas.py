@@ -0,0 +1,59 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ficha_medica', '0011_indice_fecha_ficha'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoGenerado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=200)),
+                ('tipo_contenido', models.CharField(max_length=100)),
+                ('contenido', models.BinaryField()),
+                ('creado_en', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archivos_generados', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archivo generado',
+                'verbose_name_plural': 'Archivos generados',
+            },
+        ),
+        migrations.CreateModel(
+            name='Tarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('cola', models.CharField(default='default', max_length=50)),
+                ('argumentos', models.JSONField(blank=True, default=dict)),
+                ('prioridad', models.SmallIntegerField(default=0)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('completada', 'Completada'), ('fallida', 'Fallida')], default='pendiente', max_length=10)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('max_intentos', models.PositiveSmallIntegerField(default=5)),
+                ('ejecutar_desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tomada_por', models.CharField(blank=True, max_length=100)),
+                ('bloqueada_hasta', models.DateTimeField(blank=True, null=True)),
+                ('clave', models.CharField(blank=True, max_length=150, null=True, unique=True)),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('creada_en', models.DateTimeField(auto_now_add=True)),
+                ('terminada_en', models.DateTimeField(blank=True, null=True)),
+                ('creada_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tareas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Tarea',
+                'verbose_name_plural': 'Tareas',
+                'indexes': [models.Index(condition=models.Q(('estado', 'pendiente')), fields=['cola', '-prioridad', 'ejecutar_desde', 'id'], name='tarea_pendiente'), models.Index(condition=models.Q(('estado', 'en_curso')), fields=['bloqueada_hasta'], name='tarea_en_curso'), models.Index(condition=models.Q(('estado__in', ['completada', 'fallida'])), fields=['terminada_en'], name='tarea_terminada')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0012_cola_tareas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recordatorio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('dia_anterior', 'Día anterior')], default='dia_anterior', max_length=20)),
+                ('destinatario', models.EmailField(max_length=254)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_lote', 'En un lote de envío'), ('enviado', 'Enviado'), ('fallido', 'Fallido'), ('descartado', 'Descartado')], default='pendiente', max_length=10)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('programado_para', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lote', models.CharField(blank=True, max_length=32)),
+                ('en_lote_desde', models.DateTimeField(blank=True, null=True)),
+                ('enviado_en', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('reserva', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recordatorios', to='ficha_medica.reserva')),
+            ],
+            options={
+                'verbose_name': 'Recordatorio',
+                'verbose_name_plural': 'Recordatorios',
+                'indexes': [models.Index(condition=models.Q(('estado', 'pendiente')), fields=['programado_para', 'id'], name='recordatorio_pendiente'), models.Index(condition=models.Q(('estado', 'en_lote')), fields=['lote'], name='recordatorio_lote'), models.Index(condition=models.Q(('estado', 'en_lote')), fields=['en_lote_desde'], name='recordatorio_en_lote')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recordatorio',
+            constraint=models.UniqueConstraint(fields=('reserva', 'tipo'), name='un_recordatorio_por_tipo'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0013_recordatorios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disponibilidad',
+            name='actualizado_en',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='disponibilidad',
+            name='creado_en',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reserva',
+            name='actualizado_en',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='reserva',
+            name='creado_en',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='disponibilidad',
+            index=models.Index(fields=['medico', 'actualizado_en'], name='disponibilidad_cambios'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['medico', 'actualizado_en'], name='reserva_cambios'),
+        ),
+    ]
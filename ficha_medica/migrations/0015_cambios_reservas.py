@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0014_marcas_de_cambio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CambioReserva',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('reserva_id', models.BigIntegerField()),
+                ('medico_id', models.BigIntegerField()),
+                ('operacion', models.CharField(choices=[('crear', 'Creada'), ('modificar', 'Modificada'), ('eliminar', 'Eliminada')], max_length=10)),
+                ('registrado_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Cambio de reserva',
+                'verbose_name_plural': 'Cambios de reservas',
+                'indexes': [models.Index(fields=['medico_id', 'seq'], name='cambio_reserva_medico'), models.Index(fields=['registrado_en'], name='cambio_reserva_fecha')],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def asignar_sede_principal(apps, schema_editor):
+    """Lo existente es de un solo local: se crea la sede 'principal' y se le asigna todo."""
+    alias = schema_editor.connection.alias
+    Sede = apps.get_model('ficha_medica', 'Sede')
+    Medico = apps.get_model('ficha_medica', 'Medico')
+    modelos = [apps.get_model('ficha_medica', nombre) for nombre in ('Disponibilidad', 'Reserva', 'FichaMedica', 'ListaEspera')]
+    if not Medico.objects.using(alias).exists() and not any(modelo.objects.using(alias).exists() for modelo in modelos):
+        return
+    sede, _ = Sede.objects.using(alias).get_or_create(codigo='principal', defaults={'nombre': 'Principal'})
+    for modelo in [Medico, *modelos]:
+        modelo.objects.using(alias).filter(sede__isnull=True).update(sede=sede)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0015_cambios_reservas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sede',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo', models.SlugField(max_length=30, unique=True)),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('direccion', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Sede',
+                'verbose_name_plural': 'Sedes',
+            },
+        ),
+        migrations.AddField(
+            model_name='disponibilidad',
+            name='sede',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede'),
+        ),
+        migrations.AddField(
+            model_name='fichamedica',
+            name='sede',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede'),
+        ),
+        migrations.AddField(
+            model_name='listaespera',
+            name='sede',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede'),
+        ),
+        migrations.AddField(
+            model_name='medico',
+            name='sede',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='medicos', to='ficha_medica.sede'),
+        ),
+        migrations.AddField(
+            model_name='recepcionista',
+            name='sede',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ficha_medica.sede'),
+        ),
+        migrations.AddField(
+            model_name='reserva',
+            name='sede',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede'),
+        ),
+        migrations.AddField(
+            model_name='tarea',
+            name='sede',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ficha_medica.sede'),
+        ),
+        migrations.RunPython(asignar_sede_principal, migrations.RunPython.noop),
+    ]
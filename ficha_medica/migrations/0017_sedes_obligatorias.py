@@ -0,0 +1,59 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0016_sedes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='disponibilidad',
+            name='sede',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede'),
+        ),
+        migrations.AlterField(
+            model_name='fichamedica',
+            name='sede',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede'),
+        ),
+        migrations.AlterField(
+            model_name='listaespera',
+            name='sede',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede'),
+        ),
+        migrations.AlterField(
+            model_name='medico',
+            name='sede',
+            field=models.ForeignKey(blank=True, on_delete=django.db.models.deletion.PROTECT, related_name='medicos', to='ficha_medica.sede'),
+        ),
+        migrations.AlterField(
+            model_name='reserva',
+            name='sede',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede'),
+        ),
+        migrations.RemoveIndex(
+            model_name='listaespera',
+            name='espera_cola',
+        ),
+        migrations.AddIndex(
+            model_name='disponibilidad',
+            index=models.Index(fields=['sede', 'fecha_disponible'], name='disponibilidad_sede_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='fichamedica',
+            index=models.Index(fields=['sede', 'fecha_creacion'], name='ficha_sede_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='listaespera',
+            index=models.Index(condition=models.Q(('estado', 'esperando')), fields=['sede', 'especialidad', '-prioridad', 'fecha_creacion'], name='espera_cola'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['sede', 'fecha_reserva'], name='reserva_sede_bloque'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+TABLAS_PARTICIONADAS = ('ficha_medica_disponibilidadarchivo', 'ficha_medica_reservaarchivo')
+
+
+def particionar_por_mes(apps, schema_editor):
+    """
+    En PostgreSQL las tablas de archivo se recrean particionadas por rango de `mes`; las particiones
+    mensuales las crea archivo.py al mover cada lote. En otras bases quedan como una sola tabla.
+    """
+    conexion = schema_editor.connection
+    if conexion.vendor != 'postgresql':
+        return
+    with conexion.cursor() as cursor:
+        for tabla in TABLAS_PARTICIONADAS:
+            # Los índices de Django se recrean con el mismo nombre sobre la tabla particionada
+            cursor.execute(
+                "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s",
+                [tabla, f'{tabla}_pkey'],
+            )
+            indices = [fila[0] for fila in cursor.fetchall()]
+            cursor.execute(f'ALTER TABLE {tabla} RENAME TO {tabla}_plantilla')
+            cursor.execute(f'CREATE TABLE {tabla} (LIKE {tabla}_plantilla INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (mes)')
+            cursor.execute(f'DROP TABLE {tabla}_plantilla')
+            # La clave de partición debe ser parte de la clave primaria
+            cursor.execute(f'ALTER TABLE {tabla} ADD PRIMARY KEY (id, mes)')
+            for definicion in indices:
+                cursor.execute(definicion)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ficha_medica', '0017_sedes_obligatorias'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DisponibilidadArchivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('fecha', models.DateTimeField()),
+                ('duracion', models.PositiveSmallIntegerField(verbose_name='Duración (minutos)')),
+                ('ocupada', models.BooleanField()),
+                ('creado_en', models.DateTimeField()),
+                ('archivado_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('mes', models.DateField()),
+                ('medico', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='bloques_archivados', to='ficha_medica.medico')),
+                ('sede', models.ForeignKey(db_constraint=False, db_index=False, editable=False, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede')),
+            ],
+            options={
+                'verbose_name': 'Disponibilidad archivada',
+                'verbose_name_plural': 'Disponibilidades archivadas',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReservaArchivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('fecha', models.DateTimeField()),
+                ('duracion', models.PositiveSmallIntegerField(verbose_name='Duración (minutos)')),
+                ('motivo', models.TextField()),
+                ('creado_en', models.DateTimeField()),
+                ('archivado_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('mes', models.DateField()),
+                ('bloque', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='ficha_medica.disponibilidadarchivo')),
+                ('especialidad', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='ficha_medica.especialidad')),
+                ('medico', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reservas_archivadas', to='ficha_medica.medico')),
+                ('paciente', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reservas_archivadas', to='ficha_medica.paciente')),
+                ('recepcionista', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('sede', models.ForeignKey(db_constraint=False, db_index=False, editable=False, on_delete=django.db.models.deletion.PROTECT, to='ficha_medica.sede')),
+            ],
+            options={
+                'verbose_name': 'Reserva archivada',
+                'verbose_name_plural': 'Reservas archivadas',
+                'indexes': [models.Index(fields=['paciente', 'fecha', 'id'], name='archivo_reserva_paciente'), models.Index(fields=['medico', 'fecha'], name='archivo_reserva_medico'), models.Index(fields=['mes', 'fecha'], name='archivo_reserva_mes')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='disponibilidadarchivo',
+            index=models.Index(fields=['medico', 'fecha'], name='archivo_bloque_medico'),
+        ),
+        migrations.AddIndex(
+            model_name='disponibilidadarchivo',
+            index=models.Index(fields=['mes', 'fecha'], name='archivo_bloque_mes'),
+        ),
+        migrations.RunPython(particionar_por_mes, migrations.RunPython.noop),
+    ]
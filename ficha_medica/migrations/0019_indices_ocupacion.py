@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0018_archivo_agenda'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='disponibilidad',
+            name='disponibilidad_fecha',
+        ),
+        migrations.RemoveIndex(
+            model_name='disponibilidadarchivo',
+            name='archivo_bloque_mes',
+        ),
+        migrations.AddIndex(
+            model_name='disponibilidad',
+            index=models.Index(fields=['fecha_disponible', 'medico', 'ocupada', 'duracion'], name='disponibilidad_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='disponibilidadarchivo',
+            index=models.Index(fields=['mes', 'fecha', 'medico', 'ocupada', 'duracion'], name='archivo_bloque_mes'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0019_indices_ocupacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(fields=['nombre', 'id'], name='paciente_nombre'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:25
+
+from django.db import migrations, models
+import ficha_medica.models
+
+
+def asignar_claves(apps, schema_editor):
+    """AddField calcula el valor por defecto una sola vez: cada médico necesita su propia clave."""
+    Medico = apps.get_model('ficha_medica', 'Medico')
+    medicos = list(Medico.objects.using(schema_editor.connection.alias).only('id'))
+    for medico in medicos:
+        medico.clave_calendario = ficha_medica.models.nueva_clave_calendario()
+    Medico.objects.using(schema_editor.connection.alias).bulk_update(medicos, ['clave_calendario'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ficha_medica', '0020_indice_paciente_nombre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cambioreserva',
+            name='bloque_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='medico',
+            name='clave_calendario',
+            field=models.CharField(default=ficha_medica.models.nueva_clave_calendario, editable=False, max_length=32),
+        ),
+        migrations.RunPython(asignar_claves, migrations.RunPython.noop),
+    ]
@@ -2,12 +2,24 @@ from django.db import models
 from django.contrib.auth.models import User, Group
 from datetime import date
 from django.utils.timezone import localtime, now
-from django.core.validators import RegexValidator
+from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
+from django.db.models import Q
+from django.core.exceptions import ValidationError
+from datetime import timedelta
+import secrets
+from .rut import formatear as formatear_rut, parsear as parsear_rut, validar_rut
+from .utils import sede_activa
+
+# Duración máxima de un bloque de atención, en minutos. Acota la ventana de búsqueda de solapamientos.
+DURACION_MAXIMA_DISPONIBILIDAD = 240
 
 class Paciente(models.Model):
-    rut = models.CharField(max_length=12, unique=True)  # Ejemplo: 12345678-9
+    rut = models.CharField(max_length=12, unique=True, validators=[validar_rut])  # Ejemplo: 12345678-9
+    # Forma canónica del RUT para búsquedas exactas por índice; se completa al guardar
+    rut_cuerpo = models.PositiveIntegerField(unique=True, null=True, blank=True, editable=False)
+    rut_dv = models.CharField(max_length=1, blank=True, editable=False)
     nombre = models.CharField(max_length=100)
-    fecha_nacimiento = models.DateField(blank=True, null=True)  # Campo adicional
+    fecha_nacimiento = models.DateField(blank=True, null=True, db_index=True)  # Indexado para agrupar por edad
     direccion = models.TextField(blank=True, null=True)
     telefono = models.CharField(
         max_length=15,
@@ -26,10 +38,26 @@ class Paciente(models.Model):
     class Meta:
         verbose_name = "Paciente"
         verbose_name_plural = "Pacientes"
+        indexes = [
+            # Orden del listado del admin (nombre y id como desempate), en ambos sentidos
+            models.Index(fields=['nombre', 'id'], name='paciente_nombre'),
+        ]
 
     def __str__(self):
         return f"{self.nombre} ({self.rut})"
 
+    def save(self, *args, **kwargs):
+        # El dígito se verifica en los formularios; aquí solo se normaliza para no bloquear datos antiguos
+        try:
+            self.rut_cuerpo, self.rut_dv = parsear_rut(self.rut, verificar=False)
+            self.rut = formatear_rut(self.rut_cuerpo, self.rut_dv)
+        except ValidationError:
+            self.rut_cuerpo, self.rut_dv = None, ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'rut' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'rut_cuerpo', 'rut_dv'}
+        super().save(*args, **kwargs)
+
     @property
     def edad(self):
         """Calcula la edad del paciente basado en la fecha de nacimiento."""
@@ -50,9 +78,68 @@ class Especialidad(models.Model):
         return self.nombre
 
 
+class Sede(models.Model):
+    """
+    Local del centro médico. Los médicos y sus bloques, reservas y fichas pertenecen a una sede;
+    una sede puede tener su propia base de datos (ver ficha_medica/sedes.py).
+    """
+    codigo = models.SlugField(max_length=30, unique=True)  # Su base, si la tiene, es DATABASE_URL_SEDE_<CODIGO>
+    nombre = models.CharField(max_length=100, unique=True)
+    direccion = models.TextField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Sede"
+        verbose_name_plural = "Sedes"
+
+    def __str__(self):
+        return self.nombre
+
+
+def sede_por_defecto():
+    """Sede de lo que se crea sin indicarla: la primera, que en un centro de un solo local es la única."""
+    sede_id = Sede.objects.order_by('id').values_list('id', flat=True).first()
+    if sede_id is None:
+        sede_id = Sede.objects.get_or_create(codigo='principal', defaults={'nombre': 'Principal'})[0].id
+    return sede_id
+
+
+class PorSedeQuerySet(models.QuerySet):
+
+    def create(self, **kwargs):
+        # Sin .using() explícito la base la elige el router al guardar, ya con la sede de la fila
+        if self._db is not None:
+            return super().create(**kwargs)
+        instancia = self.model(**kwargs)
+        instancia.save(force_insert=True)
+        return instancia
+
+
+class PorSedeManager(models.Manager.from_queryset(PorSedeQuerySet)):
+    """Con una sede activa (utils.en_sede) solo entrega las filas de esa sede."""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        sede_id = sede_activa()
+        return queryset if sede_id is None else queryset.filter(sede_id=sede_id)
+
+
+def _asignar_sede(instancia):
+    """Un bloque, reserva, ficha o entrada de espera es de la sede de su médico; sin médico, de la sede activa."""
+    if instancia.sede_id is None:
+        if instancia.medico_id is not None:
+            instancia.sede_id = instancia.medico.sede_id
+        else:
+            instancia.sede_id = sede_activa() or sede_por_defecto()
+
+
+def nueva_clave_calendario():
+    return secrets.token_urlsafe(24)
+
+
 class Medico(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     especialidad = models.ForeignKey(Especialidad, on_delete=models.CASCADE, related_name="medicos")  # Relación con Especialidad
+    sede = models.ForeignKey(Sede, on_delete=models.PROTECT, blank=True, related_name='medicos')  # Vacío: la sede por defecto
     telefono = models.CharField(
         max_length=15,
         blank=True,
@@ -65,6 +152,10 @@ class Medico(models.Model):
             )
         ]
     )
+    # Parte secreta de la URL de suscripción al calendario; cambiarla revoca la URL anterior
+    clave_calendario = models.CharField(max_length=32, default=nueva_clave_calendario, editable=False)
+
+    objects = PorSedeManager()
 
     class Meta:
         verbose_name = "Medico"
@@ -74,6 +165,8 @@ class Medico(models.Model):
         return f"{self.user.first_name} {self.user.last_name} - {self.especialidad.nombre}"
 
     def save(self, *args, **kwargs):
+        if self.sede_id is None:
+            self.sede_id = sede_por_defecto()
         # Crear o asignar grupo 'Medico' al usuario
         grupo, created = Group.objects.get_or_create(name='Medico')
         self.user.groups.add(grupo)
@@ -82,14 +175,29 @@ class Medico(models.Model):
 class FichaMedica(models.Model):
     paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='fichas')
     medico = models.ForeignKey(Medico, on_delete=models.SET_NULL, null=True, related_name='fichas')
+    sede = models.ForeignKey(Sede, on_delete=models.PROTECT, editable=False)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     diagnostico = models.TextField()
     tratamiento = models.TextField(blank=True, null=True)
     observaciones = models.TextField(blank=True, null=True)
-    
+
+    objects = PorSedeManager()
+
     class Meta:
         verbose_name = "Ficha"
         verbose_name_plural = "Fichas"
+        indexes = [
+            # Fichas de un paciente en orden cronológico (línea de tiempo, historial)
+            models.Index(fields=['paciente', 'fecha_creacion', 'id'], name='ficha_paciente_fecha'),
+            # Listado y filtro por rango de fechas del admin
+            models.Index(fields=['fecha_creacion'], name='ficha_fecha'),
+            # Lo mismo dentro de una sede
+            models.Index(fields=['sede', 'fecha_creacion'], name='ficha_sede_fecha'),
+        ]
+
+    def save(self, *args, **kwargs):
+        _asignar_sede(self)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         if self.medico:
@@ -97,6 +205,29 @@ class FichaMedica(models.Model):
         else:
             return f"Ficha de {self.paciente.nombre} - Médico: No asignado ({self.fecha_creacion.strftime('%d/%m/%Y')})"
 
+class RevisionFichaMedica(models.Model):
+    """
+    Historial de solo inserción de una ficha médica. Cada revisión guarda, comprimido con zlib,
+    un delta respecto de la revisión anterior; cada cierto número de revisiones se guarda el
+    contenido completo para acotar la reconstrucción (ver ficha_medica/revisiones.py).
+    """
+    ficha = models.ForeignKey(FichaMedica, on_delete=models.CASCADE, related_name='revisiones')
+    numero = models.PositiveIntegerField()
+    completa = models.BooleanField(default=False)  # True: contenido completo; False: delta
+    datos = models.BinaryField()
+    autor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    fecha = models.DateTimeField(default=now)
+
+    class Meta:
+        verbose_name = "Revisión de ficha"
+        verbose_name_plural = "Revisiones de fichas"
+        constraints = [
+            models.UniqueConstraint(fields=['ficha', 'numero'], name='revision_unica_por_ficha'),
+        ]
+
+    def __str__(self):
+        return f"Revisión {self.numero} de la ficha {self.ficha_id}"
+
 class Recepcionista(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     telefono = models.CharField(
@@ -113,6 +244,7 @@ class Recepcionista(models.Model):
     )
     direccion = models.TextField(blank=True, null=True)
     fecha_contratacion = models.DateField(blank=True, null=True)
+    sede = models.ForeignKey(Sede, on_delete=models.SET_NULL, null=True, blank=True)  # Vacío: atiende todas las sedes
 
     class Meta:
         verbose_name = "Recepcionista"
@@ -127,17 +259,59 @@ class Recepcionista(models.Model):
         self.user.groups.add(grupo)
         super().save(*args, **kwargs)
 
+def _con_marca_de_cambio(kwargs):
+    """
+    auto_now solo se escribe si el campo está en update_fields: se agrega para que un
+    save(update_fields=[...]) también marque el registro como modificado.
+    """
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None:
+        kwargs['update_fields'] = set(update_fields) | {'actualizado_en'}
+
+
 class Disponibilidad(models.Model):
     medico = models.ForeignKey('Medico', on_delete=models.CASCADE)
     fecha_disponible = models.DateTimeField()
+    duracion = models.PositiveSmallIntegerField(
+        default=30,
+        validators=[MinValueValidator(5), MaxValueValidator(DURACION_MAXIMA_DISPONIBILIDAD)],
+        verbose_name="Duración (minutos)"
+    )
     ocupada = models.BooleanField(default=False)
+    sede = models.ForeignKey(Sede, on_delete=models.PROTECT, editable=False)
+    creado_en = models.DateTimeField(default=now, editable=False)
+    actualizado_en = models.DateTimeField(auto_now=True)  # Sincronización incremental del calendario
+
+    objects = PorSedeManager()
+
+    def save(self, *args, **kwargs):
+        _asignar_sede(self)
+        _con_marca_de_cambio(kwargs)
+        super().save(*args, **kwargs)
 
     def fecha_local(self):
         return localtime(self.fecha_disponible)  # Convierte a la zona horaria local
+
+    @property
+    def fecha_fin(self):
+        """Momento en que termina el bloque de atención."""
+        return self.fecha_disponible + timedelta(minutes=self.duracion)
     
     class Meta:
         verbose_name = "Disponibilidad"
         verbose_name_plural = "Disponibilidades"
+        constraints = [
+            models.UniqueConstraint(fields=['medico', 'fecha_disponible'], name='disponibilidad_unica_por_medico'),
+        ]
+        indexes = [
+            # Reservas y bloques por rango de fechas sin filtrar por médico (scheduler, recepción);
+            # cubre además las columnas que lee la ocupación de analytics, que así no visita la tabla
+            models.Index(fields=['fecha_disponible', 'medico', 'ocupada', 'duracion'], name='disponibilidad_fecha'),
+            # Lo mismo dentro de una sede
+            models.Index(fields=['sede', 'fecha_disponible'], name='disponibilidad_sede_fecha'),
+            # Bloques de un médico modificados desde una marca de tiempo
+            models.Index(fields=['medico', 'actualizado_en'], name='disponibilidad_cambios'),
+        ]
 
     def __str__(self):
         return f"{self.medico} - {self.fecha_disponible}"
@@ -152,21 +326,338 @@ class Reserva(models.Model):
     fecha_reserva = models.ForeignKey(Disponibilidad, on_delete=models.CASCADE)
     motivo = models.TextField()
     recepcionista = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)  # Agregar este campo
+    sede = models.ForeignKey(Sede, on_delete=models.PROTECT, editable=False)
+    creado_en = models.DateTimeField(default=now, editable=False)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    objects = PorSedeManager()
 
     class Meta:
         verbose_name = "Reserva"
         verbose_name_plural = "Reservas"
+        indexes = [
+            # Reservas de un médico modificadas desde una marca de tiempo
+            models.Index(fields=['medico', 'actualizado_en'], name='reserva_cambios'),
+            # Reservas de una sede por bloque: el cruce con el rango de fechas de los bloques
+            models.Index(fields=['sede', 'fecha_reserva'], name='reserva_sede_bloque'),
+        ]
+
+    def save(self, *args, **kwargs):
+        _asignar_sede(self)
+        _con_marca_de_cambio(kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Reserva de {self.paciente.nombre} gestionada por {self.recepcionista.first_name if self.recepcionista else 'N/A'} para el médico {self.medico.user.first_name}"
 
+
+# Archivo de la agenda (ficha_medica/archivo.py). Las filas conservan el id original y se insertan
+# en lotes ya validados, así que no llevan restricciones de clave foránea; en PostgreSQL las tablas
+# están particionadas por `mes` (migración 0018) y cada mes es una partición.
+
+class DisponibilidadArchivo(models.Model):
+    """Bloques pasados movidos por `manage.py archivar_agenda`: los libres y los de reservas antiguas."""
+    id = models.BigIntegerField(primary_key=True)  # El del bloque original
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, db_constraint=False, db_index=False, related_name='bloques_archivados')
+    fecha = models.DateTimeField()
+    duracion = models.PositiveSmallIntegerField(verbose_name="Duración (minutos)")
+    ocupada = models.BooleanField()
+    sede = models.ForeignKey(Sede, on_delete=models.PROTECT, db_constraint=False, db_index=False, editable=False)
+    creado_en = models.DateTimeField()
+    archivado_en = models.DateTimeField(default=now)
+    mes = models.DateField()  # Primer día del mes del bloque
+
+    objects = PorSedeManager()
+
+    class Meta:
+        verbose_name = "Disponibilidad archivada"
+        verbose_name_plural = "Disponibilidades archivadas"
+        indexes = [
+            models.Index(fields=['medico', 'fecha'], name='archivo_bloque_medico'),
+            # Cubre la lectura por rango de la ocupación de analytics, como disponibilidad_fecha
+            models.Index(fields=['mes', 'fecha', 'medico', 'ocupada', 'duracion'], name='archivo_bloque_mes'),
+        ]
+
+    def __str__(self):
+        return f"{self.medico_id} - {self.fecha} (archivado)"
+
+
+class ReservaArchivo(models.Model):
+    """Reservas antiguas movidas con su bloque; la hora y duración del bloque se copian aquí."""
+    id = models.BigIntegerField(primary_key=True)  # El de la reserva original
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, db_constraint=False, db_index=False, related_name='reservas_archivadas')
+    # Al eliminar una especialidad sus médicos, y con ellos estas filas, se eliminan en cascada
+    especialidad = models.ForeignKey(Especialidad, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+')
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, db_constraint=False, db_index=False, related_name='reservas_archivadas')
+    bloque = models.ForeignKey(DisponibilidadArchivo, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+')
+    fecha = models.DateTimeField()
+    duracion = models.PositiveSmallIntegerField(verbose_name="Duración (minutos)")
+    motivo = models.TextField()
+    # Se conserva el id aunque el usuario se elimine
+    recepcionista = models.ForeignKey(User, on_delete=models.DO_NOTHING, null=True, blank=True, db_constraint=False, db_index=False, related_name='+')
+    sede = models.ForeignKey(Sede, on_delete=models.PROTECT, db_constraint=False, db_index=False, editable=False)
+    creado_en = models.DateTimeField()
+    archivado_en = models.DateTimeField(default=now)
+    mes = models.DateField()  # Primer día del mes del bloque
+
+    objects = PorSedeManager()
+
+    class Meta:
+        verbose_name = "Reserva archivada"
+        verbose_name_plural = "Reservas archivadas"
+        indexes = [
+            # Historial de un paciente (línea de tiempo)
+            models.Index(fields=['paciente', 'fecha', 'id'], name='archivo_reserva_paciente'),
+            models.Index(fields=['medico', 'fecha'], name='archivo_reserva_medico'),
+            models.Index(fields=['mes', 'fecha'], name='archivo_reserva_mes'),
+        ]
+
+    def __str__(self):
+        return f"Reserva {self.id} del paciente {self.paciente_id} (archivada)"
+
+
 class Notificacion(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notificaciones')
+    # Paciente al que se refiere la notificación, si corresponde; el índice compuesto cubre las búsquedas por paciente
+    paciente = models.ForeignKey(
+        Paciente, on_delete=models.SET_NULL, null=True, blank=True, related_name='notificaciones', db_index=False
+    )
     mensaje = models.TextField()
     fecha_creacion = models.DateTimeField(default=now)
     leido = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Recorrido hacia atrás: sirve al orden (fecha, id) descendente de la línea de tiempo
+            models.Index(fields=['paciente', 'fecha_creacion', 'id'], name='notificacion_paciente_fecha'),
+            # Notificaciones pendientes de un usuario, de la más reciente a la más antigua
+            models.Index(fields=['usuario', '-fecha_creacion'], name='notificacion_no_leida', condition=Q(leido=False)),
+        ]
+
     def __str__(self):
         return f"Notificación para {self.usuario.username} - {self.mensaje}"
 
 
+class ListaEspera(models.Model):
+    """
+    Paciente en espera de un bloque, por especialidad o por médico. Cuando se libera un
+    bloque compatible se le ofrece con una retención temporal (ver ficha_medica/lista_espera.py).
+    """
+    ESPERANDO = 'esperando'
+    OFRECIDA = 'ofrecida'
+    ASIGNADA = 'asignada'
+    EXPIRADA = 'expirada'
+    CANCELADA = 'cancelada'
+    ESTADOS = [
+        (ESPERANDO, 'Esperando'),
+        (OFRECIDA, 'Bloque ofrecido'),
+        (ASIGNADA, 'Reserva asignada'),
+        (EXPIRADA, 'Oferta expirada'),
+        (CANCELADA, 'Cancelada'),
+    ]
+    PRIORIDADES = [(0, 'Normal'), (1, 'Alta'), (2, 'Urgente')]
+    # Días de la semana aceptados como máscara de bits: lunes = 1, martes = 2, ..., domingo = 64
+    TODOS_LOS_DIAS = 0b1111111
+
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='esperas')
+    especialidad = models.ForeignKey(Especialidad, on_delete=models.CASCADE)
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, null=True, blank=True)  # Vacío: cualquier médico
+    motivo = models.TextField()
+    prioridad = models.PositiveSmallIntegerField(choices=PRIORIDADES, default=0)
+    hora_desde = models.TimeField(null=True, blank=True)
+    hora_hasta = models.TimeField(null=True, blank=True)
+    dias_semana = models.PositiveSmallIntegerField(default=TODOS_LOS_DIAS)
+    fecha_limite = models.DateField(null=True, blank=True)  # No ofrecer bloques posteriores a esta fecha
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=ESPERANDO)
+    bloque_ofrecido = models.ForeignKey(Disponibilidad, on_delete=models.SET_NULL, null=True, blank=True, related_name='ofertas')
+    oferta_expira = models.DateTimeField(null=True, blank=True)
+    registrada_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    sede = models.ForeignKey(Sede, on_delete=models.PROTECT, editable=False)
+    fecha_creacion = models.DateTimeField(default=now)
+
+    objects = PorSedeManager()
+
+    class Meta:
+        verbose_name = "Lista de espera"
+        verbose_name_plural = "Listas de espera"
+        indexes = [
+            # Cola de prioridad por sede y especialidad: solo las entradas que esperan
+            models.Index(
+                fields=['sede', 'especialidad', '-prioridad', 'fecha_creacion'],
+                name='espera_cola', condition=Q(estado='esperando'),
+            ),
+            # Ofertas vigentes, para expirarlas
+            models.Index(fields=['oferta_expira'], name='espera_oferta_expira', condition=Q(estado='ofrecida')),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['bloque_ofrecido'], name='una_oferta_por_bloque', condition=Q(estado='ofrecida')),
+        ]
+
+    def __str__(self):
+        return f"{self.paciente.nombre} - {self.especialidad.nombre} ({self.get_estado_display()})"
+
+    def save(self, *args, **kwargs):
+        _asignar_sede(self)
+        super().save(*args, **kwargs)
+
+    def acepta_dia(self, dia_semana):
+        """`dia_semana` como en date.weekday(): lunes = 0."""
+        return bool(self.dias_semana & (1 << dia_semana))
+
+
+class Tarea(models.Model):
+    """
+    Trabajo en segundo plano guardado en la base de datos. Lo ejecuta `manage.py run_workers`
+    (ver ficha_medica/tareas.py); sobrevive a reinicios y se reintenta con espera creciente.
+    """
+    PENDIENTE = 'pendiente'
+    EN_CURSO = 'en_curso'
+    COMPLETADA = 'completada'
+    FALLIDA = 'fallida'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_CURSO, 'En curso'),
+        (COMPLETADA, 'Completada'),
+        (FALLIDA, 'Fallida'),
+    ]
+
+    nombre = models.CharField(max_length=100)  # Nombre con que se registró la función
+    cola = models.CharField(max_length=50, default='default')
+    argumentos = models.JSONField(default=dict, blank=True)
+    prioridad = models.SmallIntegerField(default=0)  # Mayor se ejecuta antes
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    max_intentos = models.PositiveSmallIntegerField(default=5)
+    ejecutar_desde = models.DateTimeField(default=now)
+    # Quien la tomó y hasta cuándo: si el trabajador muere, al vencer vuelve a la cola
+    tomada_por = models.CharField(max_length=100, blank=True)
+    bloqueada_hasta = models.DateTimeField(null=True, blank=True)
+    # Evita encolar dos veces el mismo trabajo (por ejemplo, una tarea periódica por intervalo)
+    clave = models.CharField(max_length=150, null=True, blank=True, unique=True)
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    creada_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='tareas')
+    sede = models.ForeignKey(Sede, on_delete=models.SET_NULL, null=True, blank=True)  # Se ejecuta con esta sede activa
+    creada_en = models.DateTimeField(auto_now_add=True)
+    terminada_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Tarea"
+        verbose_name_plural = "Tareas"
+        indexes = [
+            # Siguiente tarea de una cola: solo las pendientes, por prioridad y antigüedad
+            models.Index(
+                fields=['cola', '-prioridad', 'ejecutar_desde', 'id'],
+                name='tarea_pendiente', condition=Q(estado='pendiente'),
+            ),
+            # Tareas cuyo trabajador dejó de responder
+            models.Index(fields=['bloqueada_hasta'], name='tarea_en_curso', condition=Q(estado='en_curso')),
+            # Limpieza de las terminadas
+            models.Index(fields=['terminada_en'], name='tarea_terminada', condition=Q(estado__in=['completada', 'fallida'])),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre} [{self.cola}] ({self.get_estado_display()})"
+
+
+class ArchivoGenerado(models.Model):
+    """Resultado descargable de una tarea (por ejemplo, un lote de fichas en PDF)."""
+    nombre = models.CharField(max_length=200)
+    tipo_contenido = models.CharField(max_length=100)
+    contenido = models.BinaryField()
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archivos_generados')
+    creado_en = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Archivo generado"
+        verbose_name_plural = "Archivos generados"
+
+    def __str__(self):
+        return self.nombre
+
+
+class Recordatorio(models.Model):
+    """
+    Recordatorio por correo de una reserva para el paciente. Se generan por día y se envían en
+    lotes desde la cola de tareas (ver ficha_medica/recordatorios.py).
+    """
+    PENDIENTE = 'pendiente'
+    EN_LOTE = 'en_lote'
+    ENVIADO = 'enviado'
+    FALLIDO = 'fallido'
+    DESCARTADO = 'descartado'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_LOTE, 'En un lote de envío'),
+        (ENVIADO, 'Enviado'),
+        (FALLIDO, 'Fallido'),
+        (DESCARTADO, 'Descartado'),
+    ]
+    DIA_ANTERIOR = 'dia_anterior'
+    TIPOS = [(DIA_ANTERIOR, 'Día anterior')]
+
+    reserva = models.ForeignKey(Reserva, on_delete=models.CASCADE, related_name='recordatorios')
+    tipo = models.CharField(max_length=20, choices=TIPOS, default=DIA_ANTERIOR)
+    destinatario = models.EmailField()
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    programado_para = models.DateTimeField(default=now)  # Próximo intento
+    # Lote que lo está enviando; si su tarea no termina, el recordatorio vuelve a quedar pendiente
+    lote = models.CharField(max_length=32, blank=True)
+    en_lote_desde = models.DateTimeField(null=True, blank=True)
+    enviado_en = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Recordatorio"
+        verbose_name_plural = "Recordatorios"
+        constraints = [
+            models.UniqueConstraint(fields=['reserva', 'tipo'], name='un_recordatorio_por_tipo'),
+        ]
+        indexes = [
+            # Próximos a enviar
+            models.Index(fields=['programado_para', 'id'], name='recordatorio_pendiente', condition=Q(estado='pendiente')),
+            # Recordatorios de un lote y lotes abandonados
+            models.Index(fields=['lote'], name='recordatorio_lote', condition=Q(estado='en_lote')),
+            models.Index(fields=['en_lote_desde'], name='recordatorio_en_lote', condition=Q(estado='en_lote')),
+        ]
+
+    def __str__(self):
+        return f"Recordatorio a {self.destinatario} ({self.get_estado_display()})"
+
+
+class CambioReserva(models.Model):
+    """
+    Registro de solo inserción de los cambios de reservas, en orden de `seq`. Las eliminaciones
+    quedan como lápidas: por eso no hay claves foráneas, la entrada sobrevive a la reserva.
+    Lo consumen la API de cambios (ver ficha_medica/cambios.py) y la sincronización incremental
+    del calendario, que con `bloque_id` cancela el evento de una reserva que ya no existe.
+    """
+    CREAR = 'crear'
+    MODIFICAR = 'modificar'
+    ELIMINAR = 'eliminar'
+    OPERACIONES = [
+        (CREAR, 'Creada'),
+        (MODIFICAR, 'Modificada'),
+        (ELIMINAR, 'Eliminada'),
+    ]
+
+    seq = models.BigAutoField(primary_key=True)
+    reserva_id = models.BigIntegerField()
+    medico_id = models.BigIntegerField()  # Médico al que afecta (al cambiar de médico se registra para ambos)
+    operacion = models.CharField(max_length=10, choices=OPERACIONES)
+    bloque_id = models.BigIntegerField(null=True, blank=True)  # Bloque de la reserva; vacío en las entradas anteriores
+    registrado_en = models.DateTimeField(default=now)
+
+    class Meta:
+        verbose_name = "Cambio de reserva"
+        verbose_name_plural = "Cambios de reservas"
+        indexes = [
+            # Cambios de un médico después de un cursor
+            models.Index(fields=['medico_id', 'seq'], name='cambio_reserva_medico'),
+            models.Index(fields=['registrado_en'], name='cambio_reserva_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.seq}: reserva {self.reserva_id} {self.get_operacion_display().lower()}"
@@ -0,0 +1,44 @@
+def escribir_ficha_pdf(ficha, destino):
+    """
+    Dibuja la ficha médica en formato PDF sobre `destino` (un archivo o una HttpResponse).
+
+    ReportLab se importa aquí y no a nivel de módulo: solo se carga la primera vez que
+    se genera un PDF, no en cada arranque del servidor.
+    """
+    return escribir_fichas_pdf([ficha], destino)
+
+
+def escribir_fichas_pdf(fichas, destino):
+    """Dibuja varias fichas en un mismo PDF, una por página. Lo usan los lotes en segundo plano."""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+
+    # Crear el objeto canvas para generar el PDF
+    p = canvas.Canvas(destino, pagesize=A4)
+    for ficha in fichas:
+        _dibujar_ficha(p, ficha)
+        p.showPage()
+
+    # Finalizar y cerrar el PDF
+    p.save()
+    return destino
+
+
+def _dibujar_ficha(p, ficha):
+    paciente = ficha.paciente
+
+    # Añadir contenido al PDF
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(200, 800, "Ficha Médica")
+
+    p.setFont("Helvetica", 12)
+    p.drawString(100, 750, f"Paciente: {paciente.nombre}")
+    p.drawString(100, 730, f"RUT: {paciente.rut}")
+    p.drawString(100, 710, f"Edad: {paciente.edad if paciente.edad else 'No registrada'}")
+    p.drawString(100, 690, f"Diagnóstico: {ficha.diagnostico}")
+    p.drawString(100, 670, f"Tratamiento: {ficha.tratamiento}")
+    p.drawString(100, 650, f"Observaciones: {ficha.observaciones if ficha.observaciones else 'Ninguna'}")
+    p.drawString(100, 630, f"Fecha de Creación: {ficha.fecha_creacion.strftime('%d/%m/%Y')}")
+
+    p.setFont("Helvetica-Oblique", 10)  # Fuente corregida
+    p.drawString(100, 600, "Este documento fue generado automáticamente.")
@@ -0,0 +1,169 @@
+from datetime import date, time, timedelta
+import smtplib
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils.timezone import localdate, localtime, now
+
+from .consultas import consulta_critica, reservas_en_rango
+from .models import Recordatorio
+from .sedes import en_cada_sede
+from .tareas import encolar, espera_para_reintento, tarea
+from .utils import limites_del_dia
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'RECORDATORIOS', {})
+BACKEND = _config.get('BACKEND')  # None: settings.EMAIL_BACKEND
+HORA_GENERACION = time(*_config.get('HORA_GENERACION', (9, 0)))
+DIAS_ANTICIPACION = _config.get('DIAS_ANTICIPACION', 1)
+TAMANO_LOTE = _config.get('TAMANO_LOTE', 200)
+MAXIMO_POR_CICLO = _config.get('MAXIMO_POR_CICLO', 5000)
+MAX_INTENTOS = _config.get('MAX_INTENTOS', 5)
+LOTE_ABANDONADO = timedelta(minutes=_config.get('MINUTOS_LOTE_ABANDONADO', 30))
+
+
+@tarea('generar_recordatorios', max_intentos=3)
+@en_cada_sede
+def generar_recordatorios(fecha=None):
+    """
+    Crea los recordatorios de las reservas de `fecha` (ISO; por defecto, dentro de DIAS_ANTICIPACION
+    días) cuyo paciente tiene correo. Se puede repetir: no duplica los ya creados.
+    """
+    fecha = localdate() + timedelta(days=DIAS_ANTICIPACION) if fecha is None else date.fromisoformat(fecha)
+    reservas = (
+        reservas_en_rango(*limites_del_dia(fecha))
+        .filter(paciente__email__isnull=False).exclude(paciente__email='')
+        .exclude(recordatorios__tipo=Recordatorio.DIA_ANTERIOR)
+        .values_list('id', 'paciente__email')
+    )
+    nuevos = [
+        Recordatorio(reserva_id=reserva_id, tipo=Recordatorio.DIA_ANTERIOR, destinatario=email)
+        for reserva_id, email in reservas.iterator(chunk_size=2000)
+    ]
+    # ignore_conflicts solo cubre una generación simultánea del mismo día
+    Recordatorio.objects.bulk_create(nuevos, batch_size=1000, ignore_conflicts=True)
+    logger.info(f"{len(nuevos)} recordatorios nuevos para las reservas del {fecha}.")
+    return {'fecha': fecha.isoformat(), 'creados': len(nuevos)}
+
+
+@consulta_critica('recordatorios_pendientes', ejemplo=lambda: {'ahora': now()})
+def pendientes(ahora):
+    """Recordatorios listos para enviarse, del más antiguo al más nuevo."""
+    return (
+        Recordatorio.objects.filter(estado=Recordatorio.PENDIENTE, programado_para__lte=ahora)
+        .order_by('programado_para', 'id')
+    )
+
+
+@tarea('repartir_recordatorios', max_intentos=1, tiempo_maximo=60)
+@en_cada_sede
+def repartir_recordatorios():
+    """
+    Reparte los recordatorios pendientes en lotes de TAMANO_LOTE, cada uno una tarea de la cola
+    'correo'. Los lotes cuya tarea no terminó vuelven antes a quedar pendientes.
+    """
+    ahora = now()
+    abandonados = Recordatorio.objects.filter(estado=Recordatorio.EN_LOTE, en_lote_desde__lt=ahora - LOTE_ABANDONADO).update(
+        estado=Recordatorio.PENDIENTE, lote='', en_lote_desde=None,
+    )
+    if abandonados:
+        logger.warning(f"{abandonados} recordatorios de lotes abandonados vuelven a quedar pendientes.")
+
+    alias = router.db_for_write(Recordatorio)
+    lotes = 0
+    with transaction.atomic(using=alias):
+        candidatos = pendientes(ahora)
+        if connections[alias].features.has_select_for_update_skip_locked:
+            candidatos = candidatos.select_for_update(skip_locked=True)
+        ids = list(candidatos.values_list('id', flat=True)[:MAXIMO_POR_CICLO])
+        for inicio in range(0, len(ids), TAMANO_LOTE):
+            lote = uuid.uuid4().hex
+            Recordatorio.objects.filter(id__in=ids[inicio:inicio + TAMANO_LOTE]).update(
+                estado=Recordatorio.EN_LOTE, lote=lote, en_lote_desde=ahora,
+            )
+            # Se encola en la misma transacción: si no se confirma, los recordatorios siguen pendientes.
+            # Con la sede en otra base no es la misma: si falla el encolado, el lote se recupera como abandonado
+            encolar('enviar_recordatorios', {'lote': lote})
+            lotes += 1
+    return {'recordatorios': len(ids), 'lotes': lotes}
+
+
+def construir_mensaje(recordatorio):
+    reserva = recordatorio.reserva
+    contexto = {
+        'paciente': reserva.paciente,
+        'medico': reserva.medico.user.get_full_name(),
+        'especialidad': reserva.especialidad.nombre,
+        'inicio': localtime(reserva.fecha_reserva.fecha_disponible),
+    }
+    return EmailMessage(
+        subject=render_to_string('recordatorios/reserva_asunto.txt', contexto).strip(),
+        body=render_to_string('recordatorios/reserva.txt', contexto),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[recordatorio.destinatario],
+    )
+
+
+@tarea('enviar_recordatorios', cola='correo', max_intentos=5)
+def enviar_recordatorios(lote):
+    """
+    Envía un lote por una sola conexión del backend de correo (con SMTP, una sesión para todo el
+    lote) y registra el resultado de cada mensaje. Los que fallan se reprograman con espera
+    creciente hasta MAX_INTENTOS. Si no se puede abrir la conexión la tarea falla y la cola la reintenta.
+    """
+    recordatorios = list(
+        Recordatorio.objects.filter(lote=lote, estado=Recordatorio.EN_LOTE)
+        .select_related('reserva__paciente', 'reserva__medico__user', 'reserva__especialidad', 'reserva__fecha_reserva')
+        .order_by('id')
+    )
+    if not recordatorios:
+        return {'enviados': 0, 'fallidos': 0, 'descartados': 0}
+
+    ahora = now()
+    enviados, descartados, errores = [], [], {}
+    conexion = get_connection(BACKEND, fail_silently=False)
+    with conexion:
+        for recordatorio in recordatorios:
+            if recordatorio.reserva.fecha_reserva.fecha_disponible <= ahora:
+                descartados.append(recordatorio.id)
+                continue
+            try:
+                mensaje = construir_mensaje(recordatorio)
+                try:
+                    conexion.send_messages([mensaje])
+                except smtplib.SMTPServerDisconnected:
+                    # El servidor cerró la sesión (por tiempo o cantidad de mensajes): se abre otra
+                    conexion.close()
+                    conexion.open()
+                    conexion.send_messages([mensaje])
+                enviados.append(recordatorio.id)
+            except Exception as e:
+                errores[recordatorio.id] = f"{type(e).__name__}: {e}"
+
+    Recordatorio.objects.filter(id__in=enviados).update(
+        estado=Recordatorio.ENVIADO, intentos=F('intentos') + 1, enviado_en=now(), error='', lote='', en_lote_desde=None,
+    )
+    Recordatorio.objects.filter(id__in=descartados).update(
+        estado=Recordatorio.DESCARTADO, error='La reserva ya comenzó.', lote='', en_lote_desde=None,
+    )
+    for recordatorio in recordatorios:
+        if recordatorio.id not in errores:
+            continue
+        intentos = recordatorio.intentos + 1
+        if intentos < MAX_INTENTOS:
+            cambios = {'estado': Recordatorio.PENDIENTE, 'programado_para': now() + espera_para_reintento(intentos)}
+        else:
+            cambios = {'estado': Recordatorio.FALLIDO}
+        Recordatorio.objects.filter(id=recordatorio.id).update(
+            intentos=intentos, error=errores[recordatorio.id], lote='', en_lote_desde=None, **cambios,
+        )
+    if errores:
+        logger.warning(f"Lote {lote}: {len(errores)} de {len(recordatorios)} recordatorios no se pudieron enviar.")
+    return {'enviados': len(enviados), 'fallidos': len(errores), 'descartados': len(descartados)}
@@ -0,0 +1,202 @@
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.utils.timezone import localtime, make_aware, now
+
+from core.audit import registrar
+
+from .agenda import actualizar_agendas
+from .cache import cache_en_niveles
+from .calendario import invalidar_calendarios
+from .cambios import registrar_cambios
+from .linea_tiempo import invalidar_linea_tiempo
+from .lista_espera import programar_ofertas
+from .models import CambioReserva, Disponibilidad, Notificacion, Reserva
+from .sedes import alias_de_sede
+from .utils import en_sede, senales_en_lote
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_RESERVA = (
+    'id', 'paciente_id', 'paciente__nombre', 'recepcionista_id', 'fecha_reserva_id', 'fecha_reserva__fecha_disponible',
+)
+
+
+def _reservas_del_rango(medico, desde, hasta):
+    if desde >= hasta:
+        raise ValidationError("El inicio del rango debe ser anterior al fin.")
+    return list(
+        Reserva.objects
+        .select_for_update(of=('self',))
+        .filter(medico=medico, fecha_reserva__fecha_disponible__gte=desde, fecha_reserva__fecha_disponible__lt=hasta)
+        .order_by('fecha_reserva__fecha_disponible')
+        .values(*CAMPOS_RESERVA)
+    )
+
+
+def _formatear(fecha):
+    return localtime(fecha).strftime('%d/%m/%Y %H:%M')
+
+
+def _desplazar(fecha, desplazamiento):
+    """
+    Suma el desplazamiento en hora local: con un cambio de horario en medio, la reserva de las
+    10:00 sigue yendo al bloque de las 10:00.
+    """
+    return make_aware(localtime(fecha).replace(tzinfo=None) + desplazamiento)
+
+
+def _notificacion_paciente(medico, reserva, mensaje):
+    # Los pacientes no tienen usuario: el aviso queda en su línea de tiempo y le llega a quien
+    # registró la reserva (o al médico), que es quien debe contactarlo.
+    return Notificacion(
+        usuario_id=reserva['recepcionista_id'] or medico.user_id,
+        paciente_id=reserva['paciente_id'],
+        mensaje=mensaje,
+    )
+
+
+def _refrescar_derivados(usuarios_y_fechas, paciente_ids, medico_ids):
+    """Refresca una sola vez las cachés que las señales por fila habrían actualizado."""
+    pares = {(usuario_id, localtime(fecha).date()) for usuario_id, fecha in usuarios_y_fechas}
+
+    def _refrescar():
+        for modelo in (Reserva, Disponibilidad):
+            try:
+                cache_en_niveles.incrementar_version(modelo)
+            except Exception as e:
+                logger.error(f"No se pudo invalidar la caché de {modelo._meta.label}: {e}")
+        actualizar_agendas(pares)
+
+    transaction.on_commit(_refrescar, using=router.db_for_write(Reserva))
+    invalidar_linea_tiempo(set(paciente_ids))
+    invalidar_calendarios(set(medico_ids))
+
+
+def cancelar_reservas(medico, desde, hasta, usuario=None, motivo=''):
+    """
+    Cancela en una transacción todas las reservas del médico en [desde, hasta): libera los
+    bloques con un solo UPDATE, elimina las reservas y crea las notificaciones con bulk_create.
+    Retorna un resumen con las reservas canceladas.
+    """
+    with en_sede(medico.sede_id), transaction.atomic(using=alias_de_sede(medico.sede_id)), senales_en_lote():
+        reservas = _reservas_del_rango(medico, desde, hasta)
+        if not reservas:
+            return {'canceladas': []}
+
+        # update() no aplica auto_now: la marca de cambio se escribe explícitamente
+        Disponibilidad.objects.filter(id__in=[r['fecha_reserva_id'] for r in reservas]).update(ocupada=False, actualizado_en=now())
+        Reserva.objects.filter(id__in=[r['id'] for r in reservas]).delete()
+        registrar_cambios((r['id'], medico.id, CambioReserva.ELIMINAR, r['fecha_reserva_id']) for r in reservas)
+
+        detalle = f" Motivo: {motivo}." if motivo else ''
+        notificaciones = [
+            _notificacion_paciente(
+                medico, reserva,
+                f"Se canceló la reserva del paciente {reserva['paciente__nombre']} del "
+                f"{_formatear(reserva['fecha_reserva__fecha_disponible'])}.{detalle}",
+            )
+            for reserva in reservas
+        ]
+        notificaciones.append(Notificacion(
+            usuario_id=medico.user_id,
+            mensaje=f"Se cancelaron {len(reservas)} reservas entre el {_formatear(desde)} y el {_formatear(hasta)}.{detalle}",
+        ))
+        Notificacion.objects.bulk_create(notificaciones)
+
+        _refrescar_derivados(
+            [(medico.user_id, r['fecha_reserva__fecha_disponible']) for r in reservas],
+            [r['paciente_id'] for r in reservas],
+            [medico.id],
+        )
+        programar_ofertas(r['fecha_reserva_id'] for r in reservas)
+
+    for reserva in reservas:
+        registrar(usuario, 'eliminar', Reserva(id=reserva['id']), descripcion=f"Cancelación masiva de la reserva {reserva['id']}")
+    return {'canceladas': reservas}
+
+
+def reprogramar_reservas(medico, desde, hasta, desplazamiento=timedelta(0), medico_destino=None, usuario=None):
+    """
+    Mueve las reservas del médico en [desde, hasta) al bloque libre que empieza
+    `desplazamiento` después en hora local, del mismo médico o de `medico_destino`. Las reservas sin un
+    bloque libre a esa hora no se tocan y se informan en el resumen.
+    """
+    destino = medico_destino or medico
+    if destino == medico and not desplazamiento:
+        raise ValidationError("Indique un desplazamiento o un médico de destino distinto.")
+    if destino.sede_id != medico.sede_id:
+        raise ValidationError("Solo se puede reprogramar hacia un médico de la misma sede.")
+
+    with en_sede(medico.sede_id), transaction.atomic(using=alias_de_sede(medico.sede_id)), senales_en_lote():
+        reservas = _reservas_del_rango(medico, desde, hasta)
+        horas = [_desplazar(r['fecha_reserva__fecha_disponible'], desplazamiento) for r in reservas]
+        libres = {
+            bloque.fecha_disponible: bloque
+            for bloque in Disponibilidad.objects.select_for_update().filter(
+                medico=destino, ocupada=False, fecha_disponible__in=horas,
+            )
+        }
+
+        movidas, no_movidas = [], []
+        for reserva, hora in zip(reservas, horas):
+            bloque = libres.pop(hora, None)
+            (movidas if bloque else no_movidas).append((reserva, bloque))
+        if not movidas:
+            return {'movidas': [], 'no_movidas': [reserva for reserva, _ in no_movidas]}
+
+        # update() y bulk_update() no aplican auto_now: la marca de cambio se escribe explícitamente
+        ahora = now()
+        Disponibilidad.objects.filter(id__in=[r['fecha_reserva_id'] for r, _ in movidas]).update(ocupada=False, actualizado_en=ahora)
+        Disponibilidad.objects.filter(id__in=[bloque.id for _, bloque in movidas]).update(ocupada=True, actualizado_en=ahora)
+        Reserva.objects.bulk_update(
+            [
+                Reserva(
+                    id=reserva['id'], fecha_reserva_id=bloque.id, medico_id=destino.id,
+                    especialidad_id=destino.especialidad_id, actualizado_en=ahora,
+                )
+                for reserva, bloque in movidas
+            ],
+            ['fecha_reserva', 'medico', 'especialidad', 'actualizado_en'],
+        )
+        # Para el médico de origen las reservas movidas a otro médico desaparecen
+        cambios = [(r['id'], medico.id, CambioReserva.ELIMINAR, r['fecha_reserva_id']) for r, _ in movidas] if destino != medico else []
+        registrar_cambios(cambios + [(r['id'], destino.id, CambioReserva.MODIFICAR, bloque.id) for r, bloque in movidas])
+
+        notificaciones = [
+            _notificacion_paciente(
+                medico, reserva,
+                f"Se reprogramó la reserva del paciente {reserva['paciente__nombre']} del "
+                f"{_formatear(reserva['fecha_reserva__fecha_disponible'])} al {_formatear(bloque.fecha_disponible)}"
+                + (f" con el Dr(a). {destino.user.get_full_name()}." if destino != medico else "."),
+            )
+            for reserva, bloque in movidas
+        ]
+        notificaciones.append(Notificacion(
+            usuario_id=medico.user_id,
+            mensaje=f"Se reprogramaron {len(movidas)} reservas entre el {_formatear(desde)} y el {_formatear(hasta)}.",
+        ))
+        if destino != medico:
+            notificaciones.append(Notificacion(
+                usuario_id=destino.user_id,
+                mensaje=f"Se le asignaron {len(movidas)} reservas reprogramadas del Dr(a). {medico.user.get_full_name()}.",
+            ))
+        Notificacion.objects.bulk_create(notificaciones)
+
+        _refrescar_derivados(
+            [(medico.user_id, r['fecha_reserva__fecha_disponible']) for r, _ in movidas]
+            + [(destino.user_id, bloque.fecha_disponible) for _, bloque in movidas],
+            [r['paciente_id'] for r, _ in movidas],
+            {medico.id, destino.id},
+        )
+        programar_ofertas(r['fecha_reserva_id'] for r, _ in movidas)
+
+    for reserva, _ in movidas:
+        registrar(usuario, 'modificar', Reserva(id=reserva['id']), descripcion=f"Reprogramación masiva de la reserva {reserva['id']}")
+    return {
+        'movidas': [dict(reserva, nueva_fecha=bloque.fecha_disponible) for reserva, bloque in movidas],
+        'no_movidas': [reserva for reserva, _ in no_movidas],
+    }
@@ -0,0 +1,162 @@
+from difflib import SequenceMatcher
+import json
+import zlib
+
+from django.db import router, transaction
+from django.db.models import Max
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .models import FichaMedica, RevisionFichaMedica
+from .utils import en_sede
+
+
+CAMPOS_VERSIONADOS = ('diagnostico', 'tratamiento', 'observaciones')
+
+# Cada cuántas revisiones se guarda el contenido completo. Reconstruir cualquier versión
+# aplica como máximo INTERVALO_COMPLETA - 1 deltas.
+INTERVALO_COMPLETA = 10
+
+
+def _comprimir(contenido):
+    return zlib.compress(json.dumps(contenido, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _descomprimir(datos):
+    return json.loads(zlib.decompress(bytes(datos)).decode('utf-8'))
+
+
+def calcular_delta(anterior, nuevo):
+    """
+    Operaciones por líneas para pasar de `anterior` a `nuevo`:
+    [n] conserva n líneas, [-n] elimina n líneas, "texto" inserta texto.
+    """
+    lineas_anteriores = (anterior or '').splitlines(keepends=True)
+    lineas_nuevas = (nuevo or '').splitlines(keepends=True)
+    operaciones = []
+    for etiqueta, i1, i2, j1, j2 in SequenceMatcher(None, lineas_anteriores, lineas_nuevas, autojunk=False).get_opcodes():
+        if etiqueta == 'equal':
+            operaciones.append([i2 - i1])
+        else:
+            if i2 > i1:
+                operaciones.append([i1 - i2])
+            if j2 > j1:
+                operaciones.append(''.join(lineas_nuevas[j1:j2]))
+    return operaciones
+
+
+def aplicar_delta(texto, operaciones):
+    lineas = (texto or '').splitlines(keepends=True)
+    resultado = []
+    posicion = 0
+    for operacion in operaciones:
+        if isinstance(operacion, str):
+            resultado.append(operacion)
+        elif operacion[0] >= 0:
+            resultado.extend(lineas[posicion:posicion + operacion[0]])
+            posicion += operacion[0]
+        else:
+            posicion -= operacion[0]
+    return ''.join(resultado)
+
+
+def contenido_de(ficha):
+    return {campo: getattr(ficha, campo) for campo in CAMPOS_VERSIONADOS}
+
+
+def registrar_revision(ficha, anterior=None, autor=None):
+    """
+    Agrega una revisión con el contenido actual de la ficha.
+
+    `anterior` es el contenido antes del cambio; se usa para calcular el delta sin tener
+    que reconstruir la revisión previa. Las fichas sin historial (creadas antes de esta
+    funcionalidad) reciben primero una revisión completa con ese contenido anterior.
+    """
+    actual = contenido_de(ficha)
+    # Las revisiones van en la base de la sede de su ficha
+    with en_sede(ficha.sede_id), transaction.atomic(using=router.db_for_write(RevisionFichaMedica, instance=ficha)):
+        # Dos ediciones simultáneas de la ficha calcularían el mismo número: la segunda espera aquí
+        FichaMedica.objects.select_for_update().only('id').get(pk=ficha.pk)
+        ultimo = RevisionFichaMedica.objects.filter(ficha=ficha).aggregate(n=Max('numero'))['n'] or 0
+        if ultimo == 0 and anterior is not None and anterior != actual:
+            RevisionFichaMedica.objects.create(ficha=ficha, numero=1, completa=True, datos=_comprimir(anterior))
+            ultimo = 1
+
+        numero = ultimo + 1
+        completa = anterior is None or (numero - 1) % INTERVALO_COMPLETA == 0
+        if completa:
+            datos = actual
+        else:
+            datos = {
+                campo: calcular_delta(anterior[campo], actual[campo])
+                for campo in CAMPOS_VERSIONADOS
+                if anterior[campo] != actual[campo]
+            }
+            # Distingue None de cadena vacía, que el delta por líneas no conserva
+            datos['_nulos'] = [campo for campo in CAMPOS_VERSIONADOS if actual[campo] is None]
+        return RevisionFichaMedica.objects.create(
+            ficha=ficha, numero=numero, completa=completa, datos=_comprimir(datos), autor=autor,
+        )
+
+
+def reconstruir(ficha_id, numero=None):
+    """
+    Contenido de la ficha en la revisión `numero` (la última si es None).
+    Lee la última revisión completa anterior y aplica los deltas siguientes, en una consulta.
+    """
+    revisiones = RevisionFichaMedica.objects.filter(ficha_id=ficha_id)
+    if numero is None:
+        numero = revisiones.aggregate(n=Max('numero'))['n']
+        if numero is None:
+            return None
+    base = revisiones.filter(completa=True, numero__lte=numero).aggregate(n=Max('numero'))['n']
+    if base is None:
+        return None
+
+    contenido = None
+    for completa, datos in revisiones.filter(numero__gte=base, numero__lte=numero).order_by('numero').values_list('completa', 'datos'):
+        datos = _descomprimir(datos)
+        if completa:
+            contenido = datos
+            continue
+        nulos = set(datos.pop('_nulos', []))
+        for campo, operaciones in datos.items():
+            contenido[campo] = aplicar_delta(contenido[campo], operaciones)
+        for campo in CAMPOS_VERSIONADOS:
+            if campo in nulos:
+                contenido[campo] = None
+            elif contenido[campo] is None:
+                contenido[campo] = ''
+    return contenido
+
+
+def historial(ficha_id):
+    """Metadatos de las revisiones, sin leer los datos comprimidos."""
+    return list(
+        RevisionFichaMedica.objects
+        .filter(ficha_id=ficha_id)
+        .order_by('-numero')
+        .values('numero', 'fecha', 'completa', 'autor__username')
+    )
+
+
+@receiver(pre_save, sender=FichaMedica)
+def recordar_contenido_anterior(sender, instance, **kwargs):
+    instance._contenido_anterior = None
+    if instance.pk:
+        instance._contenido_anterior = (
+            FichaMedica.objects.filter(pk=instance.pk).values(*CAMPOS_VERSIONADOS).first()
+        )
+
+
+@receiver(post_save, sender=FichaMedica)
+def versionar_ficha(sender, instance, created, **kwargs):
+    """
+    Toda escritura de la ficha (vistas, admin, shell) queda en el historial.
+    Las vistas pueden indicar el autor con `ficha._autor_revision = request.user`.
+    """
+    anterior = None if created else getattr(instance, '_contenido_anterior', None)
+    if not created and (anterior is None or anterior == contenido_de(instance)):
+        return
+    autor = getattr(instance, '_autor_revision', None)
+    registrar_revision(instance, anterior=anterior, autor=autor if getattr(autor, 'is_authenticated', False) else None)
@@ -0,0 +1,86 @@
+from django.core.exceptions import ValidationError
+
+import re
+
+# Acepta "12345678-9", "12.345.678-9", "12345678 9", "123456789" y la K en minúscula
+_FORMATO = re.compile(r'^(\d{1,3}(?:\.\d{3})+|\d{1,9})[-\s]?([\dkK])$')
+# Un separador antes del último carácter, o la K, indican que el texto trae el dígito verificador
+_CON_DIGITO_VERIFICADOR = re.compile(r'[-\s][\dkK]$|[kK]$')
+
+
+def digito_verificador(cuerpo):
+    """Dígito verificador módulo 11 de un RUT chileno."""
+    suma, factor = 0, 2
+    while cuerpo:
+        cuerpo, digito = divmod(cuerpo, 10)
+        suma += digito * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: '0', 10: 'K'}.get(resto, str(resto))
+
+
+def parsear(texto, verificar=True):
+    """
+    Retorna (cuerpo, dv) con el cuerpo como entero y el dígito verificador en mayúscula.
+    Lanza ValidationError si el formato no es reconocible o, con `verificar`, si el dígito no corresponde.
+    """
+    coincidencia = _FORMATO.match((texto or '').strip())
+    if not coincidencia:
+        raise ValidationError("El RUT debe estar en el formato 12345678-9.", code='formato_rut')
+    cuerpo = int(coincidencia.group(1).replace('.', ''))
+    dv = coincidencia.group(2).upper()
+    if cuerpo == 0:
+        raise ValidationError("El RUT debe estar en el formato 12345678-9.", code='formato_rut')
+    if verificar and digito_verificador(cuerpo) != dv:
+        raise ValidationError("El dígito verificador del RUT no es válido.", code='digito_rut')
+    return cuerpo, dv
+
+
+def formatear(cuerpo, dv=None):
+    """Forma canónica con que se guarda: sin puntos, con guion y K mayúscula."""
+    return f"{cuerpo}-{dv or digito_verificador(cuerpo)}"
+
+
+def normalizar(texto, verificar=True):
+    return formatear(*parsear(texto, verificar))
+
+
+def validar_rut(texto):
+    """Validador de formularios y modelos: formato reconocible y dígito verificador correcto."""
+    parsear(texto)
+    return texto
+
+
+def normalizar_usuario(username):
+    """
+    Nombre de usuario del personal en forma canónica. Los usuarios que no usan un RUT
+    (por ejemplo, administradores) se dejan tal cual.
+    """
+    try:
+        return normalizar(username, verificar=False)
+    except ValidationError:
+        return username
+
+
+def cuerpos_de_busqueda(texto):
+    """
+    Cuerpos de RUT con que filtrar listados por igualdad. Con guion (o espacio) antes del último
+    carácter, o con K, el RUT está completo y se verifica. Solo dígitos es ambiguo: se busca el
+    número como cuerpo y, si su último dígito es un verificador válido, también sin él.
+    Retorna una lista vacía si el texto no puede corresponder a ningún RUT.
+    """
+    texto = (texto or '').strip()
+    if _CON_DIGITO_VERIFICADOR.search(texto):
+        try:
+            return [parsear(texto)[0]]
+        except ValidationError:
+            return []
+    cuerpos = []
+    limpio = texto.replace('.', '')
+    if limpio.isdigit() and len(limpio) <= 9 and int(limpio):
+        cuerpos.append(int(limpio))
+    try:
+        cuerpos.insert(0, parsear(limpio)[0])
+    except ValidationError:
+        pass
+    return cuerpos
@@ -1,4 +1,6 @@
-from .models import Reserva, Notificacion
+from .consultas import reservas_en_rango
+from .models import Notificacion
+from .sedes import en_cada_sede
 from apscheduler.schedulers.background import BackgroundScheduler
 from django.utils.timezone import now, localtime
 from datetime import timedelta
@@ -8,17 +10,16 @@ logger = logging.getLogger(__name__)
 
 from django.db import IntegrityError
 
+@en_cada_sede
 def enviar_notificaciones_programadas():
     hora_actual = localtime(now())  # Hora local
     logger.info(f"Ejecutando notificaciones. Hora actual: {hora_actual}")
 
-    reservas = Reserva.objects.filter(
-        fecha_reserva__fecha_disponible__range=[
-            hora_actual - timedelta(minutes=1),
-            hora_actual + timedelta(minutes=5)
-        ]
+    reservas = list(
+        reservas_en_rango(hora_actual - timedelta(minutes=1), hora_actual + timedelta(minutes=5, seconds=1))
+        .select_related('paciente', 'medico__user', 'fecha_reserva')
     )
-    logger.info(f"Total reservas encontradas: {reservas.count()}")
+    logger.info(f"Total reservas encontradas: {len(reservas)}")
 
     for reserva in reservas:
         tiempo_restante = reserva.fecha_reserva.fecha_disponible - hora_actual
@@ -49,9 +50,25 @@ def enviar_notificaciones_programadas():
             logger.error(f"Error al crear notificación: {e}")
 
 
+@en_cada_sede
+def precalentar_agendas():
+    from .agenda import calentar_agendas
+    calentar_agendas()
+
+
+@en_cada_sede
+def expirar_ofertas_lista_espera():
+    from .lista_espera import expirar_ofertas
+    expirar_ofertas()
+
+
 def iniciar_scheduler():
     scheduler = BackgroundScheduler()
     scheduler.add_job(enviar_notificaciones_programadas, 'interval', seconds=10)
   # Corre cada 30 segundos
+    # Agenda diaria de cada médico lista antes de la apertura
+    scheduler.add_job(precalentar_agendas, 'cron', hour=6, minute=30)
+    # Bloques retenidos para la lista de espera que nadie confirmó
+    scheduler.add_job(expirar_ofertas_lista_espera, 'interval', minutes=1)
     scheduler.start()
     logger.info("Scheduler iniciado para enviar notificaciones programadas.")
@@ -0,0 +1,207 @@
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Especialidad, Medico, Paciente, Sede
+from .utils import en_sede, sede_activa
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+_config = getattr(settings, 'SEDES', {})
+# Código de sede -> alias de su base (settings.py los arma desde DATABASE_URL_SEDE_<CODIGO>).
+# Las sedes que no están aquí usan 'default'.
+BASES = _config.get('BASES', {})
+TAMANO_LOTE = _config.get('TAMANO_LOTE_REPLICACION', 1000)
+
+# Tablas que se guardan en la base de su sede. Las que no tienen columna sede (revisiones,
+# recordatorios) siguen a su ficha o reserva a través de la sede activa.
+MODELOS_POR_SEDE = {
+    'ficha_medica.disponibilidad', 'ficha_medica.reserva', 'ficha_medica.fichamedica',
+    'ficha_medica.revisionfichamedica', 'ficha_medica.listaespera', 'ficha_medica.recordatorio',
+    'ficha_medica.disponibilidadarchivo', 'ficha_medica.reservaarchivo',
+}
+# Catálogos compartidos: se escriben en 'default' y se copian a cada base de sede para que los
+# joins de las tablas de la sede (paciente, médico, usuario) se resuelvan en su propia base.
+# En orden de dependencia.
+CATALOGOS = (User, Sede, Especialidad, Paciente, Medico)
+
+_codigos = {}  # sede_id -> código, cargado al primer uso
+
+
+def codigos_de_sedes():
+    if not _codigos:
+        _codigos.update(Sede.objects.using(DEFAULT_DB_ALIAS).values_list('id', 'codigo'))
+    return _codigos
+
+
+def alias_de_sede(sede_id):
+    """Alias de la base de la sede; 'default' si no tiene una propia o si `sede_id` es None."""
+    if sede_id is None or not BASES:
+        return DEFAULT_DB_ALIAS
+    codigo = codigos_de_sedes().get(sede_id)
+    if codigo is None:
+        _codigos.clear()  # Sede creada en otro proceso
+        codigo = codigos_de_sedes().get(sede_id)
+    return BASES.get(codigo, DEFAULT_DB_ALIAS)
+
+
+def bases_de_sedes():
+    """Alias de las bases propias de las sedes (sin 'default')."""
+    return sorted(set(BASES.values()) - {DEFAULT_DB_ALIAS})
+
+
+class RouterSedes:
+    """
+    Envía las tablas de MODELOS_POR_SEDE a la base de la sede de la fila o, si no se conoce
+    (consultas, filas nuevas sin sede), a la de la sede activa. Todo lo demás va a 'default'.
+    Todas las bases tienen el esquema completo: se migran con `migrate --database=<alias>`.
+    """
+
+    def _base(self, model, instance=None):
+        if model._meta.label_lower not in MODELOS_POR_SEDE:
+            return DEFAULT_DB_ALIAS
+        if instance is not None:
+            # La instancia puede ser la fila o, en un manager relacionado, su médico o ficha
+            sede_id = getattr(instance, 'sede_id', None)
+            if sede_id is not None:
+                return alias_de_sede(sede_id)
+            if instance._meta.label_lower in MODELOS_POR_SEDE and instance._state.db:
+                return instance._state.db
+        return alias_de_sede(sede_activa())
+
+    def db_for_read(self, model, **hints):
+        return self._base(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._base(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Una reserva en la base de su sede apunta a su paciente y médico de 'default', copiados allí
+        return True
+
+
+def sede_de_usuario(user):
+    """Sede del médico o recepcionista; None para quien atiende todas (administración)."""
+    for perfil in ('medico', 'recepcionista'):
+        sede_id = getattr(getattr(user, perfil, None), 'sede_id', None)
+        if sede_id is not None:
+            return sede_id
+    return None
+
+
+class SedeMiddleware:
+    """Atiende cada petición con la sede del usuario activa. Va después de AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with en_sede(sede_de_usuario(request.user)):
+            return self.get_response(request)
+
+
+def en_cada_sede(funcion):
+    """
+    Para trabajos periódicos: sin una sede activa la función se ejecuta una vez por sede, con esa
+    sede activa (sus consultas usan los índices que empiezan por sede y su base); con una sede
+    activa, solo para ella. Un error en una sede no impide procesar las demás: se relanza al final.
+    Retorna los resultados por código de sede.
+    """
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        if sede_activa() is not None:
+            return funcion(*args, **kwargs)
+        resultados, error = {}, None
+        for sede_id, codigo in Sede.objects.order_by('id').values_list('id', 'codigo'):
+            with en_sede(sede_id):
+                try:
+                    resultados[codigo] = funcion(*args, **kwargs)
+                except Exception as e:
+                    logger.exception(f"{funcion.__name__} falló en la sede {codigo}.")
+                    error = error or e
+        if error is not None:
+            raise error
+        return resultados
+    return envoltura
+
+
+def replicar(modelo, ids=None):
+    """
+    Copia de 'default' a cada base de sede las filas del catálogo (todas o las de `ids`): actualiza
+    las que ya están e inserta las nuevas, en lotes. Retorna cuántas filas se copiaron por base.
+    """
+    campos = [campo.attname for campo in modelo._meta.concrete_fields]
+    actualizables = [campo.name for campo in modelo._meta.concrete_fields if not campo.primary_key]
+    origen = modelo._base_manager.using(DEFAULT_DB_ALIAS).order_by('pk')
+    if ids is not None:
+        origen = origen.filter(pk__in=ids)
+
+    def _escribir(destino, lote):
+        existentes = set(destino.filter(pk__in=[fila.pk for fila in lote]).values_list('pk', flat=True))
+        destino.bulk_update([fila for fila in lote if fila.pk in existentes], actualizables, batch_size=TAMANO_LOTE)
+        destino.bulk_create([fila for fila in lote if fila.pk not in existentes], batch_size=TAMANO_LOTE)
+
+    copiadas = {}
+    for alias in bases_de_sedes():
+        destino = modelo._base_manager.using(alias)
+        copiadas[alias] = 0
+        with transaction.atomic(using=alias):
+            lote = []
+            for valores in origen.values_list(*campos).iterator(chunk_size=TAMANO_LOTE):
+                lote.append(modelo(**dict(zip(campos, valores))))
+                if len(lote) == TAMANO_LOTE:
+                    _escribir(destino, lote)
+                    copiadas[alias] += len(lote)
+                    lote = []
+            if lote:
+                _escribir(destino, lote)
+                copiadas[alias] += len(lote)
+    return copiadas
+
+
+def eliminar_replicas(modelo, ids):
+    """Elimina las copias en las bases de sede; la eliminación en cascada ocurre en cada una."""
+    for alias in bases_de_sedes():
+        modelo._base_manager.using(alias).filter(pk__in=ids).delete()
+
+
+def _replicar_al_confirmar(operacion, modelo, pk):
+    def _ejecutar():
+        try:
+            operacion(modelo, [pk])
+        except Exception as e:
+            # La copia queda desactualizada hasta la siguiente modificación o `replicar_catalogos`
+            logger.error(f"No se pudo replicar {modelo._meta.label} {pk} en las bases de sede: {e}")
+    transaction.on_commit(_ejecutar, using=DEFAULT_DB_ALIAS)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Sede)
+@receiver(post_save, sender=Especialidad)
+@receiver(post_save, sender=Paciente)
+@receiver(post_save, sender=Medico)
+def replicar_catalogo(sender, instance, using, **kwargs):
+    if sender is Sede:
+        _codigos.clear()
+    if bases_de_sedes() and using == DEFAULT_DB_ALIAS:
+        _replicar_al_confirmar(replicar, sender, instance.pk)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Sede)
+@receiver(post_delete, sender=Especialidad)
+@receiver(post_delete, sender=Paciente)
+@receiver(post_delete, sender=Medico)
+def eliminar_replica_de_catalogo(sender, instance, using, **kwargs):
+    if sender is Sede:
+        _codigos.clear()
+    if bases_de_sedes() and using == DEFAULT_DB_ALIAS:
+        _replicar_al_confirmar(eliminar_replicas, sender, instance.pk)
@@ -0,0 +1,144 @@
+from datetime import timezone
+
+from django.db.models import CharField, Value
+from django.db.models.functions import Concat
+from django.http import HttpResponse
+from django.utils.timezone import get_current_timezone
+
+import json
+
+try:
+    import orjson
+except ImportError:  # Opcional: sin orjson se usa el codificador en C de la biblioteca estándar
+    orjson = None
+
+
+def codificar(data):
+    """
+    JSON en bytes. Las filas de un Esquema solo contienen str, int, float, bool y None,
+    así que no hace falta DjangoJSONEncoder ni llamar a `default` por cada valor.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def responder_json(data, status=200):
+    """Equivalente a JsonResponse(data, safe=False) por el camino rápido de codificar()."""
+    return HttpResponse(codificar(data), content_type='application/json', status=status)
+
+
+class ConversorLocal:
+    """
+    Convierte a la zona horaria local las fechas UTC que entrega la base de datos.
+    El desfase se calcula una vez por hora UTC (los cambios de horario ocurren en horas exactas)
+    y cada texto formateado se reutiliza si el mismo instante se repite en la respuesta.
+    """
+
+    def __init__(self, zona=None):
+        self.zona = zona or get_current_timezone()
+        self._desfases = {}
+        self._textos = {}
+
+    def local(self, valor):
+        hora = valor.timestamp() // 3600
+        desfase = self._desfases.get(hora)
+        if desfase is None:
+            desplazamiento = valor.astimezone(self.zona).utcoffset()
+            desfase = self._desfases[hora] = (desplazamiento, timezone(desplazamiento))
+        return (valor + desfase[0]).replace(tzinfo=desfase[1])
+
+    def formateador(self, formato):
+        textos = self._textos.setdefault(formato, {})
+
+        def formatear(valor):
+            if valor is None:
+                return None
+            texto = textos.get(valor)
+            if texto is None:
+                texto = textos[valor] = formato(self.local(valor))
+            return texto
+        return formatear
+
+
+# Formatos de fecha comunes a todos los endpoints (hora local)
+def fecha_hora(local):
+    return f"{local.day:02d}/{local.month:02d}/{local.year} {local.hour:02d}:{local.minute:02d}"
+
+
+def hora(local):
+    return f"{local.hour:02d}:{local.minute:02d}"
+
+
+def iso(local):
+    return local.isoformat(timespec='seconds')
+
+
+def iso_utc(local):
+    """El formato de DjangoJSONEncoder, que usaban los endpoints antiguos: UTC, milisegundos y 'Z'."""
+    utc = local.astimezone(timezone.utc)
+    return utc.isoformat(timespec='milliseconds' if utc.microsecond else 'seconds')[:-6] + 'Z'
+
+
+class Esquema:
+    """
+    Proyección declarativa de un queryset a filas JSON. Cada campo de salida es un lookup
+    ('paciente__nombre'), una expresión evaluada en la base de datos o un par
+    (lookup, formato) para fechas, que se convierten a hora local al serializar:
+
+        DISPONIBILIDAD = Esquema(id='id', fecha_hora=('fecha_disponible', fecha_hora))
+
+    Los joins los resuelve la consulta con values_list(); no se instancian modelos.
+    """
+
+    def __init__(self, **campos):
+        self.nombres = tuple(campos)
+        self.columnas = []
+        self.expresiones = {}
+        self.formatos = {}
+        for nombre, definicion in campos.items():
+            if isinstance(definicion, tuple):
+                definicion, self.formatos[nombre] = definicion
+            if isinstance(definicion, str):
+                self.columnas.append(definicion)
+            else:
+                alias = f"_{nombre}"
+                self.expresiones[alias] = definicion
+                self.columnas.append(alias)
+
+    def filas(self, queryset):
+        if self.expresiones:
+            queryset = queryset.annotate(**self.expresiones)
+        resultado = queryset.values_list(*self.columnas)
+        nombres = self.nombres
+        if not self.formatos:
+            return [dict(zip(nombres, fila)) for fila in resultado]
+
+        conversor = ConversorLocal()
+        formateadores = [
+            (nombres.index(nombre), conversor.formateador(formato)) for nombre, formato in self.formatos.items()
+        ]
+        filas = []
+        for fila in resultado:
+            fila = list(fila)
+            for posicion, formatear in formateadores:
+                fila[posicion] = formatear(fila[posicion])
+            filas.append(dict(zip(nombres, fila)))
+        return filas
+
+
+def nombre_completo(prefijo=''):
+    """Nombre y apellido del usuario concatenados en la base de datos."""
+    return Concat(f'{prefijo}first_name', Value(' '), f'{prefijo}last_name', output_field=CharField())
+
+
+# Esquemas de los endpoints JSON. Una misma entidad se entrega con las mismas claves en todos ellos.
+MEDICO = Esquema(id='id', nombre=nombre_completo('user__'))
+DISPONIBILIDAD = Esquema(id='id', fecha_hora=('fecha_disponible', fecha_hora))
+RESERVA_ACTIVA = Esquema(id='id', paciente='paciente__nombre', hora=('fecha_reserva__fecha_disponible', hora))
+NOTIFICACION = Esquema(id='id', mensaje='mensaje', fecha_creacion=('fecha_creacion', iso_utc))
+RESERVA = Esquema(
+    id='id', paciente_id='paciente_id', paciente='paciente__nombre', medico_id='medico_id',
+    especialidad_id='especialidad_id', inicio=('fecha_reserva__fecha_disponible', iso),
+    duracion='fecha_reserva__duracion', motivo='motivo', actualizado_en=('actualizado_en', iso),
+)
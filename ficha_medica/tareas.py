@@ -0,0 +1,198 @@
+from collections import namedtuple
+from datetime import timedelta
+import random
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils.timezone import localtime, now
+
+from .consultas import consulta_critica
+from .models import Tarea
+from .utils import en_sede, sede_activa
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'TAREAS', {})
+COLAS = _config.get('COLAS', {'default': 1})
+INTERVALO = _config.get('INTERVALO', 1.0)
+ESPERA_BASE = _config.get('ESPERA_BASE', 10)
+ESPERA_MAXIMA = _config.get('ESPERA_MAXIMA', 3600)
+TIEMPO_MAXIMO = _config.get('TIEMPO_MAXIMO', 300)
+DIAS_RETENCION = _config.get('DIAS_RETENCION', 7)
+PERIODICAS_EN_WORKERS = _config.get('PERIODICAS_EN_WORKERS', False)
+
+# Registro de tareas: nombre -> DefinicionTarea. Las funciones se registran con @tarea
+# en ficha_medica/trabajos.py, que la app importa en ready().
+TAREAS = {}
+DefinicionTarea = namedtuple('DefinicionTarea', 'funcion cola prioridad max_intentos tiempo_maximo')
+# Tarea que run_workers encola sola: cada `cada` (timedelta) o una vez al día desde `hora` (time)
+Periodica = namedtuple('Periodica', 'nombre cada hora', defaults=(None, None))
+
+
+def tarea(nombre, cola='default', prioridad=0, max_intentos=5, tiempo_maximo=None):
+    """
+    Registra una función como tarea. Los argumentos se guardan como JSON, así que deben ser
+    valores simples (ids, textos, fechas en ISO). Lo que retorne se guarda en Tarea.resultado.
+    La función queda con un método `encolar(**argumentos)`.
+    """
+    def decorator(funcion):
+        if nombre in TAREAS:
+            raise ValueError(f"La tarea '{nombre}' ya está registrada.")
+        TAREAS[nombre] = DefinicionTarea(funcion, cola, prioridad, max_intentos, tiempo_maximo or TIEMPO_MAXIMO)
+        funcion.encolar = lambda **argumentos: encolar(nombre, argumentos)
+        return funcion
+    return decorator
+
+
+def encolar(nombre, argumentos=None, prioridad=None, ejecutar_desde=None, clave=None, usuario=None):
+    """
+    Agrega una tarea a su cola. Dentro de una transacción queda encolada solo si esta se confirma.
+    Se ejecuta con la sede activa al encolarla (la del usuario que la pidió). Con `clave`, una tarea con la misma clave ya existente hace que no se encole otra (retorna None).
+    """
+    definicion = TAREAS[nombre]
+    nueva = Tarea(
+        nombre=nombre,
+        cola=definicion.cola,
+        argumentos=argumentos or {},
+        prioridad=definicion.prioridad if prioridad is None else prioridad,
+        max_intentos=definicion.max_intentos,
+        ejecutar_desde=ejecutar_desde or now(),
+        clave=clave,
+        creada_por=usuario,
+        sede_id=sede_activa(),
+    )
+    try:
+        # El savepoint permite seguir usando la transacción externa si la clave ya existe
+        with transaction.atomic(using=router.db_for_write(Tarea)):
+            nueva.save()
+    except IntegrityError:
+        if clave is None:
+            raise
+        return None
+    return nueva
+
+
+@consulta_critica('tareas_pendientes', ejemplo=lambda: {'cola': 'default', 'ahora': now()})
+def pendientes(cola, ahora):
+    """Tareas listas para ejecutarse en una cola, en el orden en que se toman."""
+    return (
+        Tarea.objects.filter(cola=cola, estado=Tarea.PENDIENTE, ejecutar_desde__lte=ahora)
+        .order_by('-prioridad', 'ejecutar_desde', 'id')
+    )
+
+
+def tomar(cola, trabajador):
+    """
+    Toma la siguiente tarea de la cola y la marca en curso. En PostgreSQL las filas bloqueadas por
+    otro trabajador se saltan (SKIP LOCKED); en SQLite la escritura ya está serializada y el UPDATE
+    condicionado al estado evita que dos trabajadores tomen la misma. Retorna None si no hay.
+    """
+    ahora = now()
+    alias = router.db_for_write(Tarea)
+    with transaction.atomic(using=alias):
+        candidatas = pendientes(cola, ahora)
+        if connections[alias].features.has_select_for_update_skip_locked:
+            candidatas = candidatas.select_for_update(skip_locked=True)
+        siguiente = candidatas.values_list('id', 'nombre').first()
+        if siguiente is None:
+            return None
+        tarea_id, nombre = siguiente
+        definicion = TAREAS.get(nombre)
+        limite = ahora + timedelta(seconds=definicion.tiempo_maximo if definicion else TIEMPO_MAXIMO)
+        tomadas = Tarea.objects.filter(id=tarea_id, estado=Tarea.PENDIENTE).update(
+            estado=Tarea.EN_CURSO, tomada_por=trabajador, bloqueada_hasta=limite, intentos=F('intentos') + 1,
+        )
+    if not tomadas:
+        return None
+    return Tarea.objects.get(id=tarea_id)
+
+
+def espera_para_reintento(intentos):
+    """Espera exponencial con variación aleatoria, para que los reintentos no lleguen todos juntos."""
+    espera = min(ESPERA_BASE * 2 ** max(intentos - 1, 0), ESPERA_MAXIMA)
+    return timedelta(seconds=espera * random.uniform(0.75, 1.25))
+
+
+def ejecutar(tarea_tomada):
+    """Ejecuta una tarea tomada y registra su resultado, un reintento o el fallo definitivo."""
+    definicion = TAREAS.get(tarea_tomada.nombre)
+    # Solo el trabajador que la tiene puede cerrarla: si su plazo venció, otro pudo retomarla
+    propia = Tarea.objects.filter(id=tarea_tomada.id, estado=Tarea.EN_CURSO, tomada_por=tarea_tomada.tomada_por)
+    try:
+        if definicion is None:
+            raise LookupError(f"No hay una tarea registrada con el nombre '{tarea_tomada.nombre}'.")
+        with en_sede(tarea_tomada.sede_id):
+            resultado = definicion.funcion(**tarea_tomada.argumentos)
+    except Exception:
+        error = traceback.format_exc()
+        if tarea_tomada.intentos < tarea_tomada.max_intentos:
+            propia.update(
+                estado=Tarea.PENDIENTE, error=error, bloqueada_hasta=None,
+                ejecutar_desde=now() + espera_para_reintento(tarea_tomada.intentos),
+            )
+            logger.warning(f"Tarea {tarea_tomada.id} ({tarea_tomada.nombre}) falló en el intento {tarea_tomada.intentos}; se reintentará.")
+        else:
+            propia.update(estado=Tarea.FALLIDA, error=error, bloqueada_hasta=None, terminada_en=now())
+            logger.error(f"Tarea {tarea_tomada.id} ({tarea_tomada.nombre}) falló definitivamente:\n{error}")
+        return False
+    propia.update(estado=Tarea.COMPLETADA, resultado=resultado, error='', bloqueada_hasta=None, terminada_en=now())
+    return True
+
+
+def recuperar_vencidas():
+    """
+    Devuelve a la cola las tareas en curso cuyo trabajador no terminó a tiempo (murió o se reinició).
+    Las que ya agotaron sus intentos quedan fallidas. Retorna la cantidad recuperada.
+    """
+    vencidas = Tarea.objects.filter(estado=Tarea.EN_CURSO, bloqueada_hasta__lt=now())
+    vencidas.filter(intentos__gte=F('max_intentos')).update(
+        estado=Tarea.FALLIDA, error="El trabajador no terminó la tarea en el tiempo máximo.", terminada_en=now(),
+    )
+    recuperadas = vencidas.update(estado=Tarea.PENDIENTE, tomada_por='', bloqueada_hasta=None, ejecutar_desde=now())
+    if recuperadas:
+        logger.warning(f"{recuperadas} tareas vencidas vuelven a la cola.")
+    return recuperadas
+
+
+def procesar_pendientes(colas=None, trabajador='local', maximo=None):
+    """
+    Ejecuta en este proceso las tareas listas de las colas indicadas hasta vaciarlas.
+    Lo usa run_workers --una-vez (por ejemplo desde un cron) y las pruebas. Retorna cuántas ejecutó.
+    """
+    ejecutadas = 0
+    for cola in colas or COLAS:
+        while maximo is None or ejecutadas < maximo:
+            tomada = tomar(cola, trabajador)
+            if tomada is None:
+                break
+            ejecutar(tomada)
+            ejecutadas += 1
+    return ejecutadas
+
+
+_ultimos_intervalos = {}
+
+
+def programar_periodicas(periodicas, ahora=None):
+    """
+    Encola cada tarea periódica una vez por intervalo. La clave de la tarea identifica el intervalo,
+    así que varios servidores de workers pueden llamar a esta función sin duplicar trabajo.
+    """
+    ahora = ahora or now()
+    for periodica in periodicas:
+        if periodica.hora is not None:
+            local = localtime(ahora)
+            if local.time() < periodica.hora:
+                continue
+            intervalo = local.date().isoformat()
+        else:
+            intervalo = int(ahora.timestamp() // periodica.cada.total_seconds())
+        # Sin consultar la base de datos si este proceso ya encoló el intervalo
+        if _ultimos_intervalos.get(periodica.nombre) == intervalo:
+            continue
+        encolar(periodica.nombre, clave=f"periodica:{periodica.nombre}:{intervalo}")
+        _ultimos_intervalos[periodica.nombre] = intervalo
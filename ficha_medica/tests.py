@@ -1,3 +1,1513 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+from unittest import mock
+import hashlib
+import os
+import re
+import smtplib
+import subprocess
+import sys
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, QuerySet
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import localdate, localtime, make_aware, now
+
+from core import audit
+from core.models import UserActivity
+from ficha_medica import analytics, calendario, cambios, limites, recordatorios, tareas
+from ficha_medica.admin import PaginadorEstimado
+from ficha_medica.agenda import calentar_agendas, obtener_agenda
+from ficha_medica.archivo import archivar_agenda, consultar_reservas, mes_de, resumen_ocupacion
+from ficha_medica.arranque import es_proceso_servidor, precalentar_plantillas
+from ficha_medica.auth import CachedModelBackend
+from ficha_medica.cache import CacheLocal, cache_en_niveles
+from ficha_medica.consultas import CONSULTAS_CRITICAS
+from ficha_medica.disponibilidades import Intervalo, crear_disponibilidades, detectar_solapamientos, validar_disponibilidades
+from ficha_medica.linea_tiempo import FUENTES, codificar_cursor, construir_pagina, decodificar_cursor, obtener_linea_tiempo
+from ficha_medica.lista_espera import ANTICIPACION, RETENCION, confirmar_oferta, expirar_ofertas, ofrecer_bloque, rechazar_oferta
+from ficha_medica.models import (
+    DURACION_MAXIMA_DISPONIBILIDAD, CambioReserva, Disponibilidad, DisponibilidadArchivo, Especialidad, FichaMedica,
+    ListaEspera, Medico, Notificacion, Paciente, Recepcionista, Recordatorio, Reserva, ReservaArchivo, RevisionFichaMedica, Sede,
+    Tarea,
+)
+from ficha_medica.reprogramacion import cancelar_reservas, reprogramar_reservas
+from ficha_medica.revisiones import INTERVALO_COMPLETA, aplicar_delta, calcular_delta, contenido_de, historial, reconstruir
+from ficha_medica.rut import cuerpos_de_busqueda, digito_verificador, formatear, normalizar, parsear
+from ficha_medica.serializacion import DISPONIBILIDAD, MEDICO
+from ficha_medica.sedes import SedeMiddleware, en_cada_sede
+from ficha_medica.utils import en_sede, sede_activa
+from ficha_medica.views import filtrar_por_rut
+
+# Importar los módulos registra sus consultas críticas
+import ficha_medica.agenda  # noqa: F401
+import ficha_medica.archivo  # noqa: F401
+import ficha_medica.calendario  # noqa: F401
+import ficha_medica.cambios  # noqa: F401
+import ficha_medica.linea_tiempo  # noqa: F401
+import ficha_medica.lista_espera  # noqa: F401
+import ficha_medica.recordatorios  # noqa: F401
+import ficha_medica.tareas  # noqa: F401
+
+
+# Tablas que en producción crecen sin límite: un recorrido completo u ordenamiento en ellas es una regresión
+TABLAS_GRANDES = {
+    modelo._meta.db_table
+    for modelo in (
+        CambioReserva, Disponibilidad, DisponibilidadArchivo, FichaMedica, ListaEspera, Notificacion, Paciente, Recordatorio,
+        Reserva, ReservaArchivo, Tarea, UserActivity,
+    )
+}
+
+
+def plan_de(queryset):
+    """
+    Plan de ejecución del queryset. En PostgreSQL se desactivan los recorridos secuenciales y los
+    ordenamientos para que el planificador use un índice siempre que exista uno aplicable: con las
+    tablas vacías de las pruebas los elegiría aunque hubiera índice.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_sort = off")
+    return queryset.explain()
+
+
+def problemas_del_plan(plan, permitir_ordenamiento=False):
+    """Recorridos completos y ordenamientos en tabla temporal sobre tablas grandes."""
+    problemas = []
+    if connection.vendor == 'sqlite':
+        for linea in plan.splitlines():
+            recorrido = re.search(r'\bSCAN (\w+)(.*)', linea)
+            if recorrido and recorrido.group(1) in TABLAS_GRANDES and 'USING' not in recorrido.group(2):
+                problemas.append(linea.strip())
+            if 'USE TEMP B-TREE' in linea and not permitir_ordenamiento:
+                problemas.append(linea.strip())
+    elif connection.vendor == 'postgresql':
+        for linea in plan.splitlines():
+            recorrido = re.search(r'Seq Scan on (\w+)', linea)
+            if recorrido and recorrido.group(1) in TABLAS_GRANDES:
+                problemas.append(linea.strip())
+            if re.search(r'->\s+Sort\b|^\s*Sort\b', linea) and not permitir_ordenamiento:
+                problemas.append(linea.strip())
+    return problemas
+
+
+def a_hora_local(dia, hora, minutos=0):
+    return make_aware(datetime.combine(dia, time(hora, minutos)))
+
+
+class DisponibilidadesTest(TestCase):
+    """Bloques con duración, únicos por médico, y validación de solapamientos por lote."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medico = Medico.objects.create(
+            user=User.objects.create_user(formatear(10_000)), especialidad=Especialidad.objects.create(nombre='Medicina General'),
+        )
+        cls.lunes = date(2026, 11, 2)
+        Disponibilidad.objects.create(medico=cls.medico, fecha_disponible=a_hora_local(cls.lunes, 10), duracion=60)
+
+    def test_detectar_solapamientos(self):
+        def intervalo(hora, minutos, ref):
+            inicio = a_hora_local(self.lunes, hora)
+            return Intervalo(inicio, inicio + timedelta(minutes=minutos), ref)
+
+        existentes = [intervalo(10, 60, 'existente')]
+        # Bloques contiguos no se solapan
+        self.assertEqual(detectar_solapamientos([intervalo(9, 60, 0), intervalo(11, 30, 1)], existentes), [])
+        self.assertEqual(detectar_solapamientos([intervalo(10, 30, 0)], existentes), [(0, 'existente')])
+        # Un nuevo que contiene a un existente y dos nuevos que se solapan entre sí
+        self.assertEqual(detectar_solapamientos([intervalo(9, 180, 0)], existentes), [(0, 'existente')])
+        self.assertEqual(detectar_solapamientos([intervalo(14, 60, 0), intervalo(14, 30, 1)], existentes), [(1, 0)])
+
+    def test_crear_lote(self):
+        creadas = crear_disponibilidades(self.medico, [(a_hora_local(self.lunes, 11), 30), (a_hora_local(self.lunes, 11, 30), 30)])
+        self.assertEqual(len(creadas), 2)
+        self.assertEqual(Disponibilidad.objects.filter(medico=self.medico).count(), 3)
+
+    def test_lote_con_solapamiento_no_crea_nada(self):
+        with self.assertRaises(ValidationError) as error:
+            crear_disponibilidades(self.medico, [(a_hora_local(self.lunes, 8), 30), (a_hora_local(self.lunes, 10, 30), 30)])
+        self.assertEqual(error.exception.code, 'solapamiento')
+        self.assertIn('02/11/2026 10:30', error.exception.messages[0])
+        self.assertEqual(Disponibilidad.objects.filter(medico=self.medico).count(), 1)
+        # Al modificar un bloque se excluye a sí mismo de la comparación
+        bloque = Disponibilidad.objects.get()
+        validar_disponibilidades(self.medico, [(a_hora_local(self.lunes, 10, 30), 60)], excluir_ids=[bloque.id])
+
+    def test_duracion_y_unicidad(self):
+        bloque = Disponibilidad(medico=self.medico, fecha_disponible=a_hora_local(self.lunes, 16), duracion=DURACION_MAXIMA_DISPONIBILIDAD + 1)
+        with self.assertRaises(ValidationError):
+            bloque.full_clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Disponibilidad.objects.create(medico=self.medico, fecha_disponible=a_hora_local(self.lunes, 10), duracion=30)
+
+
+class CohortesTest(TestCase):
+    """Grupos etarios, cruce con especialidades y visitas por paciente, agregados en la base."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hoy = date(2026, 10, 19)
+        cardiologia = Especialidad.objects.create(nombre='Cardiología')
+        general = Especialidad.objects.create(nombre='Medicina General')
+        medico = Medico.objects.create(user=User.objects.create_user(formatear(11_000)), especialidad=general)
+        nacimientos = [date(2008, 10, 19), date(2008, 10, 20), date(1950, 1, 1), None]  # 18 años justos, 17, 76, sin fecha
+        cls.pacientes = [
+            Paciente.objects.create(rut=formatear(11_000_000 + i), nombre=f"Paciente {i}", fecha_nacimiento=nacimiento)
+            for i, nacimiento in enumerate(nacimientos)
+        ]
+        # Reservas: tres del paciente de 18 años (una en cardiología), una del de 76
+        for i, (paciente, especialidad) in enumerate([(0, general), (0, general), (0, cardiologia), (2, general)]):
+            bloque = Disponibilidad.objects.create(medico=medico, fecha_disponible=now() + timedelta(days=1, hours=i), ocupada=True)
+            Reserva.objects.create(
+                paciente=cls.pacientes[paciente], especialidad=especialidad, medico=medico, fecha_reserva=bloque, motivo='Control',
+            )
+
+    def test_restar_anios(self):
+        self.assertEqual(analytics.restar_anios(date(2024, 2, 29), 1), date(2023, 2, 28))
+        self.assertEqual(analytics.restar_anios(date(2026, 10, 19), 18), date(2008, 10, 19))
+
+    def test_pacientes_por_grupo(self):
+        with self.assertNumQueries(1):
+            grupos = analytics.pacientes_por_grupo_etario(hoy=self.hoy)
+        self.assertEqual(grupos, {'0-17': 1, '18-29': 1, '30-44': 0, '45-59': 0, '60-74': 0, '75+': 1, 'Sin registro': 1})
+
+    def test_reservas_por_especialidad_y_grupo(self):
+        cruce = analytics.reservas_por_especialidad_y_grupo(hoy=self.hoy)
+        self.assertEqual(cruce['especialidades'], ['Cardiología', 'Medicina General'])
+        self.assertEqual(cruce['matriz'][:, cruce['grupos'].index('18-29')].tolist(), [1, 2])
+        self.assertEqual(cruce['matriz'][1, cruce['grupos'].index('75+')], 1)
+        self.assertEqual(cruce['matriz'].sum(), 4)
+
+    def test_visitas_y_frecuentes(self):
+        visitas = analytics.visitas_por_paciente(maximo=2)
+        # Dos pacientes sin reservas, uno con una y uno con tres (acumulado en el último casillero)
+        self.assertEqual(visitas['pacientes'].tolist(), [2, 1, 1])
+        self.assertEqual(visitas['promedio'], 1.0)
+        frecuentes = analytics.pacientes_frecuentes(limite=1)
+        self.assertEqual([(fila['nombre'], fila['visitas']) for fila in frecuentes], [('Paciente 0', 3)])
+
+
+class AgendaDiariaTest(TestCase):
+    """La agenda del día de cada médico se sirve desde caché y se reconstruye al cambiar sus reservas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(user=User.objects.create_user(formatear(12_000)), especialidad=cls.especialidad)
+        cls.otro = Medico.objects.create(user=User.objects.create_user(formatear(12_001)), especialidad=cls.especialidad)
+        cls.paciente = Paciente.objects.create(rut=formatear(12_000_000), nombre='Paciente')
+        cls.dia = localdate() + timedelta(days=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def reservar(self, hora, motivo):
+        bloque = Disponibilidad.objects.create(medico=self.medico, fecha_disponible=a_hora_local(self.dia, hora), ocupada=True)
+        return Reserva.objects.create(
+            paciente=self.paciente, especialidad=self.especialidad, medico=self.medico, fecha_reserva=bloque, motivo=motivo,
+        )
+
+    def test_se_lee_de_la_cache(self):
+        self.reservar(11, 'segunda')
+        self.reservar(9, 'primera')
+        with self.assertNumQueries(1):
+            agenda = obtener_agenda(self.medico.user_id, self.dia)
+        self.assertEqual([entrada['motivo'] for entrada in agenda], ['primera', 'segunda'])
+        with self.assertNumQueries(0):
+            obtener_agenda(self.medico.user_id, self.dia)
+
+    def test_cambios_actualizan_la_agenda_en_cache(self):
+        self.assertEqual(obtener_agenda(self.medico.user_id, self.dia), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva = self.reservar(9, 'control')
+        self.assertEqual([entrada['motivo'] for entrada in obtener_agenda(self.medico.user_id, self.dia)], ['control'])
+        # Mover el bloque reservado a otro día lo quita de este
+        with self.captureOnCommitCallbacks(execute=True):
+            bloque = reserva.fecha_reserva
+            bloque.fecha_disponible += timedelta(days=1)
+            bloque.save()
+        self.assertEqual(obtener_agenda(self.medico.user_id, self.dia), [])
+        siguiente = self.dia + timedelta(days=1)
+        self.assertEqual(len(obtener_agenda(self.medico.user_id, siguiente)), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Reserva.objects.get().delete()
+        self.assertEqual(obtener_agenda(self.medico.user_id, siguiente), [])
+
+    def test_calentar_agendas(self):
+        self.reservar(9, 'control')
+        with self.assertNumQueries(2):
+            self.assertEqual(calentar_agendas(self.dia), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(obtener_agenda(self.medico.user_id, self.dia)), 1)
+            self.assertEqual(obtener_agenda(self.otro.user_id, self.dia), [])
+
+
+class CacheEnNivelesTest(TestCase):
+    """L1 por proceso delante de la caché compartida, con claves versionadas por modelo."""
+
+    def setUp(self):
+        cache.clear()
+        cache_en_niveles.local.clear()
+
+    def test_cache_local_lru_y_expiracion(self):
+        local = CacheLocal(max_entradas=2, ttl=5)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)  # Sale 'b', la menos usada
+        self.assertEqual((local.get('a'), local.get('b'), local.get('c')), (1, None, 3))
+        local.set('d', 4, ttl=-1)  # Ya expirada
+        self.assertIsNone(local.get('d'))
+
+    def test_l1_entrega_copias(self):
+        cache_en_niveles.set('lista', [1])
+        cache_en_niveles.get('lista').append(2)
+        self.assertEqual(cache_en_niveles.get('lista'), [1])
+        # Sin L1 se lee de la compartida
+        cache_en_niveles.local.clear()
+        self.assertEqual(cache_en_niveles.get('lista'), [1])
+
+    def test_guardar_un_modelo_cambia_sus_claves(self):
+        clave = cache_en_niveles.clave('prueba', 'x', modelos=[Especialidad])
+        self.assertEqual(clave, cache_en_niveles.clave('prueba', 'x', modelos=[Especialidad]))
+        self.assertEqual(cache_en_niveles.clave('prueba', 'y' * 200).split(':')[-1], hashlib.sha1(('y' * 200).encode()).hexdigest())
+        Especialidad.objects.create(nombre='Pediatría')
+        cache_en_niveles.local.clear()  # Otro proceso vería la versión nueva al expirar su L1
+        self.assertNotEqual(cache_en_niveles.clave('prueba', 'x', modelos=[Especialidad]), clave)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_vista_cacheada(self):
+        especialidad = Especialidad.objects.create(nombre='Pediatría')
+        medico = Medico.objects.create(user=User.objects.create_user(formatear(13_000), first_name='Ana'), especialidad=especialidad)
+        url = f"/api/medicos/?especialidad_id={especialidad.id}"
+        self.assertEqual(len(self.client.get(url).json()), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json()[0]['id'], medico.id)
+        # Un médico nuevo invalida la respuesta; las respuestas de error no se guardan
+        Medico.objects.create(user=User.objects.create_user(formatear(13_001)), especialidad=especialidad)
+        cache_en_niveles.local.clear()
+        self.assertEqual(len(self.client.get(url).json()), 2)
+        self.assertEqual(self.client.get('/api/medicos/?especialidad_id=x').status_code, 400)
+        self.assertEqual(self.client.get('/api/medicos/?especialidad_id=x').status_code, 400)
+
+
+class PrincipalEnCacheTest(TestCase):
+    """El usuario de cada petición, con roles y perfil, se lee de la caché y se invalida al cambiar."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(formatear(14_000), first_name='Ana')
+        cls.user.groups.add(Group.objects.create(name='Medico'))
+        cls.medico = Medico.objects.create(user=cls.user, especialidad=Especialidad.objects.create(nombre='Medicina General'))
+
+    def setUp(self):
+        cache.clear()
+        cache_en_niveles.local.clear()
+        self.backend = CachedModelBackend()
+
+    def test_segunda_lectura_sin_consultas(self):
+        with self.assertNumQueries(2):
+            self.backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.user.pk)
+            self.assertEqual(user.roles, {'Medico'})
+            self.assertEqual(user.medico.especialidad.nombre, 'Medicina General')
+            self.assertFalse(hasattr(user, 'recepcionista'))
+
+    def test_cambios_del_usuario_invalidan(self):
+        self.backend.get_user(self.user.pk)
+        self.user.first_name = 'Ana María'
+        self.user.save()
+        self.assertEqual(self.backend.get_user(self.user.pk).first_name, 'Ana María')
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.backend.get_user(self.user.pk))
+
+    def test_cambios_de_grupos_invalidan(self):
+        self.backend.get_user(self.user.pk)
+        recepcion = Group.objects.create(name='Recepcionista')
+        self.user.groups.add(recepcion)
+        self.assertEqual(self.backend.get_user(self.user.pk).roles, {'Medico', 'Recepcionista'})
+        # Desde el lado del grupo: quitar miembros y vaciarlo
+        recepcion.user_set.remove(self.user)
+        self.assertEqual(self.backend.get_user(self.user.pk).roles, {'Medico'})
+        Group.objects.get(name='Medico').user_set.clear()
+        self.assertEqual(self.backend.get_user(self.user.pk).roles, set())
+
+    def test_cambio_de_perfil_invalida(self):
+        self.backend.get_user(self.user.pk)
+        self.medico.delete()
+        self.assertFalse(hasattr(self.backend.get_user(self.user.pk), 'medico'))
+
+    def test_invalidar_alcanza_a_otros_procesos(self):
+        self.backend.get_user(self.user.pk)
+        # La invalidación llega desde otro proceso: la L1 de este no se entera
+        with mock.patch.object(cache_en_niveles.local, 'delete'):
+            self.user.is_active = False
+            self.user.save()
+        self.assertIsNone(self.backend.get_user(self.user.pk))
+
+
+class ArranqueTest(TestCase):
+    """Solo los procesos que atienden peticiones arrancan servicios; lo pesado se importa al usarlo."""
+
+    def test_es_proceso_servidor(self):
+        casos = [
+            (['/venv/bin/gunicorn', 'centro_medico.wsgi'], {}, True),
+            (['manage.py', 'migrate'], {}, False),
+            (['manage.py', 'runserver'], {}, False),  # El proceso del autorecargador
+            (['manage.py', 'runserver'], {'RUN_MAIN': 'true'}, True),
+            (['manage.py', 'runserver', '--noreload'], {}, True),
+            (['manage.py', 'migrate'], {'INICIAR_SERVICIOS': '1'}, True),
+            (['/venv/bin/gunicorn'], {'INICIAR_SERVICIOS': 'no'}, False),
+        ]
+        for argv, entorno, esperado in casos:
+            with self.subTest(argv=argv, entorno=entorno), mock.patch.dict(os.environ, entorno):
+                for variable in {'RUN_MAIN', 'INICIAR_SERVICIOS'} - set(entorno):
+                    os.environ.pop(variable, None)
+                self.assertIs(es_proceso_servidor(argv), esperado)
+
+    def test_precalentar_plantillas(self):
+        self.assertGreater(precalentar_plantillas(), 10)
+
+    def test_reportlab_no_se_importa_al_arrancar(self):
+        codigo = "import sys, django; django.setup(); import ficha_medica.views; print('reportlab' in sys.modules)"
+        salida = subprocess.run(
+            [sys.executable, '-c', codigo], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'centro_medico.settings'},
+        )
+        self.assertEqual(salida.stdout.strip().splitlines()[-1], 'False')
+
+
+class RevisionesTest(TestCase):
+    """Historial de fichas con deltas por líneas y una revisión completa cada INTERVALO_COMPLETA."""
+
+    @classmethod
+    def setUpTestData(cls):
+        medico = Medico.objects.create(
+            user=User.objects.create_user(formatear(13_500)), especialidad=Especialidad.objects.create(nombre='Medicina General'),
+        )
+        cls.ficha = FichaMedica.objects.create(
+            paciente=Paciente.objects.create(rut=formatear(13_500_000), nombre='Paciente'), medico=medico,
+            diagnostico='Control\n', tratamiento=None, observaciones='',
+        )
+
+    def guardar(self, **campos):
+        for campo, valor in campos.items():
+            setattr(self.ficha, campo, valor)
+        self.ficha.save()
+        return contenido_de(self.ficha)
+
+    def test_delta_ida_y_vuelta(self):
+        anterior, nuevo = 'uno\ndos\ntres\n', 'uno\n2\ntres\ncuatro'
+        self.assertEqual(aplicar_delta(anterior, calcular_delta(anterior, nuevo)), nuevo)
+        self.assertEqual(aplicar_delta(None, calcular_delta(None, 'a\nb')), 'a\nb')
+
+    def test_reconstruir_cada_version(self):
+        versiones = [contenido_de(self.ficha)]
+        for i in range(1, INTERVALO_COMPLETA + 3):
+            versiones.append(self.guardar(diagnostico=f"Control\nEvolución {i}\n", observaciones='Nota\n' * (i % 3)))
+        revisiones = RevisionFichaMedica.objects.filter(ficha=self.ficha)
+        self.assertEqual(list(revisiones.filter(completa=True).values_list('numero', flat=True).order_by('numero')), [1, INTERVALO_COMPLETA + 1])
+        for numero, contenido in enumerate(versiones, start=1):
+            self.assertEqual(reconstruir(self.ficha.id, numero), contenido)
+        self.assertEqual(reconstruir(self.ficha.id), versiones[-1])
+        self.assertEqual([fila['numero'] for fila in historial(self.ficha.id)][:2], [len(versiones), len(versiones) - 1])
+
+    def test_nulo_y_cadena_vacia(self):
+        self.guardar(tratamiento='', observaciones=None)
+        self.guardar(tratamiento=None, observaciones='')
+        self.assertEqual(reconstruir(self.ficha.id, 2), {'diagnostico': 'Control\n', 'tratamiento': '', 'observaciones': None})
+        self.assertEqual(reconstruir(self.ficha.id, 3), {'diagnostico': 'Control\n', 'tratamiento': None, 'observaciones': ''})
+
+    def test_bloquea_la_ficha_antes_de_numerar(self):
+        bloqueadas = []
+        original = QuerySet.select_for_update
+
+        def espiar(queryset, *args, **kwargs):
+            bloqueadas.append(queryset.model)
+            return original(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', espiar), CaptureQueriesContext(connection) as consultas:
+            self.guardar(diagnostico='Alta\n')
+        self.assertEqual(bloqueadas, [FichaMedica])
+        if connection.features.has_select_for_update:
+            sql = [consulta['sql'] for consulta in consultas]
+            bloqueo = next(i for i, texto in enumerate(sql) if 'FOR UPDATE' in texto)
+            self.assertLess(bloqueo, next(i for i, texto in enumerate(sql) if 'MAX(' in texto))
+        # Una revisión confirmada por otra edición mientras esta esperaba no provoca un número repetido
+        ultima = RevisionFichaMedica.objects.filter(ficha=self.ficha).order_by('-numero').first()
+        RevisionFichaMedica.objects.create(ficha=self.ficha, numero=ultima.numero + 1, completa=True, datos=ultima.datos)
+        self.guardar(diagnostico='Control\n')
+        self.assertEqual(RevisionFichaMedica.objects.filter(ficha=self.ficha).count(), 4)
+
+    def test_sin_cambios_no_agrega_revision(self):
+        self.ficha.save()
+        self.assertEqual(RevisionFichaMedica.objects.filter(ficha=self.ficha).count(), 1)
+
+    def test_ficha_sin_historial(self):
+        # Fichas anteriores al historial: la primera revisión guarda el contenido previo completo
+        RevisionFichaMedica.objects.filter(ficha=self.ficha).delete()
+        anterior = contenido_de(self.ficha)
+        self.guardar(diagnostico='Alta\n')
+        self.assertEqual(reconstruir(self.ficha.id, 1), anterior)
+        self.assertEqual(reconstruir(self.ficha.id, 2)['diagnostico'], 'Alta\n')
+        self.assertIsNone(reconstruir(0))
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class FichaPdfTest(TestCase):
+    """La descarga del PDF de una ficha exige sesión y rol de médico, y queda auditada."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medico = Medico.objects.create(
+            user=User.objects.create_user(formatear(13_600)), especialidad=Especialidad.objects.create(nombre='Medicina General'),
+        )
+        cls.ficha = FichaMedica.objects.create(
+            paciente=Paciente.objects.create(rut=formatear(13_600_000), nombre='Paciente'), medico=cls.medico, diagnostico='Control',
+        )
+        cls.url = f'/ficha/{cls.ficha.id}/pdf/'
+
+    def test_sin_sesion_redirige_al_login(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertFalse(UserActivity.objects.exists())
+
+    def test_sin_rol_de_medico(self):
+        self.client.force_login(User.objects.create_user(formatear(13_601)))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_descarga_auditada(self):
+        self.client.force_login(self.medico.user)
+        with mock.patch.object(audit, 'EN_SEGUNDO_PLANO', False):
+            respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta['Content-Type'], 'application/pdf')
+        self.assertTrue(UserActivity.objects.filter(user=self.medico.user, accion='ver').exists())
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class LineaTiempoTest(TestCase):
+    """Reservas, fichas y notificaciones de un paciente mezcladas por fecha y paginadas con cursor."""
+
+    @classmethod
+    def setUpTestData(cls):
+        especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(user=User.objects.create_user(formatear(13_700)), especialidad=especialidad)
+        cls.paciente = Paciente.objects.create(rut=formatear(13_700_000), nombre='Paciente')
+        cls.dia = date(2026, 3, 2)
+        # Una reserva, una ficha y una notificación por hora, las tres con la misma fecha exacta
+        for hora in (9, 10, 11):
+            fecha = a_hora_local(cls.dia, hora)
+            bloque = Disponibilidad.objects.create(medico=cls.medico, fecha_disponible=fecha, ocupada=True)
+            Reserva.objects.create(
+                paciente=cls.paciente, especialidad=especialidad, medico=cls.medico, fecha_reserva=bloque, motivo=str(hora),
+            )
+            ficha = FichaMedica.objects.create(paciente=cls.paciente, medico=cls.medico, diagnostico=str(hora))
+            FichaMedica.objects.filter(pk=ficha.pk).update(fecha_creacion=fecha)
+            Notificacion.objects.create(usuario=cls.medico.user, paciente=cls.paciente, mensaje=str(hora), fecha_creacion=fecha)
+
+    def setUp(self):
+        cache.clear()
+        cache_en_niveles.local.clear()
+
+    def recorrer(self, tamano):
+        eventos, cursor = [], None
+        while True:
+            pagina = construir_pagina(self.paciente.id, cursor, tamano)
+            eventos += pagina['eventos']
+            if not pagina['siguiente']:
+                return eventos
+            cursor = decodificar_cursor(pagina['siguiente'])
+
+    def test_orden_y_paginas(self):
+        # Una consulta por fuente, sin importar cuántos eventos tenga el paciente
+        with self.assertNumQueries(len(FUENTES)):
+            completa = construir_pagina(self.paciente.id, tamano=20)
+        self.assertIsNone(completa['siguiente'])
+        self.assertEqual(
+            [(localtime(e['fecha']).hour, e['tipo']) for e in completa['eventos'][:3]],
+            [(11, 'reserva'), (11, 'notificacion'), (11, 'ficha')],
+        )
+        # Ningún tamaño de página repite ni salta eventos, incluso con fechas empatadas
+        claves = [(e['tipo'], e['id']) for e in completa['eventos']]
+        for tamano in (1, 2, 4):
+            self.assertEqual([(e['tipo'], e['id']) for e in self.recorrer(tamano)], claves)
+
+    def test_cursor_invalido(self):
+        for cursor in ('no-es-base64!', codificar_cursor({'fecha': now(), 'tipo': 'otro', 'id': 1})):
+            with self.assertRaises(ValueError):
+                decodificar_cursor(cursor)
+        with self.assertRaises(ValueError):
+            decodificar_cursor(codificar_cursor({'fecha': datetime(2026, 3, 2, 10), 'tipo': 'ficha', 'id': 1}))
+        self.client.force_login(self.medico.user)
+        url = f'/api/pacientes/{self.paciente.id}/linea-tiempo/'
+        self.assertEqual(self.client.get(url, {'cursor': 'xyz'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'tamano': 'diez'}).status_code, 400)
+
+    def test_primera_pagina_en_cache(self):
+        primera = obtener_linea_tiempo(self.paciente.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(obtener_linea_tiempo(self.paciente.id), primera)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notificacion.objects.create(usuario=self.medico.user, paciente=self.paciente, mensaje='nueva')
+        self.assertEqual(obtener_linea_tiempo(self.paciente.id)['eventos'][0]['mensaje'], 'nueva')
+
+
+class ReprogramacionTest(TestCase):
+    """Cancelación y reprogramación masiva; el 4 de abril de 2026 termina el horario de verano en Chile."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(user=User.objects.create_user(formatear(8000)), especialidad=cls.especialidad)
+        cls.otro = Medico.objects.create(user=User.objects.create_user(formatear(8001)), especialidad=cls.especialidad)
+        cls.paciente = Paciente.objects.create(rut=formatear(8_000_000), nombre='Paciente')
+        cls.viernes = date(2026, 4, 3)
+        for hora in (9, 10, 11):
+            bloque = Disponibilidad.objects.create(medico=cls.medico, fecha_disponible=a_hora_local(cls.viernes, hora), ocupada=True)
+            Reserva.objects.create(
+                paciente=cls.paciente, especialidad=cls.especialidad, medico=cls.medico, fecha_reserva=bloque, motivo=str(hora),
+            )
+
+    def test_cancelar(self):
+        resumen = cancelar_reservas(self.medico, a_hora_local(self.viernes, 9), a_hora_local(self.viernes, 11), motivo='Congreso')
+        self.assertEqual(len(resumen['canceladas']), 2)
+        self.assertEqual(list(Reserva.objects.values_list('motivo', flat=True)), ['11'])
+        self.assertEqual(Disponibilidad.objects.filter(ocupada=False).count(), 2)
+        self.assertEqual(Notificacion.objects.filter(paciente=self.paciente).count(), 2)
+        self.assertEqual(Notificacion.objects.filter(paciente=None, usuario=self.medico.user).count(), 1)
+
+    def test_reprogramar_con_cambio_de_horario(self):
+        siguiente = self.viernes + timedelta(days=7)
+        for hora, ocupada in ((9, False), (10, False), (11, True)):
+            Disponibilidad.objects.create(medico=self.medico, fecha_disponible=a_hora_local(siguiente, hora), ocupada=ocupada)
+        resumen = reprogramar_reservas(
+            self.medico, a_hora_local(self.viernes, 0), a_hora_local(siguiente, 0), desplazamiento=timedelta(days=7),
+        )
+        self.assertEqual(
+            [localtime(reserva['nueva_fecha']) for reserva in resumen['movidas']],
+            [a_hora_local(siguiente, 9), a_hora_local(siguiente, 10)],
+        )
+        # El bloque de destino de la reserva de las 11 está ocupado: queda donde estaba
+        self.assertEqual([r['fecha_reserva__fecha_disponible'] for r in resumen['no_movidas']], [a_hora_local(self.viernes, 11)])
+        self.assertEqual(
+            sorted(Reserva.objects.values_list('motivo', 'fecha_reserva__fecha_disponible')),
+            [('10', a_hora_local(siguiente, 10)), ('11', a_hora_local(self.viernes, 11)), ('9', a_hora_local(siguiente, 9))],
+        )
+        self.assertEqual(Disponibilidad.objects.filter(fecha_disponible__lt=a_hora_local(siguiente, 0), ocupada=True).count(), 1)
+
+    def test_reprogramar_a_otro_medico(self):
+        Disponibilidad.objects.create(medico=self.otro, fecha_disponible=a_hora_local(self.viernes, 10), ocupada=False)
+        resumen = reprogramar_reservas(self.medico, a_hora_local(self.viernes, 0), a_hora_local(self.viernes, 23), medico_destino=self.otro)
+        self.assertEqual(len(resumen['movidas']), 1)
+        self.assertEqual(len(resumen['no_movidas']), 2)
+        self.assertEqual(Reserva.objects.get(motivo='10').medico, self.otro)
+        with self.assertRaises(ValidationError):
+            reprogramar_reservas(self.medico, a_hora_local(self.viernes, 0), a_hora_local(self.viernes, 23))
+
+
+class ListaEsperaTest(TestCase):
+    """Los bloques liberados se retienen para el mejor candidato y pasan al siguiente si se rechazan o expiran."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(user=User.objects.create_user(formatear(8500)), especialidad=cls.especialidad)
+        otro = Medico.objects.create(user=User.objects.create_user(formatear(8501)), especialidad=cls.especialidad)
+        cls.recepcion = User.objects.create_user('recepcion')
+        cls.dia = localdate() + timedelta(days=2)
+        cls.bloque = Disponibilidad.objects.create(medico=cls.medico, fecha_disponible=a_hora_local(cls.dia, 10))
+
+        def esperar(n, **campos):
+            paciente = Paciente.objects.create(rut=formatear(8_500_000 + n), nombre=f"Paciente {n}")
+            return ListaEspera.objects.create(
+                paciente=paciente, especialidad=cls.especialidad, motivo=str(n), registrada_por=cls.recepcion, **campos,
+            )
+
+        cls.normal = esperar(0)
+        cls.urgente = esperar(1, prioridad=2)
+        # Incompatibles con el bloque: otro médico, otro horario, otro día de la semana
+        esperar(2, prioridad=2, medico=otro)
+        esperar(3, prioridad=2, hora_desde=time(15))
+        esperar(4, prioridad=2, dias_semana=ListaEspera.TODOS_LOS_DIAS & ~(1 << cls.dia.weekday()))
+
+    def test_ofrecer_al_de_mayor_prioridad(self):
+        entrada = ofrecer_bloque(self.bloque.id)
+        self.assertEqual(entrada, self.urgente)
+        self.bloque.refresh_from_db()
+        self.assertTrue(self.bloque.ocupada)
+        self.assertEqual(entrada.estado, ListaEspera.OFRECIDA)
+        self.assertLessEqual(entrada.oferta_expira, now() + RETENCION)
+        self.assertTrue(Notificacion.objects.filter(usuario=self.recepcion, paciente=self.urgente.paciente).exists())
+        # Ya retenido: no se vuelve a ofrecer
+        self.assertIsNone(ofrecer_bloque(self.bloque.id))
+
+    def test_bloque_inminente_no_se_ofrece(self):
+        inminente = Disponibilidad.objects.create(medico=self.medico, fecha_disponible=now() + ANTICIPACION / 2)
+        self.assertIsNone(ofrecer_bloque(inminente.id))
+        self.assertFalse(ListaEspera.objects.filter(estado=ListaEspera.OFRECIDA).exists())
+
+    def test_rechazar_pasa_al_siguiente(self):
+        ofrecer_bloque(self.bloque.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            rechazar_oferta(self.urgente.id)
+        self.urgente.refresh_from_db()
+        self.normal.refresh_from_db()
+        self.assertEqual((self.urgente.estado, self.urgente.bloque_ofrecido), (ListaEspera.ESPERANDO, None))
+        self.assertEqual((self.normal.estado, self.normal.bloque_ofrecido_id), (ListaEspera.OFRECIDA, self.bloque.id))
+        with self.assertRaises(ValidationError):
+            rechazar_oferta(self.urgente.id)
+
+    def test_expirar_ofertas(self):
+        ofrecer_bloque(self.bloque.id)
+        self.assertEqual(expirar_ofertas(), 0)
+        ListaEspera.objects.filter(id=self.urgente.id).update(oferta_expira=now() - timedelta(minutes=1))
+        with self.assertRaises(ValidationError):
+            confirmar_oferta(self.urgente.id, self.recepcion)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expirar_ofertas(), 1)
+        self.assertEqual(ListaEspera.objects.get(id=self.urgente.id).estado, ListaEspera.EXPIRADA)
+        self.assertEqual(ListaEspera.objects.get(id=self.normal.id).bloque_ofrecido_id, self.bloque.id)
+
+    def test_confirmar_y_cancelacion(self):
+        ofrecer_bloque(self.bloque.id)
+        reserva = confirmar_oferta(self.urgente.id, self.recepcion)
+        self.assertEqual((reserva.paciente, reserva.fecha_reserva, reserva.motivo), (self.urgente.paciente, self.bloque, '1'))
+        self.assertEqual(ListaEspera.objects.get(id=self.urgente.id).estado, ListaEspera.ASIGNADA)
+        # Cancelar la reserva libera el bloque y se ofrece al siguiente en espera
+        with self.captureOnCommitCallbacks(execute=True):
+            cancelar_reservas(self.medico, a_hora_local(self.dia, 0), a_hora_local(self.dia + timedelta(days=1), 0))
+        self.assertEqual(ListaEspera.objects.get(id=self.normal.id).bloque_ofrecido_id, self.bloque.id)
+
+
+class SeedScaleTest(TestCase):
+    """El generador de datos sintéticos produce datos válidos, coherentes y reproducibles por semilla."""
+
+    OPCIONES = {
+        'especialidades': 3, 'sedes': 2, 'medicos': 4, 'recepcionistas': 2, 'pacientes': 30, 'meses': 1,
+        'meses_futuros': 1, 'bloques_por_dia': 4, 'lote': 50, 'permitir_sin_debug': True,
+    }
+
+    def generar(self, **opciones):
+        call_command('seed_scale', stdout=StringIO(), **{**self.OPCIONES, **opciones})
+
+    def test_datos_coherentes(self):
+        self.generar()
+        self.assertEqual(Paciente.objects.count(), 30)
+        self.assertEqual(Medico.objects.count(), 4)
+        self.assertEqual(User.objects.filter(groups__name='Medico').count(), 4)
+        for rut, cuerpo, dv in Paciente.objects.values_list('rut', 'rut_cuerpo', 'rut_dv'):
+            self.assertEqual(parsear(rut), (cuerpo, dv))
+        self.assertFalse(Reserva.objects.filter(fecha_reserva__ocupada=False).exists())
+        self.assertFalse(Reserva.objects.exclude(sede=F('fecha_reserva__sede')).exists())
+        self.assertFalse(Reserva.objects.exclude(especialidad=F('medico__especialidad')).exists())
+        # Las fichas conservan la fecha sintética (25 minutos después del bloque), no la hora de inserción
+        minutos = {localtime(fecha).minute for fecha in FichaMedica.objects.values_list('fecha_creacion', flat=True)}
+        self.assertTrue(minutos)
+        self.assertLessEqual(minutos, {25, 55})
+        # Los ids explícitos no chocan con los que se asignen después
+        Paciente.objects.create(rut=formatear(4_000_000), nombre='Nuevo')
+
+    def test_misma_semilla_mismos_datos(self):
+        generados = []
+        for _ in range(2):
+            with transaction.atomic():
+                self.generar(semilla=7)
+                generados.append((
+                    list(Paciente.objects.order_by('id').values_list('rut', 'nombre')),
+                    list(Reserva.objects.order_by('id').values_list('paciente__rut', 'fecha_reserva__fecha_disponible')),
+                ))
+                transaction.set_rollback(True)
+        self.assertEqual(generados[0], generados[1])
+        self.assertTrue(generados[0][1])
+
+    def test_opciones_invalidas(self):
+        with self.assertRaises(CommandError):
+            self.generar(permitir_sin_debug=False)
+        with self.assertRaises(CommandError):
+            self.generar(ocupacion=1.5)
+        self.assertFalse(Paciente.objects.exists())
+
+
+class PlanesDeConsultasCriticasTest(TestCase):
+    """
+    Cada consulta declarada con @consulta_critica debe resolverse con índices.
+    Para agregar una ruta crítica basta con registrarla; esta prueba la revisa sola.
+    """
+
+    def test_hay_consultas_registradas(self):
+        self.assertIn('reservas_en_rango', CONSULTAS_CRITICAS)
+        self.assertIn('disponibilidades_libres', CONSULTAS_CRITICAS)
+        self.assertIn('notificaciones_no_leidas', CONSULTAS_CRITICAS)
+
+    def test_planes_sin_recorridos_completos(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f"Sin reglas de plan para {connection.vendor}.")
+        for nombre, consulta in CONSULTAS_CRITICAS.items():
+            with self.subTest(consulta=nombre):
+                plan = plan_de(consulta.construir(**consulta.ejemplo()))
+                problemas = problemas_del_plan(plan, consulta.permitir_ordenamiento)
+                self.assertEqual(problemas, [], f"Plan de '{nombre}':\n{plan}")
+
+    def test_detecta_recorrido_completo(self):
+        # Comprueba las propias reglas: filtrar por un campo sin índice debe reportarse
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f"Sin reglas de plan para {connection.vendor}.")
+        plan = plan_de(Reserva.objects.filter(motivo='Control').order_by('motivo'))
+        self.assertNotEqual(problemas_del_plan(plan), [])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class LimitesTest(TestCase):
+    """Token bucket por cliente y endpoint (429 con Retry-After) y tope de peticiones simultáneas (503)."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(limites, 'HABILITADO', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def peticion(self, ip='10.0.0.1'):
+        request = self.factory.get('/api/prueba/', REMOTE_ADDR=ip)
+        request.user = AnonymousUser()
+        return request
+
+    def test_rafaga_y_retry_after(self):
+        vista = limites.limitar('prueba', tasa='30/m', rafaga=3)(lambda request: JsonResponse({}))
+        self.assertEqual([vista(self.peticion()).status_code for _ in range(4)], [200, 200, 200, 429])
+        # Un token cada 2 segundos
+        self.assertEqual(vista(self.peticion())['Retry-After'], '2')
+        # Cada cliente tiene su propio balde
+        self.assertEqual(vista(self.peticion('10.0.0.2')).status_code, 200)
+        with mock.patch.object(limites.time, 'time', return_value=now().timestamp() + 2.5):
+            self.assertEqual(vista(self.peticion()).status_code, 200)
+
+    def test_tasa_desde_settings(self):
+        with mock.patch.dict(limites.TASAS, {'prueba': '1/h'}):
+            vista = limites.limitar('prueba', tasa='30/m')(lambda request: JsonResponse({}))
+        self.assertEqual(vista(self.peticion()).status_code, 200)
+        respuesta = vista(self.peticion())
+        self.assertEqual((respuesta.status_code, respuesta['Retry-After']), (429, '3600'))
+
+    def test_respaldo_local(self):
+        vista = limites.limitar('prueba', tasa='30/m', rafaga=1)(lambda request: JsonResponse({}))
+        with mock.patch.object(limites.baldes_compartidos, 'consumir', side_effect=ConnectionError('sin caché')):
+            self.assertEqual([vista(self.peticion()).status_code for _ in range(2)], [200, 429])
+
+    def test_concurrencia(self):
+        respuestas = []
+
+        @limites.limitar('prueba', tasa='30/m', concurrencia=1)
+        def vista(request):
+            # Una petición simultánea mientras esta ocupa el único lugar
+            if not respuestas:
+                respuestas.append(vista(request))
+            return JsonResponse({})
+
+        self.assertEqual(vista(self.peticion()).status_code, 200)
+        self.assertEqual((respuestas[0].status_code, respuestas[0]['Retry-After']), (503, '1'))
+        # El lugar se libera al terminar
+        self.assertEqual(vista(self.peticion()).status_code, 200)
+
+    def test_api_validar_rut(self):
+        codigos = [self.client.get('/api/validar_rut/', {'rut': formatear(14_000)}).status_code for _ in range(11)]
+        self.assertEqual(codigos, [404] * 10 + [429])
+
+
+class RutTest(TestCase):
+    """Dígito verificador, forma canónica del RUT y búsqueda por su cuerpo."""
+
+    def test_digito_verificador(self):
+        self.assertEqual(digito_verificador(12345678), '5')
+        self.assertEqual(digito_verificador(10000013), 'K')
+        self.assertEqual(digito_verificador(10000004), '0')
+
+    def test_parsear_y_formatear(self):
+        for texto in ('12345678-5', '12.345.678-5', '12345678 5', '123456785', ' 12345678-5 '):
+            with self.subTest(texto=texto):
+                self.assertEqual(normalizar(texto), '12345678-5')
+        self.assertEqual(parsear('10.000.013-k'), (10000013, 'K'))
+        self.assertEqual(formatear(10000013), '10000013-K')
+        with self.assertRaises(ValidationError) as error:
+            parsear('12345678-4')
+        self.assertEqual(error.exception.code, 'digito_rut')
+        self.assertEqual(parsear('12345678-4', verificar=False), (12345678, '4'))
+        for texto in ('', 'abc', '12-345', '0-0'):
+            with self.subTest(texto=texto), self.assertRaises(ValidationError) as error:
+                parsear(texto)
+            self.assertEqual(error.exception.code, 'formato_rut')
+
+    def test_cuerpos_de_busqueda(self):
+        self.assertEqual(cuerpos_de_busqueda('12.345.678-5'), [12345678])
+        self.assertEqual(cuerpos_de_busqueda('10000013k'), [10000013])
+        self.assertEqual(cuerpos_de_busqueda('12345678-4'), [])
+        self.assertEqual(cuerpos_de_busqueda('Juan'), [])
+        # Solo dígitos: el último puede ser el verificador o parte del cuerpo
+        self.assertEqual(cuerpos_de_busqueda('12343'), [1234, 12343])
+        self.assertEqual(cuerpos_de_busqueda('12345'), [12345])
+
+    def test_busqueda_por_cuerpo(self):
+        for cuerpo in (1234, 12343):
+            Paciente.objects.create(rut=formatear(cuerpo), nombre=f"Paciente {cuerpo}")
+        self.assertEqual(Paciente.objects.get(rut='12343-' + digito_verificador(12343)).rut_cuerpo, 12343)
+        pacientes = Paciente.objects.order_by('rut_cuerpo')
+        self.assertEqual([p.rut_cuerpo for p in filtrar_por_rut(pacientes, '12343', 'rut_cuerpo')], [1234, 12343])
+        self.assertEqual([p.rut_cuerpo for p in filtrar_por_rut(pacientes, '1234-3', 'rut_cuerpo')], [1234])
+        self.assertFalse(filtrar_por_rut(pacientes, 'Juan', 'rut_cuerpo').exists())
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class SerializacionTest(TestCase):
+    """Los endpoints JSON se proyectan con values_list() y conservan el formato de sus campos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(formatear(9000), first_name='Ana', last_name='Soto')
+        user.groups.add(Group.objects.create(name='Medico'))
+        cls.medico = Medico.objects.create(user=user, especialidad=Especialidad.objects.create(nombre='Medicina General'))
+
+    def test_notificaciones_con_el_formato_de_django(self):
+        fechas = [now().replace(microsecond=123456), now().replace(microsecond=0) - timedelta(hours=1)]
+        for fecha in fechas:
+            Notificacion.objects.create(usuario=self.medico.user, mensaje='Aviso', fecha_creacion=fecha)
+        self.client.force_login(self.medico.user)
+        recibidas = [n['fecha_creacion'] for n in self.client.get('/notificaciones/ajax/').json()]
+        self.assertEqual(recibidas, [DjangoJSONEncoder().default(fecha) for fecha in fechas])
+
+    def test_medicos_en_una_consulta(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(MEDICO.filas(Medico.objects.all()), [{'id': self.medico.id, 'nombre': 'Ana Soto'}])
+
+    def test_fechas_en_hora_local(self):
+        # El 4 de abril de 2026 termina el horario de verano: ambos bloques son a las 10:00 locales
+        for dia in (date(2026, 4, 3), date(2026, 4, 10)):
+            Disponibilidad.objects.create(medico=self.medico, fecha_disponible=a_hora_local(dia, 10))
+        filas = DISPONIBILIDAD.filas(Disponibilidad.objects.order_by('fecha_disponible'))
+        self.assertEqual([fila['fecha_hora'] for fila in filas], ['03/04/2026 10:00', '10/04/2026 10:00'])
+
+
+# Consultas de cada listado del admin con la caché de sesión y usuario ya caliente:
+# conteo con tope, página de resultados y, si lo hay, el filtro por médico. No dependen de la cantidad de filas.
+CONSULTAS_POR_LISTADO = {
+    'paciente': 2,
+    'medico': 4,
+    'fichamedica': 3,
+    'recepcionista': 3,
+    'reserva': 3,
+    'disponibilidad': 3,
+    'listaespera': 3,
+}
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class AdminEscalableTest(TestCase):
+    """Los listados del admin no deben hacer consultas por fila ni COUNT(*) completos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='admin')
+        especialidad = Especialidad.objects.create(nombre='Medicina General')
+        medicos = [
+            Medico.objects.create(user=User.objects.create_user(f"{formatear(1000 + i)}", first_name='Dr', last_name=str(i)), especialidad=especialidad)
+            for i in range(3)
+        ]
+        Recepcionista.objects.create(user=User.objects.create_user(formatear(2000), first_name='Recepción'), fecha_contratacion=localdate())
+        inicio = now() - timedelta(days=3)
+        for i in range(30):
+            paciente = Paciente.objects.create(rut=formatear(5_000_000 + i), nombre=f"Paciente {i}")
+            medico = medicos[i % 3]
+            bloque = Disponibilidad.objects.create(medico=medico, fecha_disponible=inicio + timedelta(hours=i), ocupada=True)
+            Reserva.objects.create(paciente=paciente, especialidad=especialidad, medico=medico, fecha_reserva=bloque, motivo='Control')
+            FichaMedica.objects.create(paciente=paciente, medico=medico, diagnostico='Sin hallazgos')
+            ListaEspera.objects.create(paciente=paciente, especialidad=especialidad, medico=medico)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_consultas_por_listado(self):
+        for modelo, esperadas in CONSULTAS_POR_LISTADO.items():
+            url = f"/admin/ficha_medica/{modelo}/"
+            with self.subTest(listado=modelo):
+                self.client.get(url)  # Llena las cachés de sesión y usuario
+                with self.assertNumQueries(esperadas):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_filtro_rango_fechas(self):
+        hoy = localdate().isoformat()
+        response = self.client.get('/admin/ficha_medica/fichamedica/', {
+            'fecha_creacion__desde': hoy, 'fecha_creacion__hasta': hoy,
+        })
+        self.assertEqual(response.context['cl'].result_count, 30)
+        response = self.client.get('/admin/ficha_medica/fichamedica/', {
+            'fecha_creacion__desde': (localdate() + timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_busqueda_por_rut_exacta(self):
+        rut = formatear(5_000_007)
+        con_puntos = f"{5_000_007:,}".replace(',', '.') + rut[-2:]
+        response = self.client.get('/admin/ficha_medica/reserva/', {'q': con_puntos})
+        self.assertEqual([r.paciente.rut for r in response.context['cl'].result_list], [rut])
+
+    def test_conteo_con_tope(self):
+        with mock.patch.object(PaginadorEstimado, 'TOPE', 10):
+            self.assertEqual(PaginadorEstimado(Paciente.objects.filter(nombre__startswith='Paciente').order_by('id'), 5).count, 10)
+            self.assertEqual(PaginadorEstimado(Paciente.objects.filter(nombre='Paciente 1').order_by('id'), 5).count, 1)
+
+    def test_aviso_de_tope(self):
+        with mock.patch.object(PaginadorEstimado, 'TOPE', 10):
+            response = self.client.get('/admin/ficha_medica/paciente/')
+        self.assertContains(response, 'Hay más de 10 resultados')
+        response = self.client.get('/admin/ficha_medica/paciente/')
+        self.assertNotContains(response, 'Hay más de')
+
+    def test_orden_de_pacientes_por_indice(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f"Sin reglas de plan para {connection.vendor}.")
+        # Orden por defecto y por la columna nombre en ambos sentidos
+        for orden in ({}, {'o': '2'}, {'o': '-2'}):
+            with self.subTest(orden=orden):
+                listado = self.client.get('/admin/ficha_medica/paciente/', orden).context['cl']
+                plan = plan_de(listado.queryset[:100])
+                self.assertEqual(problemas_del_plan(plan), [], plan)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class TareasTest(TestCase):
+    """Cola de tareas en la base: deduplicación por clave, toma por prioridad, reintentos y recuperación."""
+
+    def setUp(self):
+        registro = mock.patch.dict(tareas.TAREAS)
+        registro.start()
+        self.addCleanup(registro.stop)
+        self.addCleanup(tareas._ultimos_intervalos.clear)
+        self.llamadas = []
+
+        @tareas.tarea('prueba_suma', max_intentos=3)
+        def suma(a, b):
+            self.llamadas.append((a, b))
+            return a + b
+
+        @tareas.tarea('prueba_falla', max_intentos=2)
+        def falla():
+            raise RuntimeError('sin servicio')
+
+    def test_encolar_con_clave(self):
+        with transaction.atomic():
+            primera = tareas.encolar('prueba_suma', {'a': 1, 'b': 2}, clave='unica')
+            self.assertIsNone(tareas.encolar('prueba_suma', {'a': 1, 'b': 2}, clave='unica'))
+            # La transacción externa sigue usable después del conflicto
+            tareas.encolar('prueba_suma', {'a': 3, 'b': 4})
+        self.assertEqual(Tarea.objects.count(), 2)
+        self.assertEqual((primera.prioridad, primera.max_intentos, primera.cola), (0, 3, 'default'))
+
+    def test_tomar_por_prioridad(self):
+        normal = tareas.encolar('prueba_suma', {'a': 1, 'b': 1})
+        urgente = tareas.encolar('prueba_suma', {'a': 2, 'b': 2}, prioridad=5)
+        tareas.encolar('prueba_suma', {'a': 3, 'b': 3}, prioridad=9, ejecutar_desde=now() + timedelta(minutes=5))
+        tomada = tareas.tomar('default', 'w1')
+        self.assertEqual(tomada.id, urgente.id)
+        self.assertEqual((tomada.estado, tomada.tomada_por, tomada.intentos), (Tarea.EN_CURSO, 'w1', 1))
+        self.assertGreater(tomada.bloqueada_hasta, now())
+        self.assertEqual(tareas.tomar('default', 'w2').id, normal.id)
+        self.assertIsNone(tareas.tomar('default', 'w2'))
+        self.assertIsNone(tareas.tomar('pdf', 'w2'))
+
+    def test_ejecutar_con_exito(self):
+        tareas.encolar('prueba_suma', {'a': 2, 'b': 3})
+        self.assertTrue(tareas.ejecutar(tareas.tomar('default', 'w1')))
+        tarea_ = Tarea.objects.get()
+        self.assertEqual((tarea_.estado, tarea_.resultado, tarea_.bloqueada_hasta), (Tarea.COMPLETADA, 5, None))
+        self.assertIsNotNone(tarea_.terminada_en)
+
+    def test_reintentos_y_fallo_definitivo(self):
+        tareas.encolar('prueba_falla')
+        with mock.patch.object(tareas.random, 'uniform', return_value=1.0):
+            self.assertFalse(tareas.ejecutar(tareas.tomar('default', 'w1')))
+        tarea_ = Tarea.objects.get()
+        self.assertEqual((tarea_.estado, tarea_.intentos), (Tarea.PENDIENTE, 1))
+        self.assertIn('sin servicio', tarea_.error)
+        espera = tarea_.ejecutar_desde - now()
+        self.assertTrue(timedelta(seconds=tareas.ESPERA_BASE - 1) < espera <= timedelta(seconds=tareas.ESPERA_BASE))
+        # Aún no se puede tomar; al llegar su hora, el segundo intento es el último
+        self.assertIsNone(tareas.tomar('default', 'w1'))
+        Tarea.objects.update(ejecutar_desde=now())
+        self.assertFalse(tareas.ejecutar(tareas.tomar('default', 'w1')))
+        tarea_.refresh_from_db()
+        self.assertEqual((tarea_.estado, tarea_.intentos), (Tarea.FALLIDA, 2))
+        self.assertIsNotNone(tarea_.terminada_en)
+
+    def test_espera_exponencial(self):
+        with mock.patch.object(tareas.random, 'uniform', return_value=1.0):
+            esperas = [tareas.espera_para_reintento(intentos).total_seconds() for intentos in (1, 2, 3, 30)]
+        self.assertEqual(esperas, [tareas.ESPERA_BASE, tareas.ESPERA_BASE * 2, tareas.ESPERA_BASE * 4, tareas.ESPERA_MAXIMA])
+
+    def test_recuperar_vencidas(self):
+        for _ in range(2):
+            tareas.encolar('prueba_falla')
+        vencida, agotada = tareas.tomar('default', 'w1'), tareas.tomar('default', 'w2')
+        Tarea.objects.filter(id=agotada.id).update(intentos=2)
+        Tarea.objects.update(bloqueada_hasta=now() - timedelta(seconds=1))
+        self.assertEqual(tareas.recuperar_vencidas(), 1)
+        self.assertEqual(Tarea.objects.get(id=vencida.id).estado, Tarea.PENDIENTE)
+        self.assertEqual(Tarea.objects.get(id=agotada.id).estado, Tarea.FALLIDA)
+        # El trabajador que perdió la tarea ya no puede cerrarla
+        tareas.ejecutar(vencida)
+        self.assertEqual(Tarea.objects.get(id=vencida.id).estado, Tarea.PENDIENTE)
+
+    def test_programar_periodicas(self):
+        periodicas = [
+            tareas.Periodica('prueba_suma', cada=timedelta(minutes=10)),
+            tareas.Periodica('prueba_falla', hora=time(6, 30)),
+        ]
+        temprano = a_hora_local(date(2026, 11, 2), 6, 5)
+        tareas.programar_periodicas(periodicas, ahora=temprano)
+        with self.assertNumQueries(0):
+            tareas.programar_periodicas(periodicas, ahora=temprano + timedelta(minutes=1))
+        self.assertEqual(list(Tarea.objects.values_list('nombre', flat=True)), ['prueba_suma'])
+        # Otro servidor con su propia memoria no duplica el intervalo: lo impide la clave
+        tareas._ultimos_intervalos.clear()
+        tareas.programar_periodicas(periodicas, ahora=temprano + timedelta(minutes=2))
+        self.assertEqual(Tarea.objects.count(), 1)
+        tareas.programar_periodicas(periodicas, ahora=temprano + timedelta(minutes=30))
+        self.assertEqual(Tarea.objects.filter(nombre='prueba_suma').count(), 2)
+        self.assertEqual(Tarea.objects.filter(nombre='prueba_falla').count(), 1)
+
+    def test_run_workers_una_vez(self):
+        tareas.encolar('prueba_suma', {'a': 1, 'b': 1})
+        salida = StringIO()
+        with mock.patch('ficha_medica.trabajos.PERIODICAS_COLA', []):
+            call_command('run_workers', una_vez=True, colas='default=1', stdout=salida)
+        self.assertEqual(salida.getvalue().strip(), '1 tareas ejecutadas.')
+        self.assertEqual(self.llamadas, [(1, 1)])
+
+
+class ConexionDePrueba:
+    """Backend de correo que rechaza ciertos destinatarios y puede cortar la sesión una vez."""
+
+    def __init__(self, rechazados=(), desconectar=False):
+        self.rechazados, self.desconectar = set(rechazados), desconectar
+        self.enviados, self.aperturas = [], 0
+
+    def open(self):
+        self.aperturas += 1
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send_messages(self, mensajes):
+        destinatario = mensajes[0].to[0]
+        if self.desconectar:
+            self.desconectar = False
+            raise smtplib.SMTPServerDisconnected('cierre por inactividad')
+        if destinatario in self.rechazados:
+            raise smtplib.SMTPRecipientsRefused({destinatario: (550, b'No existe')})
+        self.enviados.append(destinatario)
+        return 1
+
+
+class RecordatoriosTest(TestCase):
+    """Recordatorios por correo: generación idempotente, reparto en lotes y envío con reintentos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(user=User.objects.create_user(formatear(14_100)), especialidad=cls.especialidad)
+        cls.manana = localdate() + timedelta(days=1)
+
+    def reservar(self, inicio, email, n):
+        paciente = Paciente.objects.create(rut=formatear(14_100_000 + n), nombre=f"Paciente {n}", email=email)
+        bloque = Disponibilidad.objects.create(medico=self.medico, fecha_disponible=inicio, ocupada=True)
+        return Reserva.objects.create(paciente=paciente, especialidad=self.especialidad, medico=self.medico, fecha_reserva=bloque, motivo='Control')
+
+    def recordatorio(self, email, n, inicio=None, **campos):
+        reserva = self.reservar(inicio or a_hora_local(self.manana, 9 + n), email, n)
+        return Recordatorio.objects.create(reserva=reserva, destinatario=email, **campos)
+
+    def test_generar_sin_duplicar(self):
+        self.reservar(a_hora_local(self.manana, 9), 'uno@ejemplo.cl', 1)
+        self.reservar(a_hora_local(self.manana, 10), 'dos@ejemplo.cl', 2)
+        self.reservar(a_hora_local(self.manana, 11), None, 3)
+        self.reservar(a_hora_local(self.manana + timedelta(days=1), 9), 'otro@ejemplo.cl', 4)
+        generar = lambda: list(recordatorios.generar_recordatorios(fecha=self.manana.isoformat()).values())[0]['creados']
+        self.assertEqual(generar(), 2)
+        self.assertEqual(generar(), 0)
+        self.reservar(a_hora_local(self.manana, 12), 'tres@ejemplo.cl', 5)
+        self.assertEqual(generar(), 1)
+        self.assertEqual(sorted(Recordatorio.objects.values_list('destinatario', flat=True)), ['dos@ejemplo.cl', 'tres@ejemplo.cl', 'uno@ejemplo.cl'])
+
+    def test_repartir_en_lotes(self):
+        for n in range(3):
+            self.recordatorio(f'{n}@ejemplo.cl', n)
+        futuro = self.recordatorio('futuro@ejemplo.cl', 5, programado_para=now() + timedelta(hours=1))
+        with mock.patch.object(recordatorios, 'TAMANO_LOTE', 2):
+            resultado = list(recordatorios.repartir_recordatorios().values())[0]
+        self.assertEqual(resultado, {'recordatorios': 3, 'lotes': 2})
+        self.assertEqual(Recordatorio.objects.filter(estado=Recordatorio.EN_LOTE).values('lote').distinct().count(), 2)
+        self.assertEqual(Tarea.objects.filter(nombre='enviar_recordatorios').count(), 2)
+        self.assertEqual(Recordatorio.objects.get(id=futuro.id).estado, Recordatorio.PENDIENTE)
+
+    def test_lote_abandonado_se_recupera(self):
+        abandonado = self.recordatorio(
+            'a@ejemplo.cl', 1, estado=Recordatorio.EN_LOTE, lote='viejo',
+            en_lote_desde=now() - recordatorios.LOTE_ABANDONADO - timedelta(minutes=1),
+        )
+        en_curso = self.recordatorio('b@ejemplo.cl', 2, estado=Recordatorio.EN_LOTE, lote='actual', en_lote_desde=now())
+        recordatorios.repartir_recordatorios()
+        abandonado.refresh_from_db()
+        self.assertEqual(abandonado.estado, Recordatorio.EN_LOTE)
+        self.assertNotEqual(abandonado.lote, 'viejo')
+        self.assertEqual(Recordatorio.objects.get(id=en_curso.id).lote, 'actual')
+
+    def test_enviar_lote(self):
+        lote = {'estado': Recordatorio.EN_LOTE, 'lote': 'lote1', 'en_lote_desde': now()}
+        enviado = self.recordatorio('ok@ejemplo.cl', 1, **lote)
+        rechazado = self.recordatorio('rechaza@ejemplo.cl', 2, **lote)
+        agotado = self.recordatorio('agota@ejemplo.cl', 3, intentos=recordatorios.MAX_INTENTOS - 1, **lote)
+        comenzada = self.recordatorio('tarde@ejemplo.cl', 4, inicio=now() - timedelta(minutes=5), **lote)
+        conexion = ConexionDePrueba(rechazados={'rechaza@ejemplo.cl', 'agota@ejemplo.cl'}, desconectar=True)
+        with mock.patch.object(recordatorios, 'get_connection', return_value=conexion):
+            resultado = recordatorios.enviar_recordatorios('lote1')
+        self.assertEqual(resultado, {'enviados': 1, 'fallidos': 2, 'descartados': 1})
+        # La sesión cortada se reabre y el mensaje se reenvía
+        self.assertEqual((conexion.enviados, conexion.aperturas), (['ok@ejemplo.cl'], 2))
+        estados = {r.id: r for r in Recordatorio.objects.all()}
+        self.assertEqual((estados[enviado.id].estado, estados[enviado.id].intentos, estados[enviado.id].lote), (Recordatorio.ENVIADO, 1, ''))
+        self.assertEqual(estados[rechazado.id].estado, Recordatorio.PENDIENTE)
+        self.assertGreater(estados[rechazado.id].programado_para, now())
+        self.assertIn('SMTPRecipientsRefused', estados[rechazado.id].error)
+        self.assertEqual(estados[agotado.id].estado, Recordatorio.FALLIDO)
+        self.assertEqual(estados[comenzada.id].estado, Recordatorio.DESCARTADO)
+        # Repetir la tarea del lote no reenvía nada
+        with mock.patch.object(recordatorios, 'get_connection', return_value=conexion):
+            self.assertEqual(recordatorios.enviar_recordatorios('lote1'), {'enviados': 0, 'fallidos': 0, 'descartados': 0})
+
+    def test_mensaje(self):
+        self.recordatorio('ok@ejemplo.cl', 1, estado=Recordatorio.EN_LOTE, lote='lote1', en_lote_desde=now())
+        recordatorios.enviar_recordatorios('lote1')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['ok@ejemplo.cl'])
+        self.assertEqual(mail.outbox[0].subject, f"Recordatorio: su hora con Medicina General el {self.manana:%d/%m/%Y} a las 10:00")
+
+
+class CalendarioTest(TestCase):
+    """Suscripción iCalendar del médico: ICS completo con ETag, sincronización incremental y URL revocable."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(
+            user=User.objects.create_user(formatear(14_200), first_name='Ana'), especialidad=cls.especialidad,
+        )
+        cls.paciente = Paciente.objects.create(rut=formatear(14_200_000), nombre='Paciente Uno')
+        cls.dia = localdate() + timedelta(days=2)
+        cls.reservas = {}
+        for hora in (9, 10, 11, 12):
+            bloque = Disponibilidad.objects.create(medico=cls.medico, fecha_disponible=a_hora_local(cls.dia, hora), ocupada=True)
+            cls.reservas[hora] = Reserva.objects.create(
+                paciente=cls.paciente, especialidad=cls.especialidad, medico=cls.medico, fecha_reserva=bloque, motivo=str(hora),
+            )
+
+    def setUp(self):
+        cache.clear()
+        cache_en_niveles.local.clear()
+        patcher = mock.patch.object(calendario, 'MARGEN_SINCRONIZACION', timedelta(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = f'/calendario/{calendario.token_suscripcion(self.medico)}.ics'
+
+    def eventos(self, contenido):
+        """{UID: STATUS} de los eventos del ICS."""
+        eventos = re.findall(r'UID:disponibilidad-(\d+)@centro-medico.*?STATUS:(\w+)', contenido.decode(), re.S)
+        return {int(bloque_id): estado for bloque_id, estado in eventos}
+
+    def test_calendario_completo_y_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertIn(b'SUMMARY:Paciente Uno', response.content)
+        self.assertEqual(self.eventos(response.content), {r.fecha_reserva_id: 'CONFIRMED' for r in self.reservas.values()})
+        self.assertTrue(response['X-Sync-Token'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        # Un cambio invalida el calendario en caché y su ETag
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reservas[9].delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_incremental_modificar_y_cancelar(self):
+        token = self.client.get(self.url)['X-Sync-Token']
+        modificada, borrada, bloque_borrado, cancelada = (self.reservas[h] for h in (9, 10, 11, 12))
+        modificada.motivo = 'Control'
+        modificada.save()
+        borrada.delete()  # Como desde el admin: el bloque queda sin tocar
+        Disponibilidad.objects.filter(id=bloque_borrado.fecha_reserva_id).delete()  # Elimina también su reserva
+        cancelar_reservas(self.medico, a_hora_local(self.dia, 12), a_hora_local(self.dia, 13))
+
+        response = self.client.get(self.url, {'desde': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.eventos(response.content), {
+            modificada.fecha_reserva_id: 'CONFIRMED',
+            borrada.fecha_reserva_id: 'CANCELLED',
+            bloque_borrado.fecha_reserva_id: 'CANCELLED',
+            cancelada.fecha_reserva_id: 'CANCELLED',
+        })
+        # Sin cambios posteriores, el siguiente token entrega un calendario vacío
+        siguiente = self.client.get(self.url, {'desde': response['X-Sync-Token']})
+        self.assertEqual(self.eventos(siguiente.content), {})
+
+    def test_token_invalido(self):
+        self.assertEqual(self.client.get('/calendario/1:firma-falsa.ics').status_code, 404)
+        otro = Medico(id=self.medico.id + 1, clave_calendario=self.medico.clave_calendario)
+        self.assertEqual(self.client.get(f'/calendario/{calendario.token_suscripcion(otro)}.ics').status_code, 404)
+        for desde in ('xyz', calendario.codificar_token(now() - timedelta(days=calendario.DIAS_PASADOS + 2))):
+            self.assertEqual(self.client.get(self.url, {'desde': desde}).status_code, 410)
+
+    def test_renovar_suscripcion(self):
+        self.client.force_login(self.medico.user)
+        with mock.patch.object(audit, 'EN_SEGUNDO_PLANO', False):
+            self.client.post('/medico/calendario/renovar/')
+        self.assertTrue(UserActivity.objects.filter(user=self.medico.user, accion='modificar').exists())
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.medico.refresh_from_db()
+        self.assertEqual(self.client.get(f'/calendario/{calendario.token_suscripcion(self.medico)}.ics').status_code, 200)
+
+
+class CambiosReservasTest(TestCase):
+    """Registro de cambios de reservas con lápidas, compactado por página y cursores que caducan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(user=User.objects.create_user(formatear(14_500)), especialidad=cls.especialidad)
+        cls.otro = Medico.objects.create(user=User.objects.create_user(formatear(14_501)), especialidad=cls.especialidad)
+        cls.paciente = Paciente.objects.create(rut=formatear(14_500_000), nombre='Paciente')
+        cls.dia = localdate() + timedelta(days=3)
+
+    def setUp(self):
+        patcher = mock.patch.object(cambios, 'MARGEN_VISIBILIDAD', timedelta(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reservar(self, medico, hora, motivo):
+        bloque = Disponibilidad.objects.create(medico=medico, fecha_disponible=a_hora_local(self.dia, hora), ocupada=True)
+        return Reserva.objects.create(
+            paciente=self.paciente, especialidad=self.especialidad, medico=medico, fecha_reserva=bloque, motivo=motivo,
+        )
+
+    def test_cambios_compactados(self):
+        movida = self.reservar(self.medico, 9, 'movida')
+        eliminada = self.reservar(self.medico, 10, 'eliminada').id
+        movida.motivo = 'Control'
+        movida.save()
+        movida.medico = self.otro
+        movida.save()
+        Reserva.objects.get(id=eliminada).delete()
+        pagina, cursor, hay_mas = cambios.cambios_desde('0')
+        self.assertEqual(
+            [(c['reserva_id'], c['operacion']) for c in pagina],
+            [(movida.id, CambioReserva.MODIFICAR), (eliminada, CambioReserva.ELIMINAR)],
+        )
+        self.assertEqual(pagina[0]['reserva']['motivo'], 'Control')
+        self.assertIsNone(pagina[1]['reserva'])
+        self.assertEqual((cursor, hay_mas), (CambioReserva.objects.order_by('-seq').first().seq, False))
+        # Para el médico anterior las dos desaparecieron
+        pagina, _, _ = cambios.cambios_desde('0', medico_id=self.medico.id)
+        self.assertEqual({(c['reserva_id'], c['operacion']) for c in pagina}, {(movida.id, 'eliminar'), (eliminada, 'eliminar')})
+        self.assertEqual(cambios.cambios_desde(str(cursor)), ([], cursor, False))
+
+    def test_paginas_y_margen(self):
+        for hora in (9, 10, 11):
+            self.reservar(self.medico, hora, str(hora))
+        pagina, cursor, hay_mas = cambios.cambios_desde('0', limite=2)
+        self.assertEqual((len(pagina), hay_mas), (2, True))
+        pagina, _, hay_mas = cambios.cambios_desde(str(cursor), limite=2)
+        self.assertEqual(([c['reserva']['motivo'] for c in pagina], hay_mas), (['11'], False))
+        # Los cambios más recientes que el margen esperan: el cursor no los salta
+        with mock.patch.object(cambios, 'MARGEN_VISIBILIDAD', timedelta(minutes=1)):
+            self.assertEqual(cambios.cambios_desde(str(cursor)), ([], cursor, False))
+            self.assertEqual(cambios.cursor_actual(), 0)
+
+    def test_cursor_invalido(self):
+        for hora in (9, 10):
+            self.reservar(self.medico, hora, str(hora))
+        CambioReserva.objects.update(registrado_en=now() - timedelta(days=cambios.DIAS_RETENCION + 1))
+        self.assertEqual(cambios.limpiar_cambios(), {'eliminados': 1})
+        ultimo = CambioReserva.objects.get().seq
+        with self.assertRaises(cambios.CursorInvalido):
+            cambios.cambios_desde(str(ultimo - 2))
+        self.assertEqual(cambios.cambios_desde(str(ultimo - 1))[1], ultimo)
+        for cursor in ('-1', 'abc'):
+            with self.assertRaises(ValueError):
+                cambios.cambios_desde(cursor)
+        self.client.force_login(self.medico.user)
+        self.assertEqual(self.client.get('/reservas/cambios/', {'desde': ultimo - 2}).status_code, 410)
+        self.assertEqual(self.client.get('/reservas/cambios/', {'desde': 'abc'}).status_code, 400)
+
+
+class SedesTest(TestCase):
+    """
+    Cada fila queda en la sede de su médico y, con una sede activa, solo se ven las suyas.
+    Los códigos no coinciden con sedes con base propia: todo queda en 'default'.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.centro = Sede.objects.create(codigo='prueba-centro', nombre='Centro')
+        cls.norte = Sede.objects.create(codigo='prueba-norte', nombre='Norte')
+        paciente = Paciente.objects.create(rut=formatear(6_000_000), nombre='Paciente')
+        for i, sede in enumerate((cls.centro, cls.norte)):
+            medico = Medico.objects.create(user=User.objects.create_user(formatear(3000 + i)), especialidad=especialidad, sede=sede)
+            bloque = Disponibilidad.objects.create(medico=medico, fecha_disponible=now() + timedelta(days=1), ocupada=True)
+            Reserva.objects.create(paciente=paciente, especialidad=especialidad, medico=medico, fecha_reserva=bloque, motivo=sede.codigo)
+
+    def test_filas_heredan_la_sede_del_medico(self):
+        for reserva in Reserva.objects.select_related('medico', 'fecha_reserva'):
+            self.assertEqual(reserva.sede_id, reserva.medico.sede_id)
+            self.assertEqual(reserva.fecha_reserva.sede_id, reserva.medico.sede_id)
+
+    def test_sede_activa_filtra(self):
+        self.assertEqual(Reserva.objects.count(), 2)
+        with en_sede(self.norte.id):
+            self.assertEqual(list(Reserva.objects.values_list('motivo', flat=True)), ['prueba-norte'])
+            self.assertEqual(Medico.objects.count(), 1)
+        self.assertIsNone(sede_activa())
+
+    def test_middleware_usa_la_sede_del_usuario(self):
+        request = mock.Mock(user=Medico.objects.get(sede=self.centro).user)
+        vistas = SedeMiddleware(lambda request: list(Reserva.objects.values_list('motivo', flat=True)))(request)
+        self.assertEqual(vistas, ['prueba-centro'])
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_vista_cacheada_por_sede(self):
+        cache.clear()
+        cache_en_niveles.local.clear()
+        url = f"/api/medicos/?especialidad_id={Especialidad.objects.get().id}"
+        for sede in (self.centro, self.norte):
+            medico = Medico.objects.get(sede=sede)
+            self.client.force_login(medico.user)
+            with self.subTest(sede=sede.codigo):
+                self.assertEqual([fila['id'] for fila in self.client.get(url).json()], [medico.id])
+
+    def test_trabajo_por_sede(self):
+        contar = en_cada_sede(lambda: Reserva.objects.count())
+        self.assertEqual(contar(), {'prueba-centro': 1, 'prueba-norte': 1})
+        with en_sede(self.centro.id):
+            self.assertEqual(contar(), 1)
+
+
+class ArchivoAgendaTest(TestCase):
+    """Lo antiguo sale de la agenda en lotes y los reportes lo siguen leyendo desde el archivo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(user=User.objects.create_user(formatear(4000)), especialidad=especialidad)
+        cls.paciente = Paciente.objects.create(rut=formatear(7_000_000), nombre='Paciente')
+        ahora = now()
+        # Reservas de hace 14 meses y de ayer; bloques libres de hace 14 meses, hace 10 días y mañana
+        for dias, reservar in [(420, True), (421, True), (422, True), (1, True), (425, False), (10, False), (-1, False)]:
+            bloque = Disponibilidad.objects.create(medico=cls.medico, fecha_disponible=ahora - timedelta(days=dias), ocupada=reservar)
+            if reservar:
+                Reserva.objects.create(paciente=cls.paciente, especialidad=especialidad, medico=cls.medico, fecha_reserva=bloque, motivo=f"{dias}")
+
+    def test_archiva_en_lotes(self):
+        movidos = archivar_agenda(lote=2)
+        self.assertEqual(list(movidos.values()), [{'bloques': 5, 'reservas': 3}])
+        self.assertEqual(list(Reserva.objects.values_list('motivo', flat=True)), ['1'])
+        self.assertEqual(Disponibilidad.objects.count(), 2)
+        self.assertEqual(ReservaArchivo.objects.count(), 3)
+        self.assertEqual(DisponibilidadArchivo.objects.filter(ocupada=False).count(), 2)
+        self.assertEqual(archivar_agenda(lote=2), {codigo: {'bloques': 0, 'reservas': 0} for codigo in movidos})
+
+    def test_fila_ya_archivada_se_actualiza(self):
+        # Un bloque restaurado a mano a la agenda y modificado allí: el archivo recibe la versión vigente
+        reserva = Reserva.objects.select_related('fecha_reserva').get(motivo='420')
+        bloque = reserva.fecha_reserva
+        DisponibilidadArchivo.objects.create(
+            id=bloque.id, medico=self.medico, fecha=bloque.fecha_disponible, duracion=15, ocupada=False,
+            sede_id=bloque.sede_id, creado_en=bloque.creado_en, archivado_en=now(), mes=mes_de(bloque.fecha_disponible),
+        )
+        ReservaArchivo.objects.create(
+            id=reserva.id, paciente=self.paciente, especialidad=reserva.especialidad, medico=self.medico, bloque_id=bloque.id,
+            fecha=bloque.fecha_disponible, duracion=15, motivo='antiguo', sede_id=reserva.sede_id, creado_en=reserva.creado_en,
+            archivado_en=now(), mes=mes_de(bloque.fecha_disponible),
+        )
+        archivar_agenda()
+        archivado = DisponibilidadArchivo.objects.get(id=bloque.id)
+        self.assertEqual((archivado.duracion, archivado.ocupada), (bloque.duracion, True))
+        self.assertEqual(ReservaArchivo.objects.get(id=reserva.id).motivo, '420')
+        self.assertEqual(ReservaArchivo.objects.count(), 3)
+        self.assertFalse(Reserva.objects.filter(id=reserva.id).exists())
+
+    def test_lectura_historica(self):
+        antes = (analytics.visitas_por_paciente()['pacientes'].tolist(), analytics.pacientes_frecuentes())
+        archivar_agenda()
+        desde, hasta = now() - timedelta(days=500), now()
+        reservas = list(consultar_reservas(desde, hasta, paciente_id=self.paciente.id, tamano=2))
+        self.assertEqual([(r['motivo'], r['archivada']) for r in reservas], [('422', True), ('421', True), ('420', True), ('1', False)])
+        self.assertEqual(resumen_ocupacion(desde, hasta)[self.medico.id]['bloques'], 6)
+        self.assertEqual((analytics.visitas_por_paciente()['pacientes'].tolist(), analytics.pacientes_frecuentes()), antes)
+        self.assertEqual(analytics.pacientes_frecuentes()[0]['visitas'], 4)
+        # La línea de tiempo muestra las archivadas como reservas, paginando a través de ambas tablas
+        pagina = construir_pagina(self.paciente.id, tamano=2)
+        siguiente = construir_pagina(self.paciente.id, cursor=decodificar_cursor(pagina['siguiente']), tamano=3)
+        self.assertEqual([e['motivo'] for e in pagina['eventos'] + siguiente['eventos']], ['1', '420', '421', '422'])
+        self.assertEqual({e['tipo'] for e in pagina['eventos'] + siguiente['eventos']}, {'reserva'})
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class OcupacionAgendaTest(TestCase):
+    """Matrices de ocupación por hora local de la semana y por día, con bloques vigentes y archivados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        especialidad = Especialidad.objects.create(nombre='Medicina General')
+        cls.medico = Medico.objects.create(user=User.objects.create_user(formatear(4500), first_name='Ana'), especialidad=especialidad)
+        cls.lunes = localdate() - timedelta(days=localdate().weekday() + 7)
+        for dias, hora, ocupada in [(0, 9, True), (0, 9.5, False), (7, 9, True), (1, 15, False)]:
+            inicio = make_aware(datetime.combine(cls.lunes + timedelta(days=dias), time.min)) + timedelta(hours=hora)
+            Disponibilidad.objects.create(medico=cls.medico, fecha_disponible=inicio, ocupada=ocupada)
+        archivar_agenda(dias_libres=0)  # El bloque libre del lunes pasado queda en el archivo
+
+    def test_matrices(self):
+        mapa = analytics.ocupacion_por_medico_y_hora(self.lunes, self.lunes + timedelta(days=7))
+        lunes_9, martes_15 = mapa['columnas'].index('Lun 09:00'), mapa['columnas'].index('Mar 15:00')
+        self.assertEqual((mapa['oferta'][0, lunes_9], mapa['ocupado'][0, lunes_9]), (90, 60))
+        self.assertEqual(mapa['utilizacion'][0, martes_15], 0)
+        self.assertEqual(mapa['oferta'].sum(), 120)
+        por_dia = analytics.ocupacion_por_especialidad_y_dia(self.lunes, self.lunes + timedelta(days=7))
+        self.assertEqual(por_dia['oferta'][0].tolist(), [60, 30, 0, 0, 0, 0, 0, 30])
+        self.assertEqual(por_dia['ocupado'][0].tolist(), [30, 0, 0, 0, 0, 0, 0, 30])
+
+    def test_vista_y_csv(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        url = '/admin-dashboard/ocupacion/'
+        response = self.client.get(url, {'desde': self.lunes.isoformat(), 'hasta': (self.lunes + timedelta(days=7)).isoformat()})
+        self.assertContains(response, 'Lun 09:00')
+        response = self.client.get(url, {'vista': 'especialidades', 'desde': self.lunes.isoformat(), 'formato': 'csv'})
+        self.assertEqual(response.content.decode().splitlines()[1], f"Medicina General,{self.lunes.isoformat()},60,30,0.500")
+        self.assertEqual(self.client.get(url, {'desde': '2000-01-01'}).status_code, 400)
@@ -0,0 +1,71 @@
+from datetime import time, timedelta
+from io import BytesIO
+
+from django.utils.timezone import now
+
+from .models import ArchivoGenerado, FichaMedica, Tarea
+from .pdf import escribir_fichas_pdf
+from .tareas import DIAS_RETENCION, Periodica, tarea
+from . import recordatorios, scheduler
+from . import archivo, cambios  # noqa: F401  (registran sus tareas)
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Los mismos trabajos que APScheduler corre en cada proceso web, como tareas de la cola.
+# Un intento basta: la siguiente ejecución periódica los repite.
+tarea('notificaciones_programadas', max_intentos=1, tiempo_maximo=60)(scheduler.enviar_notificaciones_programadas)
+tarea('expirar_ofertas_lista_espera', max_intentos=1, tiempo_maximo=60)(scheduler.expirar_ofertas_lista_espera)
+tarea('precalentar_agendas', max_intentos=3)(scheduler.precalentar_agendas)
+
+
+@tarea('limpiar_tareas', max_intentos=1)
+def limpiar_tareas(dias=DIAS_RETENCION):
+    """Borra las tareas terminadas y los archivos generados más antiguos que `dias`."""
+    limite = now() - timedelta(days=dias)
+    tareas, _ = Tarea.objects.filter(
+        estado__in=[Tarea.COMPLETADA, Tarea.FALLIDA], terminada_en__lt=limite,
+    ).delete()
+    archivos, _ = ArchivoGenerado.objects.filter(creado_en__lt=limite).delete()
+    return {'tareas': tareas, 'archivos': archivos}
+
+
+@tarea('pdf_fichas', cola='pdf', max_intentos=3, tiempo_maximo=600)
+def pdf_fichas(usuario_id, paciente_id):
+    """Todas las fichas de un paciente en un PDF, guardado para que el usuario lo descargue."""
+    fichas = list(
+        FichaMedica.objects.filter(paciente_id=paciente_id)
+        .select_related('paciente').order_by('fecha_creacion', 'id')
+    )
+    if not fichas:
+        raise ValueError(f"El paciente {paciente_id} no tiene fichas.")
+    destino = BytesIO()
+    escribir_fichas_pdf(fichas, destino)
+    generado = ArchivoGenerado.objects.create(
+        nombre=f"fichas_{fichas[0].paciente.rut}.pdf",
+        tipo_contenido='application/pdf',
+        contenido=destino.getvalue(),
+        usuario_id=usuario_id,
+    )
+    logger.info(f"PDF con {len(fichas)} fichas del paciente {paciente_id} generado ({len(generado.contenido)} bytes).")
+    return {'archivo_id': generado.id, 'fichas': len(fichas)}
+
+
+# Las que APScheduler corre en los procesos web si no está activado TAREAS_EN_WORKERS
+PERIODICAS_SCHEDULER = [
+    Periodica('notificaciones_programadas', cada=timedelta(seconds=10)),
+    Periodica('expirar_ofertas_lista_espera', cada=timedelta(minutes=1)),
+    # Agenda diaria de cada médico lista antes de la apertura
+    Periodica('precalentar_agendas', hora=time(6, 30)),
+]
+# Las que solo tienen sentido con workers: run_workers las encola siempre
+PERIODICAS_COLA = [
+    Periodica('limpiar_tareas', cada=timedelta(hours=1)),
+    Periodica('generar_recordatorios', hora=recordatorios.HORA_GENERACION),
+    Periodica('repartir_recordatorios', cada=timedelta(minutes=1)),
+    Periodica('limpiar_cambios_reservas', hora=time(3, 0)),
+    Periodica('archivar_agenda', hora=time(2, 0)),
+]
+PERIODICAS = PERIODICAS_SCHEDULER + PERIODICAS_COLA
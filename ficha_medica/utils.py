@@ -1,6 +1,21 @@
+from contextlib import contextmanager
 from django.http import HttpResponseForbidden
 import re
+import threading
+from datetime import datetime, time, timedelta
 from django.core.exceptions import ValidationError
+from django.utils.timezone import localdate, localtime, make_aware
+
+
+def tiene_rol(user, role_name):
+    """
+    Indica si el usuario pertenece al grupo. Usa los roles precargados del principal
+    en caché (ver ficha_medica.auth) y solo consulta la base de datos si no están.
+    """
+    roles = getattr(user, 'roles', None)
+    if roles is None:
+        return user.groups.filter(name=role_name).exists()
+    return role_name in roles
 
 
 def role_required(role_name):
@@ -9,8 +24,66 @@ def role_required(role_name):
     """
     def decorator(view_func):
         def _wrapped_view(request, *args, **kwargs):
-            if not request.user.groups.filter(name=role_name).exists():
+            if not tiene_rol(request.user, role_name):
                 return HttpResponseForbidden(f"No tienes acceso al rol requerido: {role_name}.")
             return view_func(request, *args, **kwargs)
         return _wrapped_view
     return decorator
+
+
+def limites_del_dia(fecha):
+    """
+    Retorna el inicio y el fin (exclusivo) de un día local como datetimes con zona horaria.
+    Filtrar por este rango permite usar el índice de la columna en vez de `__date`.
+    """
+    inicio = make_aware(datetime.combine(fecha, time.min))
+    return inicio, make_aware(datetime.combine(fecha + timedelta(days=1), time.min))
+
+
+def segundos_hasta_medianoche():
+    """Segundos que faltan para la medianoche local (mínimo 60)."""
+    _, fin = limites_del_dia(localdate())
+    return max(int((fin - localtime()).total_seconds()), 60)
+
+
+_estado_lote = threading.local()
+
+
+@contextmanager
+def senales_en_lote():
+    """
+    Durante una operación masiva, los receptores que mantienen cachés derivadas (agenda,
+    versiones, línea de tiempo) ignoran las señales por fila; quien abre el lote es
+    responsable de refrescarlas una sola vez al terminar.
+    """
+    anterior = getattr(_estado_lote, 'activo', False)
+    _estado_lote.activo = True
+    try:
+        yield
+    finally:
+        _estado_lote.activo = anterior
+
+
+def en_lote():
+    return getattr(_estado_lote, 'activo', False)
+
+
+_estado_sede = threading.local()
+
+
+@contextmanager
+def en_sede(sede_id):
+    """
+    Mientras dura, los managers por sede solo entregan filas de `sede_id` y sus tablas se leen y
+    escriben en la base de esa sede (ver ficha_medica/sedes.py). None: todas las sedes.
+    """
+    anterior = getattr(_estado_sede, 'id', None)
+    _estado_sede.id = sede_id
+    try:
+        yield
+    finally:
+        _estado_sede.id = anterior
+
+
+def sede_activa():
+    return getattr(_estado_sede, 'id', None)
@@ -1,6 +1,7 @@
 
 from django.contrib.auth.decorators import user_passes_test
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login
@@ -8,24 +9,37 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.cache import cache
-from django.core.exceptions import ValidationError
-from django.http import HttpResponse
-
-from ficha_medica.utils import role_required
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import IntegrityError
+from django.http import HttpResponse, HttpResponseForbidden
+
+from ficha_medica.utils import en_sede, role_required, tiene_rol
+from core.audit import registrar
+from ficha_medica.disponibilidades import crear_disponibilidades
+from ficha_medica.agenda import obtener_agenda
+from ficha_medica.cache import cachear_vista
+from ficha_medica.limites import limitar
+from ficha_medica import calendario, cambios, rut as ruts
+from ficha_medica.consultas import disponibilidades_libres, notificaciones_no_leidas, reservas_en_rango
+from ficha_medica.lista_espera import confirmar_oferta, programar_ofertas, rechazar_oferta
+from ficha_medica.reprogramacion import cancelar_reservas, reprogramar_reservas
+from ficha_medica.linea_tiempo import TAMANO_PAGINA, obtener_linea_tiempo
+from ficha_medica.pdf import escribir_ficha_pdf
+from ficha_medica.tareas import encolar
+from ficha_medica.serializacion import DISPONIBILIDAD, MEDICO, NOTIFICACION, RESERVA, RESERVA_ACTIVA, responder_json
 from ficha_medica.forms import (
     FichaMedicaForm, DisponibilidadForm, ReservaForm,
-    PacienteForm, MedicoForm, RecepcionistaForm
+    PacienteForm, MedicoForm, RecepcionistaForm, OperacionMasivaReservasForm, ListaEsperaForm
 )
 from .models import (
     FichaMedica, Paciente, Reserva, Disponibilidad,
-    Medico, Especialidad, Recepcionista, Notificacion
+    Medico, Especialidad, Recepcionista, Notificacion, ListaEspera, Tarea, ArchivoGenerado
 )
 
-from django.utils.timezone import make_aware, localtime, now
+from django.utils.timezone import make_aware, localdate, localtime, now
 from datetime import datetime, timedelta, date
 from django.contrib.auth.models import Group, User
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+import csv
 import json
 import logging
 
@@ -43,38 +57,42 @@ def admin_or_superuser_required(view_func):
     return user_passes_test(lambda u: u.is_active and (u.is_staff or u.is_superuser))(view_func)
 
 
+def filtrar_por_rut(queryset, texto, campo):
+    """
+    Filtra por igualdad sobre el cuerpo canónico del RUT (columna indexada), sin importar
+    puntos, guion o K minúscula. Un texto que no puede ser un RUT no encuentra nada.
+    """
+    cuerpos = ruts.cuerpos_de_busqueda(texto)
+    if not cuerpos:
+        return queryset.none()
+    return queryset.filter(**{f"{campo}__in": cuerpos})
+
+
+def medico_del_alcance(user):
+    """
+    Alcance de las APIs de reservas: None (todas las reservas) para recepción y staff, el id del
+    médico para un médico, que solo ve las suyas. PermissionDenied (403) para otros usuarios.
+    """
+    if user.is_staff or tiene_rol(user, 'Recepcionista'):
+        return None
+    medico_id = Medico.objects.filter(user=user).values_list('id', flat=True).first() if tiene_rol(user, 'Medico') else None
+    if medico_id is None:
+        raise PermissionDenied
+    return medico_id
+
+
+@login_required
+@role_required('Medico')
 def generar_ficha_pdf(request, ficha_id):
     # Obtener la ficha médica específica
-    ficha = FichaMedica.objects.get(id=ficha_id)
+    ficha = get_object_or_404(FichaMedica.objects.select_related('paciente'), id=ficha_id)
 
     # Configurar la respuesta HTTP para PDF
     response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="ficha_medica_{ficha_id}.pdf"'
 
-    # Crear el objeto canvas para generar el PDF
-    p = canvas.Canvas(response, pagesize=A4)
-
-    # Añadir contenido al PDF
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(200, 800, "Ficha Médica")
-
-    p.setFont("Helvetica", 12)
-    p.drawString(100, 750, f"Paciente: {ficha.paciente.nombre}")
-    p.drawString(100, 730, f"RUT: {ficha.paciente.rut}")
-    p.drawString(100, 710, f"Edad: {ficha.paciente.edad if ficha.paciente.edad else 'No registrada'}")
-    p.drawString(100, 690, f"Diagnóstico: {ficha.diagnostico}")
-    p.drawString(100, 670, f"Tratamiento: {ficha.tratamiento}")
-    p.drawString(100, 650, f"Observaciones: {ficha.observaciones if ficha.observaciones else 'Ninguna'}")
-    p.drawString(100, 630, f"Fecha de Creación: {ficha.fecha_creacion.strftime('%d/%m/%Y')}")
-
-    p.setFont("Helvetica-Oblique", 10)  # Fuente corregida
-    p.drawString(100, 600, "Este documento fue generado automáticamente.")
-
-    # Finalizar y cerrar el PDF
-    p.showPage()
-    p.save()
-
-    return response
+    registrar(request.user, 'ver', ficha, f"Descargó el PDF de la ficha {ficha_id}")
+    return escribir_ficha_pdf(ficha, response)
 
 @login_required
 @admin_or_superuser_required
@@ -98,7 +116,7 @@ def admin_dashboard(request):
     Vista del panel de administración personalizada.
     Accesible solo para usuarios con permisos de administrador.
     """
-    if not request.user.is_superuser and not request.user.groups.filter(name='Administrador').exists():
+    if not request.user.is_superuser and not tiene_rol(request.user, 'Administrador'):
         return HttpResponseForbidden("No tienes permiso para acceder a esta página.")
     
     # Calcular estadísticas rápidas
@@ -114,6 +132,73 @@ def admin_dashboard(request):
         'total_reservas': total_reservas,
     })
 
+@login_required
+@admin_or_superuser_required
+def api_analitica_cohortes(request):
+    """
+    Cohortes de pacientes y reservas por grupo etario, calculadas en la base de datos
+    y cacheadas por día.
+    """
+    from ficha_medica.analytics import reporte_cohortes  # NumPy solo se carga si se usa
+    return JsonResponse(reporte_cohortes())
+
+
+def _color_utilizacion(utilizacion):
+    # De azul (sin reservas) a rojo (todo reservado)
+    return f"hsl({round(220 * (1 - utilizacion))}, 75%, {round(92 - 32 * utilizacion)}%)"
+
+
+@login_required
+@admin_or_superuser_required
+def ocupacion_agenda(request):
+    """
+    Mapa de calor de la ocupación de la agenda, por médico y hora de la semana (?vista=medicos) o por
+    especialidad y día (?vista=especialidades), de ?desde a ?hasta (por defecto, los últimos 90 días).
+    Con ?formato=csv entrega una fila por celda con oferta.
+    """
+    from ficha_medica.analytics import VISTAS_OCUPACION, reporte_ocupacion  # NumPy solo se carga si se usa
+    import numpy as np
+
+    vista = request.GET.get('vista', 'medicos')
+    try:
+        hasta = date.fromisoformat(request.GET['hasta']) if request.GET.get('hasta') else localdate()
+        desde = date.fromisoformat(request.GET['desde']) if request.GET.get('desde') else hasta - timedelta(days=89)
+    except ValueError:
+        return HttpResponse("Fechas inválidas: use AAAA-MM-DD.", status=400, content_type='text/plain; charset=utf-8')
+    if vista not in VISTAS_OCUPACION or desde > hasta or (hasta - desde).days > 366:
+        return HttpResponse("Vista o período inválido (máximo un año).", status=400, content_type='text/plain; charset=utf-8')
+
+    mapa = reporte_ocupacion(vista, desde, hasta)
+    if request.GET.get('formato') == 'csv':
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="ocupacion_{vista}_{desde}_{hasta}.csv"'
+        escritor = csv.writer(response)
+        escritor.writerow(['fila', 'columna', 'minutos_ofrecidos', 'minutos_reservados', 'utilizacion'])
+        for i, j in zip(*np.nonzero(mapa['oferta'])):
+            escritor.writerow([
+                mapa['filas'][i], mapa['columnas'][j], mapa['oferta'][i, j], mapa['ocupado'][i, j], f"{mapa['utilizacion'][i, j]:.3f}",
+            ])
+        return response
+
+    # Solo las filas y columnas con oferta: las horas de la noche o los médicos sin agenda no aportan
+    filas = np.flatnonzero(mapa['oferta'].sum(axis=1))
+    columnas = np.flatnonzero(mapa['oferta'].sum(axis=0))
+    tabla = [
+        (mapa['filas'][i], [
+            {
+                'texto': f"{mapa['utilizacion'][i, j]:.0%}",
+                'color': _color_utilizacion(mapa['utilizacion'][i, j]),
+                'detalle': f"{mapa['ocupado'][i, j]} de {mapa['oferta'][i, j]} min",
+            } if mapa['oferta'][i, j] else None
+            for j in columnas
+        ])
+        for i in filas
+    ]
+    return render(request, 'core/ocupacion_agenda.html', {
+        'vista': vista, 'desde': desde, 'hasta': hasta,
+        'columnas': [mapa['columnas'][j] for j in columnas], 'tabla': tabla,
+    })
+
 @login_required
 @admin_or_superuser_required
 def listar_medicos(request):
@@ -172,7 +257,7 @@ def modificar_recepcionista(request, recepcionista_id):
         # Actualizar los datos del recepcionista
         recepcionista.user.first_name = request.POST.get('first_name')
         recepcionista.user.last_name = request.POST.get('last_name')
-        recepcionista.user.username = request.POST.get('username')
+        recepcionista.user.username = ruts.normalizar_usuario(request.POST.get('username'))
         recepcionista.telefono = request.POST.get('telefono')
         recepcionista.direccion = request.POST.get('direccion')
         recepcionista.user.save()
@@ -200,9 +285,9 @@ def home(request):
     Página de inicio que maneja el inicio de sesión y redirección según roles.
     """
     if request.user.is_authenticated:
-        if request.user.groups.filter(name='Recepcionista').exists():
+        if tiene_rol(request.user, 'Recepcionista'):
             return redirect('recepcionista_dashboard')
-        elif request.user.groups.filter(name='Medico').exists():
+        elif tiene_rol(request.user, 'Medico'):
             return redirect('medico_dashboard')
         elif request.user.is_superuser:
             return redirect('admin_dashboard')
@@ -210,7 +295,7 @@ def home(request):
             return render(request, 'core/home.html', {'error': 'No tiene un grupo asignado.'})
 
     if request.method == 'POST':
-        username = request.POST.get('username')
+        username = ruts.normalizar_usuario(request.POST.get('username'))
         password = request.POST.get('password')
         user = authenticate(request, username=username, password=password)
 
@@ -235,7 +320,7 @@ def listar_fichas(request):
 
     # Filtrar por RUT
     if rut_query:
-        fichas = fichas.filter(paciente__rut__icontains=rut_query)
+        fichas = filtrar_por_rut(fichas, rut_query, 'paciente__rut_cuerpo')
 
     # Filtrar por Fecha
     if fecha_query:
@@ -258,7 +343,9 @@ def modificar_ficha(request, ficha_id):
     if request.method == 'POST':
         form = FichaMedicaForm(request.POST, instance=ficha)
         if form.is_valid():
+            ficha._autor_revision = request.user
             form.save()
+            registrar(request.user, 'modificar', ficha)
             # Agregar mensaje de éxito
             messages.success(request, "La ficha médica ha sido modificada exitosamente.")
             return redirect('listar_fichas_medicas')
@@ -267,16 +354,42 @@ def modificar_ficha(request, ficha_id):
             messages.error(request, "Hubo errores en el formulario. Por favor, revisa los campos.")
     else:
         form = FichaMedicaForm(instance=ficha)
+        registrar(request.user, 'ver', ficha)
 
     return render(request, 'fichas_medicas/modificar_ficha.html', {'form': form, 'ficha': ficha})
 
 
+@login_required
+@role_required('Medico')
+def api_revisiones_ficha(request, ficha_id):
+    """
+    Historial de revisiones de una ficha. Con ?numero=N retorna además el contenido
+    reconstruido de esa revisión.
+    """
+    from ficha_medica.revisiones import historial, reconstruir
+
+    ficha = get_object_or_404(FichaMedica, id=ficha_id)
+    data = {'ficha': ficha.id, 'revisiones': historial(ficha.id)}
+    numero = request.GET.get('numero')
+    if numero:
+        if not numero.isdigit():
+            return JsonResponse({'error': 'Número de revisión inválido.'}, status=400)
+        contenido = reconstruir(ficha.id, int(numero))
+        if contenido is None:
+            return JsonResponse({'error': 'La revisión no existe.'}, status=404)
+        data['numero'] = int(numero)
+        data['contenido'] = contenido
+    registrar(request.user, 'ver', ficha, descripcion=f"Historial de la ficha {ficha.id}")
+    return JsonResponse(data, encoder=DjangoJSONEncoder)
+
+
 @login_required
 @role_required('Medico')
 def eliminar_ficha(request, ficha_id):
     ficha = get_object_or_404(FichaMedica, id=ficha_id)
 
     if request.method == 'POST':
+        registrar(request.user, 'eliminar', ficha)
         ficha.delete()
         messages.success(request, "Ficha médica eliminada exitosamente.")
         return redirect('listar_fichas_medicas')  # Asegúrate de que 'listar_fichas' existe
@@ -288,36 +401,135 @@ def filtrar_fichas_por_paciente(request, paciente_rut):
     """
     Filtrar fichas médicas de un paciente por su RUT.
     """
-    fichas = FichaMedica.objects.filter(paciente__rut=paciente_rut)
-    
+    fichas = filtrar_por_rut(FichaMedica.objects.all(), paciente_rut, 'paciente__rut_cuerpo').select_related('paciente', 'medico__user')
+    registrar(request.user, 'ver', descripcion=f"Consultó las fichas del paciente {paciente_rut}")
+
     return render(request, 'fichas_medicas/filtrar_fichas.html', {
         'fichas': fichas,
         'paciente_rut': paciente_rut,
     })
 
+@login_required
+@role_required('Medico')
+def encolar_pdf_fichas(request, paciente_id):
+    """
+    Encola la generación del PDF con todas las fichas del paciente. La respuesta trae la URL
+    para consultar el estado de la tarea; el archivo queda disponible solo para quien lo pidió.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido.'}, status=405)
+    paciente = get_object_or_404(Paciente, id=paciente_id)
+    tarea = encolar('pdf_fichas', {'usuario_id': request.user.id, 'paciente_id': paciente.id}, usuario=request.user)
+    registrar(request.user, 'ver', paciente, descripcion=f"Solicitó el PDF de las fichas del paciente {paciente.rut}")
+    return JsonResponse({'tarea': tarea.id, 'estado_url': reverse('api_estado_tarea', args=[tarea.id])}, status=202)
+
+@login_required
+def api_estado_tarea(request, tarea_id):
+    """Estado de una tarea encolada por el usuario y, si generó un archivo, la URL para descargarlo."""
+    tarea = get_object_or_404(
+        Tarea.objects.only('id', 'nombre', 'estado', 'intentos', 'resultado'), id=tarea_id, creada_por=request.user,
+    )
+    data = {'tarea': tarea.id, 'nombre': tarea.nombre, 'estado': tarea.estado, 'intentos': tarea.intentos}
+    archivo_id = (tarea.resultado or {}).get('archivo_id') if tarea.estado == Tarea.COMPLETADA else None
+    if archivo_id:
+        data['archivo_url'] = reverse('descargar_archivo_generado', args=[archivo_id])
+    return JsonResponse(data)
+
+@login_required
+def descargar_archivo_generado(request, archivo_id):
+    archivo = get_object_or_404(ArchivoGenerado, id=archivo_id, usuario=request.user)
+    response = HttpResponse(archivo.contenido, content_type=archivo.tipo_contenido)
+    response['Content-Disposition'] = f'attachment; filename="{archivo.nombre}"'
+    registrar(request.user, 'ver', descripcion=f"Descargó el archivo generado {archivo.nombre}")
+    return response
+
+@login_required
+@role_required('Medico')
+def api_linea_tiempo_paciente(request, paciente_id):
+    """
+    Reservas, fichas y notificaciones de un paciente en orden cronológico descendente,
+    paginadas con cursor (?cursor=...&tamano=...).
+    """
+    paciente = get_object_or_404(Paciente, id=paciente_id)
+    try:
+        tamano = int(request.GET.get('tamano', TAMANO_PAGINA))
+        pagina = obtener_linea_tiempo(paciente.id, request.GET.get('cursor'), tamano)
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros de paginación inválidos.'}, status=400)
+    registrar(request.user, 'ver', paciente, descripcion=f"Consultó la línea de tiempo del paciente {paciente.rut}")
+    return JsonResponse({'paciente': paciente.id, **pagina}, encoder=DjangoJSONEncoder)
+
 @login_required
 @role_required('Medico')
 def medico_dashboard(request):
-    medico = request.user.medico
     hora_actual = localtime(now())  # Hora actual en la zona local
 
-    # Filtrar reservas de hoy y futuras
-    reservas_hoy = Reserva.objects.filter(
-        medico=medico,
-        fecha_reserva__fecha_disponible__date=hora_actual.date(),
-        fecha_reserva__fecha_disponible__gte=hora_actual - timedelta(minutes=5)  # Mostrar horas pasadas recientes
-    ).order_by('fecha_reserva__fecha_disponible')
+    # Agenda del día precalculada; se muestran también las horas pasadas recientes
+    desde = hora_actual - timedelta(minutes=5)
+    reservas_hoy = [r for r in obtener_agenda(request.user.id, hora_actual.date()) if r['inicio'] >= desde]
 
-    logger.info(f"Reservas para hoy: {reservas_hoy.count()}")
-
-    notificaciones = Notificacion.objects.filter(usuario=request.user, leido=False).order_by('-fecha_creacion')
+    logger.info(f"Reservas para hoy: {len(reservas_hoy)}")
 
+    medico = Medico.objects.filter(user=request.user).only('id', 'clave_calendario').first()
+    url_calendario = (
+        request.build_absolute_uri(reverse('calendario_medico', args=[calendario.token_suscripcion(medico)]))
+        if medico else None
+    )
     return render(request, 'core/medico.html', {
         'reservas_hoy': reservas_hoy,
-        'notificaciones': notificaciones,
+        'url_calendario': url_calendario,
     })
 
 
+@limitar('calendario', tasa='30/m', concurrencia=8)
+def calendario_medico(request, token):
+    """
+    Agenda del médico en formato iCalendar para suscribirse desde el teléfono. La URL lleva el
+    médico firmado. Con ?desde=<token> retorna solo los eventos que cambiaron desde esa
+    sincronización; cada respuesta trae en X-Sync-Token el token para la siguiente.
+    """
+    suscripcion = calendario.medico_de_suscripcion(token)
+    medico = None
+    if suscripcion:
+        medico_id, clave = suscripcion
+        # Una URL renovada deja de valer: la clave debe ser la vigente del médico
+        medico = Medico.objects.select_related('user').filter(id=medico_id, clave_calendario=clave).first()
+    if medico is None:
+        return HttpResponse("Calendario no encontrado.", status=404, content_type='text/plain; charset=utf-8')
+    nombre = f"Agenda Dr(a). {medico.user.get_full_name()}"
+
+    # La petición no tiene usuario: la sede (y la base) es la del médico de la suscripción
+    if 'desde' in request.GET:
+        try:
+            with en_sede(medico.sede_id):
+                contenido, siguiente = calendario.cambios_desde(medico.id, request.GET['desde'], nombre)
+        except calendario.TokenInvalido as e:
+            # Como en la sincronización de CalDAV: el cliente debe volver a descargar todo
+            return HttpResponse(str(e), status=410, content_type='text/plain; charset=utf-8')
+        response = HttpResponse(contenido, content_type='text/calendar; charset=utf-8')
+    else:
+        with en_sede(medico.sede_id):
+            contenido, etag, siguiente = calendario.calendario_completo(medico.id, nombre)
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(contenido, content_type='text/calendar; charset=utf-8')
+        response['ETag'] = etag
+    response['X-Sync-Token'] = siguiente
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+@role_required('Medico')
+def renovar_calendario(request):
+    """Genera una nueva URL de suscripción; la anterior deja de funcionar (por ejemplo, si se compartió)."""
+    if request.method == 'POST':
+        medico = get_object_or_404(Medico, user=request.user)
+        calendario.renovar_suscripcion(medico)
+        registrar(request.user, 'modificar', medico, descripcion="Renovó la URL de suscripción al calendario")
+        messages.success(request, "Se generó una nueva dirección del calendario. Actualice la suscripción en su teléfono.")
+    return redirect('medico_dashboard')
+
 @login_required
 def marcar_notificacion_leida(request, notificacion_id):
     if request.method == 'POST':
@@ -336,30 +548,28 @@ def marcar_notificacion_leida(request, notificacion_id):
 @login_required
 @role_required('Medico')
 def obtener_notificaciones(request):
-    # Debug: imprimir el usuario actual
-    print(f"Usuario actual: {request.user}")
-
-    # Filtra notificaciones no leídas para el usuario actual
-    notificaciones = Notificacion.objects.filter(leido=False, usuario=request.user)
-
-    # Debug: Imprimir las notificaciones
-    print("Notificaciones encontradas:")
-    for n in notificaciones:
-        print(f"ID: {n.id}, Mensaje: {n.mensaje}, Fecha: {n.fecha_creacion}")
-
-    # Devuelve las notificaciones en JSON
-    data = [{"id": n.id, "mensaje": n.mensaje, "fecha_creacion": n.fecha_creacion} for n in notificaciones]
-    return JsonResponse(data, safe=False)
+    # Notificaciones no leídas del usuario actual
+    return responder_json(NOTIFICACION.filas(notificaciones_no_leidas(request.user.id)))
 
+@login_required
+@role_required('Medico')
 def modificar_disponibilidad(request):
     if request.method == "POST":
-        id = request.POST.get('disponibilidad_id')
-        fecha = request.POST.get('fecha')
-        hora = request.POST.get('hora')
-        disponibilidad = Disponibilidad.objects.get(id=id)
-        disponibilidad.fecha_disponible = f"{fecha} {hora}"
-        disponibilidad.save()
-        return redirect('gestionar_disponibilidades')
+        disponibilidad = get_object_or_404(
+            Disponibilidad, id=request.POST.get('disponibilidad_id'), medico=request.user.medico
+        )
+        form = DisponibilidadForm({
+            'fecha': request.POST.get('fecha'),
+            'hora': request.POST.get('hora'),
+            'duracion': request.POST.get('duracion') or disponibilidad.duracion,
+        }, instance=disponibilidad, medico=disponibilidad.medico)
+        if form.is_valid():
+            form.save()
+            messages.success(request, "Disponibilidad modificada exitosamente.")
+        else:
+            for errores in form.errors.values():
+                messages.error(request, errores[0])
+    return redirect('gestionar_disponibilidades')
 
 
 # Filtrar fichas médicas por paciente
@@ -370,7 +580,7 @@ def filtrar_fichas_medicas(request):
     fichas = FichaMedica.objects.all()
 
     if rut_query:
-        fichas = fichas.filter(paciente__rut__icontains=rut_query)
+        fichas = filtrar_por_rut(fichas, rut_query, 'paciente__rut_cuerpo')
 
     paginator = Paginator(fichas, 5)  # Paginación con 5 elementos por página
     page_number = request.GET.get("page")
@@ -402,7 +612,9 @@ def crear_ficha_medica(request, reserva_id):
             ficha.paciente = reserva.paciente
             ficha.medico = request.user.medico
             ficha.reserva = reserva  # Asignar la reserva al formulario
+            ficha._autor_revision = request.user
             ficha.save()
+            registrar(request.user, 'crear', ficha)
             messages.success(request, "Ficha médica creada con éxito.")
             return redirect('medico_dashboard')
         else:
@@ -412,13 +624,7 @@ def crear_ficha_medica(request, reserva_id):
 
     # Datos del paciente
     paciente = reserva.paciente
-    hoy = date.today()
-
-    # Calcular la edad solo si fecha_nacimiento está definida
-    if paciente.fecha_nacimiento:
-        edad = hoy.year - paciente.fecha_nacimiento.year - ((hoy.month, hoy.day) < (paciente.fecha_nacimiento.month, paciente.fecha_nacimiento.day))
-    else:
-        edad = "No registrada"
+    edad = paciente.edad if paciente.fecha_nacimiento else "No registrada"
 
     # Datos del médico
     medico = request.user.medico
@@ -439,17 +645,23 @@ def crear_ficha_medica(request, reserva_id):
 @role_required('Medico')
 def gestionar_disponibilidades(request):
     medico = request.user.medico
-    disponibilidades = Disponibilidad.objects.filter(medico=medico)
+    disponibilidades = Disponibilidad.objects.filter(medico=medico).order_by('fecha_disponible')
 
     if request.method == 'POST':
         form = DisponibilidadForm(request.POST)
         if form.is_valid():
-            disponibilidad = form.save(commit=False)
-            disponibilidad.medico = medico  # Asigna el médico al objeto
-            disponibilidad.save()
-            return redirect('gestionar_disponibilidades')  # Redirige después de guardar
+            # La validación de solapamientos se hace una sola vez para todo el lote
+            try:
+                creadas = crear_disponibilidades(medico, form.horarios())
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+            except IntegrityError:
+                messages.error(request, "Ya existe un bloque en ese horario.")
+            else:
+                messages.success(request, f"Se agregaron {len(creadas)} bloques a tu agenda.")
+                return redirect('gestionar_disponibilidades')  # Redirige después de guardar
         else:
-            print(form.errors)  # Depura errores del formulario
+            messages.error(request, "Hubo errores en el formulario. Revisa los campos.")
     else:
         form = DisponibilidadForm()
 
@@ -459,14 +671,39 @@ def gestionar_disponibilidades(request):
     })
 
 
+@login_required
 def obtener_reservas_activas(request):
     hora_actual = localtime(now())
-    reservas = Reserva.objects.filter(fecha_reserva__fecha_disponible__gte=hora_actual)
-    data = [
-        {"id": r.id, "paciente": r.paciente.nombre, "hora": r.fecha_reserva.fecha_disponible.strftime('%H:%M')}
-        for r in reservas
-    ]
-    return JsonResponse(data, safe=False)
+    reservas = reservas_en_rango(hora_actual)
+    medico_id = medico_del_alcance(request.user)
+    if medico_id is not None:
+        reservas = reservas.filter(medico_id=medico_id)
+    return responder_json(RESERVA_ACTIVA.filas(reservas))
+
+
+@login_required
+def api_cambios_reservas(request):
+    """
+    Sincronización incremental de reservas. Sin ?desde= entrega la instantánea de las reservas
+    futuras y el cursor desde el que seguir; con ?desde=<cursor> solo las creadas, modificadas o
+    eliminadas (lápidas) después del cursor, en páginas de ?limite= cambios.
+    """
+    medico_id = medico_del_alcance(request.user)
+    if 'desde' not in request.GET:
+        # El cursor se toma antes de leer: un cambio concurrente puede repetirse, pero no perderse
+        cursor = cambios.cursor_actual()
+        reservas = reservas_en_rango(localtime(now()))
+        if medico_id is not None:
+            reservas = reservas.filter(medico_id=medico_id)
+        return responder_json({'reservas': RESERVA.filas(reservas), 'cursor': str(cursor)})
+    try:
+        limite = int(request.GET.get('limite', cambios.TAMANO_PAGINA))
+        pagina, cursor, hay_mas = cambios.cambios_desde(request.GET['desde'], medico_id, limite)
+    except ValueError:
+        return JsonResponse({'error': 'Cursor o límite inválido.'}, status=400)
+    except cambios.CursorInvalido as e:
+        return JsonResponse({'error': str(e)}, status=410)
+    return responder_json({'cambios': pagina, 'cursor': str(cursor), 'hay_mas': hay_mas})
 
 
 @login_required
@@ -517,7 +754,9 @@ def recepcionista_dashboard(request):
 @role_required('Recepcionista')
 def listar_pacientes(request):
     rut_query = request.GET.get('rut', '')
-    pacientes = Paciente.objects.filter(rut__icontains=rut_query).order_by('nombre') if rut_query else Paciente.objects.all().order_by('nombre')
+    pacientes = Paciente.objects.all().order_by('nombre')
+    if rut_query:
+        pacientes = filtrar_por_rut(pacientes, rut_query, 'rut_cuerpo')
     paginator = Paginator(pacientes, 5)
     page_number = request.GET.get("page")
     page_obj = paginator.get_page(page_number)
@@ -528,7 +767,9 @@ def listar_pacientes(request):
 @role_required('Recepcionista')
 def listar_pacientes(request):
     rut_query = request.GET.get('rut', '')
-    pacientes = Paciente.objects.filter(rut__icontains=rut_query).order_by('nombre') if rut_query else Paciente.objects.all().order_by('nombre')
+    pacientes = Paciente.objects.all().order_by('nombre')
+    if rut_query:
+        pacientes = filtrar_por_rut(pacientes, rut_query, 'rut_cuerpo')
     paginator = Paginator(pacientes, 5)
     page_number = request.GET.get("page")
     page_obj = paginator.get_page(page_number)
@@ -541,7 +782,7 @@ def recepcionista_dashboard(request):
     Dashboard para recepcionistas.
     """
     # Verifica que el usuario tenga el grupo correcto
-    if not request.user.groups.filter(name='Recepcionista').exists():
+    if not tiene_rol(request.user, 'Recepcionista'):
         return HttpResponseForbidden("No tienes permiso para acceder a esta página.")
 
     return render(request, 'core/recepcionista.html')  # Cambia la ruta si está en otro directorio
@@ -553,13 +794,16 @@ def recepcionista_dashboard(request):
 def listar_reservas(request):
     fecha_inicio = request.GET.get('fecha_inicio')
     fecha_fin = request.GET.get('fecha_fin')
-    reservas = Reserva.objects.all().order_by('-fecha_reserva')
+    reservas = Reserva.objects.select_related('paciente', 'medico__user', 'fecha_reserva').order_by('-fecha_reserva__fecha_disponible')
 
     if fecha_inicio and fecha_fin:
         try:
             fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d')
             fecha_fin_dt = datetime.strptime(fecha_fin, '%Y-%m-%d')
-            reservas = reservas.filter(fecha_reserva__fecha_disponible__range=[fecha_inicio_dt, fecha_fin_dt])
+            # El día de fin se incluye completo
+            reservas = reservas_en_rango(
+                make_aware(fecha_inicio_dt), make_aware(fecha_fin_dt + timedelta(days=1)), descendente=True,
+            ).select_related('paciente', 'medico__user', 'fecha_reserva')
         except ValueError:
             return render(request, 'reservas/listar_reservas.html', {
                 'error': 'Formato de fecha inválido. Use el formato AAAA-MM-DD.',
@@ -569,7 +813,7 @@ def listar_reservas(request):
             })
 
     # Verificar si el usuario pertenece al grupo 'Medico'
-    es_medico = request.user.groups.filter(name='Medico').exists()
+    es_medico = tiene_rol(request.user, 'Medico')
 
     paginator = Paginator(reservas, 5)
     page_number = request.GET.get('page')
@@ -588,7 +832,8 @@ def crear_paciente(request):
     if request.method == 'POST':
         form = PacienteForm(request.POST)
         if form.is_valid():
-            form.save()
+            paciente = form.save()
+            registrar(request.user, 'crear', paciente)
             return redirect('recepcionista_dashboard')  # Ajusta según el nombre de tu URL de panel
     else:
         form = PacienteForm()
@@ -609,11 +854,13 @@ def modificar_paciente(request, paciente_id):
         paciente.telefono = request.POST.get('telefono')
         paciente.direccion = request.POST.get('direccion')
         paciente.save()
+        registrar(request.user, 'modificar', paciente)
 
         # Mensaje de éxito
         messages.success(request, "Los datos del paciente se han actualizado exitosamente.")
         return redirect('listar_pacientes')  # Redirige al listado de pacientes
 
+    registrar(request.user, 'ver', paciente)
     return render(request, 'pacientes/modificar_paciente.html', {'paciente': paciente})
 
 
@@ -624,6 +871,7 @@ def eliminar_paciente(request, paciente_id):
     paciente = get_object_or_404(Paciente, id=paciente_id)
 
     if request.method == 'POST':
+        registrar(request.user, 'eliminar', paciente)
         paciente.delete()
         messages.success(request, "Paciente eliminado exitosamente.")
         return redirect('listar_pacientes')  # Redirige a la lista de pacientes
@@ -647,7 +895,8 @@ def crear_reserva(request):
 
             # Crear notificación
             mensaje = f"Se ha registrado una nueva reserva para el paciente {reserva.paciente.nombre} para la fecha del {fecha_local.strftime('%d/%m/%Y %H:%M')}."
-            Notificacion.objects.create(usuario=reserva.medico.user, mensaje=mensaje)
+            Notificacion.objects.create(usuario=reserva.medico.user, paciente=reserva.paciente, mensaje=mensaje)
+            registrar(request.user, 'crear', reserva)
 
             messages.success(request, "Reserva creada exitosamente.")
             return redirect('listar_reservas')
@@ -665,7 +914,7 @@ def modificar_reserva(request, reserva_id):
     reserva = get_object_or_404(Reserva, id=reserva_id)
     especialidades = Especialidad.objects.all()
     medicos = Medico.objects.filter(especialidad=reserva.especialidad)
-    disponibilidades = Disponibilidad.objects.filter(medico=reserva.medico, ocupada=False)
+    disponibilidades = disponibilidades_libres(reserva.medico_id, now())
 
     if request.method == 'POST':
         especialidad_id = request.POST.get('especialidad')
@@ -697,7 +946,9 @@ def modificar_reserva(request, reserva_id):
             })
 
         # Liberar la disponibilidad anterior si se seleccionó una nueva
+        bloque_liberado = None
         if reserva.fecha_reserva != nueva_disponibilidad:
+            bloque_liberado = reserva.fecha_reserva_id
             reserva.fecha_reserva.ocupada = False
             reserva.fecha_reserva.save()
             nueva_disponibilidad.ocupada = True
@@ -706,7 +957,7 @@ def modificar_reserva(request, reserva_id):
             # Crear notificación para el médico
             fecha_local = localtime(nueva_disponibilidad.fecha_disponible)
             mensaje = f"Se ha modificado la reserva para el paciente {reserva.paciente.nombre}. Nueva hora: {fecha_local.strftime('%d/%m/%Y %H:%M')}."
-            Notificacion.objects.create(usuario=medico.user, mensaje=mensaje)
+            Notificacion.objects.create(usuario=medico.user, paciente=reserva.paciente, mensaje=mensaje)
 
         # Actualizar los datos de la reserva
         reserva.especialidad = especialidad
@@ -714,6 +965,9 @@ def modificar_reserva(request, reserva_id):
         reserva.fecha_reserva = nueva_disponibilidad
         reserva.motivo = request.POST.get('motivo', reserva.motivo)
         reserva.save()
+        registrar(request.user, 'modificar', reserva)
+        if bloque_liberado:
+            programar_ofertas([bloque_liberado])
 
         messages.success(request, "Reserva modificada exitosamente.")
         return redirect('listar_reservas')  # Redireccionar después de guardar
@@ -728,6 +982,97 @@ def modificar_reserva(request, reserva_id):
 
 
 
+@login_required
+@role_required('Recepcionista')
+def operacion_masiva_reservas(request):
+    """
+    Cancela o reprograma en una sola operación todas las reservas de un médico en un rango
+    (por ejemplo, cuando el médico avisa que no podrá atender).
+    """
+    resumen = None
+    if request.method == 'POST':
+        form = OperacionMasivaReservasForm(request.POST)
+        if form.is_valid():
+            datos = form.cleaned_data
+            try:
+                if datos['accion'] == 'cancelar':
+                    resumen = cancelar_reservas(
+                        datos['medico'], datos['desde'], datos['hasta'], usuario=request.user, motivo=datos['motivo'],
+                    )
+                    messages.success(request, f"Se cancelaron {len(resumen['canceladas'])} reservas.")
+                else:
+                    resumen = reprogramar_reservas(
+                        datos['medico'], datos['desde'], datos['hasta'],
+                        desplazamiento=timedelta(days=datos['dias'] or 0),
+                        medico_destino=datos['medico_destino'], usuario=request.user,
+                    )
+                    messages.success(request, f"Se reprogramaron {len(resumen['movidas'])} reservas.")
+                    if resumen['no_movidas']:
+                        messages.warning(
+                            request, f"{len(resumen['no_movidas'])} reservas no tienen un bloque libre a esa hora y no se movieron."
+                        )
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+        else:
+            messages.error(request, "Hubo errores en el formulario. Por favor, revisa los campos.")
+    else:
+        form = OperacionMasivaReservasForm()
+
+    return render(request, 'reservas/operacion_masiva.html', {'form': form, 'resumen': resumen})
+
+
+@login_required
+@role_required('Recepcionista')
+def lista_espera(request):
+    """
+    Entradas activas de la lista de espera y registro de nuevas. Las ofertas vigentes
+    (bloques retenidos) se muestran primero para confirmarlas o rechazarlas.
+    """
+    if request.method == 'POST':
+        form = ListaEsperaForm(request.POST)
+        if form.is_valid():
+            entrada = form.save(commit=False)
+            entrada.registrada_por = request.user
+            entrada.save()
+            registrar(request.user, 'crear', entrada)
+            messages.success(request, f"{entrada.paciente.nombre} quedó en la lista de espera.")
+            return redirect('lista_espera')
+        messages.error(request, "Hubo errores en el formulario. Por favor, revisa los campos.")
+    else:
+        form = ListaEsperaForm()
+
+    entradas = (
+        ListaEspera.objects
+        .filter(estado__in=[ListaEspera.OFRECIDA, ListaEspera.ESPERANDO])
+        .select_related('paciente', 'especialidad', 'medico__user', 'bloque_ofrecido')
+        .order_by('-estado', '-prioridad', 'fecha_creacion')
+    )
+    paginator = Paginator(entradas, 20)
+    return render(request, 'reservas/lista_espera.html', {
+        'form': form,
+        'entradas': paginator.get_page(request.GET.get('page')),
+    })
+
+
+@login_required
+@role_required('Recepcionista')
+def responder_oferta_espera(request, entrada_id):
+    """Confirma (crea la reserva) o rechaza el bloque ofrecido a una entrada de la lista de espera."""
+    if request.method != 'POST':
+        return redirect('lista_espera')
+    try:
+        if request.POST.get('accion') == 'confirmar':
+            reserva = confirmar_oferta(entrada_id, request.user)
+            registrar(request.user, 'crear', reserva)
+            messages.success(request, "Reserva creada desde la lista de espera.")
+        else:
+            rechazar_oferta(entrada_id)
+            messages.info(request, "Oferta rechazada; el paciente sigue en la lista de espera.")
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
+    return redirect('lista_espera')
+
+
 @login_required
 @role_required('Recepcionista')
 def eliminar_reserva(request, reserva_id):
@@ -741,9 +1086,11 @@ def eliminar_reserva(request, reserva_id):
 
         # Crear notificación
         mensaje = f"Se ha eliminado la reserva para el paciente {reserva.paciente.nombre} programada para el {fecha_local.strftime('%d/%m/%Y %H:%M')}."
-        Notificacion.objects.create(usuario=reserva.medico.user, mensaje=mensaje)
+        Notificacion.objects.create(usuario=reserva.medico.user, paciente=reserva.paciente, mensaje=mensaje)
 
+        registrar(request.user, 'eliminar', reserva)
         reserva.delete()
+        programar_ofertas([reserva.fecha_reserva_id])
         return JsonResponse({"success": True})
     else:
         return JsonResponse({"error": "Método no permitido."}, status=405)
@@ -753,6 +1100,8 @@ def eliminar_reserva(request, reserva_id):
 
 
 
+@limitar('medicos', tasa='60/m', concurrencia=16)
+@cachear_vista(modelos=[Medico, Especialidad], timeout=300)
 def api_medicos(request):
     especialidad_id = request.GET.get('especialidad_id')
     if not especialidad_id:
@@ -762,17 +1111,17 @@ def api_medicos(request):
         return JsonResponse({'error': 'El ID de la especialidad debe ser un número válido.'}, status=400)
     
     try:
-        medicos = Medico.objects.filter(especialidad_id=especialidad_id)
-        if not medicos.exists():
+        data = MEDICO.filas(Medico.objects.filter(especialidad_id=especialidad_id))
+        if not data:
             return JsonResponse({'error': 'No hay médicos registrados para esta especialidad.'}, status=404)
-
-        data = [{'id': medico.id, 'nombre': f"{medico.user.first_name} {medico.user.last_name}"} for medico in medicos]
-        return JsonResponse(data, safe=False)
+        return responder_json(data)
     except Exception as e:
         return JsonResponse({'error': f'Error inesperado: {str(e)}'}, status=500)
 
 
 
+@limitar('disponibilidades', tasa='60/m', concurrencia=8)
+@cachear_vista(modelos=[Medico, Disponibilidad], timeout=30)
 def api_disponibilidades(request):
     medico_id = request.GET.get('medico_id')
     if not medico_id:
@@ -782,38 +1131,30 @@ def api_disponibilidades(request):
         return JsonResponse({'error': 'El ID del médico debe ser un número válido.'}, status=400)
 
     try:
-        medico = Medico.objects.get(id=medico_id)
-        disponibilidades = Disponibilidad.objects.filter(
-            medico=medico, ocupada=False, fecha_disponible__gte=now()
-        )
-
-        if not disponibilidades.exists():
-            return JsonResponse({'error': 'No hay disponibilidades para este médico.'}, status=404)
-
-        data = [
-            {
-                'id': disp.id,
-                'fecha_hora': localtime(disp.fecha_disponible).strftime('%d/%m/%Y %H:%M')
-            } for disp in disponibilidades
-        ]
-        return JsonResponse(data, safe=False)
-    except Medico.DoesNotExist:
-        return JsonResponse({'error': 'El médico no existe.'}, status=404)
+        data = DISPONIBILIDAD.filas(disponibilidades_libres(int(medico_id), now()))
+        if data:
+            return responder_json(data)
+        # Solo una respuesta vacía requiere distinguir si el médico existe
+        if not Medico.objects.filter(id=medico_id).exists():
+            return JsonResponse({'error': 'El médico no existe.'}, status=404)
+        return JsonResponse({'error': 'No hay disponibilidades para este médico.'}, status=404)
     except Exception as e:
         return JsonResponse({'error': f'Error inesperado: {str(e)}'}, status=500)
 
 
+@limitar('validar_rut', tasa='30/m', rafaga=10, concurrencia=8)
 def api_validar_rut(request):
     rut = request.GET.get('rut')
     if not rut:
         return JsonResponse({'error': 'RUT no proporcionado.'}, status=400)
     
-    # Valida formato del RUT
-    if not re.match(r'^\d{7,8}-\d{1}$', rut):
-        return JsonResponse({'error': 'El RUT debe estar en el formato correcto (12345678-9).'}, status=400)
+    try:
+        cuerpo, _ = ruts.parsear(rut)
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
 
     try:
-        paciente = Paciente.objects.get(rut=rut)
+        paciente = Paciente.objects.get(rut_cuerpo=cuerpo)
         edad = paciente.edad if paciente.fecha_nacimiento else 'No registrada'
 
         return JsonResponse({